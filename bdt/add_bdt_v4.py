@@ -18,6 +18,19 @@ flag = '09Mar2022_09h42m51s'
 tree_name = 'BTo3Mu'
 tree_dir = '/pnfs/psi.ch/cms/trivcat/store/user/friti/dataframes_Dec2021'
 
+# True: only the scores are written, in chunks, in side files to be used as friends (see bdt_scoring.py)
+# False: the whole sample is rewritten with the new column
+side_output = False
+side_dir = '%s/bdt_scores' %tree_dir
+# column -> class of the model, as predict_proba(...)[:,1] below
+side_columns = {'bdt_tau_mu_v2': 1}
+
+if side_output:
+    from bdt_scoring import write_all_scores
+    sources = dict((k, '%s/%s_bdt_vv1.root' %(tree_dir, k)) for k in sample_names)
+    write_all_scores(sources, 'bdt_models/%s/classifiers_%s.pck' %(flag,flag), 'bdt_models/%s/features_'%flag+flag+'.pck', flag, side_dir, side_columns)
+    exit()
+
 classifier = pickle.load(open('bdt_models/%s/classifiers_%s.pck' %(flag,flag),'rb'))
 features = pickle.load(open('bdt_models/%s/features_'%flag+flag+'.pck', 'rb'))
 
@@ -0,0 +1,143 @@
+'''
+Cached training matrices for the BDT studies.
+
+build_matrices converts the samples once (RDataFrame with to_define, selection, AsNumpy of the features only)
+and saves the features, targets and sample of origin as .npy files in
+    <cache_dir>/<key>/
+where key is a hash of the feature list, of the definitions of the derived columns (to_define), of the selections
+and targets, and of the input files (ROOT file UUID and size, which change whenever a file is rewritten).
+If the key is already there nothing is converted again and the arrays are opened memory-mapped,
+so all the studies and all the processes of a search (bdt_search.py) share them.
+
+    sources = {'tau': (tau_file, preselection_mc, 1), 'bkg': (bkg_file, preselection_mc, 0)}
+    matrices = build_matrices(sources, features)
+    train_index, valid_index, test_index = matrices.split(0.2, 0.2)
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+tree_name = 'BTo3Mu'
+cache_dir = '/scratch/bdt_matrices'
+arrays = ['X', 'y', 'source']
+
+def file_checksum(path):
+    '''
+    UUID written by ROOT in the file header and file size: a new UUID for each (re)written file
+    '''
+    import ROOT
+    f = ROOT.TFile.Open(path)
+    uuid = f.GetUUID().AsString()
+    size = f.GetSize()
+    f.Close()
+    return uuid, size
+
+def matrices_key(sources, features, to_define, tree = tree_name, seed = 1986):
+    '''
+    to_define: all the (column, definition) pairs, a change of any definition converts the samples again
+    '''
+    signature = dict(
+        sources   = sorted((name, file_checksum(path), selection, target) for name, (path, selection, target) in sources.items()),
+        features  = list(features),
+        to_define = [tuple(item) for item in to_define],
+        tree     = tree,
+        seed     = seed,
+    )
+    return hashlib.sha1(repr(sorted(signature.items())).encode()).hexdigest()[:16]
+
+class Matrices(object):
+
+    def __init__(self, path, mmap_mode = 'r'):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as fh:
+            self.meta = json.load(fh)
+        self.features = self.meta['features']
+        self.sources = self.meta['sources']
+        for name in arrays:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode = mmap_mode))
+
+    def __len__(self):
+        return len(self.y)
+
+    def split(self, test_size = 0.25, valid_size = 0.):
+        '''
+        (train_index, valid_index, test_index): the events are already shuffled, the test set is the last
+        test_size fraction and the validation set the valid_size fraction before it
+        '''
+        n_test = int(round(len(self) * test_size))
+        n_valid = int(round(len(self) * valid_size))
+        n_train = len(self) - n_test - n_valid
+        return np.arange(n_train), np.arange(n_train, n_train + n_valid), np.arange(n_train + n_valid, len(self))
+
+    def balanced_weights(self, index = None):
+        '''
+        Weights giving the same total to each target (minn/n as in the training scripts)
+        '''
+        y = np.asarray(self.y if index is None else self.y[np.sort(index)])
+        counts = dict((target, np.count_nonzero(y == target)) for target in np.unique(y))
+        minn = min(counts.values())
+        w = np.ones(len(y), dtype = np.float32)
+        for target, n in counts.items():
+            w[y == target] = float(minn) / n
+        return w
+
+    def frame(self, index = None):
+        '''
+        pandas DataFrame with the features, 'target' and 'sample' (a copy, for the plots and the outputs)
+        '''
+        import pandas as pd
+        index = np.arange(len(self)) if index is None else np.sort(index)
+        df = pd.DataFrame(np.asarray(self.X[index]), columns = self.features)
+        df['target'] = np.asarray(self.y[index])
+        df['sample'] = np.array(self.sources)[np.asarray(self.source[index])]
+        return df
+
+def build_matrices(sources, features, tree = tree_name, cache = cache_dir, seed = 1986, to_define = None):
+    '''
+    sources: dict name -> (root file, selection, target).
+    Returns the Matrices, converted only if not already in the cache
+    '''
+    if to_define is None:
+        from new_branches import to_define
+    key = matrices_key(sources, features, to_define, tree, seed)
+    path = os.path.join(cache, key)
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        print("Matrices %s from the cache" %key)
+        return Matrices(path)
+
+    import ROOT
+
+    X, y, source = [], [], []
+    names = sorted(sources.keys())
+    for isource, name in enumerate(names):
+        print("Converting " + name)
+        sample, selection, target = sources[name]
+        df = ROOT.RDataFrame(tree, sample)
+        for new_column, new_definition in to_define:
+            if df.HasColumn(new_column): continue
+            df = df.Define(new_column, new_definition)
+        columns = df.Filter(selection).AsNumpy(list(features))
+        X.append(np.stack([columns[f].astype(np.float32) for f in features], axis = 1))
+        y.append(np.full(len(X[-1]), target, dtype = np.int8))
+        source.append(np.full(len(X[-1]), isource, dtype = np.int16))
+
+    order = np.random.RandomState(seed).permutation(sum(len(a) for a in y))
+    values = dict(X = np.concatenate(X)[order], y = np.concatenate(y)[order], source = np.concatenate(source)[order])
+
+    # written in a temporary directory and moved in place when complete
+    tmp_path = path + '_tmp'
+    shutil.rmtree(tmp_path, ignore_errors = True)
+    os.makedirs(tmp_path)
+    for name in arrays:
+        np.save(os.path.join(tmp_path, name + '.npy'), values[name])
+    meta = dict(key = key, features = list(features), tree = tree, sources = names,
+                files = [sources[name][0] for name in names], selections = [sources[name][1] for name in names],
+                targets = [sources[name][2] for name in names], events = len(order))
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as fh:
+        json.dump(meta, fh, indent = 2)
+    os.rename(tmp_path, path)
+    print("Matrices %s saved: %d events" %(key, len(order)))
+    return Matrices(path)
@@ -0,0 +1,223 @@
+'''
+Export of a trained XGBoost classifier (train_bdt.py, train_bdt_tau_vs_fakes_v2.py) to
+ - a numpy file (<name>.npz) with the trees as flat node arrays, evaluated by evaluate_numpy
+ - a self-contained C++ header (<name>.h) with the function eval_bdt_<name>(inputs...),
+   returning a std::array with the class probabilities. Thread safe (no state, no allocations),
+   to be used in a RDataFrame Define (see plotting/bdt_eval.py, which defines bdt_mu_<name>, bdt_tau_<name>, ...)
+
+The trees are not unrolled in code: the nodes are static arrays walked by a small loop,
+so the header compiles in a moment also for thousands of trees.
+Same conventions of xgboost: inputs as float, x < threshold goes to the 'yes' child, NaN to the 'missing' one,
+trees interleaved by class for the multi-class models, only the trees up to the best iteration if early stopping was used.
+
+Usage:
+    python bdt_export.py --model bdtModel/BDT_Model_<flag>.pck --features bdtModel/BDT_Model_<flag>_features.pck --name v1 [--outdir exported_bdt]
+'''
+
+import os
+import json
+import pickle
+from argparse import ArgumentParser
+import numpy as np
+
+multiclass_outputs = ['bdt_mu', 'bdt_tau', 'bdt_bkg'] # order of the targets of train_bdt.py
+
+def model_parameters(classifier):
+    '''
+    objective, number of classes, base score and number of trees to use
+    '''
+    booster = classifier.get_booster()
+    objective = getattr(classifier, 'objective', None) or 'binary:logistic'
+    base_score = getattr(classifier, 'base_score', None)
+    try:
+        config = json.loads(booster.save_config())
+        objective = config['learner']['objective']['name']
+        base_score = float(config['learner']['learner_model_param']['base_score'])
+    except (AttributeError, KeyError, ValueError):
+        pass
+    base_score = 0.5 if base_score is None else float(base_score)
+    nclasses = max(1, int(getattr(classifier, 'n_classes_', 2))) if objective.startswith('multi') else 1
+
+    ntrees = len(booster.get_dump())
+    best_iteration = getattr(booster, 'best_iteration', None)
+    if best_iteration is not None:
+        ntrees = min(ntrees, (int(best_iteration) + 1) * nclasses * (getattr(classifier, 'num_parallel_tree', None) or 1))
+    return objective, nclasses, base_score, ntrees
+
+def flatten_trees(booster, features, ntrees):
+    '''
+    Node arrays of all the trees: feature (-1 for leaves), threshold, yes, no, missing (absolute node indices),
+    value (leaves), and the root of each tree
+    '''
+    index = dict((f, i) for i, f in enumerate(features))
+    index.update(('f%d' %i, i) for i in range(len(features))) # models trained on numpy arrays
+    feature, threshold, yes, no, missing, value, roots = [], [], [], [], [], [], []
+    for dump in booster.get_dump(dump_format = 'json')[:ntrees]:
+        nodes = dict()
+        stack = [json.loads(dump)]
+        while stack:
+            node = stack.pop()
+            nodes[node['nodeid']] = node
+            stack.extend(node.get('children', []))
+        offset = len(feature)
+        # nodeids are dense within a tree
+        position = dict((nodeid, offset + i) for i, nodeid in enumerate(sorted(nodes)))
+        roots.append(position[0])
+        for nodeid in sorted(nodes):
+            node = nodes[nodeid]
+            if 'leaf' in node:
+                feature.append(-1)
+                threshold.append(0.)
+                yes.append(-1); no.append(-1); missing.append(-1)
+                value.append(node['leaf'])
+            else:
+                feature.append(index[node['split']])
+                threshold.append(node.get('split_condition', 0.5)) # boolean splits have no condition
+                yes.append(position[node['yes']]); no.append(position[node['no']]); missing.append(position[node['missing']])
+                value.append(0.)
+    return dict(
+        feature   = np.array(feature, dtype = np.int32),
+        threshold = np.array(threshold, dtype = np.float32),
+        yes       = np.array(yes, dtype = np.int32),
+        no        = np.array(no, dtype = np.int32),
+        missing   = np.array(missing, dtype = np.int32),
+        value     = np.array(value, dtype = np.float64),
+        roots     = np.array(roots, dtype = np.int32),
+    )
+
+def _base_margin(objective, base_score):
+    if objective.startswith('binary:logistic'):
+        return np.log(base_score / (1. - base_score))
+    return base_score
+
+def save_numpy(path, features, outputs, objective, nclasses, base_score, trees):
+    np.savez(path, features = np.array(features), outputs = np.array(outputs), objective = np.array(objective),
+             nclasses = nclasses, base_score = base_score, **trees)
+
+def load_numpy(path):
+    '''
+    features, outputs, objective, nclasses, base_score, trees of an exported npz file
+    '''
+    arrays = np.load(path)
+    trees = dict((key, arrays[key]) for key in ['feature', 'threshold', 'yes', 'no', 'missing', 'value', 'roots'])
+    return ([str(f) for f in arrays['features']], [str(o) for o in arrays['outputs']], str(arrays['objective']),
+            int(arrays['nclasses']), float(arrays['base_score']), trees)
+
+def evaluate_numpy(X, objective, nclasses, base_score, trees):
+    '''
+    Probabilities (n_events, n_classes) for the inputs X (n_events, n_features), ordered as the features
+    '''
+    X = np.asarray(X, dtype = np.float32)
+    events = np.arange(len(X))
+    margin = np.full((len(X), nclasses), _base_margin(objective, base_score))
+    for itree, root in enumerate(trees['roots']):
+        node = np.full(len(X), root, dtype = np.int32)
+        inner = trees['feature'][node] >= 0
+        while inner.any():
+            n = node[inner]
+            x = X[events[inner], trees['feature'][n]]
+            node[inner] = np.where(np.isnan(x), trees['missing'][n], np.where(x < trees['threshold'][n], trees['yes'][n], trees['no'][n]))
+            inner = trees['feature'][node] >= 0
+        margin[:, itree % nclasses] += trees['value'][node]
+    if objective.startswith('multi:soft'):
+        margin = np.exp(margin - margin.max(axis = 1, keepdims = True))
+        return margin / margin.sum(axis = 1, keepdims = True)
+    if objective.startswith('binary:logistic'):
+        return 1./(1.+np.exp(-margin))
+    return margin
+
+def _array(values, fmt = repr):
+    return '{%s}' %', '.join(fmt(v) for v in np.ravel(values))
+
+def cpp_code(name, features, outputs, objective, nclasses, base_score, trees):
+    '''
+    C++ source of eval_bdt_<name>(one double for each feature) -> std::array<double, nclasses>
+    '''
+    function = 'eval_bdt_%s' %name
+    guard = function.upper()
+    nnodes, ntrees = len(trees['feature']), len(trees['roots'])
+    lines = []
+    lines.append('#ifndef %s' %guard)
+    lines.append('#define %s' %guard)
+    lines.append('#include <array>')
+    lines.append('#include <cmath>')
+    lines.append('namespace %s_parameters {' %function)
+    lines.append('  static const int feature[%d] = %s;' %(nnodes, _array(trees['feature'], lambda v: str(int(v)))))
+    lines.append('  static const float threshold[%d] = %s;' %(nnodes, _array(trees['threshold'], lambda v: '%.9ef' %v)))
+    lines.append('  static const int yes[%d] = %s;' %(nnodes, _array(trees['yes'], lambda v: str(int(v)))))
+    lines.append('  static const int no[%d] = %s;' %(nnodes, _array(trees['no'], lambda v: str(int(v)))))
+    lines.append('  static const int missing[%d] = %s;' %(nnodes, _array(trees['missing'], lambda v: str(int(v)))))
+    lines.append('  static const double value[%d] = %s;' %(nnodes, _array(trees['value'], lambda v: repr(float(v)))))
+    lines.append('  static const int roots[%d] = %s;' %(ntrees, _array(trees['roots'], lambda v: str(int(v)))))
+    lines.append('}')
+    lines.append('inline std::array<double, %d> %s(%s){' %(nclasses, function, ', '.join('double x%d' %i for i in range(len(features)))))
+    lines.append('  using namespace %s_parameters;' %function)
+    lines.append('  const float x[%d] = {%s};' %(len(features), ', '.join('(float)x%d' %i for i in range(len(features)))))
+    lines.append('  std::array<double, %d> out;' %nclasses)
+    lines.append('  out.fill(%r);' %float(_base_margin(objective, base_score)))
+    lines.append('  for (int t = 0; t < %d; ++t){' %ntrees)
+    lines.append('    int n = roots[t];')
+    lines.append('    while (feature[n] >= 0){')
+    lines.append('      const float v = x[feature[n]];')
+    lines.append('      n = std::isnan(v) ? missing[n] : (v < threshold[n] ? yes[n] : no[n]);')
+    lines.append('    }')
+    lines.append('    out[t %% %d] += value[n];' %nclasses)
+    lines.append('  }')
+    if objective.startswith('multi:soft'):
+        lines.append('  double max = out[0];')
+        lines.append('  for (int c = 1; c < %d; ++c) max = out[c] > max ? out[c] : max;' %nclasses)
+        lines.append('  double sum = 0.;')
+        lines.append('  for (int c = 0; c < %d; ++c){ out[c] = std::exp(out[c] - max); sum += out[c]; }' %nclasses)
+        lines.append('  for (int c = 0; c < %d; ++c) out[c] /= sum;' %nclasses)
+    elif objective.startswith('binary:logistic'):
+        lines.append('  out[0] = 1./(1.+std::exp(-out[0]));')
+    lines.append('  return out;')
+    lines.append('}')
+    lines.append('static const char* %s_inputs = "%s";' %(function, ','.join(features)))
+    lines.append('static const char* %s_outputs = "%s";' %(function, ','.join(outputs)))
+    lines.append('#endif')
+    return '\n'.join(lines) + '\n'
+
+def export_bdt(classifier, features, name, outdir, outputs = None, X = None):
+    '''
+    Writes <outdir>/<name>.npz and <outdir>/<name>.h.
+    If X (inputs ordered as features) is given, checks that the exported evaluator
+    gives the same probabilities of xgboost and returns the largest difference
+    '''
+    objective, nclasses, base_score, ntrees = model_parameters(classifier)
+    if outputs is None:
+        outputs = multiclass_outputs if nclasses == 3 else ['bdt'] if nclasses == 1 else ['bdt_%d' %i for i in range(nclasses)]
+    if len(outputs) != nclasses:
+        raise ValueError('%d outputs for a model with %d classes' %(len(outputs), nclasses))
+    trees = flatten_trees(classifier.get_booster(), features, ntrees)
+    os.system('mkdir -p %s' %outdir)
+    save_numpy('%s/%s.npz' %(outdir, name), features, outputs, objective, nclasses, base_score, trees)
+    with open('%s/%s.h' %(outdir, name), 'w') as fh:
+        fh.write(cpp_code(name, features, outputs, objective, nclasses, base_score, trees))
+    print("Exported BDT %s: %d trees, %d nodes" %(name, len(trees['roots']), len(trees['feature'])))
+    if X is None:
+        return None
+    proba = classifier.predict_proba(np.asarray(X, dtype = np.float32))
+    proba = proba[:, 1:] if nclasses == 1 else proba
+    difference = np.max(np.abs(evaluate_numpy(X, objective, nclasses, base_score, trees) - proba))
+    print("max difference wrt xgboost on %d events: %.2e" %(len(X), difference))
+    return difference
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--model'   , required = True, help = 'pickled XGBClassifier')
+    parser.add_argument('--features', required = True, help = 'pickled list of the features')
+    parser.add_argument('--name'    , required = True, help = 'version of the BDT, e.g. v1 -> eval_bdt_v1')
+    parser.add_argument('--outputs' , default = None, help = 'comma separated names of the classes (default bdt_mu,bdt_tau,bdt_bkg or bdt)')
+    parser.add_argument('--outdir'  , default = 'exported_bdt', help = 'where to write the .npz and .h files')
+    parser.add_argument('--check'   , default = None, help = 'root file to compare the exported BDT with xgboost on (first 10000 entries)')
+    args = parser.parse_args()
+
+    classifier = pickle.load(open(args.model, 'rb'))
+    features = pickle.load(open(args.features, 'rb'))
+    X = None
+    if args.check:
+        from root_pandas import read_root
+        X = read_root(args.check, 'BTo3Mu', columns = features, stop = 10000)[features].values
+    export_bdt(classifier, features, args.name, args.outdir, args.outputs.split(',') if args.outputs else None, X)
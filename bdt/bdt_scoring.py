@@ -0,0 +1,183 @@
+'''
+Scoring of the samples with a trained XGBoost classifier, with bounded memory.
+
+Only the input features of the BDT are read, chunk by chunk (the next chunk is read while the current one is scored),
+the scores are computed with the in-place prediction of the booster on all the cores, and only the score columns
+(bdt_mu, bdt_tau, bdt_bkg for the multi-class model, one column for the binary ones) are written in a side file,
+with one entry for each entry of the source tree (same order, no selection).
+Peak memory is set by the chunk size, not by the size of the sample.
+
+The side file is used as a friend of the source tree:
+    chain = ROOT.TChain('BTo3Mu'); chain.Add(source)
+    chain.AddFriend('bdt_<flag>', side_file)
+
+Usage:
+    python bdt_scoring.py --model bdtModel/BDT_Model_<flag>.pck --features bdtModel/BDT_Model_<flag>_features.pck --flag <flag>
+'''
+
+import os
+import pickle
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser
+
+import numpy as np
+import ROOT
+from root_pandas import read_root, to_root
+
+tree_name = 'BTo3Mu'
+chunksize = 500000
+# scores of the first entries compared with predict_proba of the classifier
+check_size = 10000
+tolerance = 1e-5
+multiclass_columns = ['bdt_mu', 'bdt_tau', 'bdt_bkg'] # order of the targets of train_bdt.py
+
+def load_classifier(model_path, features_path, nthreads = None):
+    classifier = pickle.load(open(model_path, 'rb'))
+    features = pickle.load(open(features_path, 'rb'))
+    booster = classifier.get_booster()
+    booster.set_param({'nthread': nthreads or mp.cpu_count()})
+    return classifier, booster, features
+
+def score_columns(classifier, binary_column = 'bdt'):
+    '''
+    Names of the output columns: one per class for multi-class models, one for the binary ones
+    '''
+    nclasses = getattr(classifier, 'n_classes_', 2)
+    return multiclass_columns if nclasses == 3 else [binary_column] if nclasses == 2 else ['bdt_%d' %i for i in range(nclasses)]
+
+def class_indices(columns, nclasses):
+    '''
+    [(column, index of the class in the predictions)]. columns is a list with one name per class (one name for
+    binary models, the probability of class 1) or a dict column -> class, to write only some of the classes
+    '''
+    if isinstance(columns, dict):
+        mapping = list(columns.items())
+    elif nclasses == 2 and len(columns) == 1:
+        mapping = [(columns[0], 1)]
+    elif len(columns) == nclasses:
+        mapping = list(zip(columns, range(nclasses)))
+    else:
+        raise ValueError('%d score columns (%s) for a model with %d classes: give one per class or a dict column -> class'
+                         %(len(columns), ', '.join(columns), nclasses))
+    for column, iclass in mapping:
+        if not 0 <= iclass < nclasses or (nclasses == 2 and iclass != 1):
+            raise ValueError('column %s: class %d not available for a model with %d classes (binary: only class 1)' %(column, iclass, nclasses))
+    # the binary predictions have only the probability of class 1
+    return [(column, 0 if nclasses == 2 else iclass) for column, iclass in mapping]
+
+def predict(classifier, booster, X):
+    '''
+    Class probabilities, shape (n_events, n_classes), or (n_events,) for binary models
+    '''
+    X = np.ascontiguousarray(X, dtype = np.float32)
+    if hasattr(booster, 'inplace_predict'):
+        # no DMatrix copy, all the threads of the booster.
+        # With early stopping only the trees up to the best iteration, as predict_proba
+        best_iteration = getattr(booster, 'best_iteration', None)
+        if best_iteration is not None:
+            return booster.inplace_predict(X, iteration_range = (0, int(best_iteration) + 1))
+        return booster.inplace_predict(X)
+    # xgboost < 1.1
+    proba = classifier.predict_proba(X)
+    return proba[:, 1] if proba.shape[1] == 2 else proba
+
+def check_scores(classifier, booster, X):
+    '''
+    Largest difference between the scores of predict and the predict_proba of the classifier on X
+    '''
+    proba = classifier.predict_proba(np.asarray(X, dtype = np.float32))
+    proba = proba[:, 1] if proba.shape[1] == 2 else proba
+    return np.max(np.abs(predict(classifier, booster, X) - proba)) if len(X) else 0.
+
+def side_tree_name(flag):
+    return 'bdt_%s' %flag
+
+def side_path(outdir, sample, flag):
+    return '%s/%s_bdt_%s.root' %(outdir, sample, flag)
+
+def tree_info(path, tree = tree_name):
+    f = ROOT.TFile.Open(path)
+    t = f.Get(tree)
+    entries = t.GetEntries()
+    branches = set(b.GetName() for b in t.GetListOfBranches())
+    f.Close()
+    return entries, branches
+
+def write_scores(source, output, classifier, booster, features, flag, columns = None, tree = tree_name, size = chunksize):
+    '''
+    Writes the side tree with the score columns for all the entries of the source file (see class_indices for columns).
+    The scores of the first check_size entries must agree with predict_proba of the classifier.
+    Returns the number of entries written
+    '''
+    indices = class_indices(columns or score_columns(classifier), getattr(classifier, 'n_classes_', 2))
+    expected, branches = tree_info(source, tree)
+    missing = [f for f in features if f not in branches]
+    if missing:
+        raise ValueError('features not stored in %s (score the enriched samples): %s' %(source, ', '.join(missing)))
+
+    tmp_output = output.replace('.root', '_tmp.root')
+    if os.path.exists(tmp_output):
+        os.remove(tmp_output)
+
+    chunks = read_root(source, tree, columns = features, chunksize = size)
+    written = 0
+    with ThreadPoolExecutor(max_workers = 1) as reader:
+        # prefetch: the next chunk is read while scoring
+        next_chunk = reader.submit(next, chunks, None)
+        while True:
+            chunk = next_chunk.result()
+            if chunk is None:
+                break
+            next_chunk = reader.submit(next, chunks, None)
+
+            if written == 0:
+                difference = check_scores(classifier, booster, chunk[features].values[:check_size])
+                print('\tmax difference wrt predict_proba on %d events: %.2e' %(min(len(chunk), check_size), difference))
+                if difference > tolerance:
+                    raise RuntimeError('scores of %s differ from predict_proba by %.2e' %(source, difference))
+
+            proba = predict(classifier, booster, chunk[features].values).reshape(len(chunk), -1)
+            out = chunk[[]].copy()
+            for column, i in indices:
+                out[column] = proba[:, i]
+            to_root(out, tmp_output, key = side_tree_name(flag), mode = 'a', store_index = False)
+            written += len(out)
+            print('\t%d entries' %written)
+
+    if written != expected:
+        raise RuntimeError('scores of %s have %d entries, the source has %d' %(source, written, expected))
+    os.replace(tmp_output, output)
+    return written
+
+def write_all_scores(sources, model_path, features_path, flag, outdir, columns = None, nthreads = None, size = chunksize):
+    '''
+    sources: dict sample -> root file. Side files in outdir/<sample>_bdt_<flag>.root
+    '''
+    classifier, booster, features = load_classifier(model_path, features_path, nthreads)
+    os.system('mkdir -p %s' %outdir)
+    for sample, source in sources.items():
+        print('Scoring ' + sample)
+        write_scores(source, side_path(outdir, sample, flag), classifier, booster, features, flag, columns, size = size)
+
+if __name__ == '__main__':
+
+    from samples import sample_names_explicit_jpsimother_compressed as sample_names
+
+    parser = ArgumentParser()
+    parser.add_argument('--model'    , required = True, help = 'pickled XGBClassifier')
+    parser.add_argument('--features' , required = True, help = 'pickled list of the features')
+    parser.add_argument('--flag'     , required = True, help = 'label of the model, the side tree is bdt_<flag>')
+    parser.add_argument('--columns'  , default = None, help = 'comma separated names of the score columns, one per class, or column:class pairs (default bdt_mu,bdt_tau,bdt_bkg or bdt)')
+    parser.add_argument('--tree_dir' , default = '/pnfs/psi.ch/cms/trivcat/store/user/friti/dataframes_Dec2021')
+    parser.add_argument('--pattern'  , default = '%s_bdt_vv1.root', help = 'file of each sample in tree_dir')
+    parser.add_argument('--outdir'   , default = 'bdt_scores')
+    parser.add_argument('--chunksize', type = int, default = chunksize)
+    parser.add_argument('--threads'  , type = int, default = None, help = 'threads of the booster (all cores by default)')
+    args = parser.parse_args()
+
+    sources = dict((k, '%s/%s' %(args.tree_dir, args.pattern %k)) for k in sample_names)
+    columns = args.columns.split(',') if args.columns else None
+    if columns and all(':' in column for column in columns):
+        columns = dict((column.split(':')[0], int(column.split(':')[1])) for column in columns)
+    write_all_scores(sources, args.model, args.features, args.flag, args.outdir, columns, args.threads, args.chunksize)
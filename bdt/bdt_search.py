@@ -0,0 +1,153 @@
+'''
+Parallel, resumable search of the BDT configurations on the cached matrices of bdt_dataset.py.
+
+Every configuration of the grid is trained with the histogram tree method and early stopping on a validation set
+(so n_estimators is only an upper limit), in a pool of processes with a few threads each.
+Each finished configuration is appended as one json line to <outdir>/results.jsonl: an interrupted search
+started again with the same outdir skips the configurations already done.
+
+    results = run_search(matrices, grid, outdir, workers = 4, threads = 4)
+'''
+
+import os
+import json
+import time
+import hashlib
+import traceback
+import multiprocessing as mp
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+default_parameters = dict(
+    tree_method      = 'hist',
+    n_estimators     = 15000,
+    learning_rate    = 2e-2,
+    max_depth        = 6,
+    colsample_bytree = 0.5,
+    reg_alpha        = 0.3,
+    reg_lambda       = 1,
+)
+
+def expand_grid(grid, base = default_parameters):
+    '''
+    All the configurations of the grid (dict parameter -> list of values) on top of base
+    '''
+    keys = sorted(grid.keys())
+    configs = []
+    for values in product(*[grid[key] for key in keys]):
+        config = dict(base)
+        config.update(zip(keys, values))
+        configs.append(config)
+    return configs
+
+def config_key(config, early_stopping_rounds, metric):
+    return hashlib.sha1(json.dumps([sorted(config.items()), early_stopping_rounds, metric]).encode()).hexdigest()[:12]
+
+def done_configs(results_file):
+    '''
+    Results already in results_file, by configuration key
+    '''
+    done = dict()
+    if os.path.exists(results_file):
+        with open(results_file) as fh:
+            for line in fh:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue # truncated last line of an interrupted search
+                if result.get('status') == 'ok':
+                    done[result['key']] = result
+    return done
+
+def fit_config(job):
+    '''
+    Trains one configuration in the worker, returns its results
+    '''
+    key, config, matrices_path, outdir, test_size, valid_size, early_stopping_rounds, metric, threads = job
+    result = dict(key = key, config = config, status = 'ok')
+    start = time.time()
+    try:
+        import xgboost as xgb
+        from sklearn.metrics import roc_auc_score
+        from bdt_dataset import Matrices
+
+        matrices = Matrices(matrices_path)
+        train_index, valid_index, test_index = matrices.split(test_size, valid_size)
+        X_train, y_train = np.asarray(matrices.X[train_index]), np.asarray(matrices.y[train_index])
+        X_valid, y_valid = np.asarray(matrices.X[valid_index]), np.asarray(matrices.y[valid_index])
+        X_test, y_test = np.asarray(matrices.X[test_index]), np.asarray(matrices.y[test_index])
+
+        clf = xgb.XGBClassifier(n_jobs = threads, seed = 1986, **config)
+        clf.fit(X_train, y_train,
+                eval_set              = [(X_valid, y_valid)],
+                early_stopping_rounds = early_stopping_rounds,
+                eval_metric           = metric,
+                verbose               = False,
+                sample_weight         = matrices.balanced_weights(train_index),
+        )
+        history = clf.evals_result()['validation_0'][metric]
+        best_iteration = int(getattr(clf, 'best_iteration', len(history) - 1))
+        proba = clf.predict_proba(X_test)
+        result.update(
+            best_iteration = best_iteration,
+            valid_metric   = history[best_iteration],
+            test_auc       = roc_auc_score(y_test, proba[:, 1], sample_weight = matrices.balanced_weights(test_index)) if proba.shape[1] == 2 else None,
+        )
+        clf.save_model(os.path.join(outdir, 'models', 'bdt_%s.json' %key))
+    except Exception:
+        result['status'] = 'failed'
+        result['error'] = traceback.format_exc().strip().split('\n')[-1]
+        traceback.print_exc()
+    result['seconds'] = time.time() - start
+    return result
+
+def failed_configs(results_file):
+    '''
+    Last failure of each configuration of results_file that never succeeded
+    '''
+    done = done_configs(results_file)
+    failed = dict()
+    if os.path.exists(results_file):
+        with open(results_file) as fh:
+            for line in fh:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                if result.get('status') == 'failed' and result['key'] not in done:
+                    failed[result['key']] = result
+    return list(failed.values())
+
+def run_search(matrices, grid, outdir, workers = 4, threads = 4, test_size = 0.25, valid_size = 0.15,
+               early_stopping_rounds = 50, metric = 'logloss', base = default_parameters):
+    '''
+    Trains the configurations of the grid not yet in outdir/results.jsonl and returns all the results, best first
+    '''
+    os.system('mkdir -p %s/models' %outdir)
+    results_file = os.path.join(outdir, 'results.jsonl')
+    done = done_configs(results_file)
+    configs = [(config_key(config, early_stopping_rounds, metric), config) for config in expand_grid(grid, base)]
+    todo = [(key, config) for key, config in configs if key not in done]
+    print("%d configurations, %d already done" %(len(configs), len(configs) - len(todo)))
+
+    jobs = [(key, config, matrices.path, outdir, test_size, valid_size, early_stopping_rounds, metric, threads) for key, config in todo]
+    results = [done[key] for key, config in configs if key in done]
+    # spawn: no xgboost/ROOT state copied from the parent
+    with ProcessPoolExecutor(max_workers = workers, mp_context = mp.get_context('spawn')) as pool:
+        futures = [pool.submit(fit_config, job) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            with open(results_file, 'a') as fh:
+                fh.write(json.dumps(result) + '\n')
+            results.append(result)
+            print("%s %s: best iteration %s, valid %s %s, %.0f s" %(result['key'], result['status'], result.get('best_iteration'),
+                                                                    metric, result.get('valid_metric'), result['seconds']))
+
+    ok = [result for result in results if result['status'] == 'ok']
+    larger_is_better = metric in ['auc', 'aucpr', 'map']
+    return sorted(ok, key = lambda result: result['valid_metric'], reverse = larger_is_better)
@@ -0,0 +1 @@
+../hammer/inspector/ancestry.py
\ No newline at end of file
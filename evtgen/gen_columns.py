@@ -0,0 +1 @@
+../hammer/inspector/gen_columns.py
\ No newline at end of file
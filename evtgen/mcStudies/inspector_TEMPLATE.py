@@ -22,6 +22,8 @@ from DataFormats.FWLite import Events, Handle
 from PhysicsTools.HeppyCore.utils.deltar import deltaR, deltaPhi
 # https://pypi.org/project/particle/
 from particle import Particle
+from ancestry import AncestryIndex
+from tree_writer import TreeWriter, inspector_types
 from files_HbToJPsiMuMu_3MuFilter_old import files
 
 parser = argparse.ArgumentParser(description='')
@@ -95,7 +97,8 @@ def isAncestor(a, p):
             return True
     return False
 
-def printAncestors(particle, ancestors=[], verbose=True):
+def printAncestors(particle, ancestors=None, verbose=True):
+    ancestors = [] if ancestors is None else ancestors
     for i in xrange(0, particle.numberOfMothers()):
         mum = particle.mother(i)
 #         if mum is None: import pdb ; pdb.set_trace()
@@ -236,8 +239,7 @@ branches = [
 #     'ctau_weight_down_lhe',
 ]
 
-fout = ROOT.TFile('HOOK_FILE_OUT', 'recreate')
-ntuple = ROOT.TNtuple('tree', 'tree', ':'.join(branches))
+writer = TreeWriter('HOOK_FILE_OUT', branches, types = inspector_types(branches))
 tofill = OrderedDict(zip(branches, [np.nan]*len(branches)))
 
 start = time()
@@ -270,6 +272,9 @@ for i, event in enumerate(events):
    
     if verbose: print('=========>')
     
+    # ancestry of the gen particles, computed once for the event
+    ancestry = AncestryIndex(event.genp)
+
     jpsis = [ip for ip in event.genp if abs(ip.pdgId())==443]
     
     bs =  [ip for ip in event.genp if (abs(ip.pdgId())>500 and abs(ip.pdgId())<600) or (abs(ip.pdgId())>5000 and abs(ip.pdgId())<6000)]
@@ -290,7 +295,7 @@ for i, event in enumerate(events):
         if verbose: print('\t%s %s pt %3.2f,\t genealogy: ' %(Particle.from_pdgid(jpsi.pdgId()), str(daus), jpsi.pt()), end='')
         ancestors = []
         if verbose: print('\t', printAncestors(jpsi, ancestors, verbose=True))
-        else: printAncestors(jpsi, ancestors, verbose=False)
+        else: ancestors = ancestry.ancestors(jpsi)
         
         # only save jpsi->mumu
         if sum([abs(dau)==13 for dau in daus])<2: continue
@@ -354,7 +359,7 @@ for i, event in enumerate(events):
         final_state_muons = [ip for ip in event.genp if abs(ip.pdgId())==13 and ip.status()==1]
         tofill['is3m'      ] = len(final_state_muons)>=3
 
-        jpsi_muons = [imu for imu in final_state_muons if isAncestor(jpsi, imu)]
+        jpsi_muons = [imu for imu in final_state_muons if ancestry.is_ancestor(jpsi, imu)]
         jpsi_muons.sort(key = lambda x : x.pt(), reverse = True)
         if len(jpsi_muons)<2:
             continue
@@ -436,7 +441,7 @@ for i, event in enumerate(events):
 
             # fill only if it comes from  a B
             if first_ancestor in bs:
-                ntuple.Fill(array('f', tofill.values()))
+                writer.fill(tofill)
                 #         ntuple.Fill(array('f', tofill.values()))
 
     if verbose:
@@ -460,8 +465,6 @@ for i, event in enumerate(events):
                 if abs(ij.daughter(0).pdgId())!=13:
                     pass
     
-fout.cd()
-ntuple.Write()
-fout.Close()
+writer.close()
 print("Success!")    
 print("File HOOK_FILE_OUT saved!" )
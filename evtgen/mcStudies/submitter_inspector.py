@@ -39,6 +39,8 @@ if not os.path.exists(out_dir):
     os.makedirs(out_dir + '/errs')
 os.system('cp files_HbToJPsiMuMu_3MuFilter_old.py ' + out_dir + '/.')
 os.system('cp -r GeneratorInterface ' + out_dir + '/.')
+os.system('cp ancestry.py ' + out_dir + '/.')
+os.system('cp tree_writer.py ' + out_dir + '/.')
 
 for ijob in range(njobs):
 
@@ -0,0 +1 @@
+../hammer/inspector/tree_writer.py
\ No newline at end of file
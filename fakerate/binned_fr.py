@@ -0,0 +1,244 @@
+'''
+Binned fake rate: pass/total ratio in bins of a few variables (kpt, abs(keta), Q_sq, ...),
+a cheap cross-check of the NN fake rate (a table lookup instead of a model evaluation).
+
+ - compute_fr_map fills the pass and total counts of all the bins in a single RDataFrame event loop
+   (two flat histos of the global bin index, first variable running fastest)
+ - the map is saved as a numpy file (edges, counts with sumw2, fake rate and error)
+ - FRMap.lookup / FRMap.transfer give the fake rate or fr/(1-fr) of numpy arrays of the variables,
+   FRMap.define adds them as columns of a RDataFrame (generated C++ with the table, thread safe)
+Values outside the binning take the fake rate of the first/last bin of that variable.
+
+    fr_map = compute_fr_map(df, 'kpt_eta', ['kpt', 'abs(keta)'], [[4, 6, 10, 25], [0, 1.2, 2.5]], pass_id)
+    fr_map.save('fr_maps/kpt_eta.npz')
+    df = FRMap.load('fr_maps/kpt_eta.npz').define(df)   # fr_kpt_eta and fr_weight_kpt_eta = fr/(1-fr)
+'''
+
+import os
+import numpy as np
+import ROOT
+
+default_binning = {
+    'kpt'       : [4., 5., 6., 8., 10., 15., 25.],
+    'abs(keta)' : [0., 0.8, 1.2, 1.6, 2.1, 2.5],
+    'Q_sq'      : [0., 4., 6., 8., 10.5],
+}
+
+def _array(values):
+    return '{%s}' %', '.join(repr(float(v)) for v in np.ravel(values))
+
+class FRMap(object):
+    '''
+    Fake rate in the bins of variables (expressions of the branches) with edges.
+    pass_sumw, pass_sumw2, tot_sumw, tot_sumw2 have shape (nbins of each variable)
+    '''
+
+    def __init__(self, name, variables, edges, pass_sumw, pass_sumw2, tot_sumw, tot_sumw2):
+        self.name = name
+        self.variables = list(variables)
+        self.edges = [np.asarray(e, dtype = np.float64) for e in edges]
+        self.shape = tuple(len(e) - 1 for e in self.edges)
+        self.pass_sumw = np.asarray(pass_sumw).reshape(self.shape)
+        self.pass_sumw2 = np.asarray(pass_sumw2).reshape(self.shape)
+        self.tot_sumw = np.asarray(tot_sumw).reshape(self.shape)
+        self.tot_sumw2 = np.asarray(tot_sumw2).reshape(self.shape)
+        self.fr, self.fr_error = self._ratio()
+
+    def _ratio(self):
+        # binomial error with the effective number of events of the total (weighted events)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            fr = np.where(self.tot_sumw > 0., self.pass_sumw / self.tot_sumw, 0.)
+            neff = np.where(self.tot_sumw2 > 0., self.tot_sumw**2 / self.tot_sumw2, 0.)
+            error = np.where(neff > 0., np.sqrt(np.clip(fr * (1. - fr), 0., None) / neff), 0.)
+        return fr, error
+
+    @property
+    def transfer_factor(self):
+        '''
+        fr/(1-fr): weight of the events failing the id, as nn/(1-nn) for the NN
+        '''
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return np.where(self.fr < 1., self.fr / (1. - self.fr), 0.)
+
+    def cells(self, *values):
+        '''
+        Bin of each variable for arrays of values (clamped to the first/last bin)
+        '''
+        return tuple(np.clip(np.searchsorted(e, np.asarray(v, dtype = np.float64), side = 'right') - 1, 0, len(e) - 2)
+                     for e, v in zip(self.edges, values))
+
+    def lookup(self, *values):
+        return self.fr[self.cells(*values)]
+
+    def transfer(self, *values):
+        return self.transfer_factor[self.cells(*values)]
+
+    def save(self, path):
+        os.system('mkdir -p %s' %(os.path.dirname(path) or '.'))
+        arrays = dict(name = np.array(self.name), variables = np.array(self.variables),
+                      pass_sumw = self.pass_sumw, pass_sumw2 = self.pass_sumw2, tot_sumw = self.tot_sumw, tot_sumw2 = self.tot_sumw2,
+                      fr = self.fr, fr_error = self.fr_error)
+        for i, e in enumerate(self.edges):
+            arrays['edges_%d' %i] = e
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path)
+        variables = [str(v) for v in arrays['variables']]
+        edges = [arrays['edges_%d' %i] for i in range(len(variables))]
+        return cls(str(arrays['name']), variables, edges, arrays['pass_sumw'], arrays['pass_sumw2'], arrays['tot_sumw'], arrays['tot_sumw2'])
+
+    def cpp_code(self):
+        '''
+        C++ with the global bin (fr_cell_<name>) and the lookup of the fake rate and of fr/(1-fr),
+        can also be saved and included elsewhere
+        '''
+        return cell_code(self.name, self.edges) + table_code(self.name, len(self.edges), self.fr.ravel(order = 'F'), self.transfer_factor.ravel(order = 'F'))
+
+    def declare(self):
+        declare('fr_cell_%s' %self.name, cell_code(self.name, self.edges))
+        declare('fr_map_%s' %self.name, table_code(self.name, len(self.edges), self.fr.ravel(order = 'F'), self.transfer_factor.ravel(order = 'F')))
+
+    def define(self, df, column = None):
+        '''
+        Defines fr_<name> and fr_weight_<name> = fr/(1-fr) (or column, column_weight)
+        '''
+        self.declare()
+        column = column or 'fr_%s' %self.name
+        weight = column.replace('fr_', 'fr_weight_', 1) if column.startswith('fr_') else column + '_weight'
+        arguments = ', '.join('(double)(%s)' %v for v in self.variables)
+        df = df.Define(column, 'fr_map_%s(%s)' %(self.name, arguments))
+        return df.Define(weight, 'fr_transfer_%s(%s)' %(self.name, arguments))
+
+    def th(self, values = 'fr'):
+        '''
+        TH1D or TH2D of the fake rate (with errors), for 1D and 2D maps
+        '''
+        contents = self.fr if values == 'fr' else self.transfer_factor
+        if len(self.edges) == 1:
+            hist = ROOT.TH1D('fr_%s' %self.name, ';%s;fake rate' %self.variables[0], self.shape[0], self.edges[0])
+        elif len(self.edges) == 2:
+            hist = ROOT.TH2D('fr_%s' %self.name, ';%s;%s;fake rate' %tuple(self.variables), self.shape[0], self.edges[0], self.shape[1], self.edges[1])
+        else:
+            raise ValueError('only 1D and 2D maps can be converted to a histo')
+        hist.SetDirectory(0)
+        for cell in np.ndindex(*self.shape):
+            ibin = hist.GetBin(*[i + 1 for i in cell])
+            hist.SetBinContent(ibin, contents[cell])
+            hist.SetBinError(ibin, self.fr_error[cell] if values == 'fr' else 0.)
+        return hist
+
+def cell_code(name, edges):
+    '''
+    C++ of fr_cell_<name>(one double for each variable): global bin, first variable running fastest
+    '''
+    guard = 'FR_CELL_%s' %name.upper()
+    lines = []
+    lines.append('#ifndef %s' %guard)
+    lines.append('#define %s' %guard)
+    lines.append('#include <algorithm>')
+    lines.append('namespace fr_cell_%s_edges {' %name)
+    for i, e in enumerate(edges):
+        lines.append('  static const double edges_%d[%d] = %s;' %(i, len(e), _array(e)))
+    lines.append('}')
+    lines.append('inline int fr_cell_%s(%s){' %(name, ', '.join('double x%d' %i for i in range(len(edges)))))
+    lines.append('  using namespace fr_cell_%s_edges;' %name)
+    lines.append('  int cell = 0;')
+    stride = 1
+    for i, e in enumerate(edges):
+        nbins = len(e) - 1
+        lines.append('  int bin%d = std::upper_bound(edges_%d, edges_%d + %d, x%d) - edges_%d - 1;' %(i, i, i, len(e), i, i))
+        lines.append('  bin%d = std::min(std::max(bin%d, 0), %d);' %(i, i, nbins - 1))
+        lines.append('  cell += %d * bin%d;' %(stride, i))
+        stride *= nbins
+    lines.append('  return cell;')
+    lines.append('}')
+    lines.append('#endif')
+    return '\n'.join(lines) + '\n'
+
+def table_code(name, nvariables, fr, transfer):
+    '''
+    C++ of fr_map_<name> and fr_transfer_<name>, lookup in the tables (needs fr_cell_<name>)
+    '''
+    guard = 'FR_MAP_%s' %name.upper()
+    arguments = ', '.join('double x%d' %i for i in range(nvariables))
+    calls = ', '.join('x%d' %i for i in range(nvariables))
+    lines = []
+    lines.append('#ifndef %s' %guard)
+    lines.append('#define %s' %guard)
+    lines.append('namespace fr_map_%s_parameters {' %name)
+    lines.append('  static const double fr[%d] = %s;' %(len(fr), _array(fr)))
+    lines.append('  static const double transfer[%d] = %s;' %(len(transfer), _array(transfer)))
+    lines.append('}')
+    lines.append('inline double fr_map_%s(%s){ return fr_map_%s_parameters::fr[fr_cell_%s(%s)]; }' %(name, arguments, name, name, calls))
+    lines.append('inline double fr_transfer_%s(%s){ return fr_map_%s_parameters::transfer[fr_cell_%s(%s)]; }' %(name, arguments, name, name, calls))
+    lines.append('#endif')
+    return '\n'.join(lines) + '\n'
+
+def declare(function, code):
+    if not hasattr(ROOT, function):
+        if not ROOT.gInterpreter.Declare(code):
+            raise RuntimeError('cannot declare %s' %function)
+
+def compute_fr_map(df, name, variables, edges, pass_id, total = None, weight = None):
+    '''
+    Counts of pass_id and of total (all the events of df if None) in the bins, in one event loop
+    '''
+    nbins = [len(e) - 1 for e in edges]
+    ncells = int(np.prod(nbins))
+    declare('fr_cell_%s' %name, cell_code(name, edges))
+
+    cell = 'fr_cell_%s' %name
+    df = df.Define(cell, 'fr_cell_%s(%s)' %(name, ', '.join('(double)(%s)' %v for v in variables)))
+    if total is not None:
+        df = df.Filter(total)
+    w = '(double)(%s)' %weight if weight else '1.'
+    df = df.Define('%s_w_tot' %cell, w).Define('%s_w_pass' %cell, '(%s) ? %s : 0.' %(pass_id, w))
+
+    model = lambda label: ROOT.RDF.TH1DModel('%s_%s' %(cell, label), '', ncells, -0.5, ncells - 0.5)
+    h_tot = df.Histo1D(model('tot'), cell, '%s_w_tot' %cell)
+    h_pass = df.Histo1D(model('pass'), cell, '%s_w_pass' %cell)
+
+    arrays = []
+    for hist in [h_pass.GetPtr(), h_tot.GetPtr()]: # runs the event loop once for both
+        sumw = np.array([hist.GetBinContent(i) for i in range(1, ncells + 1)])
+        sumw2 = np.array([hist.GetBinError(i)**2 for i in range(1, ncells + 1)])
+        arrays += [sumw.reshape(nbins, order = 'F'), sumw2.reshape(nbins, order = 'F')]
+    return FRMap(name, variables, edges, *arrays)
+
+if __name__ == '__main__':
+
+    from argparse import ArgumentParser
+    from selections import preselection, pass_id, fail_id
+
+    parser = ArgumentParser()
+    parser.add_argument('--input'    , default = '/pnfs/psi.ch/cms/trivcat/store/user/friti/dataframes_2021Mar15/data_ptmax_merged.root')
+    parser.add_argument('--variables', default = 'kpt,abs(keta)', help = 'comma separated, binning from default_binning')
+    parser.add_argument('--name'     , default = 'kpt_eta', help = 'name of the map (and of the columns fr_<name>)')
+    parser.add_argument('--outdir'   , default = 'fr_maps')
+    parser.add_argument('--weight'   , default = None, help = 'column of the event weights')
+    parser.add_argument('--threads'  , type = int, default = 0, help = 'threads of ImplicitMT (0 for all)')
+    args = parser.parse_args()
+
+    ROOT.gROOT.SetBatch()
+    ROOT.gStyle.SetOptStat(0)
+    ROOT.EnableImplicitMT(args.threads)
+
+    variables = args.variables.split(',')
+    edges = [default_binning[v] for v in variables]
+
+    df = ROOT.RDataFrame('BTo3Mu', args.input).Filter(preselection)
+    fr_map = compute_fr_map(df, args.name, variables, edges, pass_id, total = '(%s) | (%s)' %(pass_id, fail_id), weight = args.weight)
+    fr_map.save('%s/%s.npz' %(args.outdir, args.name))
+    for cell in np.ndindex(*fr_map.shape):
+        print(' '.join('%s [%g, %g)' %(v, e[i], e[i+1]) for v, e, i in zip(variables, fr_map.edges, cell)), 'fr = %.4f +- %.4f' %(fr_map.fr[cell], fr_map.fr_error[cell]))
+
+    if len(variables) <= 2:
+        c1 = ROOT.TCanvas('c1', '', 700, 700)
+        hist = fr_map.th()
+        hist.Draw('colz text' if len(variables) == 2 else 'e')
+        c1.SaveAs('%s/%s.png' %(args.outdir, args.name))
+        fout = ROOT.TFile.Open('%s/%s.root' %(args.outdir, args.name), 'recreate')
+        hist.Write()
+        fout.Close()
@@ -6,12 +6,13 @@ from root_pandas import read_root, to_root
 from datetime import datetime
 import ROOT
 import os
-from array import array
+import numpy as np
 
 from cmsstyle import CMS_lumi
 from officialStyle import officialStyle
 
 from selections import preselection, pass_id, fail_id
+from np_histos import th1, th2, uniform_edges
 
 #no pop-up windows
 ROOT.gROOT.SetBatch()
@@ -46,13 +47,8 @@ make_directories(label)
 #tree_pass = tree_df[(tree_df.k_mediumID>0.5) & (tree_df.k_raw_db_corr_iso03_rel<0.2)].copy()
 # 1D histos of fr vs pt and fr vs eta
 for var in variables:
-    his_pass = ROOT.TH1F("pass","pass",variables[var]['nbins'],variables[var]['xmin'],variables[var]['xmax'])
-    his_tot = ROOT.TH1F("tot","tot",variables[var]['nbins'],variables[var]['xmin'],variables[var]['xmax'])
-
-    for item in tree_pass[var]:
-        his_pass.Fill(item)
-    for item in tree_df[var]:
-        his_tot.Fill(item)
+    his_pass = th1("pass","pass",variables[var]['nbins'],variables[var]['xmin'],variables[var]['xmax'], tree_pass[var], cls = ROOT.TH1F)
+    his_tot = th1("tot","tot",variables[var]['nbins'],variables[var]['xmin'],variables[var]['xmax'], tree_df[var], cls = ROOT.TH1F)
 
     eff = ROOT.TEfficiency(his_pass,his_tot)
     eff.SetTitle(';'+var+'; eff')
@@ -105,15 +101,12 @@ print(y_edges)
 
 # 2d fakerate histo
 
-pt_histo_edges = array('d',y_edges)
-histo_2d_pass = ROOT.TH2F("pass2d","pass2d",8,pt_histo_edges,5,0,variables['keta']['xmax'])
-histo_2d_tot = ROOT.TH2F("tot2d","tot2d",8,pt_histo_edges,5,0,variables['keta']['xmax'])
-eff_2d = ROOT.TH2F("eff","eff",8,pt_histo_edges,5,0,variables['keta']['xmax'])
-
-for pt,eta in zip(tree_pass['kpt'],tree_pass['keta']):
-    histo_2d_pass.Fill(pt,abs(eta))
-for pt,eta in zip(tree_df['kpt'],tree_df['keta']):
-    histo_2d_tot.Fill(pt,abs(eta))
+pt_histo_edges = np.array(y_edges)
+eta_histo_edges = uniform_edges(5,0,variables['keta']['xmax'])
+histo_2d_pass = th2("pass2d","pass2d",pt_histo_edges,eta_histo_edges,tree_pass['kpt'],np.abs(tree_pass['keta']), cls = ROOT.TH2F)
+histo_2d_tot = th2("tot2d","tot2d",pt_histo_edges,eta_histo_edges,tree_df['kpt'],np.abs(tree_df['keta']), cls = ROOT.TH2F)
+eff_2d = histo_2d_tot.Clone("eff")
+eff_2d.SetTitle("eff")
 
 #eff_2d = ROOT.TEfficiency(histo_2d_pass,histo_2d_tot)
 eff_2d.Divide(histo_2d_pass,histo_2d_tot)
@@ -0,0 +1,242 @@
+'''
+Cached training arrays for the fake-rate NNs.
+
+build_dataset reads the samples once (read_root with the selection + to_define), labels pass (1) and fail (0) events
+and saves the raw (not scaled) features, labels, weights and sample of origin as .npy files in
+    <cache_dir>/<key>/
+where key is a hash of the selection, pass/fail definitions, features, weights, of the definitions of the derived
+columns (source of to_define) and of the input files (path, size and modification time).
+The events are shuffled once, with a fixed seed, before saving.
+If the key is already there, nothing is read again: the arrays are opened memory-mapped, so
+every training (and every fold, or every process of a sweep) shares the same arrays without copies.
+
+The inputs of the nn_fakerate_* trainers (selection, pass_id, fail_id and the sources of sample_sets:
+only data, only MC, data + MC) are defined here once:
+    dataset = build_dataset(sample_sets['onlydata'], selection, features, pass_id, fail_id)
+    for fold, (train_index, test_index) in enumerate(dataset.folds(5)): ...
+    results = train_kfold(dataset, outdir, k = 5)
+'''
+
+import os
+import json
+import inspect
+import pickle
+import shutil
+import hashlib
+import numpy as np
+from sklearn.preprocessing import RobustScaler
+
+from nn_export import scaler_parameters
+from nn_training import train, build_model, diagnostics
+from selections_for_fakerate import preprepreselection, triggerselection, etaselection
+
+tree_name = 'BTo3Mu'
+cache_dir = '/scratch/fakerate_datasets'
+arrays = ['X', 'y', 'w', 'source']
+
+# selection and pass / fail regions of the nn_fakerate_* trainers
+selection = preprepreselection + "&" + triggerselection + "&" + etaselection + "& Bpt_reco<80"
+pass_id = 'k_mediumID<0.5 & k_raw_db_corr_iso03_rel<0.2'
+fail_id = '(k_mediumID<0.5) & (k_raw_db_corr_iso03_rel>0.2)'
+
+# sources of each sample set: name -> root file, or (root file, selection added to the common one, weight expression)
+tree_dir = '/pnfs/psi.ch/cms/trivcat/store/user/friti/dataframes_June2022'
+true_muon = '(abs(k_genpdgId)==13)'
+# normalisations of nn_fakerate_onlymc_v5.py
+mc_weight = '0.09 * 1.1 * 1.04 * 0.85 * 0.9 * 1.4'
+jpsix_weight = '0.3 * 0.85 * 0.7 * 0.1 * 2.7 * 1.6 * 0.85 * 1.8 * 1.4 * jpsimother_weight'
+mc_samples = ['jpsi_mu', 'jpsi_tau', 'chic0_mu', 'chic1_mu', 'chic2_mu', 'jpsi_hc', 'hc_mu', 'psi2s_mu', 'psi2s_tau']
+jpsix_samples = ['jpsi_x_mu_from_bzero', 'jpsi_x_mu_from_bplus', 'jpsi_x_mu_from_bzero_s', 'jpsi_x_mu_from_sigma',
+                 'jpsi_x_mu_from_lambdazero_b', 'jpsi_x_mu_from_xi']
+
+def _tree(sample):
+    return '%s/%s_nopresel_withpresel_v2.root' %(tree_dir, sample)
+
+sample_sets = dict(
+    # nn_fakerate_onlydata_v6.py
+    onlydata = {'data': _tree('data')},
+    # nn_fakerate_onlymc_v5.py: true muons of the signal and Hb -> J/psi X MC
+    onlymc = dict([(sample, (_tree(sample), true_muon, mc_weight)) for sample in mc_samples] +
+                  [(sample, (_tree(sample), true_muon, jpsix_weight)) for sample in jpsix_samples]),
+    # nn_fakerate_data_v2.py: data and the true muons of the J/psi mu MC
+    data_mc = {'data': _tree('data'), 'jpsi_mu': (_tree('jpsi_mu'), true_muon, None)},
+)
+
+def source_parameters(source):
+    '''
+    (root file, added selection, weight expression) of a source given as a root file or as that tuple
+    '''
+    return (source, None, None) if isinstance(source, str) else tuple(source)
+
+def file_signature(path):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, int(stat.st_mtime))
+
+def dataset_key(sources, selection, features, pass_id, fail_id, weight, to_define, tree = tree_name, seed = 1986):
+    '''
+    to_define: the function adding the derived columns, a change of its code reads the samples again
+    '''
+    signature = dict(
+        sources   = sorted((name, file_signature(path), extra, expression) for name, (path, extra, expression)
+                           in ((name, source_parameters(source)) for name, source in sources.items())),
+        to_define = inspect.getsource(to_define),
+        selection = selection,
+        features  = list(features),
+        pass_id   = pass_id,
+        fail_id   = fail_id,
+        weight    = weight,
+        tree      = tree,
+        seed      = seed,
+    )
+    return hashlib.sha1(repr(sorted(signature.items())).encode()).hexdigest()[:16]
+
+class Dataset(object):
+
+    def __init__(self, path, mmap_mode = 'r'):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as fh:
+            self.meta = json.load(fh)
+        self.features = self.meta['features']
+        for name in arrays:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode = mmap_mode))
+
+    def __len__(self):
+        return len(self.y)
+
+    def split(self, test_size = 0.2):
+        '''
+        (train_index, test_index): the events are already shuffled, the test set is the last test_size fraction
+        '''
+        n_test = int(round(len(self) * test_size))
+        return np.arange(len(self) - n_test), np.arange(len(self) - n_test, len(self))
+
+    def folds(self, k):
+        '''
+        k (train_index, test_index): fold i is tested on the i-th block of the (shuffled) events
+        '''
+        edges = np.linspace(0, len(self), k+1).astype(int)
+        everything = np.arange(len(self))
+        return [(np.concatenate([everything[:edges[i]], everything[edges[i+1]:]]), everything[edges[i]:edges[i+1]]) for i in range(k)]
+
+    def columns(self, features = None):
+        # positions of the features in X (all of them if None)
+        return list(range(len(self.features))) if features is None else [self.features.index(f) for f in features]
+
+    def scaler(self, index, features = None):
+        qt = RobustScaler()
+        qt.fit(self.X[np.sort(index)][:, self.columns(features)])
+        return qt
+
+def build_dataset(sources, selection, features, pass_id, fail_id, weight = None, tree = tree_name, cache = cache_dir, seed = 1986, to_define = None):
+    '''
+    sources: dict name -> root file, or (root file, selection added to selection, weight expression) (see sample_sets).
+    weight: column of the event weights (None for unweighted), times the weight expression of the source.
+    to_define: function adding the derived columns to the DataFrame (default the one of new_branches_pandas.py)
+    Returns the Dataset, built only if not already in the cache
+    '''
+    if to_define is None:
+        from new_branches_pandas import to_define
+    key = dataset_key(sources, selection, features, pass_id, fail_id, weight, to_define, tree, seed)
+    path = os.path.join(cache, key)
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        print("Dataset %s from the cache" %key)
+        return Dataset(path)
+
+    from root_pandas import read_root
+
+    X, y, w, source = [], [], [], []
+    names = sorted(sources.keys())
+    for isource, name in enumerate(names):
+        print("Reading " + name)
+        source_path, extra, expression = source_parameters(sources[name])
+        df = to_define(read_root(source_path, tree, where = selection if extra is None else selection + ' & ' + extra))
+        for label, query in [(1, pass_id), (0, fail_id)]:
+            sel = df.query(query)
+            X.append(sel[features].values.astype(np.float32))
+            y.append(np.full(len(sel), label, dtype = np.int8))
+            weights = sel[weight].values.astype(np.float32) if weight else np.ones(len(sel), dtype = np.float32)
+            if expression is not None:
+                weights = weights * np.broadcast_to(np.asarray(sel.eval(expression), dtype = np.float32), (len(sel),))
+            w.append(weights)
+            source.append(np.full(len(sel), isource, dtype = np.int16))
+
+    order = np.random.RandomState(seed).permutation(sum(len(a) for a in y))
+    values = dict(X = np.concatenate(X)[order], y = np.concatenate(y)[order], w = np.concatenate(w)[order], source = np.concatenate(source)[order])
+
+    # written in a temporary directory and moved in place when complete
+    tmp_path = path + '_tmp'
+    shutil.rmtree(tmp_path, ignore_errors = True)
+    os.makedirs(tmp_path)
+    for name in arrays:
+        np.save(os.path.join(tmp_path, name + '.npy'), values[name])
+    meta = dict(key = key, features = list(features), selection = selection, pass_id = pass_id, fail_id = fail_id,
+                weight = weight, tree = tree, sources = names, files = [source_parameters(sources[name]) for name in names], events = len(order))
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as fh:
+        json.dump(meta, fh, indent = 2)
+    os.rename(tmp_path, path)
+    print("Dataset %s saved: %d events" %(key, len(order)))
+    return Dataset(path)
+
+def scaler_transform(qt, columns):
+    # the RobustScaler (on the chosen columns) as a plain function of the batches
+    center, scale = scaler_parameters(qt, len(columns))
+    return lambda x: (x[:, columns] - center) / scale
+
+def train_fold(dataset, train_index, test_index, outdir, model_builder = build_model, val_fraction = 0.2, features = None, **kwargs):
+    '''
+    Trains one model on train_index (the last val_fraction of it for the validation) and evaluates it once on test_index.
+    features: subset of the features of the dataset to use (all if None).
+    outdir has the same layout of the nn_fakerate_* trainers (input_tranformation_weighted.pck, model/...),
+    so nn_inference.py and nn_export.py can be used on it
+    '''
+    os.system('mkdir -p %s/model' %outdir)
+    n_val = int(round(len(train_index) * val_fraction))
+    fit_index, val_index = train_index[:len(train_index)-n_val], train_index[len(train_index)-n_val:]
+
+    features = list(dataset.features) if features is None else list(features)
+    qt = dataset.scaler(fit_index, features)
+    pickle.dump(qt, open(os.path.join(outdir, 'input_tranformation_weighted.pck'), 'wb'))
+    pickle.dump(features, open(os.path.join(outdir, 'model', 'input_features.pck'), 'wb'))
+    transform = scaler_transform(qt, dataset.columns(features))
+
+    model = model_builder(len(features))
+    history = train(model, dataset.X, dataset.y, dataset.X, dataset.y, os.path.join(outdir, 'model'),
+                    w_train = dataset.w, w_val = dataset.w, train_index = fit_index, val_index = val_index, transform = transform, **kwargs)
+    model.save(os.path.join(outdir, 'model', 'net_model_weighted.h5'))
+
+    test_index = np.sort(test_index)
+    loss, acc, auc = diagnostics(model, transform(np.asarray(dataset.X[test_index], dtype = np.float32)), np.asarray(dataset.y[test_index], dtype = np.float32), dataset.w[test_index])
+    return dict(test_loss = loss, test_acc = acc, test_auc = auc, history = history, path = outdir)
+
+def train_kfold(dataset, outdir, k = 5, model_builder = build_model, **kwargs):
+    '''
+    k-fold training on the same (memory-mapped) arrays; returns the results of each fold
+    '''
+    results = []
+    for fold, (train_index, test_index) in enumerate(dataset.folds(k)):
+        print("Fold %d/%d" %(fold+1, k))
+        result = train_fold(dataset, train_index, test_index, os.path.join(outdir, 'fold%d' %fold), model_builder, **kwargs)
+        print("Fold %d: test loss %.4f auc %.4f" %(fold+1, result['test_loss'], result['test_auc']))
+        results.append(result)
+    return results
+
+if __name__ == '__main__':
+
+    from datetime import datetime
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('--samples'  , default = 'onlydata', choices = sorted(sample_sets), help = 'sample set of the training')
+    parser.add_argument('--folds'    , type = int, default = 5, help = 'number of folds')
+    parser.add_argument('--epochs'   , type = int, default = 50, help = 'epochs of each training')
+    parser.add_argument('--cache_dir', default = cache_dir, help = 'directory of the cached datasets')
+    parser.add_argument('--outdir'   , default = '/work/friti/rjpsi_tools/CMSSW_10_6_14/src/RJpsiTools/fakerate/nn/kfold_' + datetime.now().strftime('%d%b%Y_%Hh%Mm%Ss'))
+    args = parser.parse_args()
+
+    # same features of nn_fakerate_onlydata_v6.py
+    features = ['Bpt_log', 'abs_Beta', 'Q_sq', 'nPV', 'jpsivtx_log10_lxy_sig', 'Bmass']
+
+    dataset = build_dataset(sample_sets[args.samples], selection, features, pass_id, fail_id, cache = args.cache_dir)
+    results = train_kfold(dataset, args.outdir, k = args.folds, epochs = args.epochs)
+    aucs = [result['test_auc'] for result in results]
+    print("AUC on the test folds: %.4f +- %.4f" %(np.mean(aucs), np.std(aucs)))
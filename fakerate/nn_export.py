@@ -0,0 +1,181 @@
+'''
+Export of a trained fake-rate NN (Dense layers) and of its RobustScaler to
+ - a numpy file (<name>.npz) evaluated by evaluate_numpy, with no keras/sklearn needed
+ - a self-contained C++ header (<name>.h) with the function eval_nn_<name>(inputs...),
+   thread safe (no state, no allocations), to be used in a RDataFrame Define
+   (see plotting/nn_eval.py, which defines nn_<name> and fakerate_<name> = nn/(1-nn))
+
+Only the layers of the fake-rate networks are supported: Dense (linear, relu, sigmoid, tanh, elu),
+BatchNormalization (folded in an affine transformation) and Dropout (ignored at inference).
+
+Usage:
+    python nn_export.py --nn nn/<label> --name onlydata_70 [--model net_model_weighted.h5] [--outdir exported_nn]
+'''
+
+import os
+import pickle
+from argparse import ArgumentParser
+import numpy as np
+
+activations = ['linear', 'relu', 'sigmoid', 'tanh', 'elu']
+
+def scaler_parameters(qt, nfeatures):
+    '''
+    center and scale of the RobustScaler: x -> (x-center)/scale
+    '''
+    center = getattr(qt, 'center_', None)
+    scale = getattr(qt, 'scale_', None)
+    center = np.zeros(nfeatures) if center is None else np.asarray(center, dtype = np.float64)
+    scale = np.ones(nfeatures) if scale is None else np.asarray(scale, dtype = np.float64)
+    return center, scale
+
+def model_layers(model):
+    '''
+    List of (kernel, bias, activation) of the network, kernel with shape (n_in, n_out)
+    '''
+    layers = []
+    for layer in model.layers:
+        kind = layer.__class__.__name__
+        config = layer.get_config()
+        if kind in ['InputLayer', 'Dropout']:
+            continue
+        elif kind == 'Dense':
+            weights = layer.get_weights()
+            kernel = np.asarray(weights[0], dtype = np.float64)
+            bias = np.asarray(weights[1], dtype = np.float64) if config.get('use_bias', True) else np.zeros(kernel.shape[1])
+            activation = config['activation']
+            if activation not in activations:
+                raise ValueError('activation %s of layer %s not supported' %(activation, layer.name))
+            layers.append((kernel, bias, activation))
+        elif kind == 'BatchNormalization':
+            # weights are [gamma], [beta], moving_mean, moving_variance
+            weights = layer.get_weights()
+            gamma = weights.pop(0) if config.get('scale', True) else 1.
+            beta = weights.pop(0) if config.get('center', True) else 0.
+            mean, variance = weights
+            factor = gamma / np.sqrt(variance + config['epsilon'])
+            layers.append((np.diag(factor), beta - factor * mean, 'linear'))
+        else:
+            raise ValueError('layer %s (%s) not supported' %(layer.name, kind))
+    return layers
+
+def save_numpy(path, features, center, scale, layers):
+    arrays = dict(features = np.array(features), center = center, scale = scale,
+                  activations = np.array([act for kernel, bias, act in layers]))
+    for i, (kernel, bias, act) in enumerate(layers):
+        arrays['kernel_%d' %i] = kernel
+        arrays['bias_%d' %i] = bias
+    np.savez(path, **arrays)
+
+def load_numpy(path):
+    '''
+    features, center, scale, layers of an exported npz file
+    '''
+    arrays = np.load(path)
+    layers = [(arrays['kernel_%d' %i], arrays['bias_%d' %i], str(act)) for i, act in enumerate(arrays['activations'])]
+    return [str(f) for f in arrays['features']], arrays['center'], arrays['scale'], layers
+
+def _activate(x, activation):
+    if activation == 'relu':
+        return np.maximum(x, 0.)
+    if activation == 'sigmoid':
+        return 1./(1.+np.exp(-x))
+    if activation == 'tanh':
+        return np.tanh(x)
+    if activation == 'elu':
+        return np.where(x > 0., x, np.expm1(x))
+    return x
+
+def evaluate_numpy(X, center, scale, layers):
+    '''
+    NN output for the inputs X (n_events, n_features), ordered as the features
+    '''
+    x = (np.asarray(X, dtype = np.float64) - center) / scale
+    for kernel, bias, activation in layers:
+        x = _activate(x.dot(kernel) + bias, activation)
+    return x.ravel()
+
+def _array(values):
+    return '{%s}' %', '.join(repr(float(v)) for v in np.ravel(values))
+
+def cpp_code(name, features, center, scale, layers):
+    '''
+    C++ source of eval_nn_<name>(one double for each feature)
+    '''
+    function = 'eval_nn_%s' %name
+    guard = function.upper()
+    width = max([len(features)] + [kernel.shape[1] for kernel, bias, act in layers])
+    lines = []
+    lines.append('#ifndef %s' %guard)
+    lines.append('#define %s' %guard)
+    lines.append('#include <cmath>')
+    lines.append('namespace %s_parameters {' %function)
+    lines.append('  static const double center[%d] = %s;' %(len(features), _array(center)))
+    lines.append('  static const double scale[%d] = %s;' %(len(features), _array(scale)))
+    for i, (kernel, bias, act) in enumerate(layers):
+        # kernel stored row major (n_in, n_out)
+        lines.append('  static const double kernel_%d[%d] = %s;' %(i, kernel.size, _array(kernel)))
+        lines.append('  static const double bias_%d[%d] = %s;' %(i, bias.size, _array(bias)))
+    lines.append('}')
+    lines.append('inline double %s(%s){' %(function, ', '.join('double x%d' %i for i in range(len(features)))))
+    lines.append('  using namespace %s_parameters;' %function)
+    lines.append('  double in[%d];' %width)
+    lines.append('  double out[%d];' %width)
+    for i in range(len(features)):
+        lines.append('  in[%d] = (x%d - center[%d]) / scale[%d];' %(i, i, i, i))
+    for i, (kernel, bias, act) in enumerate(layers):
+        nin, nout = kernel.shape
+        lines.append('  for (int o = 0; o < %d; ++o){' %nout)
+        lines.append('    double sum = bias_%d[o];' %i)
+        lines.append('    for (int j = 0; j < %d; ++j) sum += in[j] * kernel_%d[j*%d + o];' %(nin, i, nout))
+        expression = {
+            'linear'  : 'sum',
+            'relu'    : 'sum > 0. ? sum : 0.',
+            'sigmoid' : '1./(1.+std::exp(-sum))',
+            'tanh'    : 'std::tanh(sum)',
+            'elu'     : 'sum > 0. ? sum : std::expm1(sum)',
+        }[act]
+        lines.append('    out[o] = %s;' %expression)
+        lines.append('  }')
+        lines.append('  for (int o = 0; o < %d; ++o) in[o] = out[o];' %nout)
+    lines.append('  return in[0];')
+    lines.append('}')
+    lines.append('static const char* %s_inputs = "%s";' %(function, ','.join(features)))
+    lines.append('#endif')
+    return '\n'.join(lines) + '\n'
+
+def export_nn(model, qt, features, name, outdir, X = None):
+    '''
+    Writes <outdir>/<name>.npz and <outdir>/<name>.h.
+    If X (inputs ordered as features) is given, checks that the exported evaluator
+    gives the same output of keras and returns the largest difference
+    '''
+    center, scale = scaler_parameters(qt, len(features))
+    layers = model_layers(model)
+    os.system('mkdir -p %s' %outdir)
+    save_numpy('%s/%s.npz' %(outdir, name), features, center, scale, layers)
+    with open('%s/%s.h' %(outdir, name), 'w') as fh:
+        fh.write(cpp_code(name, features, center, scale, layers))
+    if X is None:
+        return None
+    difference = np.max(np.abs(evaluate_numpy(X, center, scale, layers) - model.predict(qt.transform(X)).ravel()))
+    print("Exported NN %s, max difference wrt keras on %d events: %.2e" %(name, len(X), difference))
+    return difference
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--nn'    , required = True, help = 'directory of the trained NN (the label directory of the trainers)')
+    parser.add_argument('--model' , default = 'net_model_weighted.h5', help = 'file of the model in the model/ directory')
+    parser.add_argument('--name'  , required = True, help = 'version of the NN, e.g. onlydata_70 -> eval_nn_onlydata_70')
+    parser.add_argument('--outdir', default = 'exported_nn', help = 'where to write the .npz and .h files')
+    args = parser.parse_args()
+
+    from keras.models import load_model
+    model = load_model('/'.join([args.nn, 'model', args.model]))
+    qt = pickle.load(open('/'.join([args.nn, 'input_tranformation_weighted.pck']), 'rb'))
+    features = pickle.load(open('/'.join([args.nn, 'model', 'input_features.pck']), 'rb'))
+    # check on random inputs around the scaler center
+    center, scale = scaler_parameters(qt, len(features))
+    X = center + scale * np.random.RandomState(1986).normal(size = (10000, len(features)))
+    export_nn(model, qt, features, args.name, args.outdir, X)
@@ -31,6 +31,7 @@ from itertools import product
 from new_branches_pandas import to_define
 from selections_for_fakerate import prepreselection
 from histos_nordf import histos #histos file NO root dataframes
+from np_histos import th1, th2
 #from samples import sample_names
 from samples import sample_names_explicit_jpsimother_compressed as sample_names
 
@@ -86,18 +87,13 @@ def closure_test(passing_mc_ct,failing_mc_ct):
         print("Computing now variable "+ var)
         
         #histo for the MC in the pass region
-        hist_pass = ROOT.TH1D("pass"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4])
-        for item in passing_mc_ct[histos[var][0]]:
-            hist_pass.Fill(item)
+        hist_pass = th1("pass"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4], passing_mc_ct[histos[var][0]])
 
         # histo for the MC in the fail reigon
-        hist_fail = ROOT.TH1D("fail"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4])
-        for item in failing_mc_ct[histos[var][0]]:
-            hist_fail.Fill(item)
+        hist_fail = th1("fail"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4], failing_mc_ct[histos[var][0]])
 
-        hist_pass_w = ROOT.TH1D("passw"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4])
-        for item,nn in zip(failing_mc_ct[histos[var][0]],failing_mc_ct['nn']):
-            hist_pass_w.Fill(item,nn/(1-nn))
+        nn = failing_mc_ct['nn']
+        hist_pass_w = th1("passw"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4], failing_mc_ct[histos[var][0]], weights = nn/(1-nn))
 
         c1.cd()
         leg = ROOT.TLegend(0.24,.67,.95,.90)
@@ -374,11 +370,8 @@ if __name__ == "__main__":
     test_pred = model.predict(x_test)
 
     #plot
-    h1 = ROOT.TH1F("","",30,0,1)
-    h2 = ROOT.TH1F("","",30,0,1)
-    for t,b in zip(train_pred,test_pred):
-        h1.Fill(t)
-        h2.Fill(b)
+    h1 = th1("","",30,0,1, train_pred, cls = ROOT.TH1F)
+    h2 = th1("","",30,0,1, test_pred, cls = ROOT.TH1F)
     c1=ROOT.TCanvas()
     h1.Scale(1/h1.Integral())
     h2.Scale(1/h2.Integral())
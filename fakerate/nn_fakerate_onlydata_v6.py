@@ -34,8 +34,11 @@ from itertools import product
 from new_branches_pandas import to_define
 from selections_for_fakerate import preprepreselection,triggerselection, etaselection
 from histos_nordf import histos #histos file NO root dataframes
+from np_histos import th1, th2
 #from samples import sample_names
 from samples import sample_names_explicit_jpsimother_compressed as sample_names
+from nn_inference import write_friends
+from nn_training import train
 
 #no pop-up windows
 ROOT.gROOT.SetBatch()
@@ -43,6 +46,14 @@ ROOT.gStyle.SetOptStat(0)
 officialStyle(ROOT.gStyle, ROOT.TGaxis)
 
 epochs = 50
+# diagnostics (loss, acc, AUC) every diagnostics_cadence epochs on diagnostics_sample events, keep only the best keep_best_models models
+diagnostics_cadence = 1
+diagnostics_sample = 50000
+keep_best_models = 3
+# after the training, write nn_<nn_version> and fakerate_<nn_version> for all the samples in friend trees
+add_nn_friends = False
+nn_version = 'onlydata_33'
+friends_dir = '/pnfs/psi.ch/cms/trivcat/store/user/friti/dataframes_June2022/friends'
 def preprocessing(passing, failing):
     '''
     Preprocessing of data before training/testing the NN
@@ -128,18 +139,13 @@ def closure_test(passing_mc_ct,failing_mc_ct):
         print("Computing now variable "+ var)
         
         #histo for the MC in the pass region
-        hist_pass = ROOT.TH1D("pass"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4])
-        for item in passing_mc_ct[histos[var][0]]:
-            hist_pass.Fill(item)
+        hist_pass = th1("pass"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4], passing_mc_ct[histos[var][0]])
 
         # histo for the MC in the fail reigon
-        hist_fail = ROOT.TH1D("fail"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4])
-        for item in failing_mc_ct[histos[var][0]]:
-            hist_fail.Fill(item)
+        hist_fail = th1("fail"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4], failing_mc_ct[histos[var][0]])
 
-        hist_pass_w = ROOT.TH1D("passw"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4])
-        for item,nn in zip(failing_mc_ct[histos[var][0]],failing_mc_ct['nn']):
-            hist_pass_w.Fill(item,nn/(1-nn))
+        nn = failing_mc_ct['nn']
+        hist_pass_w = th1("passw"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4], failing_mc_ct[histos[var][0]], weights = nn/(1-nn))
 
         c1.cd()
         leg = ROOT.TLegend(0.24,.67,.95,.90)
@@ -331,9 +337,7 @@ if __name__ == "__main__":
     print("##########################")
 
     c1=ROOT.TCanvas()
-    h_pre = ROOT.TH2F("","",100,0,3,100,0,11)
-    for f0,f1 in zip(main_df[features[0]],main_df[features[1]]):
-        h_pre.Fill(f0,f1)
+    h_pre = th2("","",(100,0,3),(100,0,11), main_df[features[0]],main_df[features[1]], cls = ROOT.TH2F)
     print(h_pre.Integral())
     c1.Draw()
     h_pre.SetTitle("Scatter Plot 2D Pre Scaler;%s;%s"%(features[0],features[1]))
@@ -341,9 +345,7 @@ if __name__ == "__main__":
 
     c1.SaveAs(final_nn_path+'/model/scatter2d_pre.png')
 
-    h_post = ROOT.TH2F("","",100,-2,2,100,-3,2)
-    for item in xx:
-        h_post.Fill(item[0],item[1])
+    h_post = th2("","",(100,-2,2),(100,-3,2), xx[:,0],xx[:,1], cls = ROOT.TH2F)
     
     c1.Draw()
     h_post.SetTitle("Scatter Plot 2D Post Scaler;%s;%s"%(features[0],features[1]))
@@ -383,12 +385,8 @@ if __name__ == "__main__":
     # reduce learning rate when at plateau, fine search the minimum
     reduce_lr = ReduceLROnPlateau(monitor=monitor, mode='auto', factor=0.2, patience=5, min_lr=0.00001, cooldown=10, verbose=True)
     
-    # save the model every now and then
-    filepath = '/'.join([final_nn_path, '/model/saved-model-{epoch:04d}_val_loss_{val_loss:.4f}_val_acc_{val_acc:.4f}.h5'])
-    save_model = ModelCheckpoint(filepath, monitor='val_acc', verbose=1, save_best_only=True, save_weights_only=False, mode='auto', period=1)
-    
-    # train only the classifier. beta is set at 0 and the discriminator is not trained
-    callbacks = [reduce_lr, save_model]
+    # the best models are saved by the training loop (nn_training.py)
+    callbacks = [reduce_lr]
     
     #x_train, x_test, y_train, y_test = train_test_split(xx, Y, test_size=0.2, shuffle= True)
 
@@ -418,7 +416,8 @@ if __name__ == "__main__":
     x_val = pd.DataFrame(x_val_tmp, columns=list(set(features)))
     x_val = qt.transform(x_val)
 
-    history = model.fit(x_train, y_train,  validation_data=(x_val, y_val),epochs=epochs, callbacks=callbacks, batch_size=32, verbose=True)  
+    history = train(model, x_train, y_train, x_val, y_val, outdir = final_nn_path + '/model/', epochs = epochs, batch_size = 32,
+                    sample_size = diagnostics_sample, cadence = diagnostics_cadence, keep_best = keep_best_models, monitor = 'val_acc', callbacks = callbacks)
     
     '''
     # calculate predictions on the main_df sample
@@ -510,11 +509,8 @@ if __name__ == "__main__":
     test_pred_pass = model.predict(x_test_pass)
 
     #plot
-    h1 = ROOT.TH1F("","train",30,-0.5,0.5)
-    h2 = ROOT.TH1F("","test",30,-0.5,0.5)
-    for t,b in zip(train_pred_pass,test_pred_pass):
-        h1.Fill(t)
-        h2.Fill(b)
+    h1 = th1("","train",30,-0.5,0.5, train_pred_pass, cls = ROOT.TH1F)
+    h2 = th1("","test",30,-0.5,0.5, test_pred_pass, cls = ROOT.TH1F)
     c1=ROOT.TCanvas()
     h1.Scale(1/h1.Integral())
     h2.Scale(1/h2.Integral())
@@ -541,11 +537,8 @@ if __name__ == "__main__":
     test_pred_fail = model.predict(x_test_fail)
 
     #plot
-    h1 = ROOT.TH1F("","train",30,-0.5,0.5)
-    h2 = ROOT.TH1F("","test",30,-0.5,0.5)
-    for t,b in zip(train_pred_fail,test_pred_fail):
-        h1.Fill(t)
-        h2.Fill(b)
+    h1 = th1("","train",30,-0.5,0.5, train_pred_fail, cls = ROOT.TH1F)
+    h2 = th1("","test",30,-0.5,0.5, test_pred_fail, cls = ROOT.TH1F)
     c1=ROOT.TCanvas()
     h1.Scale(1/h1.Integral())
     h2.Scale(1/h2.Integral())
@@ -572,11 +565,11 @@ if __name__ == "__main__":
     print("###########################################")
     print("########  Loss Plot  #######")
     print("###########################################")
-    loss_train = history.history['loss']
-    loss_val = history.history['val_loss']
+    loss_train = history['loss']
+    loss_val = history['val_loss']
 
-    epochs_range = range(1,epochs+1)
-    epochs = epochs_range
+    # epochs where the diagnostics were computed
+    epochs = history['epoch']
     plt.plot(epochs, loss_train, 'g', label='Training loss')
     plt.plot(epochs, loss_val, 'b', label='validation loss')
     plt.title('Training and Validation loss')
@@ -587,8 +580,8 @@ if __name__ == "__main__":
 
     plt.clf()
 
-    loss_train = history.history['acc']
-    loss_val = history.history['val_acc']
+    loss_train = history['acc']
+    loss_val = history['val_acc']
     plt.plot(epochs, loss_train, 'g', label='Training accuracy')
     plt.plot(epochs, loss_val, 'b', label='validation accuracy')
     plt.title('Training and Validation accuracy')
@@ -660,6 +653,10 @@ if __name__ == "__main__":
     plt.tight_layout()
     plt.savefig(final_nn_path + '/model/corr_fail.png' )
 
+    # only the prediction columns are written, in friend trees aligned to the samples (see nn_inference.py)
+    if add_nn_friends:
+        write_friends(sample_names, final_nn_path, nn_version, friends_dir, model_name = 'net_model_weighted.h5')
+
 
     '''
     print("###########################################")
@@ -35,10 +35,16 @@ from itertools import product
 from new_branches_pandas import to_define
 from selections_for_fakerate import preprepreselection,triggerselection, etaselection
 from histos_nordf import histos #histos file NO root dataframes
+from np_histos import th1, th2
 #from samples import sample_names
 from samples import sample_names_explicit_jpsimother_compressed as sample_names
+from nn_inference import write_friends
 
 epochs = 50
+# after the training, write nn_<nn_version> and fakerate_<nn_version> for all the samples in friend trees
+add_nn_friends = False
+nn_version = 'onlymc_39'
+friends_dir = '/pnfs/psi.ch/cms/trivcat/store/user/friti/dataframes_June2022/friends'
 #no pop-up windows
 ROOT.gROOT.SetBatch()
 ROOT.gStyle.SetOptStat(0)
@@ -128,18 +134,13 @@ def closure_test(passing_mc_ct,failing_mc_ct):
         print("Computing now variable "+ var)
         
         #histo for the MC in the pass region
-        hist_pass = ROOT.TH1D("pass"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4])
-        for item in passing_mc_ct[histos[var][0]]:
-            hist_pass.Fill(item)
+        hist_pass = th1("pass"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4], passing_mc_ct[histos[var][0]])
 
         # histo for the MC in the fail reigon
-        hist_fail = ROOT.TH1D("fail"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4])
-        for item in failing_mc_ct[histos[var][0]]:
-            hist_fail.Fill(item)
+        hist_fail = th1("fail"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4], failing_mc_ct[histos[var][0]])
 
-        hist_pass_w = ROOT.TH1D("passw"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4])
-        for item,nn in zip(failing_mc_ct[histos[var][0]],failing_mc_ct['nn']):
-            hist_pass_w.Fill(item,nn/(1-nn))
+        nn = failing_mc_ct['nn']
+        hist_pass_w = th1("passw"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4], failing_mc_ct[histos[var][0]], weights = nn/(1-nn))
 
         c1.cd()
         leg = ROOT.TLegend(0.24,.67,.95,.90)
@@ -370,9 +371,7 @@ if __name__ == "__main__":
     print("##########################")
 
     c1=ROOT.TCanvas()
-    h_pre = ROOT.TH2F("","",100,1,2,100,0,11)
-    for f0,f1 in zip(main_df[features[0]],main_df[features[1]]):
-        h_pre.Fill(f0,f1)
+    h_pre = th2("","",(100,1,2),(100,0,11), main_df[features[0]],main_df[features[1]], cls = ROOT.TH2F)
     print(h_pre.Integral())
     c1.Draw()
     h_pre.SetTitle("Scatter Plot 2D Pre Scaler;%s;%s"%(features[0],features[1]))
@@ -380,9 +379,7 @@ if __name__ == "__main__":
 
     c1.SaveAs(final_nn_path+'/model/scatter2d_pre.png')
 
-    h_post = ROOT.TH2F("","",100,-2,2,100,-2,2)
-    for item in xx:
-        h_post.Fill(item[0],item[1])
+    h_post = th2("","",(100,-2,2),(100,-2,2), xx[:,0],xx[:,1], cls = ROOT.TH2F)
     
     c1.Draw()
     h_post.SetTitle("Scatter Plot 2D Post Scaler;%s;%s"%(features[0],features[1]))
@@ -506,11 +503,8 @@ if __name__ == "__main__":
         test_pred_pass = model.predict(x_test_pass)
         
         #plot
-        h1 = ROOT.TH1F("","train",30,0,1)
-        h2 = ROOT.TH1F("","test",30,0,1)
-        for t,b in zip(train_pred_pass,test_pred_pass):
-            h1.Fill(t)
-            h2.Fill(b)
+        h1 = th1("","train",30,0,1, train_pred_pass, cls = ROOT.TH1F)
+        h2 = th1("","test",30,0,1, test_pred_pass, cls = ROOT.TH1F)
         c1=ROOT.TCanvas()
         h1.Scale(1/h1.Integral())
         h2.Scale(1/h2.Integral())
@@ -537,11 +531,8 @@ if __name__ == "__main__":
         test_pred_fail = model.predict(x_test_fail)
         
         #plot
-        h1 = ROOT.TH1F("","train",30,0,1)
-        h2 = ROOT.TH1F("","test",30,0,1)
-        for t,b in zip(train_pred_fail,test_pred_fail):
-            h1.Fill(t)
-            h2.Fill(b)
+        h1 = th1("","train",30,0,1, train_pred_fail, cls = ROOT.TH1F)
+        h2 = th1("","test",30,0,1, test_pred_fail, cls = ROOT.TH1F)
         c1=ROOT.TCanvas()
         h1.Scale(1/h1.Integral())
         h2.Scale(1/h2.Integral())
@@ -683,6 +674,10 @@ if __name__ == "__main__":
     print("###########################################")
     print("########  Add NN branch in samples  #######")
     print("###########################################")
+
+    # only the prediction columns are written, in friend trees aligned to the samples (see nn_inference.py)
+    if add_nn_friends:
+        write_friends(sample_names, final_nn_path, nn_version, friends_dir, model_name = 'net_model_weighted_%d.h5' %(epochs-1))
     '''
     # open all samples as pandas
     samples = dict()
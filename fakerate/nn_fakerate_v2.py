@@ -30,6 +30,7 @@ from itertools import product
 from new_branches_pandas import to_define
 from selections import prepreselection, pass_id, fail_id
 from histos_nordf import histos #histos file NO root dataframes
+from np_histos import th1, th2
 from samples import sample_names
 
 #no pop-up windows
@@ -86,18 +87,13 @@ def closure_test(passing_mc_ct,failing_mc_ct):
         print("Computing now variable "+ var)
         
         #histo for the MC in the pass region
-        hist_pass = ROOT.TH1D("pass"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4])
-        for item in passing_mc_ct[histos[var][0]]:
-            hist_pass.Fill(item)
+        hist_pass = th1("pass"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4], passing_mc_ct[histos[var][0]])
 
         # histo for the MC in the fail reigon
-        hist_fail = ROOT.TH1D("fail"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4])
-        for item in failing_mc_ct[histos[var][0]]:
-            hist_fail.Fill(item)
+        hist_fail = th1("fail"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4], failing_mc_ct[histos[var][0]])
 
-        hist_pass_w = ROOT.TH1D("passw"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4])
-        for item,nn in zip(failing_mc_ct[histos[var][0]],failing_mc_ct['nn']):
-            hist_pass_w.Fill(item,nn/(1-nn))
+        nn = failing_mc_ct['nn']
+        hist_pass_w = th1("passw"+histos[var][0],"",histos[var][2],histos[var][3],histos[var][4], failing_mc_ct[histos[var][0]], weights = nn/(1-nn))
 
 
         c1.cd()
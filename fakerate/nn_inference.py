@@ -0,0 +1,160 @@
+'''
+Streaming inference of a trained fake-rate NN on the samples.
+
+Each sample is read in chunks of fixed size, the chunk goes through to_define, the saved RobustScaler
+and the model, and only the prediction columns nn_<version> and fakerate_<version> = nn/(1-nn)
+are written in a small friend tree, with one entry for each entry of the source tree (same order, no selection).
+The next chunk is read while the model is predicting on the current one.
+
+The friend is used by adding it to the source tree, for example
+    chain = ROOT.TChain('BTo3Mu'); chain.Add(sample_file)
+    chain.AddFriend('nn_onlydata_32', friend_file)
+    df = ROOT.RDataFrame(chain)   # the column fakerate_onlydata_32 is now available
+(see friend_chain below).
+
+Usage:
+    python nn_inference.py --nn nn/<label> --version onlydata_32 --outdir <path> [--samples data jpsi_mu ...]
+'''
+
+import os
+import pickle
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser
+
+import numpy as np
+import ROOT
+from root_pandas import read_root, to_root
+
+from new_branches_pandas import to_define
+
+tree_name = 'BTo3Mu'
+tree_dir = '/pnfs/psi.ch/cms/trivcat/store/user/friti/dataframes_June2022/'
+file_pattern = '%s_nopresel_withpresel_v2.root'
+chunksize = 200000
+batch_size = 8192
+
+def set_threads(nthreads):
+    '''
+    Lets the NN use nthreads cores for the prediction
+    '''
+    os.environ['OMP_NUM_THREADS'] = str(nthreads)
+    import tensorflow as tf
+    if hasattr(tf, 'config') and hasattr(tf.config, 'threading'):
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(nthreads)
+            tf.config.threading.set_inter_op_parallelism_threads(2)
+        except RuntimeError:
+            # already initialised
+            pass
+    else:
+        from keras import backend as K
+        K.set_session(tf.Session(config = tf.ConfigProto(intra_op_parallelism_threads = nthreads, inter_op_parallelism_threads = 2)))
+
+def load_nn(nn_path, model_name = 'net_model_weighted.h5'):
+    '''
+    Model, scaler and list of features saved by the nn_fakerate_* trainers in nn_path
+    '''
+    from keras.models import load_model
+    model = load_model('/'.join([nn_path, 'model', model_name]))
+    qt = pickle.load(open('/'.join([nn_path, 'input_tranformation_weighted.pck']), 'rb'))
+    features = pickle.load(open('/'.join([nn_path, 'model', 'input_features.pck']), 'rb'))
+    return model, qt, features
+
+def friend_tree_name(version):
+    return 'nn_%s' %version
+
+def friend_path(outdir, sample, version):
+    return '%s/%s_nn_%s.root' %(outdir, sample, version)
+
+def source_entries(path, tree = tree_name):
+    f = ROOT.TFile.Open(path)
+    entries = f.Get(tree).GetEntries()
+    f.Close()
+    return entries
+
+def predict_chunk(chunk, model, qt, features):
+    chunk = to_define(chunk)
+    nn = model.predict(qt.transform(chunk[features]), batch_size = batch_size).ravel()
+    return nn
+
+def write_friend(source, output, model, qt, features, version, tree = tree_name, size = chunksize):
+    '''
+    Writes the friend tree with the prediction columns for all the entries of the source file.
+    Returns the number of entries written
+    '''
+    friend_tree = friend_tree_name(version)
+    tmp_output = output.replace('.root', '_tmp.root')
+    if os.path.exists(tmp_output):
+        os.remove(tmp_output)
+
+    chunks = read_root(source, tree, chunksize = size)
+    written = 0
+    nans = 0
+    with ThreadPoolExecutor(max_workers = 1) as reader:
+        # prefetch: the next chunk is read while predicting
+        next_chunk = reader.submit(next, chunks, None)
+        while True:
+            chunk = next_chunk.result()
+            if chunk is None:
+                break
+            next_chunk = reader.submit(next, chunks, None)
+
+            nn = predict_chunk(chunk, model, qt, features)
+            nans += np.count_nonzero(np.isnan(nn))
+            out = chunk[[]].copy()
+            out['nn_%s' %version] = nn
+            out['fakerate_%s' %version] = nn/(1.-nn)
+            to_root(out, tmp_output, key = friend_tree, mode = 'a', store_index = False)
+            written += len(out)
+            print('\t%d entries' %written)
+
+    if nans:
+        print("WARNING: %d NaN predictions in %s" %(nans, source))
+    expected = source_entries(source, tree)
+    if written != expected:
+        raise RuntimeError('friend of %s has %d entries, the source has %d' %(source, written, expected))
+    os.replace(tmp_output, output)
+    return written
+
+def write_friends(samples, nn_path, version, outdir, model_name = 'net_model_weighted.h5', nthreads = None, size = chunksize):
+    '''
+    Friend trees of nn_<version>, fakerate_<version> for all the samples (names as in samples.py)
+    '''
+    set_threads(nthreads or mp.cpu_count())
+    model, qt, features = load_nn(nn_path, model_name)
+    os.system('mkdir -p %s' %outdir)
+    for sample in samples:
+        print("Predicting " + sample)
+        write_friend(tree_dir + file_pattern %sample, friend_path(outdir, sample, version), model, qt, features, version, size = size)
+
+def friend_chain(source, friends, tree = tree_name):
+    '''
+    Chain of the source with the given friends {version: friend file}.
+    The friend chains are returned too, they must be kept alive as long as the chain is used
+    '''
+    chain = ROOT.TChain(tree)
+    chain.Add(source)
+    friend_chains = []
+    for version, path in friends.items():
+        fchain = ROOT.TChain(friend_tree_name(version))
+        fchain.Add(path)
+        chain.AddFriend(fchain)
+        friend_chains.append(fchain)
+    return chain, friend_chains
+
+if __name__ == '__main__':
+
+    from samples import sample_names_explicit_jpsimother_compressed as sample_names
+
+    parser = ArgumentParser()
+    parser.add_argument('--nn'       , required = True, help = 'directory of the trained NN (the label directory of the trainers)')
+    parser.add_argument('--model'    , default = 'net_model_weighted.h5', help = 'file of the model in the model/ directory')
+    parser.add_argument('--version'  , required = True, help = 'suffix of the new columns, e.g. onlydata_32 -> nn_onlydata_32, fakerate_onlydata_32')
+    parser.add_argument('--outdir'   , default = tree_dir + 'friends', help = 'where to write the friend trees')
+    parser.add_argument('--samples'  , nargs = '+', default = sample_names, help = 'samples to predict on')
+    parser.add_argument('--chunksize', type = int, default = chunksize, help = 'entries read at a time')
+    parser.add_argument('--nthreads' , type = int, default = None, help = 'threads for the prediction (default all cores)')
+    args = parser.parse_args()
+
+    write_friends(args.samples, args.nn, args.version, args.outdir, model_name = args.model, nthreads = args.nthreads, size = args.chunksize)
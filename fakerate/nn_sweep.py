@@ -0,0 +1,155 @@
+'''
+Sweep over variants of the fake-rate NN (features, architecture, training settings),
+trained concurrently in a local pool of processes.
+
+One dataset is built (or taken from the cache) for each sample set of the grid (onlydata, onlymc, data_mc,
+see sample_sets in nn_dataset.py), with all the features used by its variants;
+each worker opens it memory-mapped and trains its variants with a limited number of threads.
+Each variant is saved in <outdir>/<variant>/ with the layout of the nn_fakerate_* trainers, and one row per variant
+(parameters, test metrics, timing, path) is added to <outdir>/results.csv as soon as it finishes.
+
+Usage:
+    python nn_sweep.py --grid grid.json --workers 4 --threads 2
+with grid.json like
+    {"samples": ["onlydata", "onlymc"], "nodes": [32, 64], "activation": ["relu", "tanh"], "epochs": [50],
+     "features": [["Bpt_log", "abs_Beta", "Q_sq"], ["Bpt_log", "abs_Beta", "Q_sq", "nPV", "Bmass"]]}
+'''
+
+import os
+import json
+import time
+import traceback
+import multiprocessing as mp
+from itertools import product
+from datetime import datetime
+from argparse import ArgumentParser
+
+import pandas as pd
+
+# parameters of build_model and of train, the others are the features and the sample set
+model_parameters = ['nodes', 'activation', 'optimizer']
+train_parameters = ['epochs', 'batch_size', 'sample_size', 'cadence', 'keep_best', 'monitor']
+
+default_grid = {
+    'samples'    : ['onlydata'],
+    'features'   : [['Bpt_log', 'abs_Beta', 'Q_sq', 'nPV', 'jpsivtx_log10_lxy_sig', 'Bmass']],
+    'nodes'      : [32, 64, 128],
+    'activation' : ['relu', 'tanh'],
+    'epochs'     : [50],
+}
+
+def expand_grid(grid):
+    '''
+    All the combinations of the grid, as a list of (name, variant)
+    '''
+    keys = sorted(grid.keys())
+    return [('v%03d' %i, dict(zip(keys, values))) for i, values in enumerate(product(*[grid[key] for key in keys]))]
+
+def limit_threads(threads):
+    '''
+    To be called in each worker before tensorflow is imported
+    '''
+    for var in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS']:
+        os.environ[var] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    import tensorflow as tf
+    if hasattr(tf, 'config') and hasattr(tf.config, 'threading'):
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    else:
+        from keras import backend as K
+        K.set_session(tf.Session(config = tf.ConfigProto(intra_op_parallelism_threads = threads, inter_op_parallelism_threads = 1)))
+
+def run_variant(job):
+    '''
+    Trains one variant in the worker, returns its row of the results table
+    '''
+    name, variant, dataset_path, outdir, test_size = job
+    row = dict(variant = name, path = os.path.join(outdir, name), status = 'ok')
+    row.update(dict((key, json.dumps(value) if isinstance(value, list) else value) for key, value in variant.items()))
+    start = time.time()
+    try:
+        from functools import partial
+        from nn_dataset import Dataset, train_fold
+        from nn_training import build_model
+
+        dataset = Dataset(dataset_path)
+        train_index, test_index = dataset.split(test_size)
+        builder = partial(build_model, **dict((key, variant[key]) for key in model_parameters if key in variant))
+        kwargs = dict((key, variant[key]) for key in train_parameters if key in variant)
+        result = train_fold(dataset, train_index, test_index, row['path'], builder, features = variant.get('features'), verbose = False, **kwargs)
+        history = result['history']
+        row.update(dict(
+            test_loss    = result['test_loss'],
+            test_acc     = result['test_acc'],
+            test_auc     = result['test_auc'],
+            best_val_loss = min(history['val_loss']) if history['val_loss'] else float('nan'),
+            best_val_auc  = max(history['val_auc']) if history['val_auc'] else float('nan'),
+            best_models  = json.dumps(history['best_models']),
+        ))
+    except Exception:
+        row['status'] = 'failed'
+        row['error'] = traceback.format_exc().strip().split('\n')[-1]
+        traceback.print_exc()
+    row['seconds'] = time.time() - start
+    return row
+
+def run_sweep(variants, dataset_paths, outdir, workers = 4, threads = 2, test_size = 0.2):
+    '''
+    Trains all the variants, workers at a time, and returns the results table (also saved in outdir/results.csv).
+    dataset_paths: dict sample set -> path of its dataset, each variant is trained on the one of its 'samples'
+    '''
+    os.system('mkdir -p %s' %outdir)
+    with open(os.path.join(outdir, 'variants.json'), 'w') as fh:
+        json.dump(dict(variants), fh, indent = 2)
+
+    jobs = [(name, variant, dataset_paths[variant['samples']], outdir, test_size) for name, variant in variants]
+    rows = []
+    results = pd.DataFrame()
+    # spawn: each worker starts its own tensorflow with its own thread limits
+    context = mp.get_context('spawn')
+    start = time.time()
+    with context.Pool(processes = workers, initializer = limit_threads, initargs = (threads,), maxtasksperchild = 1) as pool:
+        for row in pool.imap_unordered(run_variant, jobs):
+            rows.append(row)
+            print("%s %s in %.0f s (%d/%d done)" %(row['variant'], row['status'], row['seconds'], len(rows), len(jobs)))
+            results = pd.DataFrame(rows)
+            results.to_csv(os.path.join(outdir, 'results.csv'), index = False)
+    print("Sweep done in %.0f s" %(time.time() - start))
+    if 'test_auc' in results:
+        results = results.sort_values('test_auc', ascending = False)
+    return results
+
+if __name__ == '__main__':
+
+    from nn_dataset import build_dataset, cache_dir, sample_sets, selection, pass_id, fail_id
+
+    parser = ArgumentParser()
+    parser.add_argument('--grid'     , default = None, help = 'json file with the grid (default: default_grid)')
+    parser.add_argument('--workers'  , type = int, default = 4, help = 'variants trained at the same time')
+    parser.add_argument('--threads'  , type = int, default = max(1, mp.cpu_count() // 4), help = 'threads of each worker')
+    parser.add_argument('--test_size', type = float, default = 0.2, help = 'fraction of the events for the final test')
+    parser.add_argument('--cache_dir', default = cache_dir, help = 'directory of the cached datasets')
+    parser.add_argument('--outdir'   , default = '/work/friti/rjpsi_tools/CMSSW_10_6_14/src/RJpsiTools/fakerate/nn/sweep_' + datetime.now().strftime('%d%b%Y_%Hh%Mm%Ss'))
+    args = parser.parse_args()
+
+    grid = json.load(open(args.grid)) if args.grid else default_grid
+    variants = expand_grid(grid)
+
+    for name, variant in variants:
+        variant.setdefault('features', default_grid['features'][0])
+        variant.setdefault('samples', default_grid['samples'][0])
+        if variant['samples'] not in sample_sets:
+            parser.error('variant %s: unknown sample set %s (%s)' %(name, variant['samples'], ', '.join(sorted(sample_sets))))
+
+    # one dataset per sample set, with all the features of its variants
+    dataset_paths = dict()
+    for samples in sorted(set(variant['samples'] for name, variant in variants)):
+        features = []
+        for name, variant in variants:
+            if variant['samples'] != samples: continue
+            features += [f for f in variant['features'] if f not in features]
+        dataset_paths[samples] = build_dataset(sample_sets[samples], selection, features, pass_id, fail_id, cache = args.cache_dir).path
+
+    results = run_sweep(variants, dataset_paths, args.outdir, workers = args.workers, threads = args.threads, test_size = args.test_size)
+    print(results.to_string(index = False))
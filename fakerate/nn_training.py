@@ -0,0 +1,235 @@
+'''
+Lightweight training loop for the fake-rate NNs.
+
+ - the training arrays are kept in memory as contiguous float32 and the batches are prepared
+   (shuffled every pass) by a background thread, a few batches ahead of the training
+ - loss, accuracy and AUC are computed only every `cadence` epochs, on a fixed random subsample
+   of `sample_size` events of the training and of the validation set
+ - only the best `keep_best` models (by the monitored diagnostic, val_acc as the ModelCheckpoint it replaces) are saved,
+   the others are deleted
+ - at the end the best model is loaded back; the full-sample evaluation is left to the caller, once
+
+    history = train(model, x_train, y_train, x_val, y_val, outdir = final_nn_path + '/model/', epochs = 50)
+
+history is a dict with the list of sampled epochs ('epoch') and of the diagnostics
+('loss', 'acc', 'auc', 'val_loss', 'val_acc', 'val_auc') at those epochs, plus 'best_models'.
+'''
+
+import os
+import threading
+import queue
+import numpy as np
+from sklearn.metrics import roc_auc_score
+from keras.callbacks import Callback
+
+def _array(x):
+    if hasattr(x, 'values'):
+        x = x.values
+    return np.ascontiguousarray(x, dtype = np.float32)
+
+def _column(a):
+    # labels and weights: no copy of memory-mapped arrays
+    if hasattr(a, 'values'):
+        a = a.values
+    return np.asarray(a).ravel()
+
+def _weights(w, n):
+    return np.ones(n, dtype = np.float32) if w is None else _column(w)
+
+class _Failure(object):
+    # exception of the background thread, passed to the consumer of the batches
+    def __init__(self, error):
+        self.error = error
+
+class Prefetcher(object):
+    '''
+    Infinite iterator of (x, y, w) batches, reshuffled at each pass on the sample,
+    filled by a background thread up to `prefetch` batches in advance
+    (an exception of the thread is raised by the next call of next, the training does not hang).
+    With index, only those entries of the arrays are used and the batches are gathered
+    directly from them (e.g. memory-mapped arrays of nn_dataset.py, not copied);
+    transform (e.g. the scaler) is then applied batch by batch
+    '''
+
+    def __init__(self, x, y, w = None, batch_size = 32, prefetch = 16, seed = 1986, index = None, transform = None):
+        self.x = _array(x) if index is None else x
+        self.y = _column(y)
+        self.w = _weights(w, len(self.y))
+        self.index = np.arange(len(self.y)) if index is None else np.asarray(index)
+        self.transform = transform
+        self.batch_size = batch_size
+        self.steps = int(np.ceil(len(self.index) / float(batch_size)))
+        self.random = np.random.RandomState(seed)
+        self.queue = queue.Queue(maxsize = prefetch)
+        self.stop = threading.Event()
+        self.failure = None
+        self.thread = threading.Thread(target = self._fill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, item):
+        # False if the iterator was closed while waiting for a free slot
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout = 1.)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fill(self):
+        try:
+            while not self.stop.is_set():
+                order = self.random.permutation(len(self.index))
+                for step in range(self.steps):
+                    idx = self.index[order[step*self.batch_size:(step+1)*self.batch_size]]
+                    if not self._put(_gather(self.x, self.y, self.w, idx, self.transform)):
+                        return
+        except Exception as error:
+            # e.g. a read error of the memory-mapped arrays or of the transform: raised in the training thread
+            self._put(_Failure(error))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # after a failure, the same exception for every call (the thread is gone)
+        if self.failure is not None:
+            raise self.failure.error
+        batch = self.queue.get()
+        if isinstance(batch, _Failure):
+            self.failure = batch
+            self.stop.set()
+            raise batch.error
+        return batch
+
+    next = __next__
+
+    def close(self):
+        self.stop.set()
+
+def _gather(x, y, w, idx, transform = None):
+    xb = np.asarray(x[idx], dtype = np.float32)
+    if transform is not None:
+        xb = np.asarray(transform(xb), dtype = np.float32)
+    return xb, np.asarray(y[idx], dtype = np.float32), np.asarray(w[idx], dtype = np.float32)
+
+def _subsample(x, y, w, size, random, index = None, transform = None):
+    index = np.arange(len(y)) if index is None else np.asarray(index)
+    if size is not None and size < len(index):
+        index = np.sort(random.choice(index, size, replace = False))
+    return _gather(x, y, w, index, transform)
+
+def diagnostics(model, x, y, w, batch_size = 8192):
+    '''
+    Weighted binary cross-entropy, accuracy and AUC of the model on (x, y, w)
+    '''
+    pred = model.predict(x, batch_size = batch_size).ravel()
+    clipped = np.clip(pred, 1e-7, 1. - 1e-7)
+    loss = -np.average(y*np.log(clipped) + (1.-y)*np.log(1.-clipped), weights = w)
+    acc = np.average((pred > 0.5) == (y > 0.5), weights = w)
+    auc = roc_auc_score(y, pred, sample_weight = w)
+    return loss, acc, auc
+
+class SampledDiagnostics(Callback):
+    '''
+    Diagnostics on fixed subsamples every `cadence` epochs, and the best `keep_best` checkpoints.
+    The diagnostics are also put in the keras logs (val_loss, ...), so that callbacks
+    like ReduceLROnPlateau placed after this one can use them
+    '''
+
+    def __init__(self, train, val, outdir, cadence = 1, keep_best = 3, monitor = 'val_acc', batch_size = 8192):
+        super(SampledDiagnostics, self).__init__()
+        self.train_sample = train
+        self.val_sample = val
+        self.outdir = outdir
+        self.cadence = cadence
+        self.keep_best = keep_best
+        self.monitor = monitor
+        self.sign = 1. if 'loss' in monitor else -1. # lower is better
+        self.batch_size = batch_size
+        self.history = dict((key, []) for key in ['epoch', 'loss', 'acc', 'auc', 'val_loss', 'val_acc', 'val_auc'])
+        self.best = [] # (score, path), best first
+
+    def on_epoch_end(self, epoch, logs = None):
+        logs = logs if logs is not None else dict()
+        if (epoch + 1) % self.cadence != 0:
+            return
+        results = dict()
+        for prefix, (x, y, w) in [('', self.train_sample), ('val_', self.val_sample)]:
+            loss, acc, auc = diagnostics(self.model, x, y, w, self.batch_size)
+            results[prefix + 'loss'] = loss
+            results[prefix + 'acc'] = acc
+            results[prefix + 'auc'] = auc
+        self.history['epoch'].append(epoch + 1)
+        for key, value in results.items():
+            self.history[key].append(value)
+            logs[key if key.startswith('val_') else 'sampled_' + key] = value
+        print('epoch %d: sampled loss %.4f auc %.4f - val_loss %.4f val_auc %.4f' %(epoch+1, results['loss'], results['auc'], results['val_loss'], results['val_auc']))
+        self._checkpoint(epoch, results)
+
+    def _checkpoint(self, epoch, results):
+        score = self.sign * results[self.monitor]
+        if len(self.best) >= self.keep_best and score >= self.best[-1][0]:
+            return
+        path = os.path.join(self.outdir, 'saved-model-%04d_val_loss_%.4f_val_acc_%.4f.h5' %(epoch+1, results['val_loss'], results['val_acc']))
+        self.model.save(path)
+        self.best.append((score, path))
+        self.best.sort(key = lambda item: item[0])
+        for score, old_path in self.best[self.keep_best:]:
+            if os.path.exists(old_path):
+                os.remove(old_path)
+        self.best = self.best[:self.keep_best]
+
+def train(model, x_train, y_train, x_val, y_val, outdir, w_train = None, w_val = None,
+          epochs = 50, batch_size = 32, sample_size = 50000, cadence = 1, keep_best = 3,
+          monitor = 'val_acc', callbacks = None, prefetch = 16, seed = 1986, verbose = True,
+          train_index = None, val_index = None, transform = None):
+    '''
+    Trains the model and returns the history of the sampled diagnostics.
+    callbacks are run after the diagnostics of the epoch (so they can monitor val_loss, val_auc, ...)
+    train_index, val_index, transform: entries of the (shared) arrays to use and the scaler
+    to apply to each batch, see Prefetcher
+    '''
+    os.system('mkdir -p %s' %outdir)
+    random = np.random.RandomState(seed)
+    if train_index is None:
+        x_train = _array(x_train)
+    if val_index is None:
+        x_val = _array(x_val)
+    y_train, y_val = _column(y_train), _column(y_val)
+    w_train, w_val = _weights(w_train, len(y_train)), _weights(w_val, len(y_val))
+
+    sampled = SampledDiagnostics(_subsample(x_train, y_train, w_train, sample_size, random, train_index, transform),
+                                 _subsample(x_val, y_val, w_val, sample_size, random, val_index, transform),
+                                 outdir, cadence = cadence, keep_best = keep_best, monitor = monitor)
+    batches = Prefetcher(x_train, y_train, w_train, batch_size = batch_size, prefetch = prefetch, seed = seed, index = train_index, transform = transform)
+    all_callbacks = [sampled] + list(callbacks or [])
+    try:
+        if hasattr(model, 'fit_generator'):
+            model.fit_generator(batches, steps_per_epoch = batches.steps, epochs = epochs, callbacks = all_callbacks, verbose = verbose)
+        else:
+            model.fit(batches, steps_per_epoch = batches.steps, epochs = epochs, callbacks = all_callbacks, verbose = verbose)
+    finally:
+        batches.close()
+
+    if sampled.best:
+        print('loading the best model', sampled.best[0][1])
+        model.load_weights(sampled.best[0][1])
+    history = sampled.history
+    history['best_models'] = [path for score, path in sampled.best]
+    return history
+
+def build_model(nfeatures, nodes = 64, activation = 'relu', optimizer = 'adam'):
+    '''
+    The network of nn_fakerate_onlydata_v6.py: one hidden Dense layer and a sigmoid output
+    '''
+    from keras.models import Model
+    from keras.layers import Dense, Input
+    from keras.constraints import unit_norm
+    input  = Input((nfeatures,))
+    layer  = Dense(nodes, activation = activation, name = 'dense1', kernel_constraint = unit_norm())(input)
+    output = Dense(    1, activation = 'sigmoid', name = 'output')(layer)
+    model = Model(input, output)
+    model.compile(optimizer = optimizer, loss = 'binary_crossentropy', metrics = ['mae', 'acc'])
+    return model
@@ -0,0 +1,88 @@
+'''
+Histograms filled with numpy (one np.bincount on the whole column, weights and sumw2 included)
+and converted to TH1/TH2 for the plots, instead of calling Fill in a python loop.
+Same binning convention as ROOT: bins are [low, high), bin 0 is the underflow and bin n+1 the overflow.
+
+    hist_pass = th1('pass', '', 50, 0, 25, df.kpt)
+    hist_w    = th1('passw', '', 50, 0, 25, df.kpt, weights = df.nn/(1-df.nn))
+    eff_2d    = th2('tot2d', '', pt_edges, np.linspace(0, 2.5, 6), df.kpt, np.abs(df.keta))
+'''
+
+import numpy as np
+import ROOT
+
+def _values(a):
+    if hasattr(a, 'values'):
+        a = a.values
+    return np.asarray(a, dtype = np.float64).ravel()
+
+def _bin_index(values, edges):
+    # root global bin numbers: 0 underflow, 1..n, n+1 overflow
+    return np.digitize(values, edges, right = False)
+
+def uniform_edges(nbins, xmin, xmax):
+    return np.linspace(xmin, xmax, nbins + 1)
+
+def histogram1d(values, edges, weights = None):
+    '''
+    sumw and sumw2 of the bins, underflow and overflow included (len(edges)+1 entries)
+    '''
+    values = _values(values)
+    index = _bin_index(values, edges)
+    w = np.ones(len(values)) if weights is None else _values(weights)
+    nbins = len(edges) + 1
+    return np.bincount(index, w, nbins), np.bincount(index, w*w, nbins)
+
+def histogram2d(x, y, xedges, yedges, weights = None):
+    '''
+    sumw and sumw2 with shape (nx+2, ny+2), underflow and overflow included
+    '''
+    x, y = _values(x), _values(y)
+    nx, ny = len(xedges) + 1, len(yedges) + 1
+    index = _bin_index(x, xedges) + nx * _bin_index(y, yedges)
+    w = np.ones(len(x)) if weights is None else _values(weights)
+    shape = (nx, ny)
+    return (np.bincount(index, w, nx*ny).reshape(shape, order = 'F'),
+            np.bincount(index, w*w, nx*ny).reshape(shape, order = 'F'))
+
+def _fill(hist, sumw, sumw2, entries):
+    hist.Sumw2()
+    # root layout, x running fastest
+    hist.SetContent(np.ascontiguousarray(sumw.ravel(order = 'F'), dtype = np.float64))
+    hist.SetError(np.ascontiguousarray(np.sqrt(sumw2).ravel(order = 'F'), dtype = np.float64))
+    hist.ResetStats()
+    hist.SetEntries(entries)
+    return hist
+
+def to_th1(name, title, edges, sumw, sumw2, entries = None, cls = ROOT.TH1D):
+    edges = np.asarray(edges, dtype = np.float64)
+    hist = cls(name, title, len(edges) - 1, edges)
+    return _fill(hist, sumw, sumw2, sumw.sum() if entries is None else entries)
+
+def to_th2(name, title, xedges, yedges, sumw, sumw2, entries = None, cls = ROOT.TH2D):
+    xedges, yedges = np.asarray(xedges, dtype = np.float64), np.asarray(yedges, dtype = np.float64)
+    hist = cls(name, title, len(xedges) - 1, xedges, len(yedges) - 1, yedges)
+    return _fill(hist, sumw, sumw2, sumw.sum() if entries is None else entries)
+
+def th1(name, title, nbins, xmin, xmax, values, weights = None, cls = ROOT.TH1D):
+    '''
+    Same as cls(name, title, nbins, xmin, xmax) filled with values (and weights)
+    '''
+    edges = uniform_edges(nbins, xmin, xmax)
+    sumw, sumw2 = histogram1d(values, edges, weights)
+    return to_th1(name, title, edges, sumw, sumw2, len(_values(values)), cls)
+
+def th1_edges(name, title, edges, values, weights = None, cls = ROOT.TH1D):
+    sumw, sumw2 = histogram1d(values, edges, weights)
+    return to_th1(name, title, edges, sumw, sumw2, len(_values(values)), cls)
+
+def th2(name, title, xedges, yedges, x, y, weights = None, cls = ROOT.TH2D):
+    '''
+    xedges, yedges: bin edges, or a tuple (nbins, min, max) for uniform bins
+    '''
+    if isinstance(xedges, tuple):
+        xedges = uniform_edges(*xedges)
+    if isinstance(yedges, tuple):
+        yedges = uniform_edges(*yedges)
+    sumw, sumw2 = histogram2d(x, y, xedges, yedges, weights)
+    return to_th2(name, title, xedges, yedges, sumw, sumw2, len(_values(x)), cls)
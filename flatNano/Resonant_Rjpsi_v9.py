@@ -34,6 +34,8 @@ from bgl_variations import variations
 from itertools import product
 from hammer.hammerlib import Hammer, IOBuffer, Particle, Process, FourMomentum, WTerm
 from hammer import hepmc, pdg
+from hammer_cache import WeightCache, scheme_signatures, event_keys
+from vectorizer import bc_jpsi_lnu, take, build_processes, evaluate
 
 maxEvents = -1
 checkDoubles = True
@@ -44,6 +46,9 @@ skipFiles = 1
 #Compute hammer
 flag_hammer_mu  = False
 flag_hammer_tau = False
+# persistent cache of the hammer weights (see hammer_cache.py), shared with the other reweighting steps:
+# only the events and schemes not already there go through Hammer. None to compute everything
+hammer_cache_dir = None
 
 #Add also pu weight
 flag_pu_weight = False
@@ -321,41 +326,30 @@ def hammer_weights_mu(df,ham):
         unc = 'e%d%s'%(i,j)
         ff_schemes['bglvar_%s'%unc] = {'BcJpsi':'BGLVar_%s'%unc  }
                         
-    for k, v in ff_schemes.items():
-        ham.add_ff_scheme(k, v)
-    ham.set_units("GeV")
-    ham.init_run()
-    for i, j in product(range(11), ['up', 'down']):
-        unc = 'e%d%s'%(i,j)
-        ham.set_ff_eigenvectors('BctoJpsi', 'BGLVar_%s'%unc, variations['e%d'%i][j])
-    pids=[]
-    weights = dict()
-    for k in ff_schemes.keys():
-        weights[k] = []
-    for i in range(len(df)): #loop on the events
-        ham.init_event()
-        thebc_p4   = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(df.bc_gen_pt[i],df.bc_gen_eta[i] , df.bc_gen_phi[i], df.bc_gen_mass[i])
-        themu_p4   = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(df.mu3_gen_pt[i] , df.mu3_gen_eta[i],df.mu3_gen_phi[i] , df.mu3_gen_mass[i])
-        thejpsi_p4 = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(df.jpsi_gen_pt[i] , df.jpsi_gen_eta[i],df.jpsi_gen_phi[i] , df.jpsi_gen_mass[i])
-        thenu_p4   = thebc_p4 - themu_p4 - thejpsi_p4
-                        
-        thebc   = Particle(FourMomentum(thebc_p4.e()  , thebc_p4.px()  , thebc_p4.py()  , thebc_p4.pz()  ), 541)
-        themu   = Particle(FourMomentum(themu_p4.e()  , themu_p4.px()  , themu_p4.py()  , themu_p4.pz()  ), -13          )
-        thejpsi = Particle(FourMomentum(thejpsi_p4.e(), thejpsi_p4.px(), thejpsi_p4.py(), thejpsi_p4.pz()), 443          )
-        thenu   = Particle(FourMomentum(thenu_p4.e()  , thenu_p4.px()  , thenu_p4.py()  , thenu_p4.pz())  , 14           )
-        
-        Bc2JpsiLNu = Process()
-        
-        thebc_idx   = Bc2JpsiLNu.add_particle(thebc  )
-        themu_idx   = Bc2JpsiLNu.add_particle(themu  )
-        thejpsi_idx = Bc2JpsiLNu.add_particle(thejpsi)
-        thenu_idx   = Bc2JpsiLNu.add_particle(thenu  )
-        Bc2JpsiLNu.add_vertex(thebc_idx, [thejpsi_idx, themu_idx, thenu_idx])
-        pid = ham.add_process(Bc2JpsiLNu)
-        pids.append(pid)
-        ham.process_event()
-        for k in ff_schemes.keys():
-            weights[k].append(ham.get_weight(k))
+    # weights already in the cache, NaN for the ones to compute
+    eigenvectors = dict(('bglvar_e%d%s'%(i,j), variations['e%d'%i][j]) for i, j in product(range(11), ['up', 'down']))
+    cache = WeightCache('bc_jpsi_mu', hammer_cache_dir)
+    signatures = scheme_signatures(ff_schemes, ff_input_scheme, 'BcJpsiMuNu', eigenvectors)
+    # the inputs of Hammer for all the events, the key of each event in the cache is computed from them (see vectorizer.py)
+    particles = bc_jpsi_lnu(df, 'bc_gen', 'jpsi_gen', 'mu3_gen', lepton_pdgid=-13, neutrino_pdgid=14, mass_suffix='mass')
+    keys = event_keys(df.run, df.luminosityBlock, df.event, particles)
+    weights, todo, compute_schemes = cache.lookup(keys, signatures)
+    if len(compute_schemes):
+        for k in compute_schemes:
+            ham.add_ff_scheme(k, ff_schemes[k])
+        ham.set_units("GeV")
+        ham.init_run()
+        for i, j in product(range(11), ['up', 'down']):
+            unc = 'e%d%s'%(i,j)
+            if 'bglvar_%s'%unc in compute_schemes:
+                ham.set_ff_eigenvectors('BctoJpsi', 'BGLVar_%s'%unc, variations['e%d'%i][j])
+    # only the events not in the cache, the processes built at once from the gen columns (see vectorizer.py)
+    bc, jpsi, lepton, neutrino = take(particles, todo)
+    new_weights = evaluate(ham, build_processes(bc, [jpsi, lepton, neutrino]), compute_schemes, np.count_nonzero(todo))
+    for k in compute_schemes:
+        weights[k][todo] = new_weights[k]
+    cache.add(keys[todo], new_weights, signatures)
+    cache.save()
     for k in ff_schemes.keys():
         #save the nan as 1 (no need anymore)
         weights_clean = [ham if (not np.isnan(ham)) else 1. for ham in weights[k]]
@@ -374,45 +368,30 @@ def hammer_weights_tau(df,ham):
         unc = 'e%d%s'%(i,j)
         ff_schemes['bglvar_%s'%unc] = {'BcJpsi':'BGLVar_%s'%unc  }
                         
-    for k, v in ff_schemes.items():
-        ham.add_ff_scheme(k, v)
-    ham.set_units("GeV")
-    ham.init_run()
-    for i, j in product(range(11), ['up', 'down']):
-        unc = 'e%d%s'%(i,j)
-        ham.set_ff_eigenvectors('BctoJpsi', 'BGLVar_%s'%unc, variations['e%d'%i][j])
-    pids=[]
-    weights = dict()
-    for k in ff_schemes.keys():
-        weights[k] = []
-    for i in range(len(df)): #loop on the events
-        ham.init_event()
-
-        thebc_p4   = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(df.bc_gen_pt[i],df.bc_gen_eta[i] , df.bc_gen_phi[i],  df.bc_gen_mass[i])
-        thetau_p4 = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(df.tau_gen_pt[i] , df.tau_gen_eta[i],df.tau_gen_phi[i] , df.tau_gen_mass[i])
-        thejpsi_p4 = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(df.jpsi_gen_pt[i] , df.jpsi_gen_eta[i],df.jpsi_gen_phi[i] , df.jpsi_gen_mass[i])
-
-        thenutau_p4   = thebc_p4 - thetau_p4 - thejpsi_p4
-
-        thebc   = Particle(FourMomentum(thebc_p4.e()  , thebc_p4.px()  , thebc_p4.py()  , thebc_p4.pz()  ), 541)
-        thetau   = Particle(FourMomentum(thetau_p4.e()  , thetau_p4.px()  , thetau_p4.py()  , thetau_p4.pz()  ), -15          )
-        thejpsi = Particle(FourMomentum(thejpsi_p4.e(), thejpsi_p4.px(), thejpsi_p4.py(), thejpsi_p4.pz()), 443          )
-        thenutau   = Particle(FourMomentum(thenutau_p4.e()  , thenutau_p4.px()  , thenutau_p4.py()  , thenutau_p4.pz())  , 16)
-        
-        Bc2JpsiLNu = Process()
-        
-        thebc_idx   = Bc2JpsiLNu.add_particle(thebc  )
-        thetau_idx   = Bc2JpsiLNu.add_particle(thetau  )
-        thejpsi_idx = Bc2JpsiLNu.add_particle(thejpsi)
-        thenutau_idx   = Bc2JpsiLNu.add_particle(thenutau  )
-        Bc2JpsiLNu.add_vertex(thebc_idx, [thejpsi_idx, thetau_idx, thenutau_idx])
-        pid = ham.add_process(Bc2JpsiLNu)
-        pids.append(pid)
-        ham.process_event()
-        
-        for k in ff_schemes.keys():
-            weights[k].append(ham.get_weight(k))
-
+    # weights already in the cache, NaN for the ones to compute
+    eigenvectors = dict(('bglvar_e%d%s'%(i,j), variations['e%d'%i][j]) for i, j in product(range(11), ['up', 'down']))
+    cache = WeightCache('bc_jpsi_tau', hammer_cache_dir)
+    signatures = scheme_signatures(ff_schemes, ff_input_scheme, 'BcJpsiTauNu', eigenvectors)
+    # the inputs of Hammer for all the events, the key of each event in the cache is computed from them (see vectorizer.py)
+    particles = bc_jpsi_lnu(df, 'bc_gen', 'jpsi_gen', 'tau_gen', lepton_pdgid=-15, neutrino_pdgid=16, mass_suffix='mass')
+    keys = event_keys(df.run, df.luminosityBlock, df.event, particles)
+    weights, todo, compute_schemes = cache.lookup(keys, signatures)
+    if len(compute_schemes):
+        for k in compute_schemes:
+            ham.add_ff_scheme(k, ff_schemes[k])
+        ham.set_units("GeV")
+        ham.init_run()
+        for i, j in product(range(11), ['up', 'down']):
+            unc = 'e%d%s'%(i,j)
+            if 'bglvar_%s'%unc in compute_schemes:
+                ham.set_ff_eigenvectors('BctoJpsi', 'BGLVar_%s'%unc, variations['e%d'%i][j])
+    # only the events not in the cache, the processes built at once from the gen columns (see vectorizer.py)
+    bc, jpsi, lepton, neutrino = take(particles, todo)
+    new_weights = evaluate(ham, build_processes(bc, [jpsi, lepton, neutrino]), compute_schemes, np.count_nonzero(todo))
+    for k in compute_schemes:
+        weights[k][todo] = new_weights[k]
+    cache.add(keys[todo], new_weights, signatures)
+    cache.save()
     for k in ff_schemes.keys():
         #save the nan as 1
         weights_clean = [ham if (not np.isnan(ham)) else 1. for ham in weights[k]]
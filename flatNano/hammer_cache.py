@@ -0,0 +1 @@
+../hammer/compute_yield_weights/hammer_cache.py
\ No newline at end of file
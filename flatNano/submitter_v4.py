@@ -72,6 +72,8 @@ if not os.path.exists(out_dir):
 os.system('cp nanoframe.py '+ out_dir+ '/.')
 os.system('cp mybatch.py '+ out_dir+ '/.')
 os.system('cp bgl_variations.py '+ out_dir+ '/.')
+os.system('cp hammer_cache.py '+ out_dir+ '/.')
+os.system('cp vectorizer.py '+ out_dir+ '/.')
 os.system('cp decay_weight.root '+ out_dir+ '/.')
 
 fcheck = open(out_dir+"/"+dataset+"_files_check.txt","w+")
@@ -0,0 +1 @@
+../hammer/vectorizer.py
\ No newline at end of file
@@ -0,0 +1,200 @@
+'''
+Closure of the Hammer reweighting, as plot_v2.py (mu) and plot_tau_v1.py (tau), for any number of weights at once.
+
+The variables, the weights and the selection are read once with root_pandas (only those columns), the bins of
+each variable are computed once and the histograms of all the weights are filled with np.bincount.
+For each variable and weight the reweighted sample (EFG x weight) is compared to the target (Kiselev),
+and so is the original sample (unweighted), with
+    chi2: normalized histograms, errors of both, ndf = bins - 1
+    KS  : unbinned Kolmogorov-Smirnov of the weighted empirical distributions, with the effective numbers of entries
+The results are printed and written in closure_<channel>_<tag>.json, plots/hammer-closure_<channel>_<variable>_<tag>.png
+has the distributions and the ratios to the target:
+    python closure.py --channel tau --weights 'hammer*' [--original ...] [--target ...] [--tag 14Apr21]
+'''
+
+from __future__ import print_function
+import os
+import json
+from fnmatch import fnmatch
+from argparse import ArgumentParser
+import numpy as np
+from scipy import stats
+from root_pandas import read_root
+
+nbin = 12
+
+variables = {
+    'pt_miss_vec': {'nbin' : nbin, 'xmin' : 0  , 'xmax' : 9  },
+    'q2'         : {'nbin' : nbin, 'xmin' : 0  , 'xmax' : 10 },
+    'e_star_mu3' : {'nbin' : nbin, 'xmin' : 0.5, 'xmax' : 2.2},
+    'm2_miss'    : {'nbin' : nbin, 'xmin' : 0  , 'xmax' : 0.1},
+    'pt_miss_sca': {'nbin' : nbin, 'xmin' : 0  , 'xmax' : 10 },
+}
+
+channels = {
+    'mu' : dict(
+        original  = 'reweighed_bc_tree_mu_fromEfgtoKis_14Apr21.root',
+        target    = 'inspector/flat_tree_kiselev_mu_14Apr21.root',
+        selection = None,
+        variables = variables,
+    ),
+    'tau': dict(
+        original  = 'reweighed_bc_tree_tau_EFTtoKis_14Apr21_1vertx.root',
+        target    = 'inspector/flat_tree_tau_kiselev_13Apr21.root',
+        selection = 'is_jpsi_tau & is3m & ismu3fromtau & bhad_pdgid == 541',
+        variables = dict(variables, q2 = {'nbin' : nbin, 'xmin' : 4, 'xmax' : 10}),
+    ),
+}
+
+def bin_indices(values, nbin, xmin, xmax):
+    '''
+    Bin of each value as TH1 (-1 for NaN, underflow and overflow)
+    '''
+    values = np.asarray(values, dtype = np.float64)
+    inside = (values >= xmin) & (values < xmax)
+    indices = np.full(len(values), -1, dtype = np.int64)
+    indices[inside] = np.minimum(((values[inside] - xmin) / (xmax - xmin) * nbin).astype(np.int64), nbin - 1)
+    return indices
+
+def histogram(indices, weights, nbin):
+    '''
+    Sum of the weights and of their squares in each bin
+    '''
+    inside = indices >= 0
+    return (np.bincount(indices[inside], weights = weights[inside]   , minlength = nbin),
+            np.bincount(indices[inside], weights = weights[inside]**2, minlength = nbin))
+
+def chi2_test(h1, h2):
+    '''
+    chi2, ndf and probability of the compatibility of the shapes of two weighted histograms (sumw, sumw2)
+    '''
+    (w1, s1), (w2, s2) = h1, h2
+    n1, n2 = w1.sum(), w2.sum()
+    variance = s1 / n1**2 + s2 / n2**2
+    used = variance > 0
+    chi2 = (((w1 / n1 - w2 / n2)[used])**2 / variance[used]).sum()
+    ndf = max(np.count_nonzero(used) - 1, 1)
+    return chi2, ndf, stats.chi2.sf(chi2, ndf)
+
+def _ecdf(sorted_values, cumulative, points):
+    return np.concatenate([[0.], cumulative])[np.searchsorted(sorted_values, points, side = 'right')] / cumulative[-1]
+
+def ks_test(x1, w1, x2, w2):
+    '''
+    Kolmogorov-Smirnov distance and probability of two weighted samples (x sorted),
+    with the effective numbers of entries (sum w)^2 / sum w^2
+    '''
+    if not (w1.sum() > 0 and w2.sum() > 0):
+        return np.nan, np.nan
+    points = np.concatenate([x1, x2])
+    distance = np.abs(_ecdf(x1, np.cumsum(w1), points) - _ecdf(x2, np.cumsum(w2), points)).max()
+    n1 = w1.sum()**2 / (w1**2).sum()
+    n2 = w2.sum()**2 / (w2**2).sum()
+    return distance, stats.kstwobign.sf(distance * np.sqrt(n1 * n2 / (n1 + n2)))
+
+def _th1(name, title, h, config):
+    import ROOT
+    sumw, sumw2 = h
+    th1 = ROOT.TH1F(name, title, config['nbin'], config['xmin'], config['xmax'])
+    for i in range(config['nbin']):
+        th1.SetBinContent(i + 1, sumw[i] / sumw.sum())
+        th1.SetBinError(i + 1, np.sqrt(sumw2[i]) / sumw.sum())
+    return th1
+
+def plot(variable, config, histograms, path):
+    '''
+    Normalized distributions and ratios to the target, the original in red, the target in black, the weights after them
+    '''
+    import ROOT
+    ROOT.gStyle.SetOptStat(0)
+    ROOT.gROOT.SetBatch()
+    colors = [ROOT.kRed, ROOT.kBlack, ROOT.kBlue, ROOT.kGreen+2, ROOT.kMagenta, ROOT.kOrange+1, ROOT.kCyan+1, ROOT.kViolet, ROOT.kAzure+7, ROOT.kPink+9]
+    ths = [_th1('%s_%s' %(variable, name), name, h, config) for name, h in histograms.items()]
+    ratios = []
+    for th, color in zip(ths, colors * (len(ths) // len(colors) + 1)):
+        th.SetLineColor(color)
+        ratio = th.Clone(th.GetName() + '_ratio')
+        ratio.Divide(th, ths[1])
+        ratios.append(ratio)
+
+    c = ROOT.TCanvas('', '', 1400, 700)
+    c.Divide(2, 1)
+    for ipad, (hs, ytitle) in enumerate([(ths, 'Normalized Events'), (ratios, 'Ratio with %s' %ths[1].GetTitle())]):
+        c.cd(ipad + 1)
+        hs[0].SetMaximum(max(h.GetMaximum() for h in hs) * 1.1)
+        hs[0].GetYaxis().SetTitle(ytitle)
+        hs[0].GetXaxis().SetTitle(variable)
+        for i, h in enumerate(hs):
+            h.Draw('e' if i == 0 else 'eSAME')
+        ROOT.gPad.BuildLegend()
+    c.SaveAs(path)
+
+def closure(original, target, weights, config, selection = None, tree = 'tree'):
+    '''
+    Histograms, chi2 and KS of each variable for the original, the target and the reweighted samples.
+    weights: branches (or patterns, as 'hammer*') of the original tree
+    '''
+    names = list(config)
+    df_target = read_root(target, tree, columns = names, where = selection)
+    df_original = read_root(original, tree, columns = names + list(weights), where = selection)
+    weights = [column for column in df_original.columns if any(fnmatch(column, pattern) for pattern in weights) and column not in names]
+    samples = [('original', df_original, np.ones(len(df_original))), ('target', df_target, np.ones(len(df_target)))]
+    for weight in weights:
+        values = df_original[weight].values.astype(np.float64)
+        bad = ~np.isfinite(values)
+        if bad.any():
+            print('%s: %d not finite weights, set to 0' %(weight, np.count_nonzero(bad)))
+            values = np.where(bad, 0., values)
+        samples.append((weight, df_original, values))
+
+    results = dict()
+    for variable, binning in config.items():
+        indices = dict((id(df), bin_indices(df[variable].values, **binning)) for df in [df_original, df_target])
+        histograms = dict((name, histogram(indices[id(df)], w, binning['nbin'])) for name, df, w in samples)
+        # values in the range, sorted once per sample, for the KS
+        order = dict()
+        for df in [df_original, df_target]:
+            rows = np.flatnonzero(indices[id(df)] >= 0)
+            order[id(df)] = rows[np.argsort(df[variable].values[rows], kind = 'mergesort')]
+        x_target = df_target[variable].values[order[id(df_target)]]
+        results[variable] = dict()
+        for name, df, w in samples:
+            if name == 'target': continue
+            x = df[variable].values[order[id(df)]]
+            chi2, ndf, chi2_prob = chi2_test(histograms[name], histograms['target'])
+            distance, ks_prob = ks_test(x, w[order[id(df)]], x_target, np.ones(len(x_target)))
+            results[variable][name] = dict(chi2 = chi2, ndf = ndf, chi2_prob = chi2_prob, ks = distance, ks_prob = ks_prob)
+        results[variable]['histograms'] = dict((name, [list(h[0]), list(h[1])]) for name, h in histograms.items())
+    return results, [name for name, df, w in samples]
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--channel' , default = 'mu', choices = list(channels))
+    parser.add_argument('--original', default = None, help = 'reweighted tree (as the tester scripts write it), default of the channel')
+    parser.add_argument('--target'  , default = None, help = 'tree of the target FF, default of the channel')
+    parser.add_argument('--weights' , nargs = '+', default = ['hammer'], help = 'weight branches of the original tree, also patterns as hammer_*')
+    parser.add_argument('--tag'     , default = '14Apr21')
+    parser.add_argument('--no_plots', action = 'store_true')
+    args = parser.parse_args()
+
+    channel = channels[args.channel]
+    results, names = closure(args.original or channel['original'], args.target or channel['target'], args.weights, channel['variables'], channel['selection'])
+
+    if not args.no_plots:
+        os.system('mkdir -p plots')
+    for variable in channel['variables']:
+        print('%-12s %-24s %10s %10s %10s %10s' %(variable, 'sample', 'chi2/ndf', 'chi2 prob', 'KS', 'KS prob'))
+        for name in names:
+            if name == 'target': continue
+            r = results[variable][name]
+            print('%-12s %-24s %10.2f %10.3g %10.4f %10.3g' %('', name, r['chi2'] / r['ndf'], r['chi2_prob'], r['ks'], r['ks_prob']))
+        if not args.no_plots:
+            histograms = results[variable]['histograms']
+            ordered = [(name, tuple(np.array(h) for h in histograms[name])) for name in ['original', 'target'] + [n for n in names if n not in ['original', 'target']]]
+            plot(variable, channel['variables'][variable], dict(ordered), 'plots/hammer-closure_%s_%s_%s.png' %(args.channel, variable, args.tag))
+
+    output = 'closure_%s_%s.json' %(args.channel, args.tag)
+    with open(output, 'w') as fh:
+        json.dump(results, fh, indent = 1, sort_keys = True, default = float)
+    print('results written in %s' %output)
@@ -0,0 +1 @@
+../inspector/ancestry.py
\ No newline at end of file
@@ -1,7 +1,18 @@
 # with this script we compute the sum for the hammer weights for mu and tau
+'''
+Means, variances and sums of the Hammer weights of the merged hammer trees, in a single pass over chunks
+of only the weight branches (and the flags), so the memory does not depend on the size of the samples.
+The statistics of each chunk are merged with the running ones (Chan et al.), stable also for large samples.
 
-from root_pandas import read_root, to_root
+The normalization of each FF scheme (1 / mean weight) is written in a table that samples.py reads
+(ff_weights_table), with the same keys as ff_weights:
+    python compute_yield_weights.py [--flags_mu is3m] [--flags_tau is3m ismu3fromtau] [--output ff_weights.json]
+'''
+
+from argparse import ArgumentParser
+import json
 import numpy as np
+from root_pandas import read_root
 
 path_storage = "/pnfs/psi.ch/cms/trivcat/store/user/friti/"
 #folder_mu =  "Rjpsi_hammer_mu_01Dec21_v1"
@@ -12,8 +23,7 @@ folder_tau = "Rjpsi_hammer_tau_24jan22_v2"
 file_mu = path_storage + folder_mu + "/rjpsi_hammer_mu_merged.root"
 file_tau = path_storage + folder_tau + "/rjpsi_hammer_tau_merged.root"
 
-tree_mu = read_root(file_mu, 'tree')
-tree_tau = read_root(file_tau, 'tree')
+chunksize = 500000
 
 hammer_syst = [
     'bglvar',
@@ -30,15 +40,107 @@ hammer_syst = [
     'bglvar_e10',
 ]
 
-for hammer in hammer_syst:
-    hammer = 'hammer_'+hammer
-    if hammer != 'hammer_bglvar':
-        hammer = [hammer+'up',hammer+'down']
-    else:
-        hammer = [hammer]
-    for ham in hammer:
-        #print("Number of events with hammer weight = 0 for mu: ",len(tree_mu[ham][(tree_mu[ham] ==0)]))
-        #print("Number of events with hammer weight = 0 for tau: ",len(tree_tau[ham][(tree_tau[ham] ==0)]))
-        print("Average hammer weight "+ham+" for tau: ",np.mean(tree_tau[ham])," +- ",np.std(tree_tau[ham])/np.sqrt(len(tree_tau[ham])))
-        print("Average hammer weight "+ham+" for mu: ",np.mean(tree_mu[ham])," +- ",np.std(tree_mu[ham])/np.sqrt(len(tree_mu[ham])))
+def weight_columns(schemes = hammer_syst):
+    '''
+    Branches of the weights: hammer_bglvar, hammer_bglvar_e<k>up/down
+    '''
+    columns = []
+    for scheme in schemes:
+        if scheme == 'bglvar':
+            columns.append('hammer_' + scheme)
+        else:
+            columns += ['hammer_' + scheme + 'up', 'hammer_' + scheme + 'down']
+    return columns
+
+def ff_key(channel, column):
+    '''
+    Key of ff_weights in samples.py: hammer_bglvar -> jpsi_mu, hammer_bglvar_e0up -> jpsi_mu_bglvar_e0Up
+    '''
+    scheme = column[len('hammer_'):]
+    if scheme == 'bglvar':
+        return channel
+    for direction, suffix in [('up', 'Up'), ('down', 'Down')]:
+        if scheme.endswith(direction):
+            return channel + '_' + scheme[:-len(direction)] + suffix
+    return channel + '_' + scheme
+
+class RunningStats(object):
+    '''
+    Number of entries, mean, sum of the squared deviations and sum of each column, updated chunk by chunk
+    '''
+    def __init__(self, ncolumns):
+        self.n = 0
+        self.mean = np.zeros(ncolumns)
+        self.m2 = np.zeros(ncolumns)
+        self.sum = np.zeros(ncolumns)
+
+    def update(self, values):
+        values = np.asarray(values, dtype = np.float64)
+        n = len(values)
+        if n == 0:
+            return
+        mean = values.mean(axis = 0)
+        m2 = ((values - mean)**2).sum(axis = 0)
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * n / total
+        self.m2 = self.m2 + m2 + delta**2 * self.n * n / total
+        self.sum = self.sum + values.sum(axis = 0)
+        self.n = total
+
+    def std(self):
+        # as np.std, as in the previous version of the script
+        return np.sqrt(self.m2 / self.n) if self.n else np.full(len(self.mean), np.nan)
+
+    def summary(self, columns):
+        std = self.std()
+        return dict((column, dict(n = self.n, sum = self.sum[i], mean = self.mean[i], std = std[i],
+                                  mean_error = std[i] / np.sqrt(self.n) if self.n else np.nan)) for i, column in enumerate(columns))
+
+def aggregate(path, columns, flags = (), tree = 'tree', size = chunksize):
+    '''
+    RunningStats of the columns for all the events ('all') and for the events passing each flag
+    '''
+    stats = dict((selection, RunningStats(len(columns))) for selection in ['all'] + list(flags))
+    for chunk in read_root(path, tree, columns = list(columns) + list(flags), chunksize = size):
+        values = chunk[columns].values
+        stats['all'].update(values)
+        for flag in flags:
+            stats[flag].update(values[chunk[flag].values.astype(bool)])
+    return stats
+
+def ff_weights_table(summaries, selection = 'all'):
+    '''
+    ff_weights (1 / mean weight) of each channel and scheme, as in samples.py
+    '''
+    table = dict()
+    for channel, summary in summaries.items():
+        for column, stats in summary[selection].items():
+            table[ff_key(channel, column)] = 1. / stats['mean']
+    return table
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--mu'       , default = file_mu , help = 'merged hammer tree of Bc -> J/psi mu')
+    parser.add_argument('--tau'      , default = file_tau, help = 'merged hammer tree of Bc -> J/psi tau')
+    parser.add_argument('--flags_mu' , nargs = '*', default = [], help = 'boolean branches of the mu tree, statistics also for the events passing each one')
+    parser.add_argument('--flags_tau', nargs = '*', default = [], help = 'boolean branches of the tau tree (ismu3fromtau only there), as --flags_mu')
+    parser.add_argument('--chunksize', type = int, default = chunksize)
+    parser.add_argument('--output'   , default = 'ff_weights.json', help = 'normalization table for samples.py')
+    args = parser.parse_args()
+
+    columns = weight_columns()
+    summaries = dict()
+    for channel, path, flags in [('jpsi_tau', args.tau, args.flags_tau), ('jpsi_mu', args.mu, args.flags_mu)]:
+        stats = aggregate(path, columns, flags, size = args.chunksize)
+        summaries[channel] = dict((selection, s.summary(columns)) for selection, s in stats.items())
+        for selection in ['all'] + flags:
+            for column in columns:
+                result = summaries[channel][selection][column]
+                print("Average hammer weight %s for %s (%s, %d events): %f +- %f" %(column, channel, selection, result['n'], result['mean'], result['mean_error']))
 
+    table = ff_weights_table(summaries)
+    with open(args.output, 'w') as fh:
+        json.dump(dict(ff_weights = table, stats = summaries), fh, indent = 1, sort_keys = True, default = float)
+    print('ff_weights written in %s' %args.output)
@@ -0,0 +1,171 @@
+'''
+Form factor weights as a tensor in the BGL parameter space, for the reweighting to any BGL point without rerunning Hammer.
+
+The BGL form factors are linear in the BGL coefficients, so the weight of each event is a quadratic form
+in the shifts of the coefficients. Writing the shift as a combination of the eigenvectors of bgl_variations.py,
+    delta = sum_k theta_k * e_k        (theta_k = +-1 are the usual e<k>up / e<k>down variations)
+the weight of each event is
+    w(theta) = x^T T x,   x = (1, theta_0, ..., theta_10)
+with T a symmetric 12x12 matrix per event. T is measured once from the Hammer weights at
+1 + 2*11 + 55 points of the parameter space (the nominal, the 22 up/down and the 55 sums e_k + e_l),
+all computed in the same Hammer run (only the contraction changes between the schemes).
+
+Then, with no event-level recomputation:
+    weights_at(tensors, theta)            per event weights at theta
+    binned = bin_tensors(tensors, index)  tensors summed in the analysis bins (template shapes)
+    shape_at(binned, theta)               template at theta, e.g. for a continuous FF profiling in the fit
+
+    points = tensor_points(variations)
+    for name, scheme in scheme_definitions(points).items(): ham.add_ff_scheme(name, scheme)
+    ham.init_run(); set_eigenvectors(ham, points, variations)
+    ... weights[name] per event ...
+    save_tensors('hammer_output_mu_v2_tensor.npz', tensors_from_weights(weights))
+'''
+
+import numpy as np
+
+nparameters = 11
+# one extra point, not used to build the tensors, to check the quadratic form
+check_theta = np.full(nparameters, 0.5)
+
+def _delta(variations, theta):
+    '''
+    Shifts of the BGL coefficients (delta_a0, ...) for the point theta of the eigenvector space
+    '''
+    keys = sorted(variations['e0']['up'].keys())
+    return dict((key, sum(t * variations['e%d' %k]['up'][key] for k, t in enumerate(theta) if t != 0.)) for key in keys)
+
+def tensor_points(variations, check = True):
+    '''
+    List of (scheme name, theta) of the points needed for the tensors (names of the existing schemes where they exist)
+    '''
+    points = [('bglvar', np.zeros(nparameters))]
+    for k in range(nparameters):
+        for direction, sign in [('up', 1.), ('down', -1.)]:
+            theta = np.zeros(nparameters)
+            theta[k] = sign
+            points.append(('bglvar_e%d%s' %(k, direction), theta))
+    for k in range(nparameters):
+        for l in range(k+1, nparameters):
+            theta = np.zeros(nparameters)
+            theta[k] = theta[l] = 1.
+            points.append(('bglvar_e%de%d' %(k, l), theta))
+    if check:
+        points.append(('bglvar_check', check_theta.copy()))
+    return points
+
+def scheme_definitions(points):
+    '''
+    FF schemes to add to Hammer before init_run
+    '''
+    return dict((name, {'BcJpsi': 'BGLVar' if name == 'bglvar' else 'BGLVar_' + name[len('bglvar_'):]}) for name, theta in points)
+
+def point_eigenvectors(points, variations):
+    '''
+    Shifts of the BGL coefficients of each scheme of the points (as given to set_ff_eigenvectors)
+    '''
+    return dict((name, _delta(variations, theta)) for name, theta in points if name != 'bglvar')
+
+def set_eigenvectors(ham, points, variations):
+    '''
+    To be called after init_run
+    '''
+    for name, delta in point_eigenvectors(points, variations).items():
+        ham.set_ff_eigenvectors('BctoJpsi', 'BGLVar_' + name[len('bglvar_'):], delta)
+
+def _weights(weights, name):
+    # NaN as 0, as for the weight columns of the output trees
+    return np.nan_to_num(np.asarray(weights[name], dtype = np.float64))
+
+def tensors_from_weights(weights, n = nparameters):
+    '''
+    weights: dict scheme name -> per event weights (at least the points of tensor_points).
+    Returns the tensors T, shape (n_events, n+1, n+1)
+    '''
+    w0 = _weights(weights, 'bglvar')
+    up = np.stack([_weights(weights, 'bglvar_e%dup' %k) for k in range(n)], axis = 1)
+    down = np.stack([_weights(weights, 'bglvar_e%ddown' %k) for k in range(n)], axis = 1)
+
+    tensors = np.zeros((len(w0), n+1, n+1))
+    linear = 0.5 * (up - down)
+    diagonal = 0.5 * (up + down) - w0[:, None]
+    tensors[:, 0, 0] = w0
+    tensors[:, 0, 1:] = tensors[:, 1:, 0] = 0.5 * linear
+    tensors[:, np.arange(1, n+1), np.arange(1, n+1)] = diagonal
+    for k in range(n):
+        for l in range(k+1, n):
+            cross = _weights(weights, 'bglvar_e%de%d' %(k, l)) - w0 - linear[:, k] - linear[:, l] - diagonal[:, k] - diagonal[:, l]
+            tensors[:, k+1, l+1] = tensors[:, l+1, k+1] = 0.5 * cross
+    return tensors
+
+def _x(theta):
+    theta = np.asarray(theta, dtype = np.float64)
+    return np.concatenate([[1.], theta])
+
+def weights_at(tensors, theta):
+    '''
+    Per event weights at the point theta (eigenvector coordinates, +-1 = 1 sigma)
+    '''
+    x = _x(theta)
+    return np.einsum('eij,i,j->e', tensors, x, x)
+
+def check_tensors(tensors, weights):
+    '''
+    Largest relative difference between the weights of the check point and the tensor prediction
+    '''
+    if 'bglvar_check' not in weights:
+        return None
+    expected = _weights(weights, 'bglvar_check')
+    predicted = weights_at(tensors, check_theta)
+    scale = np.maximum(np.abs(expected), 1e-12)
+    return np.max(np.abs(predicted - expected) / scale) if len(expected) else 0.
+
+def bin_tensors(tensors, index, nbins, event_weights = None):
+    '''
+    Tensors summed in the analysis bins: index is the bin of each event (-1 or >= nbins to drop it),
+    event_weights the other (FF independent) weights of the events
+    '''
+    index = np.asarray(index)
+    good = (index >= 0) & (index < nbins)
+    t = tensors[good] if event_weights is None else tensors[good] * np.asarray(event_weights)[good][:, None, None]
+    binned = np.zeros((nbins,) + tensors.shape[1:])
+    np.add.at(binned, index[good], t)
+    return binned
+
+def shape_at(binned, theta):
+    '''
+    Template (yield of each bin) at the point theta
+    '''
+    x = _x(theta)
+    return np.einsum('bij,i,j->b', binned, x, x)
+
+def delta_to_theta(variations, delta):
+    '''
+    Eigenvector coordinates of a point given as shifts of the BGL coefficients (least squares if not in the span)
+    '''
+    keys = sorted(variations['e0']['up'].keys())
+    basis = np.array([[variations['e%d' %k]['up'][key] for key in keys] for k in range(nparameters)]).T
+    theta = np.linalg.lstsq(basis, np.array([delta.get(key, 0.) for key in keys]), rcond = None)[0]
+    return theta
+
+def pack(tensors):
+    # upper triangle of each symmetric tensor
+    iu = np.triu_indices(tensors.shape[1])
+    return tensors[:, iu[0], iu[1]]
+
+def unpack(packed, n = nparameters):
+    iu = np.triu_indices(n+1)
+    tensors = np.zeros((len(packed), n+1, n+1))
+    tensors[:, iu[0], iu[1]] = packed
+    tensors[:, iu[1], iu[0]] = packed
+    return tensors
+
+def save_tensors(path, tensors, **extra):
+    '''
+    Tensors packed (upper triangles), one row per row of the output tree; extra arrays saved alongside
+    '''
+    np.savez(path, tensors = pack(tensors), nparameters = tensors.shape[1] - 1, **extra)
+
+def load_tensors(path):
+    arrays = np.load(path)
+    return unpack(arrays['tensors'], int(arrays['nparameters']))
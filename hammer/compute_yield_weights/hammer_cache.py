@@ -0,0 +1,196 @@
+'''
+Persistent cache of the Hammer weights, shared by the reweighting steps (flatNano with flag_hammer_mu/tau,
+hammer_*_v2.py, tester_*.py), so that the same Bc events do not go through Hammer again.
+
+Each event is identified by a 64 bit key, hash of (run, lumi, event) and of the inputs of Hammer themselves,
+the (e, px, py, pz) (as float32) and pdg id of the particles of the process, whatever the columns they come from:
+all the steps compute the same key for the same event, and the same event with different kinematics gets a different key.
+Each FF scheme is identified by the hash of its signature (decay, input scheme, scheme definition and eigenvector
+shifts of the BGLVar schemes), so new variations, or a different input scheme, make new entries.
+
+    <directory>/<process>/<scheme hash>/signature.json
+    <directory>/<process>/<scheme hash>/shard_<id>.npz     keys (sorted), weights
+
+Each job writes its own shards (no locking for the parallel batch jobs), compact() merges them.
+
+    cache = WeightCache('bc_jpsi_mu', directory)
+    signatures = scheme_signatures(ff_schemes, ff_input_scheme, 'BcJpsiMuNu', eigenvectors)
+    particles = bc_jpsi_lnu(tree_df, ...)
+    keys = event_keys(tree_df.run, tree_df.lumi, tree_df.event, particles)
+    weights, todo, schemes = cache.lookup(keys, signatures)
+    ... Hammer with only the schemes in schemes, on only the events in todo (take(particles, todo)), filling weights ...
+    cache.add(keys[todo], dict((k, weights[k][todo]) for k in schemes), signatures)
+    cache.save()
+
+Usage (summary of a cache, or merge of the shards when no job is writing):
+    python hammer_cache.py --directory /pnfs/.../hammer_weights --process bc_jpsi_mu [--compact]
+'''
+
+import os
+import json
+import uuid
+import hashlib
+from argparse import ArgumentParser
+import numpy as np
+
+cache_version = 2
+
+def event_keys(run, lumi, event, particles):
+    '''
+    Key of each event: hash of run, lumi, event (as int64) and of the Hammer inputs, the particles (p4, pdgid)
+    of the process as vectorizer.bc_jpsi_lnu returns them (p4 (e, px, py, pz) as float32, pdgid as int64)
+    '''
+    n = len(particles[0][0])
+    ids = np.stack([np.asarray(x, dtype = np.int64) for x in (run, lumi, event)] +
+                   [np.broadcast_to(np.asarray(pdgid), (n,)).astype(np.int64) for p4, pdgid in particles], axis = 1)
+    kinematics = np.ascontiguousarray(np.concatenate([np.asarray(p4, dtype = np.float32) for p4, pdgid in particles], axis = 1))
+    rows = np.concatenate([ids.view(np.uint8).reshape(n, 8 * ids.shape[1]),
+                           kinematics.view(np.uint8).reshape(n, 4 * kinematics.shape[1])], axis = 1)
+    digests = b''.join(hashlib.blake2b(row.tobytes(), digest_size = 8).digest() for row in rows)
+    return np.frombuffer(digests, dtype = np.uint64).copy()
+
+def scheme_signatures(ff_schemes, input_scheme, decay, eigenvectors = None):
+    '''
+    Signature of each FF scheme: everything that changes its weights.
+    eigenvectors: dict scheme name -> shifts of the FF parameters set with set_ff_eigenvectors
+    '''
+    eigenvectors = eigenvectors or dict()
+    return dict((name, dict(version = cache_version, decay = decay, input = input_scheme, scheme = definition,
+                            eigenvectors = eigenvectors.get(name))) for name, definition in ff_schemes.items())
+
+def signature_hash(signature):
+    return hashlib.sha1(json.dumps(signature, sort_keys = True, default = float).encode()).hexdigest()[:16]
+
+def _merge(keys, weights):
+    # sorted unique keys, the first occurrence wins
+    if not keys:
+        return np.zeros(0, dtype = np.uint64), np.zeros(0)
+    keys, first = np.unique(np.concatenate(keys), return_index = True)
+    return keys, np.concatenate(weights)[first]
+
+class WeightCache(object):
+
+    def __init__(self, process, directory = None):
+        '''
+        directory None: nothing cached, all the events are computed (same code path for the scripts)
+        '''
+        self.directory = None if directory is None else os.path.join(directory, process)
+        self.loaded = dict()
+        self.pending = dict()
+
+    def _path(self, signature):
+        return os.path.join(self.directory, signature_hash(signature))
+
+    def _shards(self, path):
+        if not os.path.isdir(path):
+            return []
+        return [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.startswith('shard_') and f.endswith('.npz')]
+
+    def _load(self, signature):
+        key = signature_hash(signature)
+        if key not in self.loaded:
+            keys, weights = [], []
+            if self.directory is not None:
+                for shard in self._shards(self._path(signature)):
+                    with np.load(shard) as arrays:
+                        keys.append(arrays['keys'])
+                        weights.append(arrays['weights'])
+            self.loaded[key] = _merge(keys, weights)
+        return self.loaded[key]
+
+    def lookup(self, keys, signatures):
+        '''
+        Returns the weights found (dict scheme -> array, NaN where missing), the mask of the events with
+        at least one scheme missing and the list of the schemes missing for at least one event
+        '''
+        keys = np.asarray(keys, dtype = np.uint64)
+        todo = np.zeros(len(keys), dtype = bool)
+        weights, schemes = dict(), []
+        for name, signature in signatures.items():
+            cached_keys, cached_weights = self._load(signature)
+            weights[name] = np.full(len(keys), np.nan)
+            found = np.zeros(len(keys), dtype = bool)
+            if len(cached_keys):
+                position = np.minimum(np.searchsorted(cached_keys, keys), len(cached_keys) - 1)
+                found = cached_keys[position] == keys
+                weights[name][found] = cached_weights[position[found]]
+            if not found.all():
+                schemes.append(name)
+                todo |= ~found
+        print('hammer cache: %d / %d events and %d / %d schemes to compute' %(np.count_nonzero(todo), len(keys), len(schemes), len(signatures)))
+        return weights, todo, schemes
+
+    def add(self, keys, weights, signatures):
+        '''
+        New weights (dict scheme -> array, aligned with keys), written by save
+        '''
+        keys = np.asarray(keys, dtype = np.uint64)
+        for name, values in weights.items():
+            key = signature_hash(signatures[name])
+            self.pending.setdefault(key, (signatures[name], []))[1].append((keys, np.asarray(values, dtype = np.float64)))
+
+    def _write(self, path, signature, keys, weights):
+        os.system('mkdir -p %s' %path)
+        if not os.path.exists(os.path.join(path, 'signature.json')):
+            with open(os.path.join(path, 'signature.json'), 'w') as fh:
+                json.dump(signature, fh, indent = 2, sort_keys = True, default = float)
+        # written with another name and moved in place when complete: readers only see full shards
+        shard = uuid.uuid4().hex
+        np.savez(os.path.join(path, 'tmp_%s.npz' %shard), keys = keys, weights = weights)
+        os.replace(os.path.join(path, 'tmp_%s.npz' %shard), os.path.join(path, 'shard_%s.npz' %shard))
+
+    def save(self):
+        for key, (signature, parts) in self.pending.items():
+            keys, weights = _merge([p[0] for p in parts], [p[1] for p in parts])
+            if self.directory is not None and len(keys):
+                self._write(self._path(signature), signature, keys, weights)
+            if key in self.loaded:
+                old_keys, old_weights = self.loaded[key]
+                self.loaded[key] = _merge([old_keys, keys], [old_weights, weights])
+        self.pending = dict()
+
+    def summary(self):
+        '''
+        dict scheme hash -> (scheme definition, number of events, number of shards)
+        '''
+        summary = dict()
+        if self.directory is None or not os.path.isdir(self.directory):
+            return summary
+        for key in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, key)
+            if not os.path.exists(os.path.join(path, 'signature.json')):
+                continue
+            with open(os.path.join(path, 'signature.json')) as fh:
+                signature = json.load(fh)
+            summary[key] = (signature['scheme'], len(self._load(signature)[0]), len(self._shards(path)))
+        return summary
+
+    def compact(self):
+        '''
+        Merges the shards of each scheme in one. Only when no job is writing to the cache
+        '''
+        for key in self.summary():
+            path = os.path.join(self.directory, key)
+            with open(os.path.join(path, 'signature.json')) as fh:
+                signature = json.load(fh)
+            shards = self._shards(path)
+            if len(shards) < 2:
+                continue
+            keys, weights = self._load(signature)
+            self._write(path, signature, keys, weights)
+            for shard in shards:
+                os.remove(shard)
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--directory', required = True, help = 'directory of the cache')
+    parser.add_argument('--process'  , required = True, help = 'e.g. bc_jpsi_mu, bc_jpsi_tau')
+    parser.add_argument('--compact'  , action = 'store_true', help = 'merge the shards of each scheme')
+    args = parser.parse_args()
+
+    cache = WeightCache(args.process, args.directory)
+    if args.compact:
+        cache.compact()
+    for key, (scheme, events, shards) in cache.summary().items():
+        print('%s %s: %d events, %d shards' %(key, scheme, events, shards))
@@ -15,6 +15,8 @@ import math
 from bgl_variations import variations
 from itertools import product
 from glob import glob
+from hammer_cache import WeightCache, scheme_signatures, event_keys
+from vectorizer import bc_jpsi_lnu, take, build_processes, evaluate
 import argparse
 
 parser = argparse.ArgumentParser(description='')
@@ -31,6 +33,10 @@ verbose       = args.verbose
 destination   = args.destination
 maxevents     = args.maxevents
 
+# persistent cache of the weights (see hammer_cache.py), in a directory shared by the jobs:
+# only the events and schemes not already there go through Hammer. None to compute everything
+cache_dir = None
+
 ham = Hammer()
 fbBuffer = IOBuffer
 ham.include_decay("BcJpsiMuNu")
@@ -46,87 +52,51 @@ for i, j in product(range(11), ['up', 'down']):
     unc = 'e%d%s'%(i,j)
     ff_schemes['bglvar_%s'%unc] = {'BcJpsi':'BGLVar_%s'%unc  }
                         
-for k, v in ff_schemes.items():
-    ham.add_ff_scheme(k, v)
-ham.add_total_sum_of_weights() # adds "Total Sum of Weights" histo with auto bin filling
-ham.set_units("GeV")
-ham.init_run()
-
-files = glob('/pnfs/psi.ch/cms/trivcat/store/user/friti/HOOK_INPUT/*.root')
-files.sort()
-fname = files[(jobid)*files_per_job:(jobid+1)*files_per_job]
-fname = fname[0]
-print("files: ",fname)
-
-for i, j in product(range(11), ['up', 'down']):
-    unc = 'e%d%s'%(i,j)
-    ham.set_ff_eigenvectors('BctoJpsi', 'BGLVar_%s'%unc, variations['e%d'%i][j])
-
-fin = ROOT.TFile.Open(fname)
-tree = fin.Get('tree')
-tree_df = read_root(fname, 'tree', where='is_jpsi_mu & is3m')
-
-pids = []
-weights = dict()
-for k in ff_schemes.keys():
-    weights[k] = []
-
-start = time()
-maxevents = maxevents if maxevents>=0 else tree.GetEntries() # total number of events in the files
-
-for i, ev in enumerate(tree):
-
-    if (i+1)>maxevents:
-        break
-        
-    if i%1000==0:
-        percentage = float(i)/maxevents*100.
-        speed = float(i)/(time()-start)
-        eta = datetime.now() + timedelta(seconds=(maxevents-i) / max(0.1, speed))
-        print('\t===> processing %d / %d event \t completed %.1f%s \t %.1f ev/s \t ETA %s s' %(i, maxevents, percentage, '%', speed, eta.strftime('%Y-%m-%d %H:%M:%S')))
-
-    if not ev.is_jpsi_mu: continue
-    if not ev.is3m: continue
-
-    ham.init_event()
-    
-    thebc_p4   = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(ev.bhad_pt, ev.bhad_eta, ev.bhad_phi, ev.bhad_m)
-    themu_p4   = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(ev.mu3_pt , ev.mu3_eta , ev.mu3_phi , 0.1056   )
-    thejpsi_p4 = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(ev.jpsi_pt, ev.jpsi_eta, ev.jpsi_phi, ev.jpsi_m)
-
-    thenu_p4   = thebc_p4 - themu_p4 - thejpsi_p4
-        
-    thebc   = Particle(FourMomentum(thebc_p4.e()  , thebc_p4.px()  , thebc_p4.py()  , thebc_p4.pz()  ), ev.bhad_pdgid)
-    themu   = Particle(FourMomentum(themu_p4.e()  , themu_p4.px()  , themu_p4.py()  , themu_p4.pz()  ), -13          )
-    thejpsi = Particle(FourMomentum(thejpsi_p4.e(), thejpsi_p4.px(), thejpsi_p4.py(), thejpsi_p4.pz()), 443          )
-    thenu   = Particle(FourMomentum(thenu_p4.e()  , thenu_p4.px()  , thenu_p4.py()  , thenu_p4.pz())  , 14           )
-
-    Bc2JpsiLNu = Process()
-    
-    # each of these add_particle operations returns an index, needed to define vertices 
-    thebc_idx   = Bc2JpsiLNu.add_particle(thebc  )
-    themu_idx   = Bc2JpsiLNu.add_particle(themu  )
-    thejpsi_idx = Bc2JpsiLNu.add_particle(thejpsi)
-    thenu_idx   = Bc2JpsiLNu.add_particle(thenu  )
-
-
-    # define decay vertex
-    Bc2JpsiLNu.add_vertex(thebc_idx, [thejpsi_idx, themu_idx, thenu_idx])
-
-    # save process id to later retrieve the per-event weight
-    pid = ham.add_process(Bc2JpsiLNu)
-    pids.append(pid)
-
-    ham.process_event()
-    for k in ff_schemes.keys():
-        weights[k].append(ham.get_weight(k))
-    if i>maxevents: break
-
-reduced_tree = tree_df[:len(weights[k])].copy()
+# input file and range of entries of this job (work unit of sharding.py)
+fname = 'HOOK_FILE_IN'
+skip_events = HOOK_SKIP_EVENTS
+maxevents = HOOK_MAX_EVENTS
+print("files: ",fname, "entries from", skip_events)
+
+# the selected events among the maxevents entries from skip_events (all with -1)
+tree_df = read_root(fname, 'tree', where='is_jpsi_mu & is3m', start=skip_events, stop=skip_events+maxevents if maxevents>=0 else None)
+
+# weights already in the cache, NaN for the ones to compute
+eigenvectors = dict(('bglvar_e%d%s'%(i,j), variations['e%d'%i][j]) for i, j in product(range(11), ['up', 'down']))
+cache = WeightCache('bc_jpsi_mu', cache_dir)
+signatures = scheme_signatures(ff_schemes, ff_input_scheme, 'BcJpsiMuNu', eigenvectors)
+# the inputs of Hammer for all the events, the key of each event in the cache is computed from them (see vectorizer.py)
+particles = bc_jpsi_lnu(tree_df, 'bhad', 'jpsi', 'mu3', bc_pdgid=tree_df.bhad_pdgid, lepton_pdgid=-13, neutrino_pdgid=14, lepton_mass=0.1056)
+keys = event_keys(tree_df.run, tree_df.lumi, tree_df.event, particles)
+weights, todo, compute_schemes = cache.lookup(keys, signatures)
+
+if len(compute_schemes):
+    for k in compute_schemes:
+        ham.add_ff_scheme(k, ff_schemes[k])
+    ham.add_total_sum_of_weights() # adds "Total Sum of Weights" histo with auto bin filling
+    ham.set_units("GeV")
+    ham.init_run()
+
+    for i, j in product(range(11), ['up', 'down']):
+        unc = 'e%d%s'%(i,j)
+        if 'bglvar_%s'%unc in compute_schemes:
+            ham.set_ff_eigenvectors('BctoJpsi', 'BGLVar_%s'%unc, variations['e%d'%i][j])
+
+# only the events not in the cache, the processes built at once from the columns (see vectorizer.py)
+bc, jpsi, lepton, neutrino = take(particles, todo)
+new_weights = evaluate(ham, build_processes(bc, [jpsi, lepton, neutrino]), compute_schemes, np.count_nonzero(todo))
+for k in compute_schemes:
+    weights[k][todo] = new_weights[k]
+
+# the new weights go to the cache
+cache.add(keys[todo], new_weights, signatures)
+cache.save()
+
+reduced_tree = tree_df.copy()
 
 #it shouldn't be needed anymore: nan problem solved
 for k in ff_schemes.keys():
-    reduced_tree['hammer_'+k] = np.nan_to_num(np.array(weights[k])) 
+    reduced_tree['hammer_'+k] = np.nan_to_num(weights[k])
 #output file
 to_root(reduced_tree, 'HOOK_FILE_OUT', key='tree')
 print("Success!")        
@@ -14,6 +14,8 @@ from root_pandas import read_root, to_root
 import numpy as np
 from bgl_variations import variations
 from glob import glob
+from hammer_cache import WeightCache, scheme_signatures, event_keys
+from vectorizer import bc_jpsi_lnu, take, build_processes, evaluate
 import argparse
 
 parser = argparse.ArgumentParser(description='')
@@ -30,6 +32,10 @@ verbose       = args.verbose
 destination   = args.destination
 maxevents     = args.maxevents
 
+# persistent cache of the weights (see hammer_cache.py), in a directory shared by the jobs:
+# only the events and schemes not already there go through Hammer. None to compute everything
+cache_dir = None
+
 ham = Hammer()
 fbBuffer = IOBuffer
 
@@ -46,89 +52,54 @@ for i, j in product(range(11), ['up', 'down']):
         unc = 'e%d%s'%(i,j)
         ff_schemes['bglvar_%s'%unc] = {'BcJpsi':'BGLVar_%s'%unc  }
 
-for k, v in ff_schemes.items():
-        ham.add_ff_scheme(k, v)
-ham.set_units("GeV")
-ham.init_run()
-
-files = glob('/pnfs/psi.ch/cms/trivcat/store/user/friti/HOOK_INPUT/*.root')
-files.sort()
-files = files[2:]
-files = files[(jobid)*files_per_job:(jobid+1)*files_per_job]
-print("files: ",files)
-
-
-for i, j in product(range(11), ['up', 'down']):
-        unc = 'e%d%s'%(i,j)
-        ham.set_ff_eigenvectors('BctoJpsi', 'BGLVar_%s'%unc, variations['e%d'%i][j])
+# input file and range of entries of this job (work unit of sharding.py)
+files = ['HOOK_FILE_IN']
+skip_events = HOOK_SKIP_EVENTS
+maxevents = HOOK_MAX_EVENTS
+print("files: ",files, "entries from", skip_events)
+
+# weights already in the cache for the events of each file, NaN for the ones to compute
+eigenvectors = dict(('bglvar_e%d%s'%(i,j), variations['e%d'%i][j]) for i, j in product(range(11), ['up', 'down']))
+cache = WeightCache('bc_jpsi_tau', cache_dir)
+signatures = scheme_signatures(ff_schemes, ff_input_scheme, 'BcJpsiTauNu', eigenvectors)
+lookups = dict()
+for fname in files:
+        # the selected events among the maxevents entries from skip_events (all with -1)
+        tree_df = read_root(fname, 'tree', where='is_jpsi_tau & is3m & ismu3fromtau & bhad_pdgid == 541', start=skip_events, stop=skip_events+maxevents if maxevents>=0 else None)
+        # the inputs of Hammer for all the events, the key of each event in the cache is computed from them (see vectorizer.py)
+        particles = bc_jpsi_lnu(tree_df, 'bhad', 'jpsi', 'tau', bc_pdgid=tree_df.bhad_pdgid, lepton_pdgid=-15, neutrino_pdgid=16)
+        keys = event_keys(tree_df.run, tree_df.lumi, tree_df.event, particles)
+        lookups[fname] = (tree_df, particles, keys) + cache.lookup(keys, signatures)
+# the schemes missing for at least one event of the job
+compute_schemes = [k for k in ff_schemes.keys() if any(k in lookup[5] for lookup in lookups.values())]
+
+if len(compute_schemes):
+        for k in compute_schemes:
+                ham.add_ff_scheme(k, ff_schemes[k])
+        ham.set_units("GeV")
+        ham.init_run()
+
+        for i, j in product(range(11), ['up', 'down']):
+                unc = 'e%d%s'%(i,j)
+                if 'bglvar_%s'%unc in compute_schemes:
+                        ham.set_ff_eigenvectors('BctoJpsi', 'BGLVar_%s'%unc, variations['e%d'%i][j])
 
 for fname in files:
-        fin = ROOT.TFile.Open(fname)
-        tree = fin.Get('tree')
-    
-        tree_df = read_root(fname, 'tree', where='is_jpsi_tau & is3m & ismu3fromtau & bhad_pdgid == 541')
+        tree_df, particles, keys, weights, todo, missing = lookups[fname]
 
-        pids = []
-        weights = dict()
+        # only the events not in the cache, the processes built at once from the columns (see vectorizer.py)
+        bc, jpsi, lepton, neutrino = take(particles, todo)
+        new_weights = evaluate(ham, build_processes(bc, [jpsi, lepton, neutrino]), compute_schemes, np.count_nonzero(todo))
+        for k in compute_schemes:
+                weights[k][todo] = new_weights[k]
 
+        # the new weights go to the cache
+        cache.add(keys[todo], new_weights, signatures)
+        cache.save()
+
+        reduced_tree = tree_df.copy()
         for k in ff_schemes.keys():
-                weights[k] = []
-        start = time()
-        maxevents = maxevents if maxevents>=0 else tree.GetEntries() # total number of events in the files
-
-        for i, ev in enumerate(tree):
-                if (i+1)>maxevents:
-                        break
-        
-                if i%1000==0:
-                        percentage = float(i)/maxevents*100.
-                        speed = float(i)/(time()-start)
-                        eta = datetime.now() + timedelta(seconds=(maxevents-i) / max(0.1, speed))
-                        print('\t===> processing %d / %d event \t completed %.1f%s \t %.1f ev/s \t ETA %s s' %(i, maxevents, percentage, '%', speed, eta.strftime('%Y-%m-%d %H:%M:%S')))
-
-                if not ev.is_jpsi_tau: continue
-                if not ev.is3m: continue
-                if not ev.ismu3fromtau: continue
-                if not ev.bhad_pdgid == 541: continue
-    
-                ham.init_event()
-    
-                thebc_p4   = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(ev.bhad_pt, ev.bhad_eta, ev.bhad_phi, ev.bhad_m)
-                thejpsi_p4 = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(ev.jpsi_pt, ev.jpsi_eta, ev.jpsi_phi, ev.jpsi_m)
-                thetau_p4 = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(ev.tau_pt, ev.tau_eta, ev.tau_phi, ev.tau_m)
-                
-                thenutau_p4   = thebc_p4 - thetau_p4 - thejpsi_p4
-                
-                
-                thebc   = Particle(FourMomentum(thebc_p4.e()  , thebc_p4.px()  , thebc_p4.py()  , thebc_p4.pz()  ), ev.bhad_pdgid)
-                thejpsi = Particle(FourMomentum(thejpsi_p4.e(), thejpsi_p4.px(), thejpsi_p4.py(), thejpsi_p4.pz()), 443          )
-                thetau = Particle(FourMomentum(thetau_p4.e(), thetau_p4.px(), thetau_p4.py(), thetau_p4.pz()), -15          )
-                thenutau   = Particle(FourMomentum(thenutau_p4.e()  , thenutau_p4.px()  , thenutau_p4.py()  , thenutau_p4.pz())  , 16     )
-
-                Bc2JpsiLNu = Process()
-    
-                # each of these add_particle operations returns an index, needed to define vertices 
-                thebc_idx   = Bc2JpsiLNu.add_particle(thebc  )
-                thejpsi_idx = Bc2JpsiLNu.add_particle(thejpsi)
-                thetau_idx   = Bc2JpsiLNu.add_particle(thetau  )
-                thenutau_idx   = Bc2JpsiLNu.add_particle(thenutau  )
-
-                # define decay vertex
-                Bc2JpsiLNu.add_vertex(thebc_idx, [thejpsi_idx, thetau_idx, thenutau_idx])
-
-                # save process id to later retrieve the per-event weight
-                pid = ham.add_process(Bc2JpsiLNu)
-                pids.append(pid)
-                
-                ham.process_event()
-                for k in ff_schemes.keys():
-                        weights[k].append(ham.get_weight(k))
-    
-                if i>maxevents: break
-
-        reduced_tree = tree_df[:len(weights[k])].copy()
-        for k in ff_schemes.keys():
-                reduced_tree['hammer_'+k] = np.nan_to_num(np.array(weights[k])) 
+                reduced_tree['hammer_'+k] = np.nan_to_num(weights[k])
         to_root(reduced_tree, 'HOOK_FILE_OUT', key='tree')
 
         print("Success!")        
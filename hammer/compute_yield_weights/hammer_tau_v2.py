@@ -13,6 +13,9 @@ from hammer import hepmc, pdg
 from root_pandas import read_root, to_root
 import numpy as np
 from bgl_variations import variations
+from ff_tensor import tensor_points, scheme_definitions, point_eigenvectors, set_eigenvectors, tensors_from_weights, check_tensors, save_tensors
+from hammer_cache import WeightCache, scheme_signatures, event_keys
+from vectorizer import bc_jpsi_lnu, take, build_processes, evaluate
 
 ham = Hammer()
 fbBuffer = IOBuffer
@@ -20,6 +23,14 @@ fbBuffer = IOBuffer
 # We don't add the tau decay, becasue that doesn't change the FF of the Bc
 ham.include_decay(["BcJpsiTauNu"])
 
+# also store the weight tensor in the BGL parameter space (see ff_tensor.py):
+# 78 points computed in this same run, then weights and shapes at any BGL point with no rerun
+tensor_mode = False
+
+# persistent cache of the weights (see hammer_cache.py), shared with the other reweighting steps:
+# only the events and schemes not already there go through Hammer. None to compute everything
+cache_dir = None
+
 ff_input_scheme = dict()
 ff_input_scheme["BcJpsi"] = "Kiselev"
 ham.set_ff_input_scheme(ff_input_scheme)
@@ -30,84 +41,58 @@ for i, j in product(range(11), ['up', 'down']):
         unc = 'e%d%s'%(i,j)
         ff_schemes['bglvar_%s'%unc] = {'BcJpsi':'BGLVar_%s'%unc  }
 
-for k, v in ff_schemes.items():
-        ham.add_ff_scheme(k, v)
-ham.set_units("GeV")
-ham.init_run()
-
-for i, j in product(range(11), ['up', 'down']):
-        unc = 'e%d%s'%(i,j)
-        ham.set_ff_eigenvectors('BctoJpsi', 'BGLVar_%s'%unc, variations['e%d'%i][j])
+# the schemes saved as columns of the output tree
+tree_schemes = list(ff_schemes.keys())
+if tensor_mode:
+    points = tensor_points(variations)
+    ff_schemes.update(scheme_definitions(points))
 
 fname = 'inspector_output_tau_v1.root'
-fin = ROOT.TFile.Open(fname)
-tree = fin.Get('tree')
 maxevents = 1000
-tree_df = read_root(fname, 'tree', where='is_jpsi_tau & is3m & ismu3fromtau & bhad_pdgid == 541')
-
-pids = []
-weights = dict()
-
-for k in ff_schemes.keys():
-        weights[k] = []
-
-start = time()
-maxevents = maxevents if maxevents>=0 else tree.GetEntries() # total number of events in the files
-
-
-for i, ev in enumerate(tree):
-
-    if (i+1)>maxevents:
-        break
-        
-    if i%1000==0:
-        percentage = float(i)/maxevents*100.
-        speed = float(i)/(time()-start)
-        eta = datetime.now() + timedelta(seconds=(maxevents-i) / max(0.1, speed))
-        print('\t===> processing %d / %d event \t completed %.1f%s \t %.1f ev/s \t ETA %s s' %(i, maxevents, percentage, '%', speed, eta.strftime('%Y-%m-%d %H:%M:%S')))
-
-    if not ev.is_jpsi_tau: continue
-    if not ev.is3m: continue
-    if not ev.ismu3fromtau: continue
-    if not ev.bhad_pdgid == 541: continue
-    
-    ham.init_event()
-    
-    thebc_p4   = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(ev.bhad_pt, ev.bhad_eta, ev.bhad_phi, ev.bhad_m)
-    thejpsi_p4 = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(ev.jpsi_pt, ev.jpsi_eta, ev.jpsi_phi, ev.jpsi_m)
-    thetau_p4 = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(ev.tau_pt, ev.tau_eta, ev.tau_phi, ev.tau_m)
-
-    thenutau_p4   = thebc_p4 - thetau_p4 - thejpsi_p4
-
-
-    thebc   = Particle(FourMomentum(thebc_p4.e()  , thebc_p4.px()  , thebc_p4.py()  , thebc_p4.pz()  ), ev.bhad_pdgid)
-    thejpsi = Particle(FourMomentum(thejpsi_p4.e(), thejpsi_p4.px(), thejpsi_p4.py(), thejpsi_p4.pz()), 443          )
-    thetau = Particle(FourMomentum(thetau_p4.e(), thetau_p4.px(), thetau_p4.py(), thetau_p4.pz()), -15          )
-    thenutau   = Particle(FourMomentum(thenutau_p4.e()  , thenutau_p4.px()  , thenutau_p4.py()  , thenutau_p4.pz())  , 16     )
-
-    Bc2JpsiLNu = Process()
-    
-    # each of these add_particle operations returns an index, needed to define vertices 
-    thebc_idx   = Bc2JpsiLNu.add_particle(thebc  )
-    thejpsi_idx = Bc2JpsiLNu.add_particle(thejpsi)
-    thetau_idx   = Bc2JpsiLNu.add_particle(thetau  )
-    thenutau_idx   = Bc2JpsiLNu.add_particle(thenutau  )
-
-    # define decay vertex
-    Bc2JpsiLNu.add_vertex(thebc_idx, [thejpsi_idx, thetau_idx, thenutau_idx])
-
-    # save process id to later retrieve the per-event weight
-    pid = ham.add_process(Bc2JpsiLNu)
-    pids.append(pid)
-
-    ham.process_event()
-    for k in ff_schemes.keys():
-            weights[k].append(ham.get_weight(k))
-    
-    if i>maxevents: break
-
-reduced_tree = tree_df[:len(weights[k])].copy()
-for k in ff_schemes.keys():
-        reduced_tree['hammer_'+k] = np.nan_to_num(np.array(weights[k])) 
+# the selected events among the first maxevents entries (all with -1)
+tree_df = read_root(fname, 'tree', where='is_jpsi_tau & is3m & ismu3fromtau & bhad_pdgid == 541', stop=maxevents if maxevents>=0 else None)
+
+# weights already in the cache, NaN for the ones to compute
+eigenvectors = dict(('bglvar_e%d%s'%(i,j), variations['e%d'%i][j]) for i, j in product(range(11), ['up', 'down']))
+if tensor_mode:
+    eigenvectors.update(point_eigenvectors(points, variations))
+cache = WeightCache('bc_jpsi_tau', cache_dir)
+signatures = scheme_signatures(ff_schemes, ff_input_scheme, 'BcJpsiTauNu', eigenvectors)
+# the inputs of Hammer for all the events, the key of each event in the cache is computed from them (see vectorizer.py)
+particles = bc_jpsi_lnu(tree_df, 'bhad', 'jpsi', 'tau', bc_pdgid=tree_df.bhad_pdgid, lepton_pdgid=-15, neutrino_pdgid=16)
+keys = event_keys(tree_df.run, tree_df.lumi, tree_df.event, particles)
+weights, todo, compute_schemes = cache.lookup(keys, signatures)
+
+if len(compute_schemes):
+    for k in compute_schemes:
+        ham.add_ff_scheme(k, ff_schemes[k])
+    ham.set_units("GeV")
+    ham.init_run()
+
+    for i, j in product(range(11), ['up', 'down']):
+        unc = 'e%d%s'%(i,j)
+        if 'bglvar_%s'%unc in compute_schemes:
+            ham.set_ff_eigenvectors('BctoJpsi', 'BGLVar_%s'%unc, variations['e%d'%i][j])
+    if tensor_mode:
+        set_eigenvectors(ham, [(k, theta) for k, theta in points if k in compute_schemes], variations)
+
+# only the events not in the cache, the processes built at once from the columns (see vectorizer.py)
+bc, jpsi, lepton, neutrino = take(particles, todo)
+new_weights = evaluate(ham, build_processes(bc, [jpsi, lepton, neutrino]), compute_schemes, np.count_nonzero(todo))
+for k in compute_schemes:
+    weights[k][todo] = new_weights[k]
+
+# the new weights go to the cache
+cache.add(keys[todo], new_weights, signatures)
+cache.save()
+
+reduced_tree = tree_df.copy()
+for k in tree_schemes:
+        reduced_tree['hammer_'+k] = np.nan_to_num(weights[k])
 to_root(reduced_tree, 'hammer_output_tau_v2.root', key='tree')
+if tensor_mode:
+    tensors = tensors_from_weights(weights)
+    print('largest relative difference of the tensor weights at the check point: %s' %check_tensors(tensors, weights))
+    # one row per entry of the output tree
+    save_tensors('hammer_output_tau_v2_tensor.npz', tensors)
 
@@ -18,6 +18,8 @@ from DataFormats.FWLite import Events, Handle
 from PhysicsTools.HeppyCore.utils.deltar import deltaR, deltaPhi
 # https://pypi.org/project/particle/
 from particle import Particle
+from ancestry import AncestryIndex
+from tree_writer import TreeWriter, inspector_types
 
 parser = argparse.ArgumentParser(description='')
 parser.add_argument('--files_per_job', dest='files_per_job', default=2    , type=int)
@@ -88,7 +90,8 @@ def isAncestor(a, p):
             return True
     return False
 
-def printAncestors(particle, ancestors=[], verbose=True):
+def printAncestors(particle, ancestors=None, verbose=True):
+    ancestors = [] if ancestors is None else ancestors
     for i in xrange(0, particle.numberOfMothers()):
         mum = particle.mother(i)
 #         if mum is None: import pdb ; pdb.set_trace()
@@ -215,8 +218,7 @@ branches = [
 
 ]
 
-fout = ROOT.TFile('%s/inspector_output_mu_v1.root' %(destination), 'recreate')
-ntuple = ROOT.TNtuple('tree', 'tree', ':'.join(branches))
+writer = TreeWriter('%s/inspector_output_mu_v1.root' %(destination), branches, types = inspector_types(branches))
 tofill = OrderedDict(zip(branches, [np.nan]*len(branches)))
 
 start = time()
@@ -240,6 +242,9 @@ for i, event in enumerate(events):
 
     event.qscale = event.genInfo.qScale()
     if verbose: print('=========>')
+    # ancestry of the gen particles, computed once for the event
+    ancestry = AncestryIndex(event.genp)
+
     jpsis = [ip for ip in event.genp if abs(ip.pdgId())==443]
     
     bs =  [ip for ip in event.genp if (abs(ip.pdgId())>500 and abs(ip.pdgId())<600) or (abs(ip.pdgId())>5000 and abs(ip.pdgId())<6000)]
@@ -262,7 +267,7 @@ for i, event in enumerate(events):
         if verbose: print('\t%s %s pt %3.2f,\t genealogy: ' %(Particle.from_pdgid(jpsi.pdgId()), str(daus), jpsi.pt()), end='')
         ancestors = []
         if verbose: print('\t', printAncestors(jpsi, ancestors, verbose=True))
-        else: printAncestors(jpsi, ancestors, verbose=False)
+        else: ancestors = ancestry.ancestors(jpsi)
         
         # only save jpsi->mumu
         if sum([abs(dau)==13 for dau in daus])<2: continue
@@ -315,7 +320,7 @@ for i, event in enumerate(events):
         final_state_muons = [ip for ip in event.genp if abs(ip.pdgId())==13 and ip.status()==1]
         tofill['is3m'      ] = len(final_state_muons)>=3
 
-        jpsi_muons = [imu for imu in final_state_muons if isAncestor(jpsi, imu)]
+        jpsi_muons = [imu for imu in final_state_muons if ancestry.is_ancestor(jpsi, imu)]
         jpsi_muons.sort(key = lambda x : x.pt(), reverse = True)
         if len(jpsi_muons)<2:
             continue
@@ -456,7 +461,7 @@ for i, event in enumerate(events):
 
         # fill only if it comes from  a Bc
         if abs(first_ancestor.pdgId()) in [541, 543]:
-            ntuple.Fill(array('f', tofill.values()))
+            writer.fill(tofill)
 
     if verbose:
         if len(bs)>1: # and len(jpsis)>1:
@@ -479,7 +484,5 @@ for i, event in enumerate(events):
                 if abs(ij.daughter(0).pdgId())!=13:
                     pass
     
-fout.cd()
-ntuple.Write()
-fout.Close()
+writer.close()
     
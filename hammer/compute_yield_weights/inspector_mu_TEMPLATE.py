@@ -19,6 +19,8 @@ from DataFormats.FWLite import Events, Handle
 from PhysicsTools.HeppyCore.utils.deltar import deltaR, deltaPhi
 # https://pypi.org/project/particle/
 from particle import Particle
+from ancestry import AncestryIndex
+from tree_writer import TreeWriter, inspector_types
 
 parser = argparse.ArgumentParser(description='')
 parser.add_argument('--files_per_job', dest='files_per_job', default=2    , type=int)
@@ -97,7 +99,8 @@ def isAncestor(a, p):
             return True
     return False
 
-def printAncestors(particle, ancestors=[], verbose=True):
+def printAncestors(particle, ancestors=None, verbose=True):
+    ancestors = [] if ancestors is None else ancestors
     for i in xrange(0, particle.numberOfMothers()):
         mum = particle.mother(i)
 #         if mum is None: import pdb ; pdb.set_trace()
@@ -223,23 +226,28 @@ branches = [
 
 ]
 
-fout = ROOT.TFile('HOOK_FILE_OUT', 'recreate')
-ntuple = ROOT.TNtuple('tree', 'tree', ':'.join(branches))
+writer = TreeWriter('HOOK_FILE_OUT', branches, types = inspector_types(branches))
 tofill = OrderedDict(zip(branches, [np.nan]*len(branches)))
 
 start = time()
-maxevents = maxevents if maxevents>=0 else events.size() # total number of events in the files
+maxevents = maxevents if maxevents>=0 else events.size()-skip_events # events of this job
+last_event = min(skip_events+maxevents, events.size())
 
-for i,event in enumerate(events, start=skip_events):
+def event_range(events, first, last):
+    '''
+    FWLite events from entry first to last (excluded): the work unit of this job (see sharding.py)
+    '''
+    for i in range(first, last):
+        events.to(i)
+        yield i, events
 
-    if (i+1)>maxevents+skip_events:
-        break
-        
-    if i%1000==0 or i == skip_events:
-        percentage = float(i)/(maxevents)*100.
-        speed = float(i)/(time()-start)
-        eta = datetime.now() + timedelta(seconds=(maxevents-i) / max(0.1, speed))
-        print('\t===> processing %d / %d event \t completed %.1f%s \t %.1f ev/s \t ETA %s s' %(i, maxevents, percentage, '%', speed, eta.strftime('%Y-%m-%d %H:%M:%S')))
+for i, event in event_range(events, skip_events, last_event):
+
+    if (i-skip_events)%1000==0:
+        percentage = float(i-skip_events)/maxevents*100.
+        speed = float(i-skip_events)/(time()-start)
+        eta = datetime.now() + timedelta(seconds=(last_event-i) / max(0.1, speed))
+        print('\t===> processing %d / %d event \t completed %.1f%s \t %.1f ev/s \t ETA %s s' %(i-skip_events, maxevents, percentage, '%', speed, eta.strftime('%Y-%m-%d %H:%M:%S')))
 
     # access the handles
     for k, v in handles.iteritems():
@@ -248,6 +256,9 @@ for i,event in enumerate(events, start=skip_events):
 
     event.qscale = event.genInfo.qScale()
     if verbose: print('=========>')
+    # ancestry of the gen particles, computed once for the event
+    ancestry = AncestryIndex(event.genp)
+
     jpsis = [ip for ip in event.genp if abs(ip.pdgId())==443]
     
     bs =  [ip for ip in event.genp if (abs(ip.pdgId())>500 and abs(ip.pdgId())<600) or (abs(ip.pdgId())>5000 and abs(ip.pdgId())<6000)]
@@ -270,7 +281,7 @@ for i,event in enumerate(events, start=skip_events):
         if verbose: print('\t%s %s pt %3.2f,\t genealogy: ' %(Particle.from_pdgid(jpsi.pdgId()), str(daus), jpsi.pt()), end='')
         ancestors = []
         if verbose: print('\t', printAncestors(jpsi, ancestors, verbose=True))
-        else: printAncestors(jpsi, ancestors, verbose=False)
+        else: ancestors = ancestry.ancestors(jpsi)
         
         # only save jpsi->mumu
         if sum([abs(dau)==13 for dau in daus])<2: continue
@@ -323,7 +334,7 @@ for i,event in enumerate(events, start=skip_events):
         final_state_muons = [ip for ip in event.genp if abs(ip.pdgId())==13 and ip.status()==1]
         tofill['is3m'      ] = len(final_state_muons)>=3
 
-        jpsi_muons = [imu for imu in final_state_muons if isAncestor(jpsi, imu)]
+        jpsi_muons = [imu for imu in final_state_muons if ancestry.is_ancestor(jpsi, imu)]
         jpsi_muons.sort(key = lambda x : x.pt(), reverse = True)
         if len(jpsi_muons)<2:
             continue
@@ -464,7 +475,7 @@ for i,event in enumerate(events, start=skip_events):
 
         # fill only if it comes from  a Bc
         if abs(first_ancestor.pdgId()) in [541, 543]:
-            ntuple.Fill(array('f', tofill.values()))
+            writer.fill(tofill)
 
     if verbose:
         if len(bs)>1: # and len(jpsis)>1:
@@ -487,8 +498,6 @@ for i,event in enumerate(events, start=skip_events):
                 if abs(ij.daughter(0).pdgId())!=13:
                     pass
     
-fout.cd()
-ntuple.Write()
-fout.Close()
+writer.close()
 print("Success!")        
 print("File HOOK_FILE_OUT saved!" )    
@@ -17,6 +17,8 @@ from DataFormats.FWLite import Events, Handle
 from PhysicsTools.HeppyCore.utils.deltar import deltaR, deltaPhi
 # https://pypi.org/project/particle/
 from particle import Particle
+from ancestry import AncestryIndex
+from tree_writer import TreeWriter, inspector_types
 
 
 parser = argparse.ArgumentParser(description='')
@@ -89,7 +91,8 @@ def isAncestor(a, p):
             return True
     return False
 
-def printAncestors(particle, ancestors=[], verbose=True):
+def printAncestors(particle, ancestors=None, verbose=True):
+    ancestors = [] if ancestors is None else ancestors
     for i in xrange(0, particle.numberOfMothers()):
         mum = particle.mother(i)
         if abs(mum.pdgId())<8 or abs(mum.pdgId())==21: continue
@@ -251,8 +254,7 @@ branches = [
 ]
 
 #output file
-fout = ROOT.TFile('%s/inspector_output_tau_v1.root' %(destination), 'recreate')
-ntuple = ROOT.TNtuple('tree', 'tree', ':'.join(branches))
+writer = TreeWriter('%s/inspector_output_tau_v1.root' %(destination), branches, types = inspector_types(branches))
 tofill = OrderedDict(zip(branches, [np.nan]*len(branches)))
 
 start = time()
@@ -276,6 +278,9 @@ for i, event in enumerate(events):
    
     if verbose: print('=========>')
     
+    # ancestry of the gen particles, computed once for the event
+    ancestry = AncestryIndex(event.genp)
+
     jpsis = [ip for ip in event.genp if abs(ip.pdgId())==443]    
     bs =  [ip for ip in event.genp if (abs(ip.pdgId())>500 and abs(ip.pdgId())<600) or (abs(ip.pdgId())>5000 and abs(ip.pdgId())<6000)]
     muons =  [ip for ip in event.genp if abs(ip.pdgId())==13 and ip.status()==1]
@@ -311,7 +316,7 @@ for i, event in enumerate(events):
         #jpsi ancestors
         ancestors = []
         if verbose: print('\t', printAncestors(jpsi, ancestors, verbose=True))
-        else: printAncestors(jpsi, ancestors, verbose=False)
+        else: ancestors = ancestry.ancestors(jpsi)
         
         # only save jpsi->mumu
         if sum([abs(dau)==13 for dau in daus])<2: continue
@@ -364,7 +369,7 @@ for i, event in enumerate(events):
         final_state_muons = [ip for ip in event.genp if abs(ip.pdgId())==13 and ip.status()==1]
         tofill['is3m'      ] = len(final_state_muons)>=3
 
-        jpsi_muons = [imu for imu in final_state_muons if isAncestor(jpsi, imu)]
+        jpsi_muons = [imu for imu in final_state_muons if ancestry.is_ancestor(jpsi, imu)]
         jpsi_muons.sort(key = lambda x : x.pt(), reverse = True)
         if len(jpsi_muons)<2:
             continue
@@ -473,12 +478,12 @@ for i, event in enumerate(events):
                 if(final_daus==[15, 16, 443]):
                     taus =  [ip for ip in event.genp if abs(ip.pdgId())==15 and ip.status()==2]
                     nutaus = [ip for ip in event.genp if abs(ip.pdgId())==16]# and ip.status()==1]
-                    tau_frombc =[itau for itau in taus if isAncestor(first_ancestor,itau)]
+                    tau_frombc =[itau for itau in taus if ancestry.is_ancestor(first_ancestor,itau)]
                     if(len(tau_frombc)>1):
                         #I take the one with highest pt
                         tau_frombc.sort(key = lambda x : x.pt(), reverse = True)
-                    extra_mu_fromtau = [imu for imu in final_state_muons_non_jpsi if isAncestor(tau_frombc[0],imu)]
-                    nutau_fromtau = [inu for inu in nutaus if isAncestor(tau_frombc[0],inu)]
+                    extra_mu_fromtau = [imu for imu in final_state_muons_non_jpsi if ancestry.is_ancestor(tau_frombc[0],imu)]
+                    nutau_fromtau = [inu for inu in nutaus if ancestry.is_ancestor(tau_frombc[0],inu)]
 
                     tofill['tau_pt' ] = tau_frombc[0].pt()
                     tofill['tau_eta'] = tau_frombc[0].eta()
@@ -553,7 +558,7 @@ for i, event in enumerate(events):
             
         # fill only if it comes from  a Bc
         if abs(first_ancestor.pdgId()) in [541, 543]:
-            ntuple.Fill(array('f', tofill.values()))
+            writer.fill(tofill)
 
     if verbose:
         if len(bs)>1: # and len(jpsis)>1:
@@ -576,7 +581,5 @@ for i, event in enumerate(events):
                 if abs(ij.daughter(0).pdgId())!=13:
                     pass
     
-fout.cd()
-ntuple.Write()
-fout.Close()
+writer.close()
     
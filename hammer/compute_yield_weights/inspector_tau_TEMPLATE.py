@@ -12,6 +12,8 @@ from DataFormats.FWLite import Events, Handle
 from PhysicsTools.HeppyCore.utils.deltar import deltaR, deltaPhi
 # https://pypi.org/project/particle/
 from particle import Particle
+from ancestry import AncestryIndex
+from tree_writer import TreeWriter, inspector_types
 
 
 parser = argparse.ArgumentParser(description='')
@@ -32,6 +34,8 @@ maxevents     = args.maxevents
 is_miniaod    = args.is_miniaod
 
 files = HOOK_FILE_IN
+skip_events = HOOK_SKIP_EVENTS
+maxevents = HOOK_MAX_EVENTS
 
 '''files = glob('/pnfs/psi.ch/cms/trivcat/store/user/friti/HOOK_INPUT/*.root')
 files.sort()
@@ -92,7 +96,8 @@ def isAncestor(a, p):
             return True
     return False
 
-def printAncestors(particle, ancestors=[], verbose=True):
+def printAncestors(particle, ancestors=None, verbose=True):
+    ancestors = [] if ancestors is None else ancestors
     for i in xrange(0, particle.numberOfMothers()):
         mum = particle.mother(i)
 #         if mum is None: import pdb ; pdb.set_trace()
@@ -234,22 +239,28 @@ branches = [
     'weight',
 ]
 
-fout = ROOT.TFile('HOOK_FILE_OUT', 'recreate')
-ntuple = ROOT.TNtuple('tree', 'tree', ':'.join(branches))
+writer = TreeWriter('HOOK_FILE_OUT', branches, types = inspector_types(branches))
 tofill = OrderedDict(zip(branches, [np.nan]*len(branches)))
 
 start = time()
-maxevents = maxevents if maxevents>=0 else events.size() # total number of events in the files
+maxevents = maxevents if maxevents>=0 else events.size()-skip_events # events of this job
+last_event = min(skip_events+maxevents, events.size())
 
-for i, event in enumerate(events):
-    if (i+1)>maxevents:
-        break
-        
-    if i%1000==0:
-        percentage = float(i)/maxevents*100.
-        speed = float(i)/(time()-start)
-        eta = datetime.now() + timedelta(seconds=(maxevents-i) / max(0.1, speed))
-        print('\t===> processing %d / %d event \t completed %.1f%s \t %.1f ev/s \t ETA %s s' %(i, maxevents, percentage, '%', speed, eta.strftime('%Y-%m-%d %H:%M:%S')))
+def event_range(events, first, last):
+    '''
+    FWLite events from entry first to last (excluded): the work unit of this job (see sharding.py)
+    '''
+    for i in range(first, last):
+        events.to(i)
+        yield i, events
+
+for i, event in event_range(events, skip_events, last_event):
+
+    if (i-skip_events)%1000==0:
+        percentage = float(i-skip_events)/maxevents*100.
+        speed = float(i-skip_events)/(time()-start)
+        eta = datetime.now() + timedelta(seconds=(last_event-i) / max(0.1, speed))
+        print('\t===> processing %d / %d event \t completed %.1f%s \t %.1f ev/s \t ETA %s s' %(i-skip_events, maxevents, percentage, '%', speed, eta.strftime('%Y-%m-%d %H:%M:%S')))
 
     # access the handles
     for k, v in handles.iteritems():
@@ -259,6 +270,9 @@ for i, event in enumerate(events):
    
     if verbose: print('=========>')
     
+    # ancestry of the gen particles, computed once for the event
+    ancestry = AncestryIndex(event.genp)
+
     jpsis = [ip for ip in event.genp if abs(ip.pdgId())==443]    
     bs =  [ip for ip in event.genp if (abs(ip.pdgId())>500 and abs(ip.pdgId())<600) or (abs(ip.pdgId())>5000 and abs(ip.pdgId())<6000)]
     muons =  [ip for ip in event.genp if abs(ip.pdgId())==13 and ip.status()==1]
@@ -277,7 +291,7 @@ for i, event in enumerate(events):
         if verbose: print('\t%s %s pt %3.2f,\t genealogy: ' %(Particle.from_pdgid(jpsi.pdgId()), str(daus), jpsi.pt()), end='')
         ancestors = []
         if verbose: print('\t', printAncestors(jpsi, ancestors, verbose=True))
-        else: printAncestors(jpsi, ancestors, verbose=False)
+        else: ancestors = ancestry.ancestors(jpsi)
         
         # only save jpsi->mumu
         if sum([abs(dau)==13 for dau in daus])<2: continue
@@ -332,7 +346,7 @@ for i, event in enumerate(events):
         final_state_muons = [ip for ip in event.genp if abs(ip.pdgId())==13 and ip.status()==1]
         tofill['is3m'      ] = len(final_state_muons)>=3
 
-        jpsi_muons = [imu for imu in final_state_muons if isAncestor(jpsi, imu)]
+        jpsi_muons = [imu for imu in final_state_muons if ancestry.is_ancestor(jpsi, imu)]
         jpsi_muons.sort(key = lambda x : x.pt(), reverse = True)
         if len(jpsi_muons)<2:
             continue
@@ -439,12 +453,12 @@ for i, event in enumerate(events):
                 if(final_daus==[15, 16, 443]):
                     taus =  [ip for ip in event.genp if abs(ip.pdgId())==15 and ip.status()==2]
                     nutaus = [ip for ip in event.genp if abs(ip.pdgId())==16]# and ip.status()==1]
-                    tau_frombc =[itau for itau in taus if isAncestor(first_ancestor,itau)]
+                    tau_frombc =[itau for itau in taus if ancestry.is_ancestor(first_ancestor,itau)]
                     if(len(tau_frombc)>1):
                         #I take the one with highest pt
                         tau_frombc.sort(key = lambda x : x.pt(), reverse = True)
-                    extra_mu_fromtau = [imu for imu in final_state_muons_non_jpsi if isAncestor(tau_frombc[0],imu)]
-                    nutau_fromtau = [inu for inu in nutaus if isAncestor(tau_frombc[0],inu)]
+                    extra_mu_fromtau = [imu for imu in final_state_muons_non_jpsi if ancestry.is_ancestor(tau_frombc[0],imu)]
+                    nutau_fromtau = [inu for inu in nutaus if ancestry.is_ancestor(tau_frombc[0],inu)]
 
                     tofill['tau_pt' ] = tau_frombc[0].pt()
                     tofill['tau_eta'] = tau_frombc[0].eta()
@@ -519,7 +533,7 @@ for i, event in enumerate(events):
             
         # fill only if it comes from  a Bc
         if abs(first_ancestor.pdgId()) in [541, 543]:
-            ntuple.Fill(array('f', tofill.values()))
+            writer.fill(tofill)
 
     if verbose:
         if len(bs)>1: # and len(jpsis)>1:
@@ -542,9 +556,7 @@ for i, event in enumerate(events):
                 if abs(ij.daughter(0).pdgId())!=13:
                     pass
     
-fout.cd()
-ntuple.Write()
-fout.Close()
+writer.close()
     
 print("Success!")        
 print("File HOOK_FILE_OUT saved!" )
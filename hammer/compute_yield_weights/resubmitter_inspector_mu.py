@@ -18,6 +18,9 @@ for file in files_done:
 
 template_inspector = "inspector_mu_TEMPLATE.py"
 template_fileout = "RJpsi_inspector_bc_mu_TEMPLATE.root"
+# the templates import ancestry.py and tree_writer.py from the job directory
+os.system('cp ancestry.py '+out_dir+'/.')
+os.system('cp tree_writer.py '+out_dir+'/.')
 
 ##########################################################################################
 ##########################################################################################
@@ -0,0 +1,112 @@
+'''
+Inspector campaign on a single machine: the same work units and job scripts as submitter_inspector_general.py,
+run on a pool of local processes instead of the batch system, and merged in the order of the units.
+
+The inputs are files, globs or text files with one file per line (any mix, in the order given):
+    python run_inspector_local.py --template inspector_mu_TEMPLATE.py --files '/data/BcToJpsiMuNu_GEN_*.root' --out_dir insp_mu --target insp_mu.root
+Each job writes <output>.tmp and renames it when the inspector ends without errors, so running the same command
+again (same inputs) only runs the units that failed or did not run, and merges when all the outputs are there.
+'''
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+from glob import glob
+from argparse import ArgumentParser
+from multiprocessing import cpu_count
+from sharding import make_units, write_manifest, read_manifest, run_local, merge_outputs, manifest_name
+
+# the template and the modules it imports are next to this script, wherever it is run from
+here = os.path.dirname(os.path.abspath(__file__))
+helpers = ['ancestry.py', 'tree_writer.py']
+
+def input_files(inputs):
+    '''
+    Files of the inputs, the globs sorted, without repetitions
+    '''
+    files = []
+    seen = set()
+    for item in inputs:
+        if item.endswith('.txt'):
+            with open(item) as fh:
+                names = [line.strip() for line in fh if line.strip() and not line.strip().startswith('#')]
+        elif any(c in item for c in '*?['):
+            names = sorted(glob(item))
+        else:
+            names = [item]
+        for name in names:
+            if name in seen: continue
+            seen.add(name)
+            files.append(name)
+    return files
+
+def write_job(template, out_dir, ijob, unit, output):
+    '''
+    Inspector of the unit (HOOK_* of the template) and the job script, that renames the output only if it succeeds
+    '''
+    file_in, first_entry, last_entry = unit
+    inspector = os.path.basename(template).replace('TEMPLATE', 'chunk%d' %ijob)
+    with open(template) as fin, open(os.path.join(out_dir, inspector), 'w') as fout:
+        for line in fin:
+            if   'HOOK_FILE_IN'     in line: line = line.replace('HOOK_FILE_IN'    , str([file_in]))
+            elif 'HOOK_MAX_EVENTS'  in line: line = line.replace('HOOK_MAX_EVENTS' , '%d' %(last_entry - first_entry))
+            elif 'HOOK_SKIP_EVENTS' in line: line = line.replace('HOOK_SKIP_EVENTS', '%d' %first_entry)
+            elif 'HOOK_FILE_OUT'    in line: line = line.replace('HOOK_FILE_OUT'   , output + '.tmp')
+            fout.write(line)
+
+    script = os.path.join(out_dir, 'job_chunk%d.sh' %ijob)
+    with open(script, 'w') as fh:
+        fh.write('\n'.join([
+            '#!/bin/bash',
+            'cd %s' %out_dir,
+            '%s %s || exit $?' %(sys.executable, inspector),
+            'mv %s.tmp %s' %(output, output),
+            '',
+        ]))
+    return script
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--template'       , default = os.path.join(here, 'inspector_mu_TEMPLATE.py'), help = 'inspector with the HOOK_* of the submitters')
+    parser.add_argument('--files'          , nargs = '+', required = True, help = 'GEN files, globs or text files with one file per line')
+    parser.add_argument('--out_dir'        , required = True, help = 'directory of the jobs and of their outputs')
+    parser.add_argument('--target'         , default = None, help = 'merged root file, none if not given')
+    parser.add_argument('--workers'        , type = int, default = cpu_count())
+    parser.add_argument('--events_per_unit', type = int, default = 20000)
+    args = parser.parse_args()
+
+    out_dir = os.path.abspath(args.out_dir)
+    os.system('mkdir -p %s' %out_dir)
+    # a missing helper fails here, not in every job
+    for helper in helpers:
+        shutil.copy(os.path.join(here, helper), out_dir)
+
+    files = input_files(args.files)
+    if not files:
+        sys.exit('no input files')
+    units = make_units(files, args.events_per_unit, tree = 'Events')
+    stem = os.path.basename(args.template).replace('_TEMPLATE.py', '')
+    outputs = ['%s_%d.root' %(stem, ijob) for ijob in range(len(units))]
+    write_manifest(out_dir, units, outputs)
+
+    scripts = []
+    for ijob, (unit, output) in enumerate(zip(units, outputs)):
+        script = write_job(args.template, out_dir, ijob, unit, output)
+        # already done by a previous run
+        if os.path.exists(os.path.join(out_dir, output)): continue
+        scripts.append(script)
+    print('%d units, %d to run on %d workers' %(len(units), len(scripts), args.workers))
+
+    failed = run_local(scripts, args.workers)
+    failed_list = os.path.join(out_dir, 'failed.txt')
+    if os.path.exists(failed_list):
+        os.remove(failed_list)
+    if failed:
+        with open(failed_list, 'w') as fh:
+            fh.write('\n'.join(failed) + '\n')
+        print('logs of the failed jobs next to their scripts, listed in %s/failed.txt; run the same command again to retry them' %out_dir)
+
+    if args.target and not failed:
+        merge_outputs(read_manifest(os.path.join(out_dir, manifest_name)), args.target, out_dir)
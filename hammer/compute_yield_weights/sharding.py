@@ -0,0 +1,163 @@
+'''
+Sharding of the inputs of the batch jobs (inspector, hammer) in balanced work units.
+
+A work unit is (file, first entry, last entry): each file is split in ranges of about events_per_unit entries,
+so that one large file does not make its job much slower than the others, and the wall time of a campaign
+is set by the mean work unit instead of the largest file.
+The entries of the local files are counted once and cached in a json file (keyed by path, size and modification time),
+the remote ones (root://...) are counted at each call.
+
+In the submitters:
+    units = make_units(files, events_per_unit, tree = 'Events')
+    write_manifest(out_dir, units, outputs)
+    ... one job per unit, the template gets the file and the entry range through HOOK_FILE_IN, HOOK_SKIP_EVENTS, HOOK_MAX_EVENTS ...
+    run_local(scripts, workers)   # or sbatch, as before
+When the jobs are done, the outputs are merged in the order of the units:
+    python sharding.py --manifest <out_dir>/units.json --outputs_dir /pnfs/.../<out_dir> --target merged.root
+'''
+
+from __future__ import print_function
+import os
+import json
+import math
+import subprocess
+from time import time
+from multiprocessing import Pool
+from argparse import ArgumentParser
+
+entries_cache = 'entries_cache.json'
+manifest_name = 'units.json'
+
+def _is_local(path):
+    return '://' not in path
+
+def _signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+def count_entries(path, tree):
+    import ROOT
+    f = ROOT.TFile.Open(path)
+    t = f.Get(tree) if f else None
+    entries = int(t.GetEntries()) if t else 0
+    if f: f.Close()
+    return entries
+
+def entry_counts(files, tree, cache = entries_cache):
+    '''
+    dict file -> number of entries of tree, counted only for the files not (or changed since) in the cache
+    '''
+    cached = dict()
+    if cache and os.path.exists(cache):
+        with open(cache) as fh:
+            cached = json.load(fh)
+    counts = dict()
+    changed = False
+    for path in files:
+        if not _is_local(path):
+            # root://, ... : no size and modification time to validate the cache, counted every time
+            counts[path] = count_entries(path, tree)
+            continue
+        key = '%s:%s' %(path, tree)
+        signature = _signature(path)
+        if key in cached and cached[key]['signature'] == signature:
+            counts[path] = cached[key]['entries']
+            continue
+        counts[path] = count_entries(path, tree)
+        cached[key] = dict(signature = signature, entries = counts[path])
+        changed = True
+    if cache and changed:
+        with open(cache + '.tmp', 'w') as fh:
+            json.dump(cached, fh, indent = 1, sort_keys = True)
+        os.rename(cache + '.tmp', cache)
+    return counts
+
+def split_entries(entries, events_per_unit):
+    '''
+    [(first, last)] ranges of about the same size, none larger than events_per_unit
+    '''
+    nunits = max(1, int(math.ceil(float(entries) / events_per_unit)))
+    edges = [int(round(float(entries) * i / nunits)) for i in range(nunits + 1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+def make_units(files, events_per_unit, tree = 'Events', cache = entries_cache):
+    '''
+    Work units (file, first entry, last entry excluded) of the files, in order. Empty files are dropped
+    '''
+    counts = entry_counts(files, tree, cache)
+    units = []
+    for path in files:
+        if counts[path] == 0:
+            print('no entries in %s, skipped' %path)
+            continue
+        for first, last in split_entries(counts[path], events_per_unit):
+            units.append((path, first, last))
+    print('%d files, %d entries, %d work units' %(len(files), sum(counts.values()), len(units)))
+    return units
+
+def write_manifest(out_dir, units, outputs):
+    '''
+    The units and the output file of each one, in the order of the merge
+    '''
+    manifest = [dict(file = path, first = first, last = last, output = output) for (path, first, last), output in zip(units, outputs)]
+    with open(os.path.join(out_dir, manifest_name), 'w') as fh:
+        json.dump(manifest, fh, indent = 1)
+
+def read_manifest(path):
+    with open(path) as fh:
+        return json.load(fh)
+
+def _run(script):
+    start = time()
+    with open(script.replace('.sh', '.log'), 'w') as log:
+        code = subprocess.call(['bash', script], stdout = log, stderr = subprocess.STDOUT)
+    return script, code, time() - start
+
+def run_local(scripts, workers = 4):
+    '''
+    Runs the job scripts on a local pool instead of the batch system, printing each job when it ends,
+    returns the failed ones (the log of each job is next to its script)
+    '''
+    pool = Pool(workers)
+    codes = dict()
+    start = time()
+    for script, code, seconds in pool.imap_unordered(_run, scripts):
+        codes[script] = code
+        done = len(codes)
+        nfailed = sum(c != 0 for c in codes.values())
+        eta = (time() - start) / done * (len(scripts) - done)
+        print('[%d/%d] %s %s in %.0f s, %d failed, ETA %.0f s' %(done, len(scripts), script, 'done' if code == 0 else 'FAILED (%d)' %code, seconds, nfailed, eta))
+    pool.close()
+    pool.join()
+    failed = [script for script in scripts if codes[script] != 0]
+    print('%d jobs done, %d failed' %(len(scripts), len(failed)))
+    for script in failed:
+        print('\tfailed: ' + script)
+    return failed
+
+def merge_outputs(manifest, target, outputs_dir = '.', tree = 'tree'):
+    '''
+    hadd of the outputs in the order of the units. Nothing is merged if some output is missing
+    '''
+    outputs = [os.path.join(outputs_dir, unit['output']) for unit in manifest]
+    missing = [output for output in outputs if not os.path.exists(output)]
+    if missing:
+        print('%d outputs missing, not merged:' %len(missing))
+        for output in missing:
+            print('\t' + output)
+        return False
+    code = os.system('hadd -f %s %s' %(target, ' '.join(outputs)))
+    if code == 0:
+        print('%s: %d entries from %d units' %(target, count_entries(target, tree), len(outputs)))
+    return code == 0
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--manifest'   , required = True, help = 'units.json written by the submitter')
+    parser.add_argument('--outputs_dir', default = '.', help = 'directory of the outputs of the jobs')
+    parser.add_argument('--target'     , required = True, help = 'merged root file')
+    parser.add_argument('--tree'       , default = 'tree')
+    args = parser.parse_args()
+
+    merge_outputs(read_manifest(args.manifest), args.target, args.outputs_dir, args.tree)
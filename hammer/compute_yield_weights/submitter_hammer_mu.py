@@ -13,16 +13,21 @@ process.RandomNumberGeneratorService.saveFileName =  cms.untracked.string("Rando
 '''
 import os
 from glob import glob
+from sharding import make_units, write_manifest, run_local
 
 
 files = glob('/pnfs/psi.ch/cms/trivcat/store/user/friti/Rjpsi_inspector_bc_mu_01Dec21_v1/*.root')
 print(files)
-nfiles = len(files)
+files.sort()
 out_dir = 'Rjpsi_hammer_mu_24jan22_v2'
-#keep files per job at 1, because the script does not support different
-files_per_job = 1
-njobs = int(nfiles/files_per_job)
-#njobs = 2
+# each job processes a range of entries of a file (work units of sharding.py, the empty files are dropped)
+events_per_unit = 50000
+# 'batch': sbatch, 'local': the job scripts on a pool of local_workers processes
+backend = 'batch'
+local_workers = 8
+
+units = make_units(files, events_per_unit, tree = 'tree')
+njobs = len(units)
 print(njobs," will be submitted")
 
 template_inspector = "hammer_mu_TEMPLATE_v2.py"
@@ -41,11 +46,16 @@ if not os.path.exists(out_dir):
     os.makedirs(out_dir + '/logs')
     os.makedirs(out_dir + '/errs')
 os.system('cp bgl_variations.py '+out_dir+'/.')
+os.system('cp hammer_cache.py '+out_dir+'/.')
+os.system('cp vectorizer.py '+out_dir+'/.')
+os.system('cp sharding.py '+out_dir+'/.')
 
 #os.system('cp files_HbToJPsiMuMu_3MuFilter_old.py ' + out_dir + '/.')
 #os.system('cp -r GeneratorInterface ' + out_dir + '/.')
 
-for ijob in range(njobs):
+write_manifest(out_dir, units, [template_fileout.replace('TEMPLATE', '%d'%ijob) for ijob in range(njobs)])
+scripts = []
+for ijob, (file_in, first_entry, last_entry) in enumerate(units):
 
     tmp_inspector = template_inspector.replace('TEMPLATE', 'chunk%d' %ijob)
     tmp_fileout = template_fileout.replace('TEMPLATE', '%d'%ijob)
@@ -57,9 +67,9 @@ for ijob in range(njobs):
     #for each line in the input file
     for line in fin:
         #read replace the string and write to output file
-        if   'HOOK_FILE_IN'    in line: fout.write(line.replace('HOOK_FILE_IN'   , files[ijob]))
-        elif   'HOOK_INPUT'    in line: fout.write(line.replace('HOOK_INPUT'   , "/Rjpsi_inspector_bc_mu_01Dec21_v1/"))
-        elif 'HOOK_MAX_EVENTS' in line: fout.write(line.replace('HOOK_MAX_EVENTS', '%d' %events_per_job))
+        if   'HOOK_FILE_IN'    in line: fout.write(line.replace('HOOK_FILE_IN'   , file_in))
+        elif 'HOOK_SKIP_EVENTS' in line: fout.write(line.replace('HOOK_SKIP_EVENTS', '%d' %first_entry))
+        elif 'HOOK_MAX_EVENTS' in line: fout.write(line.replace('HOOK_MAX_EVENTS', '%d' %(last_entry - first_entry)))
         elif 'HOOK_FILE_OUT'   in line: fout.write(line.replace('HOOK_FILE_OUT'  , '/scratch/friti/%s/%s' %(out_dir, tmp_fileout)))
         else: fout.write(line)
     #close input and output files
@@ -72,7 +82,7 @@ for ijob in range(njobs):
         'scramv1 runtime -sh',
         'mkdir -p /scratch/friti/{scratch_dir}',
         'ls /scratch/friti/',
-        'python {insp} --files_per_job 1 --jobid {jobid}',
+        'python {insp}',
         'xrdcp /scratch/friti/{scratch_dir}/{fout} root://t3dcachedb.psi.ch:1094////pnfs/psi.ch/cms/trivcat/store/user/friti/{se_dir}/{fout}',
         #'xrdcp /scratch/friti/{scratch_dir}/{fout} /pnfs/psi.ch/cms/trivcat/store/user/friti/{se_dir}/{fout}',
         'rm /scratch/friti/{scratch_dir}/{fout}',
@@ -82,14 +92,14 @@ for ijob in range(njobs):
         dir           = '/'.join([os.getcwd(), out_dir]), 
         scratch_dir   = out_dir, 
         insp           = tmp_inspector, 
-        files_per_job = files_per_job,
         se_dir        = out_dir,
-        jobid         = ijob,
         fout          = tmp_fileout
         )
 
     with open("%s/submitter_chunk%d.sh" %(out_dir, ijob), "wt") as flauncher: 
         flauncher.write(to_write)
+    scripts.append("%s/submitter_chunk%d.sh" %(out_dir, ijob))
+    if backend == 'local': continue
     
     command_sh_batch = ' '.join([
         'sbatch', 
@@ -104,3 +114,7 @@ for ijob in range(njobs):
     ])
 
     os.system(command_sh_batch)
+
+if backend == 'local':
+    run_local(scripts, local_workers)
+print("merge the outputs, in order, with: python sharding.py --manifest %s/units.json --outputs_dir /pnfs/psi.ch/cms/trivcat/store/user/friti/%s --target <merged file>" %(out_dir, out_dir))
@@ -3,6 +3,7 @@ Script to submit the inspector mu on the batch
 '''
 import os
 from glob import glob
+from sharding import make_units, write_manifest, run_local
 
 decay = 'mu'
 input_directory = '/RJPsi_Bc_GEN_23May22_v7/'
@@ -26,18 +27,23 @@ if not os.path.exists(out_dir):
     os.makedirs(out_dir + '/errs')
 #os.system('cp files_HbToJPsiMuMu_3MuFilter_old.py ' + out_dir + '/.')
 #os.system('cp -r GeneratorInterface ' + out_dir + '/.')
-events_per_job = -1
+os.system('cp sharding.py '+out_dir+'/.')
+os.system('cp ancestry.py '+out_dir+'/.')
+os.system('cp tree_writer.py '+out_dir+'/.')
 
-files_name = os.popen('ls /pnfs/psi.ch/cms/trivcat/store/user/friti/RJPsi_Bc_GEN_23May22_v7/')
-jobs = []
-for file in files_name:
-    ijob=file.split("_")[1]
-    if ijob not in jobs:
-        jobs.append(ijob)
+# each job processes a range of entries of a GEN file (work units of sharding.py)
+events_per_unit = 20000
+# 'batch': sbatch, 'local': the job scripts on a pool of local_workers processes
+backend = 'batch'
+local_workers = 8
 
-for ijob in jobs:
-    files = glob('/pnfs/psi.ch/cms/trivcat/store/user/friti/RJPsi_Bc_GEN_23May22_v7/RJpsi-BcToXToJpsiMuMu-RunIISummer19UL18GEN_%s_*.root'%ijob)
-    #print(str(files))
+files = sorted(glob('/pnfs/psi.ch/cms/trivcat/store/user/friti/RJPsi_Bc_GEN_23May22_v7/RJpsi-BcToXToJpsiMuMu-RunIISummer19UL18GEN_*.root'))
+units = make_units(files, events_per_unit, tree = 'Events')
+write_manifest(out_dir, units, [template_fileout.replace('TEMPLATE', '%d'%ijob) for ijob in range(len(units))])
+print(len(units)," will be submitted")
+
+scripts = []
+for ijob, (file_in, first_entry, last_entry) in enumerate(units):
     tmp_inspector = template_inspector.replace('TEMPLATE', 'chunk%s' %ijob)
     tmp_fileout = template_fileout.replace('TEMPLATE', '%s'%ijob)
     
@@ -48,10 +54,10 @@ for ijob in jobs:
     #for each line in the input file
     for line in fin:
         #read replace the string and write to output file
-        if   'HOOK_FILE_IN'    in line: fout.write(line.replace('HOOK_FILE_IN'   , str(files)))
+        if   'HOOK_FILE_IN'    in line: fout.write(line.replace('HOOK_FILE_IN'   , str([file_in])))
         elif   'HOOK_INPUT'    in line: fout.write(line.replace('HOOK_INPUT'   , input_directory))
-        elif 'HOOK_MAX_EVENTS' in line: fout.write(line.replace('HOOK_MAX_EVENTS', '%d' %events_per_job))
-        elif 'HOOK_SKIP_EVENTS' in line: fout.write(line.replace('HOOK_SKIP_EVENTS', '0' ))
+        elif 'HOOK_MAX_EVENTS' in line: fout.write(line.replace('HOOK_MAX_EVENTS', '%d' %(last_entry - first_entry)))
+        elif 'HOOK_SKIP_EVENTS' in line: fout.write(line.replace('HOOK_SKIP_EVENTS', '%d' %first_entry))
 
         elif 'HOOK_FILE_OUT'   in line: fout.write(line.replace('HOOK_FILE_OUT'  , '/scratch/friti/%s/%s' %(out_dir, tmp_fileout)))
         else: fout.write(line)
@@ -83,6 +89,8 @@ for ijob in jobs:
 
     with open("%s/submitter_chunk%s.sh" %(out_dir, ijob), "wt") as flauncher: 
         flauncher.write(to_write)
+    scripts.append("%s/submitter_chunk%s.sh" %(out_dir, ijob))
+    if backend == 'local': continue
     
     command_sh_batch = ' '.join([
         'sbatch', 
@@ -98,3 +106,6 @@ for ijob in jobs:
     print(command_sh_batch)
     os.system(command_sh_batch)
 
+if backend == 'local':
+    run_local(scripts, local_workers)
+print("merge the outputs, in order, with: python sharding.py --manifest %s/units.json --outputs_dir /pnfs/psi.ch/cms/trivcat/store/user/friti/%s --target <merged file>" %(out_dir, out_dir))
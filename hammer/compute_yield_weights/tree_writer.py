@@ -0,0 +1 @@
+../inspector/tree_writer.py
\ No newline at end of file
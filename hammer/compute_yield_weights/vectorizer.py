@@ -0,0 +1 @@
+../vectorizer.py
\ No newline at end of file
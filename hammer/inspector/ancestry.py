@@ -0,0 +1,105 @@
+'''
+Ancestry of the gen particles of one event, built once per event and memoized, for the inspectors.
+
+isAncestor walks all the mothers recursively for every (J/psi, muon), (b, tau), ... pair, and printAncestors
+does the same for every J/psi. Here the ancestors of each particle are a bitset (python int, one bit per index
+in the genParticles collection), computed once from the bitsets of its mothers, so that
+    ancestry = AncestryIndex(event.genp)
+    ancestry.is_ancestor(jpsi, mu)            isAncestor(jpsi, mu), constant time
+    ancestry.ancestors(jpsi)                  the list filled by printAncestors(jpsi, ancestors, verbose=False)
+    ancestry.first_common_ancestor(mu1, mu2)  the nearest common ancestor, None if there is none
+The particles are identified by their address (the mother references give the indices of the mothers).
+'''
+
+import ROOT
+
+def _address(obj):
+    if hasattr(ROOT, 'addressof'):
+        return ROOT.addressof(obj)
+    return ROOT.AddressOf(obj)[0]
+
+def _bits(x):
+    # indices of the bits set in x
+    while x:
+        low = x & -x
+        yield low.bit_length() - 1
+        x ^= low
+
+class AncestryIndex(object):
+
+    def __init__(self, genp):
+        self.genp = genp
+        self.particles = [ip for ip in genp]
+        self.index = dict((_address(ip), i) for i, ip in enumerate(self.particles))
+        self._mothers = [None] * len(self.particles)
+        self._ancestors = [None] * len(self.particles)
+        self._chains = dict()
+
+    def _index(self, particle):
+        return self.index[_address(particle)]
+
+    def mothers(self, i):
+        if self._mothers[i] is None:
+            ip = self.particles[i]
+            self._mothers[i] = [ip.motherRef(j).key() for j in range(ip.numberOfMothers())]
+        return self._mothers[i]
+
+    def ancestor_bits(self, i):
+        '''
+        Bitset of the ancestors of the particle of index i, without recursion (long chains of copies)
+        '''
+        stack = [i]
+        while stack:
+            j = stack[-1]
+            if self._ancestors[j] is not None:
+                stack.pop()
+                continue
+            todo = [m for m in self.mothers(j) if self._ancestors[m] is None]
+            if todo:
+                stack.extend(todo)
+                continue
+            bits = 0
+            for m in self.mothers(j):
+                bits |= (1 << m) | self._ancestors[m]
+            self._ancestors[j] = bits
+            stack.pop()
+        return self._ancestors[i]
+
+    def is_ancestor(self, a, p):
+        '''
+        As isAncestor(a, p): a is p or one of its ancestors
+        '''
+        ia, ip = self._index(a), self._index(p)
+        return ia == ip or bool((self.ancestor_bits(ip) >> ia) & 1)
+
+    def _valid(self, i):
+        # the mothers printAncestors keeps: no quarks and gluons, only last copies
+        pdgid = abs(self.particles[i].pdgId())
+        return pdgid >= 8 and pdgid != 21 and self.particles[i].isLastCopy()
+
+    def _chain(self, i):
+        if i not in self._chains:
+            chain = []
+            for m in self.mothers(i):
+                if not self._valid(m):
+                    continue
+                chain.append(m)
+                chain.extend(self._chain(m))
+            self._chains[i] = chain
+        return self._chains[i]
+
+    def ancestors(self, particle):
+        '''
+        New list of the ancestors of particle, in the order of printAncestors
+        '''
+        return [self.particles[m] for m in self._chain(self._index(particle))]
+
+    def first_common_ancestor(self, a, b):
+        '''
+        Common ancestor of a and b that is not an ancestor of another common ancestor (None if none)
+        '''
+        common = self.ancestor_bits(self._index(a)) & self.ancestor_bits(self._index(b))
+        for c in sorted(_bits(common), reverse = True):
+            if not any((self.ancestor_bits(d) >> c) & 1 for d in _bits(common) if d != c):
+                return self.particles[c]
+        return None
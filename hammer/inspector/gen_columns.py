@@ -0,0 +1,552 @@
+'''
+Two-stage running of the gen-level inspectors (inspector_mu.py, inspector_tau.py, evtgen/inspector.py).
+
+Stage 1, with the EDM files: the gen particles of each event are dumped once in flat columns
+    python inspector_mu.py --dump_gen gen_columns/kiselev_mu      ->  gen_columns/kiselev_mu_<n>.npz
+Stage 2, anywhere with numpy and ROOT: the J/psi candidates, the ancestry and all the branches of the inspector
+flat tree are computed on the arrays of all the events of a file at once, so the physics can be changed and rerun
+in seconds without the EDM files
+    python gen_columns.py --channel mu --input 'gen_columns/kiselev_mu_*.npz' --output flat_tree.root
+
+The channels are the three inspectors: mu and tau (Bc, hammer/inspector) and bplus (B+, evtgen).
+
+Columns of each file:
+    events     run, lumi, event, qscale, nparticles
+    particles  pdgid, status, pt, eta, phi, mass, charge, vx, vy, vz, last_copy, hard_process (all the events, in order)
+    links      nmothers, mothers, ndaughters, daughters: per particle counts and the flat indices in the event
+'''
+
+from __future__ import print_function, division
+import os
+from glob import glob
+from argparse import ArgumentParser
+from collections import OrderedDict
+import numpy as np
+
+event_columns = [
+    ('run'         , np.int64  ),
+    ('lumi'        , np.int64  ),
+    ('event'       , np.int64  ),
+    ('qscale'      , np.float64),
+    ('nparticles'  , np.int32  ),
+]
+
+particle_columns = [
+    ('pdgid'       , np.int32  ),
+    ('status'      , np.int16  ),
+    ('pt'          , np.float64),
+    ('eta'         , np.float64),
+    ('phi'         , np.float64),
+    ('mass'        , np.float64),
+    ('charge'      , np.int8   ),
+    ('vx'          , np.float64),
+    ('vy'          , np.float64),
+    ('vz'          , np.float64),
+    ('last_copy'   , np.bool_  ),
+    ('hard_process', np.bool_  ),
+]
+
+links = ['mothers', 'daughters']
+
+diquarks = [1103, 2101, 2103, 2203, 3101, 3103, 3201, 3203, 3303, 4101, 4103, 4201, 4203,
+            4301, 4303, 4403, 5101, 5103, 5201, 5203, 5301, 5303, 5401, 5403, 5503]
+
+class GenColumnWriter(object):
+    '''
+    Stage 1: gen particles of the events, written every events_per_file events in <prefix>_<n>.npz
+    '''
+    def __init__(self, prefix, events_per_file = 20000):
+        self.prefix = prefix
+        self.events_per_file = events_per_file
+        self.nfiles = 0
+        if os.path.dirname(prefix):
+            os.system('mkdir -p %s' %os.path.dirname(prefix))
+        self._reset()
+
+    def _reset(self):
+        self.events = dict((name, []) for name, dtype in event_columns)
+        self.particles = dict((name, []) for name, dtype in particle_columns)
+        self.links = dict((name, []) for link in links for name in [link, 'n' + link])
+
+    def add(self, event, genp, qscale):
+        aux = event.eventAuxiliary()
+        self.events['run'       ].append(aux.run())
+        self.events['lumi'      ].append(aux.luminosityBlock())
+        self.events['event'     ].append(aux.event())
+        self.events['qscale'    ].append(qscale)
+        self.events['nparticles'].append(genp.size())
+        p, l = self.particles, self.links
+        for ip in genp:
+            p['pdgid'       ].append(ip.pdgId())
+            p['status'      ].append(ip.status())
+            p['pt'          ].append(ip.pt())
+            p['eta'         ].append(ip.eta())
+            p['phi'         ].append(ip.phi())
+            p['mass'        ].append(ip.mass())
+            p['charge'      ].append(ip.charge())
+            p['vx'          ].append(ip.vx())
+            p['vy'          ].append(ip.vy())
+            p['vz'          ].append(ip.vz())
+            p['last_copy'   ].append(ip.isLastCopy())
+            p['hard_process'].append(ip.isHardProcess())
+            # the keys of the references are the indices in the genParticles collection of the event
+            l['nmothers'  ].append(ip.numberOfMothers())
+            l['mothers'   ].extend(ip.motherRef(i).key() for i in range(ip.numberOfMothers()))
+            l['ndaughters'].append(ip.numberOfDaughters())
+            l['daughters' ].extend(ip.daughterRef(i).key() for i in range(ip.numberOfDaughters()))
+        if len(self.events['run']) >= self.events_per_file:
+            self.flush()
+
+    def flush(self):
+        if not len(self.events['run']):
+            return
+        arrays = dict()
+        for name, dtype in event_columns:
+            arrays[name] = np.array(self.events[name], dtype = dtype)
+        for name, dtype in particle_columns:
+            arrays[name] = np.array(self.particles[name], dtype = dtype)
+        for link in links:
+            arrays['n' + link] = np.array(self.links['n' + link], dtype = np.int32)
+            arrays[link] = np.array(self.links[link], dtype = np.int32)
+        np.savez_compressed('%s_%d.npz' %(self.prefix, self.nfiles), **arrays)
+        self.nfiles += 1
+        self._reset()
+
+    def close(self):
+        self.flush()
+        print('gen columns written in %d files %s_*.npz' %(self.nfiles, self.prefix))
+
+def load(path):
+    '''
+    Stage 2: arrays of a file, with the links as indices in the file and ev, the event of each particle
+    '''
+    with np.load(path) as f:
+        arrays = dict((name, f[name]) for name in f.files)
+    nparticles = arrays['nparticles']
+    first = np.cumsum(nparticles) - nparticles
+    arrays['ev'] = np.repeat(np.arange(len(nparticles)), nparticles)
+    for link in links:
+        counts = arrays['n' + link]
+        arrays[link] = arrays[link].astype(np.int64) + np.repeat(first[arrays['ev']], counts)
+        arrays[link + '_offset'] = np.concatenate([[0], np.cumsum(counts)])
+    # children from the mothers: isAncestor walks the mothers
+    child = np.repeat(np.arange(len(arrays['pdgid'])), arrays['nmothers'])
+    order = np.argsort(arrays['mothers'], kind = 'mergesort')
+    arrays['children'] = child[order]
+    arrays['children_offset'] = np.concatenate([[0], np.cumsum(np.bincount(arrays['mothers'], minlength = len(arrays['pdgid'])))])
+    return arrays
+
+def _expand(offset, values, rows):
+    '''
+    (position in rows, value) for all the values of the rows of a table in CSR form
+    '''
+    rows = np.asarray(rows, dtype = np.int64)
+    starts = offset[rows]
+    counts = offset[rows + 1] - starts
+    position = np.repeat(np.arange(len(rows)), counts)
+    index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+    return position, values[index]
+
+def descendant_codes(arrays, roots):
+    '''
+    Sorted codes position * nparticles + particle of the descendants of each root (isAncestor(roots[position], particle))
+    '''
+    n = len(arrays['pdgid'])
+    position, particle = _expand(arrays['children_offset'], arrays['children'], roots)
+    codes = np.unique(position * n + particle)
+    frontier = codes
+    while len(frontier):
+        position, particle = _expand(arrays['children_offset'], arrays['children'], frontier % n)
+        new = np.unique((frontier // n)[position] * n + particle)
+        new = new[~np.isin(new, codes)]
+        codes = np.union1d(codes, new)
+        frontier = new
+    return codes
+
+def _ancestor_links(arrays):
+    # the mothers printAncestors goes through: no quarks and gluons, only last copies
+    apdg = np.abs(arrays['pdgid'])
+    valid = (apdg >= 8) & (apdg != 21) & arrays['last_copy']
+    n = len(apdg)
+    child = np.repeat(np.arange(n), arrays['nmothers'])
+    mother = arrays['mothers']
+    keep = valid[mother]
+    child, mother = child[keep], mother[keep]
+    last, second_last = np.full(n, -1, dtype = np.int64), np.full(n, -1, dtype = np.int64)
+    first = np.full(n, -1, dtype = np.int64)
+    if len(child):
+        at_first = np.unique(child, return_index = True)[1]
+        first[child[at_first]] = mother[at_first]
+        at_last = len(child) - 1 - np.unique(child[::-1], return_index = True)[1]
+        last[child[at_last]] = mother[at_last]
+        has_second = (at_last > 0) & (child[np.maximum(at_last - 1, 0)] == child[at_last])
+        second_last[child[at_last[has_second]]] = mother[at_last[has_second] - 1]
+    return first, last, second_last
+
+def _walk_last(last, start):
+    # last particle reached from start always going to the last valid mother, and the one before it on the path
+    node, before = last[start], np.array(start, dtype = np.int64)
+    active = node >= 0
+    while active.any():
+        up = np.full(len(node), -1, dtype = np.int64)
+        up[active] = last[node[active]]
+        step = up >= 0
+        before[step] = node[step]
+        node[step] = up[step]
+        active = step
+    return node, before
+
+def first_ancestors(arrays, particles):
+    '''
+    ancestors[-1] of printAncestors, ancestors[-2] if it is a diquark, -1 if there is none.
+    printAncestors appends the valid mothers depth first: the last appended is reached always going to the last
+    valid mother, the one before is the previous node of that path, or the last one reached from the previous sibling
+    '''
+    first, last, second_last = _ancestor_links(arrays)
+    particles = np.asarray(particles, dtype = np.int64)
+    node, before = _walk_last(last, particles)
+    found = node >= 0
+    diquark = found & np.isin(arrays['pdgid'][np.maximum(node, 0)], diquarks)
+    if diquark.any():
+        d = np.flatnonzero(diquark)
+        second = np.where((first[before[d]] == node[d]) & (before[d] != particles[d]), before[d], -1)
+        sibling = (first[before[d]] != node[d])
+        if sibling.any():
+            from_sibling, _ = _walk_last(last, second_last[before[d[sibling]]])
+            # the sibling itself when it has no valid mothers
+            second[sibling] = np.where(from_sibling >= 0, from_sibling, second_last[before[d[sibling]]])
+        node[d] = second
+    return node
+
+def _ranked(position, particle, size, key = None, ranks = 2):
+    '''
+    The particles of each position sorted by decreasing key (as list.sort(reverse = True), collection order if no key):
+    array (size, ranks) with -1 where missing, and the number of particles of each position
+    '''
+    position, particle = np.asarray(position, dtype = np.int64), np.asarray(particle, dtype = np.int64)
+    order = np.lexsort((particle, np.zeros(len(particle)) if key is None else -key[particle], position))
+    position, particle = position[order], particle[order]
+    counts = np.bincount(position, minlength = size)
+    rank = np.arange(len(position)) - np.repeat(np.cumsum(counts) - counts, counts)
+    ranked = np.full((size, ranks), -1, dtype = np.int64)
+    keep = rank < ranks
+    ranked[position[keep], rank[keep]] = particle[keep]
+    return ranked, counts
+
+def _in_codes(position, particle, codes, n):
+    return np.isin(np.asarray(position, dtype = np.int64) * n + particle, codes)
+
+# kinematics, on arrays of four momenta (e, px, py, pz), NaN for the missing particles
+
+def p4(arrays, index):
+    index = np.asarray(index, dtype = np.int64)
+    safe = np.maximum(index, 0)
+    pt, eta, phi, m = [arrays[name][safe] for name in ['pt', 'eta', 'phi', 'mass']]
+    px, py, pz = pt * np.cos(phi), pt * np.sin(phi), pt * np.sinh(eta)
+    # as ROOT's PtEtaPhiM4D, negative masses as -m^2
+    e = np.sqrt(np.maximum(px**2 + py**2 + pz**2 + m * np.abs(m), 0.))
+    p = np.stack([e, px, py, pz], axis = 1)
+    p[index < 0] = np.nan
+    return p
+
+def _pt(p) : return np.hypot(p[:, 1], p[:, 2])
+def _phi(p): return np.arctan2(p[:, 2], p[:, 1])
+def _eta(p): return np.arcsinh(p[:, 3] / _pt(p))
+def _y(p)  : return 0.5 * np.log((p[:, 0] + p[:, 3]) / (p[:, 0] - p[:, 3]))
+def _m2(p) : return p[:, 0]**2 - p[:, 1]**2 - p[:, 2]**2 - p[:, 3]**2
+def _m(p)  :
+    m2 = _m2(p)
+    return np.sign(m2) * np.sqrt(np.abs(m2))
+
+def _dot(p, q):
+    return p[:, 0] * q[:, 0] - p[:, 1] * q[:, 1] - p[:, 2] * q[:, 2] - p[:, 3] * q[:, 3]
+
+def _energy_in_rest_frame(p, frame):
+    # energy of p boosted to the rest frame of frame
+    return _dot(p, frame) / _m(frame)
+
+def _delta_r(eta1, phi1, eta2, phi2):
+    dphi = np.mod(phi1 - phi2 + np.pi, 2. * np.pi) - np.pi
+    return np.sqrt((eta1 - eta2)**2 + dphi**2)
+
+# the three inspectors
+
+jpsi_hc = [[431, 443], [433, 443], [411, 443], [313, 413, 443], [321, 423, 443], [413, 443], [321, 421, 443], [313, 411, 443]]
+
+decays = OrderedDict([
+    ('is_jpsi_mu'  , [[13, 14, 443       ]]),
+    ('is_psi2s_mu' , [[13, 14, 100443    ]]),
+    ('is_chic0_mu' , [[13, 14, 10441     ]]),
+    ('is_chic1_mu' , [[13, 14, 20443     ]]),
+    ('is_chic2_mu' , [[13, 14, 445       ]]),
+    ('is_hc_mu'    , [[13, 14, 10443     ]]),
+    ('is_jpsi_tau' , [[15, 16, 443       ]]),
+    ('is_psi2s_tau', [[15, 16, 100443    ]]),
+    ('is_jpsi_pi'  , [[211, 443          ]]),
+    ('is_jpsi_k'   , [[321, 443          ]]),
+    ('is_jpsi_3pi' , [[211, 211, 211, 443]]),
+    ('is_jpsi_hc'  , jpsi_hc               ),
+    ('is_jpsi_pppi', [[211, 443, 2212, 2212]]),
+])
+
+decay_weights = OrderedDict([
+    ('is_jpsi_mu'  , 1.    ),
+    ('is_psi2s_mu' , 0.5474), # Psi(2S) -> J/Psi X BR, forced decay at generation
+    ('is_chic0_mu' , 0.0116),
+    ('is_chic1_mu' , 0.3440),
+    ('is_chic2_mu' , 0.1950),
+    ('is_hc_mu'    , 0.01  ),
+    ('is_jpsi_tau' , 1.    ),
+    ('is_psi2s_tau', 0.5474),
+    ('is_jpsi_pi'  , 1.    ),
+    ('is_jpsi_k'   , 1.    ),
+    ('is_jpsi_3pi' , 1.    ),
+    ('is_jpsi_hc'  , 1.    ),
+    ('is_jpsi_pppi', 1.    ),
+])
+
+def _kinematics(name, charge = True, mass = False, status = False, pdgid = False):
+    names = ['%s_%s' %(name, var) for var in ['pt', 'eta', 'y', 'phi']]
+    names += ['%s_m' %name] * mass + ['%s_status' %name] * status + ['%s_q' %name] * charge + ['%s_pdgid' %name] * pdgid
+    return names
+
+branches_bplus = ['run', 'lumi', 'event', 'qscale', 'min_bq_pt', 'max_bq_eta'] + \
+                 _kinematics('mu1') + _kinematics('mu2') + \
+                 _kinematics('jpsi', charge = False, mass = True, status = True) + \
+                 _kinematics('bhad', mass = True, pdgid = True) + \
+                 _kinematics('mmm', mass = True) + \
+                 ['m2_miss', 'pt_miss_sca', 'pt_miss_vec', 'q2', 'e_star_mu3', 'e_hash_mu3', 'ptvar'] + \
+                 _kinematics('mu3') + ['dr_jpsi_m', 'is3m'] + list(decays.keys())[:-1] + \
+                 ['pv_x', 'pv_y', 'pv_z', 'sv_x', 'sv_y', 'sv_z', 'lxyz', 'beta', 'gamma', 'n_extra_mu', 'n_jpsi', 'weight']
+
+branches_mu = branches_bplus[:branches_bplus.index('mu3_pt')] + \
+              ['m2_miss_reco', 'pt_miss_sca_reco', 'pt_miss_vec_reco', 'q2_reco', 'e_star_mu3_reco'] + \
+              branches_bplus[branches_bplus.index('mu3_pt'):branches_bplus.index('pv_x')] + ['is_jpsi_pppi'] + \
+              branches_bplus[branches_bplus.index('pv_x'):]
+
+branches_tau = branches_mu[:branches_mu.index('mmm_pt')] + \
+               ['tau_pt', 'tau_eta', 'tau_y', 'tau_phi', 'tau_q', 'tau_pdgid', 'tau_m',
+                'nutau_pt', 'nutau_eta', 'nutau_phi', 'nutau_y', 'nutau_pdgid', 'nutau_q'] + \
+               branches_mu[branches_mu.index('mmm_pt'):branches_mu.index('mu3_pt')] + ['ismu3fromtau'] + \
+               branches_mu[branches_mu.index('mu3_pt'):]
+
+channels = dict(
+    # b hadrons of the flat tree, b of the J/psi mother(0) test, missing quantities from the gen b (else from the scaled 3 mu)
+    mu    = dict(b_pdgids = [541, 543], gen_b = True , tau = False, branches = branches_mu   , hc = jpsi_hc    ),
+    tau   = dict(b_pdgids = [541, 543], gen_b = True , tau = True , branches = branches_tau  , hc = jpsi_hc    ),
+    bplus = dict(b_pdgids = [521, 523], gen_b = False, tau = False, branches = branches_bplus, hc = jpsi_hc[:2]),
+)
+
+def _decay_flags(position, pdgids, size, channel_decays):
+    # final_daus == pattern, as multisets
+    ndaughters = np.bincount(position, minlength = size)
+    flags = OrderedDict()
+    for name, patterns in channel_decays.items():
+        flag = np.zeros(size, dtype = bool)
+        for pattern in patterns:
+            match = ndaughters == len(pattern)
+            for pdgid in set(pattern):
+                match &= np.bincount(position[pdgids == pdgid], minlength = size) == pattern.count(pdgid)
+            flag |= match
+        flags[name] = flag
+    return flags
+
+def _event_reduce(ufunc, ev, values, nevents, initial):
+    out = np.full(nevents, initial)
+    ufunc.at(out, ev, values)
+    out[out == initial] = np.nan
+    return out
+
+def flat_columns(arrays, channel):
+    '''
+    Stage 2: the branches of the flat tree of the inspector of the channel (mu, tau, bplus), one row per candidate
+    '''
+    config = channels[channel]
+    n = len(arrays['pdgid'])
+    nevents = len(arrays['run'])
+    ev, pdgid, status, pt = arrays['ev'], arrays['pdgid'], arrays['status'], arrays['pt']
+    apdg = np.abs(pdgid)
+
+    # per event
+    bq = (apdg == 5) & arrays['hard_process']
+    min_bq_pt = _event_reduce(np.minimum, ev[bq], pt[bq], nevents, np.inf)
+    max_bq_eta = _event_reduce(np.maximum, ev[bq], np.abs(arrays['eta'][bq]), nevents, -np.inf)
+    jpsis = np.flatnonzero(apdg == 443)
+    n_jpsi = np.bincount(ev[jpsis], minlength = nevents)
+    muons = np.flatnonzero((apdg == 13) & (status == 1))
+    muon_offset = np.concatenate([[0], np.cumsum(np.bincount(ev[muons], minlength = nevents))])
+
+    # J/psi -> mu mu with an ancestor
+    position, daughter = _expand(arrays['daughters_offset'], arrays['daughters'], jpsis)
+    dimuon = np.bincount(position[apdg[daughter] == 13], minlength = len(jpsis)) >= 2
+    jpsi = jpsis[dimuon]
+    bhad = first_ancestors(arrays, jpsi)
+    jpsi, bhad = jpsi[bhad >= 0], bhad[bhad >= 0]
+
+    # two muons from the J/psi
+    jpsi_codes = descendant_codes(arrays, jpsi)
+    position, particle = jpsi_codes // n, jpsi_codes % n
+    is_muon = np.isin(particle, muons)
+    jpsi_muons, njpsi_muons = _ranked(position[is_muon], particle[is_muon], len(jpsi), pt)
+    # only the candidates filled in the tree: two muons, from the b hadrons of the channel
+    keep = (njpsi_muons >= 2) & np.isin(apdg[bhad], config['b_pdgids'])
+    index = np.flatnonzero(keep)
+    jpsi, bhad, jpsi_muons = jpsi[keep], bhad[keep], jpsi_muons[keep]
+    size = len(jpsi)
+    cev = ev[jpsi]
+
+    columns = dict()
+    columns['run'       ] = arrays['run'   ][cev]
+    columns['lumi'      ] = arrays['lumi'  ][cev]
+    columns['event'     ] = arrays['event' ][cev]
+    columns['qscale'    ] = arrays['qscale'][cev]
+    columns['min_bq_pt' ] = min_bq_pt[cev]
+    columns['max_bq_eta'] = max_bq_eta[cev]
+    columns['n_jpsi'    ] = n_jpsi[cev]
+
+    p4_jpsi, p4_bhad = p4(arrays, jpsi), p4(arrays, bhad)
+    sv = np.stack([arrays[v][jpsi] for v in ['vx', 'vy', 'vz']], axis = 1)
+    pv = np.stack([arrays[v][bhad] for v in ['vx', 'vy', 'vz']], axis = 1)
+    for i, v in enumerate(['x', 'y', 'z']):
+        columns['pv_' + v] = pv[:, i]
+        columns['sv_' + v] = sv[:, i]
+    columns['lxyz' ] = np.sqrt(((sv - pv)**2).sum(axis = 1)) # in [cm]
+    columns['beta' ] = np.sqrt(p4_bhad[:, 1]**2 + p4_bhad[:, 2]**2 + p4_bhad[:, 3]**2) / p4_bhad[:, 0]
+    columns['gamma'] = 1. / np.sqrt(1. - columns['beta']**2)
+
+    def fill_particle(name, index, p, mass = False, charge = True, status = False, pdgid = False, rows = None, composite = False):
+        # composite: the kinematics from p, else as stored (p only for the rapidity)
+        rows = np.ones(size, dtype = bool) if rows is None else rows
+        safe = np.maximum(index, 0)
+        if composite:
+            values = [('pt', _pt(p)), ('eta', _eta(p)), ('phi', _phi(p)), ('m', _m(p))]
+        else:
+            values = [(var, arrays[stored][safe]) for var, stored in [('pt', 'pt'), ('eta', 'eta'), ('phi', 'phi'), ('m', 'mass')]]
+        values = [(var, value) for var, value in values if var != 'm' or mass] + [('y', _y(p))]
+        values += [('q', arrays['charge'][safe])] * charge
+        values += [('status', arrays['status'][safe])] * status + [('pdgid', arrays['pdgid'][safe])] * pdgid
+        for var, value in values:
+            columns['%s_%s' %(name, var)] = np.where(rows & (index >= 0), value, np.nan)
+
+    fill_particle('jpsi', jpsi, p4_jpsi, mass = True, charge = False, status = True)
+    fill_particle('bhad', bhad, p4_bhad, mass = True, pdgid = True)
+    p4_mu1, p4_mu2 = p4(arrays, jpsi_muons[:, 0]), p4(arrays, jpsi_muons[:, 1])
+    fill_particle('mu1', jpsi_muons[:, 0], p4_mu1)
+    fill_particle('mu2', jpsi_muons[:, 1], p4_mu2)
+
+    # decay of the b: daughters of the J/psi mother, or of its mother if that is not the b
+    b = config['b_pdgids'][0]
+    mother = arrays['mothers'][arrays['mothers_offset'][jpsi]]
+    grandmother = np.where(arrays['nmothers'][mother] > 0, arrays['mothers'][arrays['mothers_offset'][mother]], -1)
+    the_b = np.where(apdg[mother] == b, mother, grandmother)
+    has_b = the_b >= 0
+    position, daughter = _expand(arrays['daughters_offset'], arrays['daughters'], the_b[has_b])
+    position = np.flatnonzero(has_b)[position]
+    final = ~np.isin(pdgid[daughter], [22, b])
+    channel_decays = OrderedDict((name, config['hc'] if name == 'is_jpsi_hc' else patterns) for name, patterns in decays.items() if name in config['branches'])
+    flags = _decay_flags(position[final], apdg[daughter[final]], size, channel_decays)
+    known = np.zeros(size, dtype = bool)
+    for name, flag in flags.items():
+        columns[name] = flag
+        known |= flag
+    if (~known).any():
+        print('unknown decay in %d candidates' %np.count_nonzero(~known))
+    columns['weight'] = np.select(list(flags.values()), [decay_weights[name] for name in flags], -1.)
+
+    # third muon: the leading final state muon not from the J/psi
+    nmuons = np.diff(muon_offset)[cev]
+    columns['is3m'] = nmuons >= 3
+    position, muon = _expand(muon_offset, muons, cev)
+    other = ~_in_codes(index[position], muon, jpsi_codes, n)
+    position, muon = position[other], muon[other]
+    extra_mu, n_extra_mu = _ranked(position, muon, size, pt, ranks = 1)
+    extra_mu = extra_mu[:, 0]
+    three = columns['is3m'] & (extra_mu >= 0)
+
+    if config['tau']:
+        columns['ismu3fromtau'] = np.where(three, 0., np.nan)
+        rows = np.flatnonzero(three & flags['is_jpsi_tau'])
+        # the leading tau from the b, its neutrino and the leading extra muon from it
+        b_codes = descendant_codes(arrays, bhad[rows])
+        b_position, b_particle = b_codes // n, b_codes % n
+        is_tau = (apdg[b_particle] == 15) & (status[b_particle] == 2)
+        tau = _ranked(b_position[is_tau], b_particle[is_tau], len(rows), pt, ranks = 1)[0][:, 0]
+        with_tau = tau >= 0
+        tau_codes = descendant_codes(arrays, tau[with_tau])
+        t_position, t_particle = tau_codes // n, tau_codes % n
+        t_rows = np.flatnonzero(with_tau)
+        is_nutau = apdg[t_particle] == 16
+        nutau = np.full(len(rows), -1, dtype = np.int64)
+        nutau[t_rows] = _ranked(t_position[is_nutau], t_particle[is_nutau], len(t_rows), ranks = 1)[0][:, 0]
+        # extra muons (not from the J/psi) of the rows with a tau
+        lookup = np.full(size, -1, dtype = np.int64)
+        lookup[rows[with_tau]] = np.arange(len(t_rows))
+        from_tau_rows = lookup[position] >= 0
+        from_tau = np.zeros(len(position), dtype = bool)
+        from_tau[from_tau_rows] = _in_codes(lookup[position[from_tau_rows]], muon[from_tau_rows], tau_codes, n)
+        mu_from_tau, n_mu_from_tau = _ranked(position[from_tau], muon[from_tau], size, pt, ranks = 1)
+        columns['ismu3fromtau'][rows] = n_mu_from_tau[rows] != 0
+        extra_mu = np.where(n_mu_from_tau > 0, mu_from_tau[:, 0], extra_mu)
+        tau_rows = np.zeros(size, dtype = bool)
+        tau_rows[rows] = True
+        tau_index, nutau_index = np.full(size, -1, dtype = np.int64), np.full(size, -1, dtype = np.int64)
+        tau_index[rows], nutau_index[rows] = tau, nutau
+        fill_particle('tau', tau_index, p4(arrays, tau_index), mass = True, pdgid = True, rows = tau_rows)
+        fill_particle('nutau', nutau_index, p4(arrays, nutau_index), pdgid = True, rows = tau_rows)
+
+    p4_mu3 = p4(arrays, np.where(three, extra_mu, -1))
+    fill_particle('mu3', np.where(three, extra_mu, -1), p4_mu3)
+    p4_mmm = p4_mu3 + p4_mu1 + p4_mu2
+    p4_b_scaled = p4_mmm * (6.275 / _m(p4_mmm))[:, None]
+    fill_particle('mmm', np.where(three, extra_mu, -1), p4_mmm, mass = True, composite = True)
+    columns['dr_jpsi_m'] = _delta_r(columns['mu3_eta'], columns['mu3_phi'], columns['jpsi_eta'], columns['jpsi_phi'])
+    columns['n_extra_mu'] = np.where(three, n_extra_mu, np.nan)
+
+    p4_reco_miss = p4_b_scaled - p4_mu3 - p4_mu1 - p4_mu2
+    reco = dict(
+        m2_miss     = _m2(p4_reco_miss),
+        pt_miss_sca = _pt(p4_b_scaled) - columns['mu3_pt'] - columns['mu1_pt'] - columns['mu2_pt'],
+        pt_miss_vec = _pt(p4_reco_miss),
+        q2          = _m2(p4_b_scaled - p4_jpsi),
+        e_star_mu3  = _energy_in_rest_frame(p4_mu3, p4_b_scaled),
+    )
+    if config['gen_b']:
+        columns['m2_miss'    ] = _m2(p4_bhad - p4_jpsi - p4_mu3)
+        columns['pt_miss_sca'] = columns['bhad_pt'] - columns['mu3_pt'] - columns['jpsi_pt']
+        columns['pt_miss_vec'] = _pt(p4_bhad - p4_mu3 - p4_jpsi)
+        columns['q2'         ] = _m2(p4_bhad - p4_jpsi)
+        columns['e_star_mu3' ] = _energy_in_rest_frame(p4_mu3, p4_bhad)
+        for name, value in reco.items():
+            columns[name + '_reco'] = value
+    else:
+        columns.update(reco)
+    columns['e_hash_mu3'] = _energy_in_rest_frame(p4_mu3, p4_jpsi)
+    columns['ptvar'     ] = columns['jpsi_pt'] - columns['mu3_pt']
+
+    return OrderedDict((name, np.asarray(columns[name], dtype = np.float64)) for name in config['branches'])
+
+def write_ntuple(path, columns, tree = 'tree'):
+    '''
+    Same typed tree as the inspectors
+    '''
+    from tree_writer import TreeWriter, inspector_types
+    writer = TreeWriter(path, columns.keys(), types = inspector_types(columns.keys()), tree = tree)
+    writer.fill_columns(columns)
+    writer.close()
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--channel', required = True, choices = sorted(channels.keys()), help = 'inspector: mu, tau (Bc) or bplus (evtgen)')
+    parser.add_argument('--input'  , required = True, help = 'npz files of stage 1 (glob)')
+    parser.add_argument('--output' , required = True, help = 'flat tree')
+    args = parser.parse_args()
+
+    files = sorted(glob(args.input), key = lambda f: (len(f), f))
+    parts = []
+    for path in files:
+        parts.append(flat_columns(load(path), args.channel))
+        print('%s: %d candidates' %(path, len(parts[-1]['run'])))
+    columns = OrderedDict((name, np.concatenate([part[name] for part in parts])) for name in channels[args.channel]['branches'])
+    write_ntuple(args.output, columns)
+    print('%s: %d candidates from %d files' %(args.output, len(columns['run']), len(files)))
@@ -12,6 +12,9 @@ from DataFormats.FWLite import Events, Handle
 from PhysicsTools.HeppyCore.utils.deltar import deltaR, deltaPhi
 # https://pypi.org/project/particle/
 from particle import Particle
+from ancestry import AncestryIndex
+from tree_writer import TreeWriter, inspector_types
+from gen_columns import GenColumnWriter
 from kiselev_paths_mu import files
 #from ebert_paths_mu import files
 
@@ -21,6 +24,7 @@ parser.add_argument('--jobid'        , dest='jobid'        , default=0    , type
 parser.add_argument('--verbose'      , dest='verbose'      , action='store_true' )
 parser.add_argument('--destination'  , dest='destination'  , default='.'  , type=str)
 parser.add_argument('--maxevents'    , dest='maxevents'    , default=-1   , type=int)
+parser.add_argument('--dump_gen'     , dest='dump_gen'     , default=''   , type=str, help='only dump the gen particles in <destination>/<dump_gen>_<n>.npz, see gen_columns.py')
 args = parser.parse_args()
 
 files_per_job = args.files_per_job
@@ -28,6 +32,7 @@ jobid         = args.jobid
 verbose       = args.verbose
 destination   = args.destination
 maxevents     = args.maxevents
+dump_gen      = args.dump_gen
 
 diquarks = [
     1103,
@@ -82,7 +87,8 @@ def isAncestor(a, p):
             return True
     return False
 
-def printAncestors(particle, ancestors=[], verbose=True):
+def printAncestors(particle, ancestors=None, verbose=True):
+    ancestors = [] if ancestors is None else ancestors
     for i in xrange(0, particle.numberOfMothers()):
         mum = particle.mother(i)
 #         if mum is None: import pdb ; pdb.set_trace()
@@ -230,8 +236,11 @@ branches = [
 #     'ctau_weight_down_lhe',
 ]
 
-fout = ROOT.TFile('%s/flat_tree_kiselev_mu_14Apr21.root' %(destination), 'recreate')
-ntuple = ROOT.TNtuple('tree', 'tree', ':'.join(branches))
+if dump_gen:
+    # stage 1: the flat tree is then made from the gen particles with gen_columns.py
+    gen_writer = GenColumnWriter('%s/%s' %(destination, dump_gen))
+else:
+    writer = TreeWriter('%s/flat_tree_kiselev_mu_14Apr21.root' %(destination), branches, types = inspector_types(branches))
 tofill = OrderedDict(zip(branches, [np.nan]*len(branches)))
 
 start = time()
@@ -260,9 +269,16 @@ for i, event in enumerate(events):
 #     ctaus = [hepup.VTIMUP.at(ictau) for ictau in xrange(hepup.VTIMUP.size()) if hepup.VTIMUP.at(ictau)>0.] # in [mm]
     
     event.qscale = event.genInfo.qScale()
+
+    if dump_gen:
+        gen_writer.add(event, event.genp, event.qscale)
+        continue
    
     if verbose: print('=========>')
     
+    # ancestry of the gen particles, computed once for the event
+    ancestry = AncestryIndex(event.genp)
+
     jpsis = [ip for ip in event.genp if abs(ip.pdgId())==443]
     
 #     bs =  [ip for ip in event.genp if abs(ip.pdgId())==511]
@@ -284,7 +300,7 @@ for i, event in enumerate(events):
         if verbose: print('\t%s %s pt %3.2f,\t genealogy: ' %(Particle.from_pdgid(jpsi.pdgId()), str(daus), jpsi.pt()), end='')
         ancestors = []
         if verbose: print('\t', printAncestors(jpsi, ancestors, verbose=True))
-        else: printAncestors(jpsi, ancestors, verbose=False)
+        else: ancestors = ancestry.ancestors(jpsi)
         
         # only save jpsi->mumu
         if sum([abs(dau)==13 for dau in daus])<2: continue
@@ -348,7 +364,7 @@ for i, event in enumerate(events):
         final_state_muons = [ip for ip in event.genp if abs(ip.pdgId())==13 and ip.status()==1]
         tofill['is3m'      ] = len(final_state_muons)>=3
 
-        jpsi_muons = [imu for imu in final_state_muons if isAncestor(jpsi, imu)]
+        jpsi_muons = [imu for imu in final_state_muons if ancestry.is_ancestor(jpsi, imu)]
         jpsi_muons.sort(key = lambda x : x.pt(), reverse = True)
         if len(jpsi_muons)<2:
             continue
@@ -499,7 +515,7 @@ for i, event in enumerate(events):
 
         # fill only if it comes from  a Bc
         if abs(first_ancestor.pdgId()) in [541, 543]:
-            ntuple.Fill(array('f', tofill.values()))
+            writer.fill(tofill)
 #         ntuple.Fill(array('f', tofill.values()))
 
     if verbose:
@@ -523,7 +539,8 @@ for i, event in enumerate(events):
                 if abs(ij.daughter(0).pdgId())!=13:
                     pass
     
-fout.cd()
-ntuple.Write()
-fout.Close()
+if dump_gen:
+    gen_writer.close()
+else:
+    writer.close()
     
@@ -12,6 +12,9 @@ from DataFormats.FWLite import Events, Handle
 from PhysicsTools.HeppyCore.utils.deltar import deltaR, deltaPhi
 # https://pypi.org/project/particle/
 from particle import Particle
+from ancestry import AncestryIndex
+from tree_writer import TreeWriter, inspector_types
+from gen_columns import GenColumnWriter
 #from kiselev_paths import files
 #from kiselev_paths_tau import files
 #from ebert_paths import files
@@ -22,6 +25,7 @@ parser.add_argument('--jobid'        , dest='jobid'        , default=0    , type
 parser.add_argument('--verbose'      , dest='verbose'      , action='store_true' )
 parser.add_argument('--destination'  , dest='destination'  , default='.'  , type=str)
 parser.add_argument('--maxevents'    , dest='maxevents'    , default=-1   , type=int)
+parser.add_argument('--dump_gen'     , dest='dump_gen'     , default=''   , type=str, help='only dump the gen particles in <destination>/<dump_gen>_<n>.npz, see gen_columns.py')
 args = parser.parse_args()
 
 files_per_job = args.files_per_job
@@ -29,6 +33,7 @@ jobid         = args.jobid
 verbose       = args.verbose
 destination   = args.destination
 maxevents     = args.maxevents
+dump_gen      = args.dump_gen
 
 diquarks = [
     1103,
@@ -83,7 +88,8 @@ def isAncestor(a, p):
             return True
     return False
 
-def printAncestors(particle, ancestors=[], verbose=True):
+def printAncestors(particle, ancestors=None, verbose=True):
+    ancestors = [] if ancestors is None else ancestors
     for i in xrange(0, particle.numberOfMothers()):
         mum = particle.mother(i)
 #         if mum is None: import pdb ; pdb.set_trace()
@@ -249,8 +255,11 @@ branches = [
 #     'ctau_weight_down_lhe',
 ]
 
-fout = ROOT.TFile('%s/flat_tree_tau_ebert_13Apr21.root' %(destination), 'recreate')
-ntuple = ROOT.TNtuple('tree', 'tree', ':'.join(branches))
+if dump_gen:
+    # stage 1: the flat tree is then made from the gen particles with gen_columns.py
+    gen_writer = GenColumnWriter('%s/%s' %(destination, dump_gen))
+else:
+    writer = TreeWriter('%s/flat_tree_tau_ebert_13Apr21.root' %(destination), branches, types = inspector_types(branches))
 tofill = OrderedDict(zip(branches, [np.nan]*len(branches)))
 
 start = time()
@@ -278,9 +287,16 @@ for i, event in enumerate(events):
 #     ctaus = [hepup.VTIMUP.at(ictau) for ictau in xrange(hepup.VTIMUP.size()) if hepup.VTIMUP.at(ictau)>0.] # in [mm]
     
     event.qscale = event.genInfo.qScale()
+
+    if dump_gen:
+        gen_writer.add(event, event.genp, event.qscale)
+        continue
    
     if verbose: print('=========>')
     
+    # ancestry of the gen particles, computed once for the event
+    ancestry = AncestryIndex(event.genp)
+
     jpsis = [ip for ip in event.genp if abs(ip.pdgId())==443]    
     bs =  [ip for ip in event.genp if (abs(ip.pdgId())>500 and abs(ip.pdgId())<600) or (abs(ip.pdgId())>5000 and abs(ip.pdgId())<6000)]
     muons =  [ip for ip in event.genp if abs(ip.pdgId())==13 and ip.status()==1]
@@ -299,7 +315,7 @@ for i, event in enumerate(events):
         if verbose: print('\t%s %s pt %3.2f,\t genealogy: ' %(Particle.from_pdgid(jpsi.pdgId()), str(daus), jpsi.pt()), end='')
         ancestors = []
         if verbose: print('\t', printAncestors(jpsi, ancestors, verbose=True))
-        else: printAncestors(jpsi, ancestors, verbose=False)
+        else: ancestors = ancestry.ancestors(jpsi)
         
         # only save jpsi->mumu
         if sum([abs(dau)==13 for dau in daus])<2: continue
@@ -363,7 +379,7 @@ for i, event in enumerate(events):
         final_state_muons = [ip for ip in event.genp if abs(ip.pdgId())==13 and ip.status()==1]
         tofill['is3m'      ] = len(final_state_muons)>=3
 
-        jpsi_muons = [imu for imu in final_state_muons if isAncestor(jpsi, imu)]
+        jpsi_muons = [imu for imu in final_state_muons if ancestry.is_ancestor(jpsi, imu)]
         jpsi_muons.sort(key = lambda x : x.pt(), reverse = True)
         if len(jpsi_muons)<2:
             continue
@@ -480,12 +496,12 @@ for i, event in enumerate(events):
                 if(final_daus==[15, 16, 443]):
                     taus =  [ip for ip in event.genp if abs(ip.pdgId())==15 and ip.status()==2]
                     nutaus = [ip for ip in event.genp if abs(ip.pdgId())==16]# and ip.status()==1]
-                    tau_frombc =[itau for itau in taus if isAncestor(first_ancestor,itau)]
+                    tau_frombc =[itau for itau in taus if ancestry.is_ancestor(first_ancestor,itau)]
                     if(len(tau_frombc)>1):
                         #I take the one with highest pt
                         tau_frombc.sort(key = lambda x : x.pt(), reverse = True)
-                    extra_mu_fromtau = [imu for imu in final_state_muons_non_jpsi if isAncestor(tau_frombc[0],imu)]
-                    nutau_fromtau = [inu for inu in nutaus if isAncestor(tau_frombc[0],inu)]
+                    extra_mu_fromtau = [imu for imu in final_state_muons_non_jpsi if ancestry.is_ancestor(tau_frombc[0],imu)]
+                    nutau_fromtau = [inu for inu in nutaus if ancestry.is_ancestor(tau_frombc[0],inu)]
                     #                print(nutau_fromtau)
                     #print("ex",extra_mu_fromtau)
                     #print(tau_frombc[0].pt(),nutau_fromtau[0].pt())
@@ -562,7 +578,7 @@ for i, event in enumerate(events):
             
         # fill only if it comes from  a Bc
         if abs(first_ancestor.pdgId()) in [541, 543]:
-            ntuple.Fill(array('f', tofill.values()))
+            writer.fill(tofill)
             #         ntuple.Fill(array('f', tofill.values()))
 
     if verbose:
@@ -586,7 +602,8 @@ for i, event in enumerate(events):
                 if abs(ij.daughter(0).pdgId())!=13:
                     pass
     
-fout.cd()
-ntuple.Write()
-fout.Close()
+if dump_gen:
+    gen_writer.close()
+else:
+    writer.close()
     
@@ -0,0 +1,132 @@
+'''
+Buffered writer of the flat trees of the inspectors, with typed branches.
+
+The inspectors used to fill a TNtuple (all branches float32) with one PyROOT call per candidate:
+    ntuple.Fill(array('f', tofill.values()))
+Here the rows are only kept in a list, and every block_size rows they are converted to one numpy array per branch,
+of the type of the branch, and written with a loop in C++ (one Fill per row, no python in between).
+The run, lumi, event numbers are 64 bit integers, charges, pdg ids and counters 32 bit integers,
+the flags booleans, and all the rest float32 as before (NaN when not set):
+    writer = TreeWriter(path, branches, types = inspector_types(branches))
+    writer.fill(tofill)           # per candidate, in place of ntuple.Fill
+    writer.fill_columns(columns)  # or whole columns at once, dict branch -> array
+    writer.close()
+'''
+
+from __future__ import print_function
+import numpy as np
+import ROOT
+
+leaf_types = {
+    np.dtype(np.bool_  ) : 'O',
+    np.dtype(np.int32  ) : 'I',
+    np.dtype(np.int64  ) : 'L',
+    np.dtype(np.float32) : 'F',
+    np.dtype(np.float64) : 'D',
+}
+
+_fill_code = '''
+#include "TTree.h"
+#include <cstring>
+#include <vector>
+void tree_writer_fill(TTree* tree, const std::vector<Long_t>& columns, const std::vector<Long_t>& buffers, const std::vector<int>& sizes, Long64_t nrows)
+{
+    for (Long64_t i = 0; i < nrows; ++i) {
+        for (size_t j = 0; j < columns.size(); ++j)
+            std::memcpy((char*)buffers[j], (char*)columns[j] + i * sizes[j], sizes[j]);
+        tree->Fill();
+    }
+}
+'''
+
+def _declare():
+    if not hasattr(ROOT, 'tree_writer_fill'):
+        ROOT.gInterpreter.Declare(_fill_code)
+    return ROOT.tree_writer_fill
+
+def inspector_types(branches):
+    '''
+    Types of the branches of the inspectors that are set for all the filled candidates, float32 for the others
+    '''
+    types = dict()
+    for name in branches:
+        if name in ['run', 'lumi', 'event']:
+            types[name] = np.int64
+        elif name in ['n_jpsi', 'jpsi_status', 'bhad_pdgid', 'bhad_q', 'mu1_q', 'mu2_q']:
+            types[name] = np.int32
+        elif name == 'is3m' or name.startswith('is_'):
+            types[name] = np.bool_
+    return types
+
+def _vector(values, kind):
+    vector = ROOT.std.vector(kind)()
+    for value in values:
+        vector.push_back(value)
+    return vector
+
+class TreeWriter(object):
+
+    def __init__(self, path, branches, types = None, tree = 'tree', block_size = 10000):
+        types = types or dict()
+        self.branches = list(branches)
+        self.dtypes = [np.dtype(types.get(name, np.float32)) for name in self.branches]
+        self.block_size = block_size
+        self.rows = []
+        self.entries = 0
+        self.fout = ROOT.TFile(path, 'recreate')
+        self.tree = ROOT.TTree(tree, tree)
+        # one element buffer per branch, the C++ loop copies each row there before the Fill
+        self.buffers = [np.zeros(1, dtype = dtype) for dtype in self.dtypes]
+        for name, dtype, buffer in zip(self.branches, self.dtypes, self.buffers):
+            self.tree.Branch(name, buffer, '%s/%s' %(name, leaf_types[dtype]))
+        self._fill = _declare()
+        self._addresses = _vector([buffer.ctypes.data for buffer in self.buffers], 'Long_t')
+        self._sizes = _vector([dtype.itemsize for dtype in self.dtypes], 'int')
+
+    def fill(self, row):
+        '''
+        One row: dict branch -> value (as tofill) or the values in the order of the branches
+        '''
+        if isinstance(row, dict):
+            row = [row[name] for name in self.branches]
+        self.rows.append(tuple(row))
+        if len(self.rows) >= self.block_size:
+            self.flush()
+
+    def _column(self, name, dtype, values):
+        values = np.asarray(values, dtype = np.float64 if dtype.kind != 'f' else dtype)
+        if dtype.kind != 'f':
+            if np.isnan(values).any():
+                raise ValueError('branch %s of type %s is not set (NaN) for some rows' %(name, dtype))
+            values = values.astype(dtype)
+        return np.ascontiguousarray(values)
+
+    def _write(self, columns, nrows):
+        addresses = _vector([column.ctypes.data for column in columns], 'Long_t')
+        self._fill(self.tree, addresses, self._addresses, self._sizes, nrows)
+        self.entries += nrows
+
+    def flush(self):
+        if not self.rows:
+            return
+        table = list(zip(*self.rows))
+        columns = [self._column(name, dtype, values) for name, dtype, values in zip(self.branches, self.dtypes, table)]
+        self._write(columns, len(self.rows))
+        self.rows = []
+
+    def fill_columns(self, columns):
+        '''
+        Whole columns, dict branch -> array (all the branches, same length)
+        '''
+        self.flush()
+        columns = [self._column(name, dtype, columns[name]) for name, dtype in zip(self.branches, self.dtypes)]
+        nrows = len(columns[0]) if columns else 0
+        for start in range(0, nrows, self.block_size):
+            block = [column[start:start + self.block_size] for column in columns]
+            self._write(block, len(block[0]))
+
+    def close(self):
+        self.flush()
+        self.fout.cd()
+        self.tree.Write()
+        self.fout.Close()
@@ -1,55 +1,175 @@
-import ROOT
-from hammer.hammerlib import Hammer, IOBuffer, Particle, Process, FourMomentum, WTerm
-from hammer import hepmc, pdg
-from root_pandas import read_root, to_root
+'''
+Batch construction of the Hammer processes from columnar gen-level arrays.
+
+The per-event path of the hammer scripts reads each branch of each event through PyROOT, builds a ROOT LorentzVector
+per particle to go from (pt, eta, phi, m) to (e, px, py, pz) and then the Hammer objects one attribute at a time.
+Here all the kinematics is converted at once with numpy, the arrays are turned into plain python lists once,
+and the only python work left per event is the construction of the Hammer objects themselves.
+
+    bc, jpsi, lepton, neutrino = bc_jpsi_lnu(df, 'bhad', 'jpsi', 'mu3', bc_pdgid = df.bhad_pdgid, lepton_mass = 0.1056)
+    processes = build_processes(bc, [jpsi, lepton, neutrino])
+    weights = evaluate(ham, processes, schemes, len(df))
+
+Each particle is a pair (p4, pdgid): p4 with shape (n_events, 4) as (e, px, py, pz), pdgid a number or an array;
+take(particles, mask) keeps only some of the events (e.g. the ones not in the weight cache).
+
+Micro-benchmark of the per-event and batch paths on an inspector tree (construction only, or with the Hammer weights):
+    python vectorizer.py --input flat_tree_bc_newtaubranches.root --maxevents 20000 [--hammer]
+'''
+
+from time import time
+from datetime import datetime, timedelta
+from argparse import ArgumentParser
 import numpy as np
-# from numba import float32    # import the types
-# from numba.experimental import jitclass
 from hammer.hammerlib import Hammer, IOBuffer, Particle, Process, FourMomentum, WTerm
 from hammer import hepmc, pdg
 
-# spec = [
-#     ('e' , float32),
-#     ('px', float32),
-#     ('py', float32),
-#     ('pz', float32),
-# ]
-# 
-# @jitclass(spec)
-# class MyFourMomentum(FourMomentum):
-#     def __init__(self, e, px, py, pz):
-#         self = FourMomentum(e, px, py, pz)
-# 
-# @np.vectorize
-# class MyFourMomentum(FourMomentum):
-#     def __init__(self, e, px, py, pz):
-#         self = FourMomentum(e, px, py, pz)
+def p4_from_ptetaphim(pt, eta, phi, m):
+    '''
+    (e, px, py, pz), shape (n, 4), as ROOT's PtEtaPhiM4D (negative masses as -m^2)
+    '''
+    pt, eta, phi, m = [np.asarray(x, dtype = np.float64) for x in (pt, eta, phi, m)]
+    px = pt * np.cos(phi)
+    py = pt * np.sin(phi)
+    pz = pt * np.sinh(eta)
+    e = np.sqrt(np.maximum(px**2 + py**2 + pz**2 + m * np.abs(m), 0.))
+    return np.stack([e, px, py, pz], axis = 1)
+
+def p4_columns(df, prefix, mass = None, mass_suffix = 'm'):
+    '''
+    Four momenta from the columns <prefix>_pt, _eta, _phi and _<mass_suffix>, or a fixed mass
+    '''
+    m = df['%s_%s' %(prefix, mass_suffix)] if mass is None else np.full(len(df), mass)
+    return p4_from_ptetaphim(df['%s_pt' %prefix], df['%s_eta' %prefix], df['%s_phi' %prefix], m)
+
+def bc_jpsi_lnu(df, bc, jpsi, lepton, bc_pdgid = 541, lepton_pdgid = -13, neutrino_pdgid = 14, lepton_mass = None, mass_suffix = 'm'):
+    '''
+    Particles of Bc -> J/psi l nu from the columns with the prefixes bc, jpsi and lepton,
+    the neutrino as Bc - J/psi - l (as in the hammer scripts)
+    '''
+    bc_p4 = p4_columns(df, bc, mass_suffix = mass_suffix)
+    jpsi_p4 = p4_columns(df, jpsi, mass_suffix = mass_suffix)
+    lepton_p4 = p4_columns(df, lepton, lepton_mass, mass_suffix = mass_suffix)
+    return (bc_p4, bc_pdgid), (jpsi_p4, 443), (lepton_p4, lepton_pdgid), (bc_p4 - jpsi_p4 - lepton_p4, neutrino_pdgid)
+
+def take(particles, mask):
+    '''
+    The particles (p4, pdgid) of the events selected by mask (boolean or indices)
+    '''
+    return tuple((p4[mask], pdgid if np.ndim(pdgid) == 0 else np.asarray(pdgid)[mask]) for p4, pdgid in particles)
 
+def _pdgids(pdgid, n):
+    return np.broadcast_to(np.asarray(pdgid), (n,)).astype(np.int64).tolist()
 
-def MyFourMomentum(e, px, py, pz):
-    return FourMomentum(e, px, py, pz)
+def build_processes(parent, daughters):
+    '''
+    Generator of the Hammer processes parent -> daughters, one per event
+    '''
+    particles = [parent] + list(daughters)
+    n = len(parent[0])
+    # python lists: iterating them is much faster than indexing numpy arrays element by element
+    p4s = [np.asarray(p4, dtype = np.float64).tolist() for p4, pdgid in particles]
+    pdgids = [_pdgids(pdgid, n) for p4, pdgid in particles]
+    for i in range(n):
+        process = Process()
+        indices = [process.add_particle(Particle(FourMomentum(*p4[i]), pdgid[i])) for p4, pdgid in zip(p4s, pdgids)]
+        process.add_vertex(indices[0], indices[1:])
+        yield process
 
-def MyParticle(e, px, py, pz, pdgid):
-    p4 = FourMomentum(e, px, py, pz)
-    return Particle(p4, np.int32(pdgid))
+def evaluate(ham, processes, schemes, n, verbose = True):
+    '''
+    Weights of the schemes (dict scheme -> array of n entries) for the processes of n events
+    '''
+    weights = dict((k, np.full(n, np.nan)) for k in schemes)
+    start = time()
+    for i, process in enumerate(processes):
+        if verbose and i%1000==0:
+            speed = float(i)/max(time()-start, 1e-9)
+            eta = datetime.now() + timedelta(seconds=(n-i) / max(0.1, speed))
+            print('\t===> processing %d / %d event \t completed %.1f%s \t %.1f ev/s \t ETA %s s' %(i, n, float(i)/n*100., '%', speed, eta.strftime('%Y-%m-%d %H:%M:%S')))
+        ham.init_event()
+        ham.add_process(process)
+        ham.process_event()
+        for k in schemes:
+            weights[k][i] = ham.get_weight(k)
+    return weights
 
-# vectorize
-FourMomentumVec = np.frompyfunc(MyFourMomentum, 4, 1)
-ParticleVec = np.frompyfunc(MyParticle, 5, 1)
+def _hammer():
+    ham = Hammer()
+    ham.include_decay("BcJpsiMuNu")
+    ham.set_ff_input_scheme({'BcJpsi':'Kiselev'})
+    ham.add_ff_scheme('bglvar', {'BcJpsi':'BGLVar'})
+    ham.set_units("GeV")
+    ham.init_run()
+    return ham
 
-es   = np.ones(10)*10.
-pxs  = np.ones(10)*2.
-pys  = np.ones(10)*1.
-pzs  = np.ones(10)*3.
-pdgids = np.ones(10)*541.
+def per_event_path(tree, ham, maxevents):
+    '''
+    As the hammer scripts: PyROOT branches and LorentzVectors, one event at a time
+    '''
+    import ROOT
+    weights = []
+    for i, ev in enumerate(tree):
+        if (i+1)>maxevents: break
+        if not ev.is_jpsi_mu: continue
+        if not ev.is3m: continue
+        thebc_p4   = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(ev.bhad_pt, ev.bhad_eta, ev.bhad_phi, ev.bhad_m)
+        themu_p4   = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(ev.mu3_pt , ev.mu3_eta , ev.mu3_phi , 0.1056   )
+        thejpsi_p4 = ROOT.Math.LorentzVector('ROOT::Math::PtEtaPhiM4D<double>')(ev.jpsi_pt, ev.jpsi_eta, ev.jpsi_phi, ev.jpsi_m)
+        thenu_p4   = thebc_p4 - themu_p4 - thejpsi_p4
+        thebc   = Particle(FourMomentum(thebc_p4.e()  , thebc_p4.px()  , thebc_p4.py()  , thebc_p4.pz()  ), ev.bhad_pdgid)
+        themu   = Particle(FourMomentum(themu_p4.e()  , themu_p4.px()  , themu_p4.py()  , themu_p4.pz()  ), -13          )
+        thejpsi = Particle(FourMomentum(thejpsi_p4.e(), thejpsi_p4.px(), thejpsi_p4.py(), thejpsi_p4.pz()), 443          )
+        thenu   = Particle(FourMomentum(thenu_p4.e()  , thenu_p4.px()  , thenu_p4.py()  , thenu_p4.pz())  , 14           )
+        Bc2JpsiLNu = Process()
+        thebc_idx   = Bc2JpsiLNu.add_particle(thebc  )
+        themu_idx   = Bc2JpsiLNu.add_particle(themu  )
+        thejpsi_idx = Bc2JpsiLNu.add_particle(thejpsi)
+        thenu_idx   = Bc2JpsiLNu.add_particle(thenu  )
+        Bc2JpsiLNu.add_vertex(thebc_idx, [thejpsi_idx, themu_idx, thenu_idx])
+        if ham is not None:
+            ham.init_event()
+            ham.add_process(Bc2JpsiLNu)
+            ham.process_event()
+            weights.append(ham.get_weight('bglvar'))
+    return np.array(weights)
 
-four_momenta = FourMomentumVec(es, pxs, pys, pzs)
-particles = ParticleVec(es, pxs, pys, pzs, pdgids)
+def batch_path(fname, ham, where, maxevents):
+    from root_pandas import read_root
+    columns = ['bhad_pt', 'bhad_eta', 'bhad_phi', 'bhad_m', 'bhad_pdgid', 'mu3_pt', 'mu3_eta', 'mu3_phi', 'jpsi_pt', 'jpsi_eta', 'jpsi_phi', 'jpsi_m']
+    df = read_root(fname, 'tree', columns = columns, where = where, stop = maxevents)
+    bc, jpsi, mu, nu = bc_jpsi_lnu(df, 'bhad', 'jpsi', 'mu3', bc_pdgid = df.bhad_pdgid, lepton_mass = 0.1056)
+    processes = build_processes(bc, [jpsi, mu, nu])
+    if ham is None:
+        for process in processes: pass
+        return np.array([])
+    return evaluate(ham, processes, ['bglvar'], len(df), verbose = False)['bglvar']
 
-# fname = 'flat_tree_bc_chunk0.root'
-# tree_df = read_root(fname, 'tree', where='is_jpsi_mu & is3m')
+if __name__ == '__main__':
 
+    parser = ArgumentParser()
+    parser.add_argument('--input'    , default = 'flat_tree_bc_newtaubranches.root', help = 'inspector tree of the Bc -> J/psi mu events')
+    parser.add_argument('--maxevents', default = 20000, type = int, help = 'entries of the tree to read')
+    parser.add_argument('--hammer'   , action = 'store_true', help = 'also compute the weights (Kiselev -> BGL), not only the processes')
+    args = parser.parse_args()
 
+    import ROOT
+    fin = ROOT.TFile.Open(args.input)
+    tree = fin.Get('tree')
+    # the same first entries of the tree for the two paths
+    maxevents = min(args.maxevents, tree.GetEntries())
 
+    results = dict()
+    for name in ['per event', 'batch']:
+        ham = _hammer() if args.hammer else None
+        start = time()
+        if name == 'per event':
+            weights = per_event_path(tree, ham, maxevents)
+        else:
+            weights = batch_path(args.input, ham, 'is_jpsi_mu & is3m', maxevents)
+        results[name] = (time() - start, np.nan_to_num(weights))
+        print('%-10s %8.2f s' %(name, results[name][0]))
 
-# FourMomentum(10., 2., 1., 3.)
\ No newline at end of file
+    print('speedup of the batch path: %.1fx' %(results['per event'][0] / results['batch'][0]))
+    if args.hammer and len(results['batch'][1]):
+        print('largest difference of the weights: %.2e' %np.max(np.abs(results['per event'][1] - results['batch'][1])))
@@ -16,6 +16,8 @@ from new_branches import to_define
 from selections import preselection, preselection_mc, pass_id, fail_id
 from create_datacard_3dfit import create_datacard_pass,create_datacard_fail
 from plot_shape_nuisances import plot_shape_nuisances
+from histos import binnings_nd
+from ndhistos import NDBinning, book_nd, project, chosen_cells, unroll
 
 #options
 shape_nuisances = True
@@ -46,6 +48,9 @@ def make_directories(label):
     os.system('mkdir -p multi_plots/%s/unrolled/fail_region/pdf/' %label)
     os.system('mkdir -p multi_plots/%s/unrolled/fail_region/png/' %label)
     os.system('mkdir -p multi_plots/%s/datacards' %label)
+    # 1D projections of the templates
+    os.system('mkdir -p multi_plots/%s/projections/pdf/' %label)
+    os.system('mkdir -p multi_plots/%s/projections/png/' %label)
 
 def create_legend(temp_hists, sample_names, titles):
     '''
@@ -60,7 +65,7 @@ def create_legend(temp_hists, sample_names, titles):
     leg.SetNColumns(3)
     k = list(temp_hists.keys())[0]
     for kk in sample_names:
-        leg.AddEntry(temp_hists[k]['%s_%s' %(k, kk)].GetValue(), titles[kk], 'F' if kk!='data' else 'EP')
+        leg.AddEntry(temp_hists[k]['%s_%s' %(k, kk)], titles[kk], 'F' if kk!='data' else 'EP')
     return leg
 
 
@@ -121,6 +126,51 @@ def make_binbybin(hist, flag, label, name):
         histo_down.Write()
     fout.Close()
 
+axis_titles = {
+    'E_mu_star' : 'E_{#mu}*',
+    'm_miss_sq' : 'm_{miss}^{2}',
+    'Q_sq'      : 'q^{2}',
+}
+
+def plot_projection(c1, main_pad, label, binning, var, nd_hists, nd_hists_fake):
+    '''
+    Control plot of the pass region templates projected on var, 
+    with the fakes from the fail region as in the q2 plots
+    '''
+    hists = dict((kk, project(vv, binning, 'proj_%s_%s' %(var, kk), [var])) for kk, vv in nd_hists.items())
+    fakes = project(nd_hists_fake['data'], binning, 'proj_%s_fakes' %var, [var])
+    for kk, vv in nd_hists_fake.items():
+        if kk == 'data': continue
+        fakes.Add(project(vv, binning, 'proj_%s_fail_%s' %(var, kk), [var]), -1.)
+    if flat_fakerate:
+        fakes.Scale(weights['fakes'])
+
+    ths1 = ROOT.THStack('proj_stack_%s' %var, '')
+    for kk, hh in hists.items():
+        if kk == 'data': continue
+        hh.SetLineColor(colours[kk])
+        hh.SetFillColor(colours[kk])
+        ths1.Add(hh)
+    fakes.SetLineColor(colours['fakes'])
+    fakes.SetFillColor(colours['fakes'])
+    fakes.SetFillStyle(1001)
+    ths1.Add(fakes)
+
+    c1.cd()
+    main_pad.cd()
+    main_pad.SetLogy(False)
+    ths1.Draw('hist')
+    ths1.GetXaxis().SetTitle(axis_titles.get(var, var))
+    ths1.GetYaxis().SetTitle('Events')
+    ths1.SetMaximum(max(ths1.GetMaximum(), hists['data'].GetMaximum()) * 1.5)
+    ths1.SetMinimum(0.)
+    hists['data'].Draw('EP SAME')
+    CMS_lumi(main_pad, 4, 0, cmsText = 'CMS', extraText = ' Preliminary', lumi_13TeV = '')
+    c1.Modified()
+    c1.Update()
+    c1.SaveAs('multi_plots/%s/projections/pdf/%s.pdf' %(label, var))
+    c1.SaveAs('multi_plots/%s/projections/png/%s.png' %(label, var))
+
 def save_weights(label, sample_names, weights):
     with open('multi_plots/%s/normalisations.txt' %label, 'w') as ff:
         for sname in sample_names: 
@@ -347,39 +397,47 @@ if __name__ == '__main__':
                'dd':'Q_sq>=8.7 && Q_sq<=10'
     }
 
-    #define 2D histos in the 4 qsq regions for each sample (e_mu_star vs m_miss_sq)
-    histos = {}
-    nbins = 25
-    for iter_q2,k in enumerate(q2_bins):
-        histos['estar_mmiss_'+k] = ROOT.RDF.TH2DModel('estar_mmiss_'+k, '', nbins, 0.3, 2.3, nbins, 0, 9)
+    # one 3D template (e_mu_star vs m_miss_sq vs q2) for each sample, filled in a single event loop:
+    # the 2D histos of the 4 q2 regions are its slices
+    binning = NDBinning('estar_mmiss_q2', ['E_mu_star', 'm_miss_sq', 'Q_sq'], binnings_nd)
 
-    temp_hists           = {}
-    temp_hists_fake      = {}
-    for iter_q2,k in enumerate(q2_bins):
-        temp_hists[k]           = {}
-        temp_hists_fake[k]      = {}
-        for kk, vv in samples.items():
-            temp_hists[k]['%s_%s'%(k,kk)]= vv.Filter(' && '.join([pass_id,q2_bins[k]])).Histo2D(histos['estar_mmiss_'+k],'E_mu_star','m_miss_sq','total_weight')
-            if flat_fakerate:
-                temp_hists_fake[k]['%s_%s'%(k,kk)]= vv.Filter(' && '.join([fail_id,q2_bins[k]])).Histo2D(histos['estar_mmiss_'+k],'E_mu_star','m_miss_sq','total_weight')
-            else:
-                temp_hists_fake[k]['%s_%s'%(k,kk)]= vv.Filter(' && '.join([fail_id,q2_bins[k]])).Histo2D(histos['estar_mmiss_'+k],'E_mu_star','m_miss_sq','total_weight_wfr')
+    nd_hists      = {}
+    nd_hists_fake = {}
+    for kk, vv in samples.items():
+        nd_hists     [kk] = book_nd(vv.Filter(pass_id), binning, 'total_weight')
+        nd_hists_fake[kk] = book_nd(vv.Filter(fail_id), binning, 'total_weight' if flat_fakerate else 'total_weight_wfr')
         
     # Create pointers for the shapes histos 
     if shape_nuisances:
         print('====> shape uncertainties histos')
-        unc_hists      = {} # pass muon ID category
-        unc_hists_fake = {} # pass muon ID category
-        for k in q2_bins:
-            # Compute them only for the variables that we want to fit
-            unc_hists     [k] = {}
-            unc_hists_fake[k] = {}
-            for kk, vv in shapes.items():
-                unc_hists      [k]['%s_%s'%(k,kk)]= vv.Filter(' && '.join([pass_id,q2_bins[k]])).Histo2D(histos['estar_mmiss_'+k],'E_mu_star','m_miss_sq','shape_weight')
-                if flat_fakerate:
-                    unc_hists_fake[k]['%s_%s'%(k,kk)]= vv.Filter(' && '.join([fail_id,q2_bins[k]])).Histo2D(histos['estar_mmiss_'+k],'E_mu_star','m_miss_sq','shape_weight')
-                else:
-                    unc_hists_fake[k]['%s_%s'%(k,kk)]= vv.Filter(' && '.join([fail_id,q2_bins[k]])).Histo2D(histos['estar_mmiss_'+k],'E_mu_star','m_miss_sq','shape_weight_wfr')
+        nd_unc_hists      = {} # pass muon ID category
+        nd_unc_hists_fake = {} # fail muon ID category
+        for kk, vv in shapes.items():
+            nd_unc_hists     [kk] = book_nd(vv.Filter(pass_id), binning, 'shape_weight')
+            nd_unc_hists_fake[kk] = book_nd(vv.Filter(fail_id), binning, 'shape_weight' if flat_fakerate else 'shape_weight_wfr')
+
+    # all the samples together (each one has its own dataframe)
+    if hasattr(ROOT.RDF, 'RunGraphs'):
+        ROOT.RDF.RunGraphs(list(nd_hists.values()) + list(nd_hists_fake.values()))
+
+    # q2 slices as 2D histos
+    def q2_slices(nd, iter_q2, k):
+        return dict(('%s_%s'%(k,kk), project(vv, binning, 'estar_mmiss_%s_%s'%(k,kk), ['E_mu_star', 'm_miss_sq'], fixed = {'Q_sq':iter_q2})) for kk, vv in nd.items())
+
+    temp_hists      = {}
+    temp_hists_fake = {}
+    unc_hists       = {}
+    unc_hists_fake  = {}
+    for iter_q2,k in enumerate(q2_bins):
+        temp_hists     [k] = q2_slices(nd_hists     , iter_q2, k)
+        temp_hists_fake[k] = q2_slices(nd_hists_fake, iter_q2, k)
+        if shape_nuisances:
+            unc_hists     [k] = q2_slices(nd_unc_hists     , iter_q2, k)
+            unc_hists_fake[k] = q2_slices(nd_unc_hists_fake, iter_q2, k)
+
+    # 1D control plots of the three variables, projected from the same templates
+    for var in binning.variables:
+        plot_projection(c1, main_pad, label, binning, var, nd_hists, nd_hists_fake)
 
     ######################################
     ############## PLOTS #################
@@ -425,7 +483,7 @@ if __name__ == '__main__':
             # adding 2d histos to their stack
             if key=='%s_data'%k: continue
             #ihist.Draw('hist' + 'same'*(i>0))
-            ths1.Add(ihist.GetValue())
+            ths1.Add(ihist)
 
         # apply same aestethics to pass and fail (needed?)
         for kk in temp_hists[k].keys():
@@ -443,7 +501,7 @@ if __name__ == '__main__':
                 kv[1].SetLineColor(ROOT.kBlack)
                 continue
             else:
-                fakes.Add(kv[1].GetPtr(), -1.)
+                fakes.Add(kv[1], -1.)
 
         fakes.SetFillColor(colours['fakes'])
         fakes.SetFillStyle(1001)
@@ -458,81 +516,22 @@ if __name__ == '__main__':
         ########### UNROLLED HISTOS #########
         #####################################
 
-        #dic of final unrolled_bins
-        hists_unrolled = {}
-        hists_unrolled_fake = {}
-
-        #dic of tmp unrolled_bins (with empty bins also)
-        tmp_hists_unrolled = {}
-        tmp_hists_unrolled_fake = {}
+        # the 2D histos are unrolled to be used with combine.
+        # Only the bins where data in the pass region are >= 80 are kept, both for pass and fail region
+        chosen_bins = chosen_cells(temp_hists[k]['%s_data'%k], 80.)
 
         #####################################
         ########### Pass Region ### #########
         #####################################
 
-        # Compute the unrolled stack histo (with empty bins also)
+        hists_unrolled = {}
         maxima_unrolled = []
-        for i, kv in enumerate(temp_hists[k].items()):
-            key = kv[0]
-            ihist = kv[1]
-            tmp_ihist_unrolled = ROOT.TH1F('unrolled '+ key,'unrolled '+ key,ihist.GetNbinsY()*ihist.GetNbinsX(),0.,ihist.GetNbinsY()*ihist.GetNbinsX())
-            for ybin in range(1,ihist.GetNbinsY()):
-                for xbin in range(1,ihist.GetNbinsX()):
-                    tmp_ihist_unrolled.SetBinContent(xbin + ihist.GetNbinsX()*(ybin -1), ihist.GetBinContent(xbin,ybin))
-                    tmp_ihist_unrolled.SetBinError(xbin + ihist.GetNbinsX()*(ybin -1), ihist.GetBinError(xbin,ybin))
-            sample_name = key.split(k+'_')[1]
-            tmp_ihist_unrolled.SetLineColor(colours[sample_name])
-            tmp_ihist_unrolled.SetFillColor(colours[sample_name] if key!='%s_data'%k else ROOT.kWhite)
-            #tmp_ihist_unrolled.Draw('hist'+'same'*(i>0))
-            tmp_hists_unrolled[key] = tmp_ihist_unrolled
-            maxima_unrolled.append(tmp_ihist_unrolled.GetMaximum())
-
-
-        # Compute the unrolled histo for the fakes sample, to add to the total dictionary of unrolled histos
-        tmp_fakes_unrolled = ROOT.TH1F('unrolled '+ key,'unrolled '+ key,ihist.GetNbinsY()*ihist.GetNbinsX(),0.,ihist.GetNbinsY()*ihist.GetNbinsX())
-        for ybin in range(1,fakes.GetNbinsY()):
-            for xbin in range(1,fakes.GetNbinsX()):
-                tmp_fakes_unrolled.SetBinContent(xbin + fakes.GetNbinsX()*(ybin -1), fakes.GetBinContent(xbin,ybin))
-                tmp_fakes_unrolled.SetBinError(xbin + fakes.GetNbinsX()*(ybin -1), fakes.GetBinError(xbin,ybin))
-        tmp_hists_unrolled['%s_fakes'%k] = tmp_fakes_unrolled
-
-        # Create unrolled_histo that do not have empty bins
-        # in chosen_bins, the final choice of bins that are not empty
-        total_bins = [i for i in range(1,tmp_hists_unrolled['%s_data'%k].GetNbinsX()+1)]
-        chosen_bins = []
-        # loop over the total bins
-        for b in range(1,len(total_bins)+1):
-            #loop over the samples
-            flag_not_empty = 0. # this flag becomes 1. if the bin is not empty for at least one sample 
-            for i, kv in enumerate(temp_hists[k].items()):
-                key = kv[0]
-                #check which bins to keep
-                if tmp_hists_unrolled[key].GetBinContent(b) >= 80.:
-                    flag_not_empty = 1.
-                else:
-                    if key == '%s_data'%k: #if data is empty, we skip the bin anyway
-                        flag_not_empty = 0.
-                        break 
-            if flag_not_empty:
-                chosen_bins.append(b)
-        
-        # create the non empty histos + stack
-        for i, kv in enumerate(temp_hists[k].items()):
-            key = kv[0]
-            ihist_unrolled = ROOT.TH1F('clean_unrolled_'+ key,'', len(chosen_bins),0., len(chosen_bins))
-            ibin = 1
-            for b in range(1,tmp_hists_unrolled[key].GetNbinsX()+1):
-                if b in chosen_bins:
-                    if tmp_hists_unrolled[key].GetBinContent(b) <= 0.:
-                        ihist_unrolled.SetBinContent(ibin, 0.01)
-                    else:
-                        ihist_unrolled.SetBinContent(ibin,tmp_hists_unrolled[key].GetBinContent(b))
-                    ihist_unrolled.SetBinError(ibin,tmp_hists_unrolled[key].GetBinError(b))
-                    ibin += 1
+        for key, ihist in temp_hists[k].items():
+            maxima_unrolled.append(ihist.GetMaximum())
+            ihist_unrolled = unroll(ihist, 'clean_unrolled_'+ key, chosen_bins)
             sample_name = key.split(k+'_')[1]
             ihist_unrolled.SetLineColor(colours[sample_name])
             ihist_unrolled.SetFillColor(colours[sample_name] if key!='%s_data'%k else ROOT.kWhite)
-            #ihist_unrolled.Draw('hist'+'same'*(i>0))
             hists_unrolled[key]=ihist_unrolled
             if key == '%s_data'%k: continue # we don't want data in the stack
             ths1_unrolled.Add(ihist_unrolled)
@@ -541,56 +540,14 @@ if __name__ == '__main__':
         ########### Fail Region #############
         #####################################
 
+        hists_unrolled_fake = {}
         maxima_unrolled_fake = []
-        for i, kv in enumerate(temp_hists_fake[k].items()):
-            key = kv[0]
-            ihist = kv[1]
-            # Compute the unrolled stack histo (with empty bins also)
-            tmp_ihist_unrolled = ROOT.TH1F('unrolled '+ key,'unrolled '+ key,ihist.GetNbinsY()*ihist.GetNbinsX(),0.,ihist.GetNbinsY()*ihist.GetNbinsX())
-            for ybin in range(1,ihist.GetNbinsY()):
-                for xbin in range(1,ihist.GetNbinsX()):
-                    tmp_ihist_unrolled.SetBinContent(xbin + ihist.GetNbinsX()*(ybin -1), ihist.GetBinContent(xbin,ybin))
-                    tmp_ihist_unrolled.SetBinError(xbin + ihist.GetNbinsX()*(ybin -1), ihist.GetBinError(xbin,ybin))
-            sample_name = key.split(k+'_')[1]
-            tmp_ihist_unrolled.SetLineColor(colours[sample_name])
-            tmp_ihist_unrolled.SetFillColor(colours[sample_name] if key!='%s_data'%k else ROOT.kWhite)
-            #tmp_ihist_unrolled.Draw('hist'+'same'*(i>0))
-            tmp_hists_unrolled_fake[key] = tmp_ihist_unrolled
-            maxima_unrolled_fake.append(tmp_ihist_unrolled.GetMaximum())
-
-        tmp_hists_unrolled_fake['%s_fakes'%k] = tmp_fakes_unrolled
-
-        '''# in chosen_bins, the final choice of bins that are not empty
-        total_bins_fake = [i for i in range(1,tmp_hists_unrolled_fake['%s_data'%k].GetNbinsX()+1)]
-        chosen_bins_fake = []
-        # loop over the total bins
-        for b in range(1,len(total_bins_fake)+1):
-            #loop over the samples
-            flag_not_empty = 0. # this flag becomes 1. if the bin is not empty for at least one sample 
-            for i, kv in enumerate(tmp_hists_unrolled_fake.keys()):
-                key = kv
-                if tmp_hists_unrolled_fake[key].GetBinContent(b) >= 0.0001:
-                    flag_not_empty = 1.
-            if flag_not_empty:
-                chosen_bins_fake.append(b)
-        '''
-        # create the non empty histos + stack
-        for i, kv in enumerate(tmp_hists_unrolled_fake.keys()):
-            key = kv
-            ihist_unrolled = ROOT.TH1F('clean_unrolled_'+ key,'', len(chosen_bins),0., len(chosen_bins))
-            ibin = 1
-            for b in range(1,tmp_hists_unrolled_fake[key].GetNbinsX()+1):
-                if b in chosen_bins:
-                    if tmp_hists_unrolled_fake[key].GetBinContent(b) <= 0.:
-                        ihist_unrolled.SetBinContent(ibin, 0.01)
-                    else:
-                        ihist_unrolled.SetBinContent(ibin,tmp_hists_unrolled_fake[key].GetBinContent(b))
-                    ihist_unrolled.SetBinError(ibin,tmp_hists_unrolled_fake[key].GetBinError(b))
-                    ibin += 1
+        for key, ihist in list(temp_hists_fake[k].items()) + [('%s_fakes'%k, fakes)]:
+            maxima_unrolled_fake.append(ihist.GetMaximum())
+            ihist_unrolled = unroll(ihist, 'clean_unrolled_'+ key, chosen_bins)
             sample_name = key.split(k+'_')[1]
             ihist_unrolled.SetLineColor(colours[sample_name])
             ihist_unrolled.SetFillColor(colours[sample_name] if key!='%s_data'%k else ROOT.kWhite)
-            #ihist_unrolled.Draw('hist'+'same'*(i>0))
             hists_unrolled_fake[key]=ihist_unrolled
             if key == '%s_data'%k: continue # we don't want data in the stack
             ths1_unrolled_fake.Add(ihist_unrolled)
@@ -599,79 +556,9 @@ if __name__ == '__main__':
         ########### Unrolled histos for shape nuisances #############
         ############################################################
         if shape_nuisances:
-            #dic of final unrolled_bins
-            shapes_hists_unrolled = {}
-            shapes_hists_unrolled_fake = {}
-            
-            #dic of tmp unrolled_bins (with empty bins also)
-            tmp_shapes_hists_unrolled = {}
-            tmp_shapes_hists_unrolled_fake = {}
-            
-            
-            #####################################
-            ########### Pass Region ### #########
-            #####################################
-            
-            #loop on all the shapes
-            for i, kv in enumerate(unc_hists[k].items()):
-                key = kv[0]
-                ihist = kv[1]
-                unc_ihist_unrolled = ROOT.TH1F('unrolled '+ key,'unrolled '+ key,ihist.GetNbinsY()*ihist.GetNbinsX(),0.,ihist.GetNbinsY()*ihist.GetNbinsX())
-                for ybin in range(1,ihist.GetNbinsY()):
-                    for xbin in range(1,ihist.GetNbinsX()):
-                        unc_ihist_unrolled.SetBinContent(xbin + ihist.GetNbinsX()*(ybin -1), ihist.GetBinContent(xbin,ybin))
-                        unc_ihist_unrolled.SetBinError(xbin + ihist.GetNbinsX()*(ybin -1), ihist.GetBinError(xbin,ybin))
-                sample_name = key.split(k+'_')[1]
-                tmp_shapes_hists_unrolled[key] = unc_ihist_unrolled
-	
-            #chosen bins is the same as before	        
-            # create the non empty histos + stack
-            for i, kv in enumerate(unc_hists[k].items()):
-                key = kv[0]
-                ihist_unrolled = ROOT.TH1F('clean_unrolled_'+ key,'', len(chosen_bins),0., len(chosen_bins))
-                ibin = 1
-                for b in range(1,tmp_shapes_hists_unrolled[key].GetNbinsX()+1):
-                    if b in chosen_bins:
-                        if tmp_shapes_hists_unrolled[key].GetBinContent(b) <= 0.:
-                            ihist_unrolled.SetBinContent(ibin, 0.01)
-                        else:
-                            ihist_unrolled.SetBinContent(ibin,tmp_shapes_hists_unrolled[key].GetBinContent(b))
-                        ihist_unrolled.SetBinError(ibin,tmp_shapes_hists_unrolled[key].GetBinError(b))
-                        ibin += 1
-                sample_name = key.split(k+'_')[1]
-                shapes_hists_unrolled[key]=ihist_unrolled
-
-            #####################################
-            ########### Fail Region #############
-            #####################################
-            
-            for i, kv in enumerate(unc_hists_fake[k].items()):
-                key = kv[0]
-                ihist = kv[1]
-                # Compute the unrolled stack histo (with empty bins also)
-                unc_ihist_unrolled = ROOT.TH1F('unrolled '+ key,'unrolled '+ key,ihist.GetNbinsY()*ihist.GetNbinsX(),0.,ihist.GetNbinsY()*ihist.GetNbinsX())
-                for ybin in range(1,ihist.GetNbinsY()):
-                    for xbin in range(1,ihist.GetNbinsX()):
-                        unc_ihist_unrolled.SetBinContent(xbin + ihist.GetNbinsX()*(ybin -1), ihist.GetBinContent(xbin,ybin))
-                        unc_ihist_unrolled.SetBinError(xbin + ihist.GetNbinsX()*(ybin -1), ihist.GetBinError(xbin,ybin))
-                tmp_shapes_hists_unrolled_fake[key] = unc_ihist_unrolled
-                	
-            	        
-            # create the non empty histos + stack
-            for i, kv in enumerate(tmp_shapes_hists_unrolled_fake.keys()):
-                key = kv
-                ihist_unrolled = ROOT.TH1F('clean_unrolled_'+ key,'', len(chosen_bins),0., len(chosen_bins))
-                ibin = 1
-                for b in range(1,tmp_shapes_hists_unrolled_fake[key].GetNbinsX()+1):
-                    if b in chosen_bins:
-                        if tmp_shapes_hists_unrolled_fake[key].GetBinContent(b) <= 0.:
-                            ihist_unrolled.SetBinContent(ibin, 0.01)
-                        else:
-                            ihist_unrolled.SetBinContent(ibin,tmp_shapes_hists_unrolled_fake[key].GetBinContent(b))
-                        ihist_unrolled.SetBinError(ibin,tmp_shapes_hists_unrolled_fake[key].GetBinError(b))
-                        ibin += 1
-                shapes_hists_unrolled_fake[key]=ihist_unrolled
-
+            # chosen bins is the same as before
+            shapes_hists_unrolled      = dict((key, unroll(ihist, 'clean_unrolled_'+ key, chosen_bins)) for key, ihist in unc_hists     [k].items())
+            shapes_hists_unrolled_fake = dict((key, unroll(ihist, 'clean_unrolled_'+ key, chosen_bins)) for key, ihist in unc_hists_fake[k].items())
         ######################################################################
         if shape_nuisances:
             make_binbybin(hists_unrolled['%s_jpsi_x_mu'%k],'pass', label, k)
@@ -14,6 +14,7 @@ import numpy as np
 from array import array
 import pickle
 import math 
+import hashlib
 from bokeh.palettes import viridis, all_palettes
 from keras.models import load_model
 from ROOT import * #Added for the dimuon combinatorial background
@@ -33,15 +34,129 @@ from create_datacard_v3 import create_datacard_ch1, create_datacard_ch2, create_
 
 ROOT.ROOT.EnableImplicitMT()
 
+tree_name = 'BTo3Mu'
+tree_dir = '/pnfs/psi.ch/cms/trivcat/store/user/friti/dataframes_Dec2021/'
+input_files = {
+    'SR'  : ['%s/data_fakerate_only_iso.root'%(tree_dir)],
+    'SBs' : ['%s/datalowmass_fakerate_only_iso.root'%(tree_dir), '%s/data_fakerate_only_iso.root'%(tree_dir)],
+}
+
+# Fits and shapes are cached here, keyed by selection, input files and fit model:
+# a rerun with the same inputs doesn't need any new fit
+dimuon_cache_dir = 'plots_ul/dimuon_cache/'
+# change it every time the fit model (pdfs, ranges, binning) or the shape extrapolation change
+dimuon_fit_model = 'SBExpo[2.4,2.8]_CBGaussExpo[2.96,3.23]_LSB[2.89,3.01]_v1'
+
+def files_signature(files):
+    # name, size and modification time of the inputs; if they change the cache is not valid anymore
+    signature = []
+    for ifile in files:
+        try:
+            signature.append((ifile, os.path.getsize(ifile), int(os.path.getmtime(ifile))))
+        except OSError:
+            signature.append((ifile, None, None))
+    return signature
+
+def cache_key(*items):
+    return hashlib.sha1(repr(items).encode()).hexdigest()
+
+def load_cached_norm(key):
+    path = dimuon_cache_dir + 'norm_%s.pkl' %key
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as fin:
+        return pickle.load(fin)
+
+def save_cached_norm(key, norm):
+    os.makedirs(dimuon_cache_dir, exist_ok = True)
+    with open(dimuon_cache_dir + 'norm_%s.pkl' %key, 'wb') as fout:
+        pickle.dump(norm, fout)
+
+def load_cached_shape(key):
+    path = dimuon_cache_dir + 'shape_%s.root' %key
+    if not os.path.exists(path):
+        return None
+    fin = ROOT.TFile.Open(path)
+    shape = fin.Get('dimuon')
+    shape.SetDirectory(0)
+    fin.Close()
+    return shape
+
+def save_cached_shape(key, shape):
+    os.makedirs(dimuon_cache_dir, exist_ok = True)
+    fout = ROOT.TFile.Open(dimuon_cache_dir + 'shape_%s.root' %key, 'RECREATE')
+    fout.cd()
+    shape.Clone('dimuon').Write()
+    fout.Close()
+
+def run_together(results):
+    # all the booked histos filled in one concurrent event loop (when RunGraphs is available)
+    if hasattr(ROOT.RDF, 'RunGraphs'):
+        ROOT.RDF.RunGraphs(results)
+    return [result.GetValue() for result in results]
+
+ROOT.gInterpreter.Declare(
+    """
+    using Vec_t = const ROOT::VecOps::RVec<float>;
+    float SB_extrap(float B_pt_reco, int variable, float scale,
+    float pt1, float eta1, float phi1, float m1, 
+    float pt2, float eta2, float phi2, float m2, 
+    float pt3, float eta3, float phi3, float m3) {
+    float Bc_MASS_PDG = 6.275;
+    //cout<<pt1<<" "<<eta1<<" "<<phi1<<" "<<m1<<" "<<endl;
+    //cout<<pt2<<" "<<eta2<<" "<<phi2<<" "<<m2<<" "<<endl;
+    //cout<<pt3<<" "<<eta3<<" "<<phi3<<" "<<m3<<" "<<endl;
+    //cout<<scale<<endl;
+    TLorentzVector mu1_p4, mu2_p4, mu3_p4, B_coll_p4, Jpsi_p4_extrap;
+    mu1_p4.SetPtEtaPhiM(pt1, eta1, phi1, m1);
+    mu2_p4.SetPtEtaPhiM(pt1, eta2, phi2, m2);
+    mu3_p4.SetPtEtaPhiM(pt3, eta3, phi3, m3);
+    B_coll_p4.SetPtEtaPhiM(B_pt_reco, (mu1_p4 + mu2_p4 + mu3_p4).Eta(), (mu1_p4 + mu2_p4 + mu3_p4).Phi(), Bc_MASS_PDG);
+    Jpsi_p4_extrap.SetPtEtaPhiM((mu1_p4 + mu2_p4).Pt(), (mu1_p4 + mu2_p4).Eta(), (mu1_p4 + mu2_p4).Phi(), (mu1_p4 + mu2_p4).M()*scale);
+  
+    Float_t Q_sq = (B_coll_p4 - Jpsi_p4_extrap)*(B_coll_p4 - Jpsi_p4_extrap);
+    Float_t m_miss_sq = (B_coll_p4 - Jpsi_p4_extrap - mu3_p4)*(B_coll_p4 - Jpsi_p4_extrap - mu3_p4);
+    Float_t pt_var = (Jpsi_p4_extrap.Pt() - mu3_p4.Pt());
+    Float_t pt_miss_vec = ((B_coll_p4 - mu3_p4 - Jpsi_p4_extrap).Pt());
+    Float_t pt_miss_scal = (B_coll_p4.Pt() - mu3_p4.Pt() - Jpsi_p4_extrap.Pt());
+
+    Float_t RetVar;
+    if (variable == 0)      RetVar = Q_sq;
+    else if (variable == 1) RetVar = m_miss_sq;
+    else if (variable == 2) RetVar = pt_var;
+    else if (variable == 3) RetVar = pt_miss_vec;
+    else if (variable == 4) RetVar = pt_miss_scal;
+
+    return RetVar;
+    }
+    """)
+
+dataframes = {}
+def get_dataframes():
+    '''
+    The SR and SBs dataframes (with the new columns) are built only once and shared by all the calls
+    '''
+    if not dataframes:
+        for s in ["SR", "SBs"]:
+            dataframes[s] = ROOT.RDataFrame(tree_name, input_files[s][0] if len(input_files[s]) == 1 else set(input_files[s]))
+            for new_column, new_definition in to_define: 
+                if dataframes[s].HasColumn(new_column):
+                    continue       
+                dataframes[s] = dataframes[s].Define(new_column, new_definition)
+    return dict(dataframes)
+
 
 def get_DiMuonBkgNorm():
     
-    tree_name = 'BTo3Mu'
-    tree_dir = '/pnfs/psi.ch/cms/trivcat/store/user/friti/dataframes_Dec2021/'
+    filterSBsShape = ' & '.join([prepreselection])
+    filterSRloose = ' & '.join([prepreselection, triggerselection])
+    key = cache_key('norm', filterSBsShape, filterSRloose, files_signature(input_files['SR']), files_signature(input_files['SBs']), dimuon_fit_model)
+    Normalization = load_cached_norm(key)
+    if Normalization is not None:
+        print("DiMuon Normalization from cache: ", Normalization)
+        return Normalization
 
-    dataframe = {}
-    dataframe["SR"] = ROOT.RDataFrame(tree_name,'%s/data_fakerate_only_iso.root'%(tree_dir))
-    dataframe["SBs"] = ROOT.RDataFrame(tree_name,{'%s/datalowmass_fakerate_only_iso.root'%(tree_dir), '%s/data_fakerate_only_iso.root'%(tree_dir)})
+    dataframe = get_dataframes()
     regions = list(dataframe.keys())
 
     print("==================================")
@@ -67,9 +182,11 @@ def get_DiMuonBkgNorm():
 
     ### Get the histo with the full invariant-mass distribution to extract the Dimuon shape ###
     #filterSBsShape = ' & '.join([prepreselection,'Bmass<6.3', pass_id])
-    filterSBsShape = ' & '.join([prepreselection])
     JpsimassShape["SBs"] = dataframe["SBs"].Filter(filterSBsShape).Histo1D(("mJpsiSBShape","mJpsiSBShape;  m_{#mu#mu} [GeV]; Events/0.01 GeV", 200, 2, 4), "jpsi_mass")
-    HJpsimassSB = JpsimassShape["SBs"].GetValue()
+    ### Get the histo in the SR with the SR loose selection to perform the fit to get the Dimuon normalization ###
+    #filterSR = ' & '.join([preselectionSRForSB, pass_id])
+    JpsimassSRloose["SR"] = dataframe["SR"].Filter(filterSRloose).Histo1D(("mJpsiSRloose","mJpsiSRloose;  m_{#mu#mu} [GeV]; Events/0.01 GeV", 200, 2, 4), "jpsi_mass")
+    HJpsimassSB, HJpsimassSRloose = run_together([JpsimassShape["SBs"], JpsimassSRloose["SR"]])
     if(sanitycheck):
         SBMasscanvas = TCanvas("SBMassc", "SBMassc")
         SBMasscanvas.cd()
@@ -77,11 +194,6 @@ def get_DiMuonBkgNorm():
         SBMasscanvas.Print('SBMasscanvas.png')
     
     
-    ### Get the histo in the SR with the SR loose selection to perform the fit to get the Dimuon normalization ###
-    #filterSR = ' & '.join([preselectionSRForSB, pass_id])
-    filterSRloose = ' & '.join([prepreselection, triggerselection])
-    JpsimassSRloose["SR"] = dataframe["SR"].Filter(filterSRloose).Histo1D(("mJpsiSRloose","mJpsiSRloose;  m_{#mu#mu} [GeV]; Events/0.01 GeV", 200, 2, 4), "jpsi_mass")
-    HJpsimassSRloose = JpsimassSRloose["SR"].GetValue()
     #SRdataset = ROOT.RooDataSet('SRdataset', 'SRdataset', tree_name, filterSR)
     if(sanitycheck):
         SRMasscanvas = TCanvas("SRMassc", "SRMassc")
@@ -259,6 +371,7 @@ def get_DiMuonBkgNorm():
     # The final NBkg = NBkg_SRloose * N_entires_SR/N_entries_SRloose. This function returns the Number of background events/N_entries_SRloose. The function get_DiMuonBkg() will later scale it by the missing N_entires_SR
     if(sanitycheck):
         print("NBkg: ", NBkg.getVal(), "Jpsimass[SRloose].Integral(): ",  JpsimassSRloose["SR"].Integral(), "NormalizationSRloose: ", Normalization)
+    save_cached_norm(key, Normalization)
     print("DiMuon Normalization done")
     return Normalization
     
@@ -275,17 +388,18 @@ def get_DiMuonBkg(NormSRloose, selection, var_index, isfail, label, channel):
     if not os.path.exists('plots_ul/'+label+'/dimuon/'):
         os.makedirs('plots_ul/'+label+'/dimuon/')
 
-    tree_name = 'BTo3Mu'
-    tree_dir = '/pnfs/psi.ch/cms/trivcat/store/user/friti/dataframes_Dec2021/'
-        
-    dataframe = {}
+    # the shape depends on the normalisation from the SRloose fit and on the global selections, so they go in the key too
+    key = cache_key('shape', NormSRloose, prepreselection, triggerselection, selection, var_index, isfail, files_signature(input_files['SR']), files_signature(input_files['SBs']), dimuon_fit_model)
+    DimuonShape = load_cached_shape(key)
+    if DimuonShape is not None:
+        print("DiMuon shape for %s from cache"%channel)
+        return DimuonShape
+
     #dataframe["SR"] = ROOT.RDataFrame(tree_name,'%s/data_ptmax_merged_fakerate.root'%(tree_dir))
-    #dataframe["SR"] = ROOT.RDataFrame(tree_name,'%s/data_fakerate_only_iso.root'%(tree_dir))
     #dataframe["ResonantTrg"] = ROOT.RDataFrame(tree_name,'%s/data_ptmax_merged_fakerate.root'%(tree_dir)) 
     #dataframe["NonResonantTrg"] = ROOT.RDataFrame(tree_name,'%s/datalowmass_ptmax_merged_fakerate.root'%(tree_dir))
     #dataframe["SBs"] = ROOT.RDataFrame(tree_name,{'%s/datalowmass_ptmax_merged_fakerate_2.root'%(tree_dir), '%s/data_ptmax_merged_fakerate.root'%(tree_dir)})
-    dataframe["SR"] = ROOT.RDataFrame(tree_name,'%s/data_fakerate_only_iso.root'%(tree_dir))
-    dataframe["SBs"] = ROOT.RDataFrame(tree_name,{'%s/datalowmass_fakerate_only_iso.root'%(tree_dir), '%s/data_fakerate_only_iso.root'%(tree_dir)})
+    dataframe = get_dataframes()
     regions = list(dataframe.keys())
     
     print("==================================")
@@ -328,12 +442,7 @@ def get_DiMuonBkg(NormSRloose, selection, var_index, isfail, label, channel):
     filterLSB = ' & '.join([preselectionLSB, pass_id])
     hists[s] = dataframe[s].Filter(filterLSB).Histo1D(('Q2LSB%s'%s,"Q2LSB;  q^{2} [GeV^{2}]; Events/0.5 GeV",24,0,10.5),"Q_sq")'''
 
-    #define new columns
-    for s in ["SR", "SBs"]:
-        for new_column, new_definition in to_define: 
-            if dataframe[s].HasColumn(new_column):
-                continue       
-            dataframe[s] = dataframe[s].Define(new_column, new_definition)
+    # the new columns are already defined in get_dataframes
         
     ### Get the relevant histos and information from the DataFrames  ###
     
@@ -345,11 +454,11 @@ def get_DiMuonBkg(NormSRloose, selection, var_index, isfail, label, channel):
     ### SR for this category ###
     filterSR = ' & '.join([prepreselection, triggerselection, selection])
     JpsimassSR["SR"] = dataframe["SR"].Filter(filterSR).Histo1D(("mJpsiSR","mJpsiSR;  m_{#mu#mu} [GeV]; Events/0.01 GeV", 200, 2, 4), "jpsi_mass")
-    HJpsimassSR = JpsimassSR["SR"].GetValue()
               
     ### Get the scale factor to extrapolate the LSB to the SR ###
     JpsimassLSB["SBs"] = dataframe["SBs"].Filter(filterLSB).Histo1D(("mJpsiLSB","mJpsiLSB;  m_{#mu#mu} [GeV]; Events/0.01 GeV", 200, 2, 4), "jpsi_mass")
-    HJpsimassLSB = JpsimassLSB["SBs"].GetValue()
+    # SR, LSB and Q2 LSB histos in one go
+    HJpsimassSR, HJpsimassLSB, HQ2LSB = run_together([JpsimassSR["SR"], JpsimassLSB["SBs"], Q2hist["SBs"]])
     Jpsi_scale = 3.0969/HJpsimassLSB.GetMean()
     dataframe["SBs"] = dataframe["SBs"].Filter(filterLSB).Define("Jpsi_scale", "{}".format(Jpsi_scale))
     if(sanitycheck):
@@ -371,41 +480,7 @@ def get_DiMuonBkg(NormSRloose, selection, var_index, isfail, label, channel):
     #############################
                 
                 
-    ROOT.gInterpreter.Declare(
-        """
-        using Vec_t = const ROOT::VecOps::RVec<float>;
-        float SB_extrap(float B_pt_reco, int variable, float scale,
-        float pt1, float eta1, float phi1, float m1, 
-        float pt2, float eta2, float phi2, float m2, 
-        float pt3, float eta3, float phi3, float m3) {
-        float Bc_MASS_PDG = 6.275;
-        //cout<<pt1<<" "<<eta1<<" "<<phi1<<" "<<m1<<" "<<endl;
-        //cout<<pt2<<" "<<eta2<<" "<<phi2<<" "<<m2<<" "<<endl;
-        //cout<<pt3<<" "<<eta3<<" "<<phi3<<" "<<m3<<" "<<endl;
-        //cout<<scale<<endl;
-        TLorentzVector mu1_p4, mu2_p4, mu3_p4, B_coll_p4, Jpsi_p4_extrap;
-        mu1_p4.SetPtEtaPhiM(pt1, eta1, phi1, m1);
-        mu2_p4.SetPtEtaPhiM(pt1, eta2, phi2, m2);
-        mu3_p4.SetPtEtaPhiM(pt3, eta3, phi3, m3);
-        B_coll_p4.SetPtEtaPhiM(B_pt_reco, (mu1_p4 + mu2_p4 + mu3_p4).Eta(), (mu1_p4 + mu2_p4 + mu3_p4).Phi(), Bc_MASS_PDG);
-        Jpsi_p4_extrap.SetPtEtaPhiM((mu1_p4 + mu2_p4).Pt(), (mu1_p4 + mu2_p4).Eta(), (mu1_p4 + mu2_p4).Phi(), (mu1_p4 + mu2_p4).M()*scale);
-      
-        Float_t Q_sq = (B_coll_p4 - Jpsi_p4_extrap)*(B_coll_p4 - Jpsi_p4_extrap);
-        Float_t m_miss_sq = (B_coll_p4 - Jpsi_p4_extrap - mu3_p4)*(B_coll_p4 - Jpsi_p4_extrap - mu3_p4);
-        Float_t pt_var = (Jpsi_p4_extrap.Pt() - mu3_p4.Pt());
-        Float_t pt_miss_vec = ((B_coll_p4 - mu3_p4 - Jpsi_p4_extrap).Pt());
-        Float_t pt_miss_scal = (B_coll_p4.Pt() - mu3_p4.Pt() - Jpsi_p4_extrap.Pt());
-
-        Float_t RetVar;
-        if (variable == 0)      RetVar = Q_sq;
-        else if (variable == 1) RetVar = m_miss_sq;
-        else if (variable == 2) RetVar = pt_var;
-        else if (variable == 3) RetVar = pt_miss_vec;
-        else if (variable == 4) RetVar = pt_miss_scal;
-
-        return RetVar;
-        }
-        """)
+    # SB_extrap is declared once, when the module is imported
 
     if var_index == 0:
         dataframe["SBs"] = dataframe["SBs"].Filter(filterLSB).Define("Q_sq_extrap", "SB_extrap(Bpt_reco, 0, Jpsi_scale, mu1pt, mu1eta, mu1phi, mu1mass, mu2pt, mu2eta, mu2phi, mu2mass, kpt, keta, kphi, kmass)")
@@ -469,6 +544,8 @@ def get_DiMuonBkg(NormSRloose, selection, var_index, isfail, label, channel):
         DiMuonShapeCanvas.cd()
         DimuonShape.GetValue().Draw("pe")
         DiMuonShapeCanvas.Print('plots_ul/'+label+'/dimuon/NormalizedDiMuonShape'+channel+'.png')
+    DimuonShape = DimuonShape.GetValue()
+    save_cached_shape(key, DimuonShape)
     print("DiMuon done")
     return DimuonShape
                     
@@ -0,0 +1,42 @@
+'''
+BDTs evaluated on the fly in RDataFrame, from the C++ headers exported by bdt/bdt_export.py.
+    df = define_bdt(df, 'exported_bdt/v1.h')
+defines bdt_mu_v1, bdt_tau_v1, bdt_bkg_v1 (or bdt_v1 for a binary BDT), so the scores and the cuts on them
+are computed in the same event loop of the histos, with no rescoring of the samples after each training.
+The exported function has no state, so it runs with all the threads of EnableImplicitMT.
+'''
+
+import os
+import ROOT
+
+def declare_bdt(header):
+    '''
+    Declares the exported function (once) and returns the version of the BDT (name of the header)
+    '''
+    version = os.path.splitext(os.path.basename(header))[0]
+    if not hasattr(ROOT, 'eval_bdt_%s' %version):
+        if not ROOT.gInterpreter.Declare('#include "%s"' %os.path.abspath(header)):
+            raise RuntimeError('cannot declare the BDT in %s' %header)
+    return version
+
+def bdt_inputs(version):
+    return str(getattr(ROOT, 'eval_bdt_%s_inputs' %version)).split(',')
+
+def bdt_outputs(version):
+    return str(getattr(ROOT, 'eval_bdt_%s_outputs' %version)).split(',')
+
+def define_bdt(df, header, inputs = None):
+    '''
+    inputs: optional dict feature -> expression, for the features that are not columns of the dataframe
+    '''
+    version = declare_bdt(header)
+    inputs = inputs or dict()
+    arguments = ', '.join('(double)(%s)' %inputs.get(feature, feature) for feature in bdt_inputs(version))
+    scores = 'bdt_scores_%s' %version
+    if not df.HasColumn(scores):
+        df = df.Define(scores, 'eval_bdt_%s(%s)' %(version, arguments))
+    for i, output in enumerate(bdt_outputs(version)):
+        column = '%s_%s' %(output, version)
+        if not df.HasColumn(column):
+            df = df.Define(column, '%s[%d]' %(scores, i))
+    return df
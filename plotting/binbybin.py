@@ -0,0 +1,96 @@
+'''
+Bin by bin statistical uncertainties for the datacards, computed with numpy.
+For a histo with n bins all the n Up and n Down variations are built at once as (n, n+2) arrays
+(one row per nuisance, underflow and overflow included), and only then converted to TH1D.
+Names, contents and errors are the same as the ones of the old bin by bin loops in showplots.
+'''
+
+import numpy as np
+from hist_arrays import th1, th1_to_arrays, arrays_to_th1
+
+def _axis(hist):
+    hist = th1(hist)
+    nbins = hist.GetNbinsX()
+    return nbins, hist.GetBinLowEdge(1), hist.GetBinLowEdge(nbins + 1)
+
+def _inner(array):
+    # the new histos have empty underflow and overflow
+    array = array.copy()
+    array[0] = 0.
+    array[-1] = 0.
+    return array
+
+def binbybin_shapes(hist, sample, channel):
+    '''
+    One nuisance per bin for the given sample: in bin i the content is moved by +-error,
+    all the other bins are the nominal ones.
+    Returns the list of histos [Up1, Down1, Up2, Down2, ...] ready to be written
+    '''
+    nbins, xmin, xmax = _axis(hist)
+    contents, errors = th1_to_arrays(hist)
+    contents = _inner(contents)
+    errors = _inner(errors)
+
+    rows = np.arange(nbins)
+    bins = rows + 1
+    up_contents   = np.tile(contents, (nbins, 1))
+    down_contents = np.tile(contents, (nbins, 1))
+    up_errors     = np.tile(errors, (nbins, 1))
+    down_errors   = np.tile(errors, (nbins, 1))
+
+    up_contents  [rows, bins] += errors[bins]
+    down_contents[rows, bins] -= errors[bins]
+    up_errors    [rows, bins] = errors[bins] + np.sqrt(errors[bins])
+    down_errors  [rows, bins] = errors[bins] - np.sqrt(errors[bins])
+
+    bbb_histos = []
+    for i in rows:
+        name = sample+'_'+sample+'_bbb'+str(i+1)+channel
+        bbb_histos.append(arrays_to_th1(name+'Up_'+channel, up_contents[i], up_errors[i], nbins, xmin, xmax))
+        bbb_histos.append(arrays_to_th1(name+'Down_'+channel, down_contents[i], down_errors[i], nbins, xmin, xmax))
+    return bbb_histos
+
+def single_binbybin_shapes(hists, channel):
+    '''
+    Only one nuisance per bin for the jpsi_x_mu contributions in hists (sigma, xi, lambdazero_b):
+    the quadratic sum of their stat uncertainties is assigned to the sample with the largest one.
+    If at least two of them are (almost) empty in a bin, there is no nuisance for that bin.
+    Returns the list of histos to be written and, for each bin, the sample that takes the nuisance (or None)
+    '''
+    names = list(hists.keys())
+    nbins = th1(hists[names[0]]).GetNbinsX()
+    arrays = [th1_to_arrays(hists[s]) for s in names]
+    contents = np.stack([c for c, e in arrays])[:, 1:nbins+1]
+    errors   = np.stack([e for c, e in arrays])[:, 1:nbins+1]
+
+    # if at least 2 of them are zero, no uncertainty bc gives problems to the fit
+    empty = dict(zip(names, contents < 0.01))
+    skip = np.zeros(nbins, dtype = bool)
+    for s1,s2 in zip(['sigma','xi','lambdazero_b'],['xi','lambdazero_b','sigma']):
+        skip |= empty[s1] & empty[s2]
+
+    stat_unc = np.sqrt((errors*errors).sum(axis = 0))
+    highest = np.argmax(errors, axis = 0)
+
+    which_sample = []
+    bbb_histos = []
+    for i in range(nbins):
+        if skip[i]:
+            which_sample.append(None)
+            continue
+        highest_stat = names[highest[i]]
+        which_sample.append(highest_stat)
+
+        nb, xmin, xmax = _axis(hists[highest_stat])
+        up_contents, up_errors = [_inner(a) for a in arrays[highest[i]]]
+        down_contents = up_contents.copy()
+        down_errors = up_errors.copy()
+        up_contents  [i+1] += stat_unc[i]
+        down_contents[i+1] -= stat_unc[i]
+        up_errors    [i+1] = stat_unc[i] + np.sqrt(stat_unc[i])
+        down_errors  [i+1] = stat_unc[i] + np.sqrt(stat_unc[i])
+
+        name = 'jpsi_x_mu_from_'+highest_stat+'_'+'jpsi_x_mu_from_'+highest_stat+'_single_bbb'+str(i+1)+channel
+        bbb_histos.append(arrays_to_th1(name+'Up_'+channel, up_contents, up_errors, nb, xmin, xmax))
+        bbb_histos.append(arrays_to_th1(name+'Down_'+channel, down_contents, down_errors, nb, xmin, xmax))
+    return bbb_histos, which_sample
@@ -1,3 +1,13 @@
+def open_card(label, channel, var_name, card = None):
+    # card is an already open (even in-memory) file where to write the datacard text
+    if card is not None:
+        return card
+    return open('plots_ul/%s/datacards/datacard_%s_%s.txt' %(label, channel, var_name),"w")
+
+def close_card(f, card = None):
+    if card is None:
+        f.close()
+
 def first_part(f, channel, histos, shapes_file = 'param_ws.root wspace:$PROCESS_$CHANNEL wspace:$PROCESS_$SYSTEMATIC_$CHANNEL'):
     f.write("imax 1 number of channels \n")
     f.write("jmax * number of backgrounds \n")
@@ -285,10 +295,10 @@ def dimuon(f, channel, histos):
     
 # date; name of the variable for the fit; array of histos; bool if jpsi_x_mu must be split; bool if we also have the high mass low mass split; jpsi_x_mu_samples
 
-def create_datacard_ch1(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples, which_sample_bbb_unc =[], add_dimuon = False):
+def create_datacard_ch1(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples, which_sample_bbb_unc =[], add_dimuon = False, card = None):
     jpsi_split = len(jpsi_x_mu_samples)>1
 
-    f= open('plots_ul/%s/datacards/datacard_ch1_%s.txt' %(label, var_name),"w")
+    f = open_card(label, 'ch1', var_name, card)
 
     first_part(f, 'ch1', histos)
     rates(f, 'ch1', histos, jpsi_split)
@@ -363,12 +373,12 @@ def create_datacard_ch1(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples,
             if histo == 'jpsi_x_mu' and jpsi_split:
                 continue
             f.write('bkg rateParam ch1 %s 1 \n'%histo)
-    f.close()
+    close_card(f, card)
 
-def create_datacard_ch2(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples, which_sample_bbb_unc =[]):
+def create_datacard_ch2(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples, which_sample_bbb_unc =[], card = None):
     jpsi_split = len(jpsi_x_mu_samples)>1
 
-    f= open('plots_ul/%s/datacards/datacard_ch2_%s.txt' %(label, var_name),"w")
+    f = open_card(label, 'ch2', var_name, card)
     first_part(f, 'ch2', histos)
     rates(f, 'ch2', histos, jpsi_split)
     norm_nuisances(f, 'ch2', histos, jpsi_split)
@@ -447,12 +457,12 @@ def create_datacard_ch2(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples,
     for i in range(1,histos['data'].GetNbinsX()+1):
         f.write("fakes_ch2_bin"+str(i)+"  flatParam \n")
 
-    f.close()
+    close_card(f, card)
 
-def create_datacard_ch3(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples, which_sample_bbb_unc =[],add_dimuon = False):
+def create_datacard_ch3(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples, which_sample_bbb_unc =[],add_dimuon = False, card = None):
     jpsi_split = len(jpsi_x_mu_samples)>1
 
-    f= open('plots_ul/%s/datacards/datacard_ch3_%s.txt' %(label, var_name),"w")
+    f = open_card(label, 'ch3', var_name, card)
     first_part(f, 'ch3', histos)
     rates(f, 'ch3', histos, jpsi_split)
     norm_nuisances(f, 'ch3', histos,jpsi_split)
@@ -491,13 +501,13 @@ def create_datacard_ch3(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples,
             f.write('bkg rateParam ch3 %s 1 \n'%histo)
 
     #f.write("fake_rate rateParam ch3 fakes 1\n")
-    f.close()
+    close_card(f, card)
 
 
-def create_datacard_ch4(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples, which_sample_bbb_unc =[]):
+def create_datacard_ch4(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples, which_sample_bbb_unc =[], card = None):
     jpsi_split = len(jpsi_x_mu_samples)>1
 
-    f= open('plots_ul/%s/datacards/datacard_ch4_%s.txt' %(label, var_name),"w")
+    f = open_card(label, 'ch4', var_name, card)
     first_part(f, 'ch4', histos)
     rates(f, 'ch4', histos, jpsi_split)
     norm_nuisances(f, 'ch4', histos, jpsi_split)
@@ -538,12 +548,12 @@ def create_datacard_ch4(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples,
         f.write("fakes_ch4_bin"+str(i)+"  flatParam \n")
         #f.write("stat_bin"+str(i)+"  flatParam \n")
 
-    f.close()
+    close_card(f, card)
   
-def create_datacard_ch1_onlypass(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples, which_sample_bbb_unc =[]):
+def create_datacard_ch1_onlypass(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples, which_sample_bbb_unc =[], card = None):
     jpsi_split = len(jpsi_x_mu_samples)>1
 
-    f= open('plots_ul/%s/datacards/datacard_ch1_%s.txt' %(label, var_name),"w")
+    f = open_card(label, 'ch1', var_name, card)
 
     shapes_file = 'datacard_ch1_%s.root $PROCESS_$CHANNEL $PROCESS_$SYSTEMATIC_$CHANNEL'%var_name
     first_part(f, 'ch1', histos, shapes_file)
@@ -615,12 +625,12 @@ def create_datacard_ch1_onlypass(label, var_name,  histos, hmlm_split, jpsi_x_mu
             if histo == 'jpsi_x_mu' and jpsi_split:
                 continue
             f.write('bkg rateParam ch1 %s 1 \n'%histo)
-    f.close()
+    close_card(f, card)
 
-def create_datacard_ch3_onlypass(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples, which_sample_bbb_unc =[]):
+def create_datacard_ch3_onlypass(label, var_name,  histos, hmlm_split, jpsi_x_mu_samples, which_sample_bbb_unc =[], card = None):
     jpsi_split = len(jpsi_x_mu_samples)>1
 
-    f= open('plots_ul/%s/datacards/datacard_ch3_%s.txt' %(label, var_name),"w")
+    f = open_card(label, 'ch3', var_name, card)
 
     shapes_file = 'datacard_ch3_%s.root $PROCESS_$CHANNEL $PROCESS_$SYSTEMATIC_$CHANNEL'%var_name
     first_part(f, 'ch3', histos, shapes_file)
@@ -656,4 +666,4 @@ def create_datacard_ch3_onlypass(label, var_name,  histos, hmlm_split, jpsi_x_mu
             if jpsi_split and histo == 'jpsi_x_mu':
                 continue
             f.write('bkg rateParam ch3 %s 1 \n'%histo)
-    f.close()
+    close_card(f, card)
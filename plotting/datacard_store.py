@@ -0,0 +1,103 @@
+'''
+In memory store of all the histograms that go in the datacards.
+Every nominal, systematic and bbb shape of a (channel, variable) card is kept in memory
+with its final combine name ($PROCESS_$CHANNEL or $PROCESS_$SYSTEMATIC_$CHANNEL),
+and only when the card is complete the text datacard and its root file are written together:
+ - both are first written to temporary files and then moved in place
+ - a sha1 of the text and of all the histos (names, contents, errors) is saved next to them;
+   if nothing changed from the previous run with the same label, nothing is rewritten
+'''
+
+import os
+import io
+import hashlib
+import ROOT
+import numpy as np
+from hist_arrays import th1, th1_to_arrays
+
+class DatacardStore(object):
+
+    def __init__(self, label, path = 'plots_ul', verbose = True):
+        self.label = label
+        self.path = path
+        self.verbose = verbose
+        self.histos = dict()
+
+    def card_path(self, channel, name, extension):
+        return '%s/%s/datacards/datacard_%s_%s.%s' %(self.path, self.label, channel, name, extension)
+
+    def add(self, channel, name, hist, hist_name):
+        '''
+        Stores a copy of hist with the name it must have in the root file of the datacard
+        '''
+        hh = th1(hist).Clone(hist_name)
+        hh.SetDirectory(0)
+        self.histos.setdefault((channel, name), dict())[hist_name] = hh
+        return hh
+
+    def add_histos(self, channel, name, histos):
+        # the histos are already named as combine wants them (bbb for example)
+        for hist in histos:
+            self.add(channel, name, hist, hist.GetName())
+
+    def release(self, channel, name):
+        # forget the histos of a card that is not going to be written
+        self.histos.pop((channel, name), None)
+
+    def get(self, channel, name):
+        return self.histos.get((channel, name), dict())
+
+    def content_hash(self, channel, name, text):
+        sha = hashlib.sha1(text.encode())
+        for hist_name, hist in sorted(self.get(channel, name).items()):
+            contents, errors = th1_to_arrays(hist)
+            sha.update(hist_name.encode())
+            sha.update(np.ascontiguousarray(contents).tobytes())
+            sha.update(np.ascontiguousarray(errors).tobytes())
+        return sha.hexdigest()
+
+    def is_unchanged(self, channel, name, digest):
+        hash_path = self.card_path(channel, name, 'sha1')
+        if not all(os.path.exists(self.card_path(channel, name, ext)) for ext in ['txt', 'root', 'sha1']):
+            return False
+        with open(hash_path) as fh:
+            return fh.read().strip() == digest
+
+    def write(self, channel, name, create_datacard, *args, **kwargs):
+        '''
+        Writes the text datacard (produced by create_datacard, one of the create_datacard_* functions,
+        called with card = an in-memory file) and the root file with all the stored histos of this card.
+        The histos of the card are released from memory after the writing.
+        Returns False if the card was already there and unchanged
+        '''
+        card = io.StringIO()
+        create_datacard(*args, card = card, **kwargs)
+        text = card.getvalue()
+        digest = self.content_hash(channel, name, text)
+
+        if self.is_unchanged(channel, name, digest):
+            if self.verbose: print("Datacard %s %s unchanged, not rewritten"%(channel, name))
+            self.release(channel, name)
+            return False
+
+        txt_path = self.card_path(channel, name, 'txt')
+        root_path = self.card_path(channel, name, 'root')
+        tmp_txt_path = self.card_path(channel, name + '_tmp', 'txt')
+        tmp_root_path = self.card_path(channel, name + '_tmp', 'root')
+
+        fout = ROOT.TFile.Open(tmp_root_path, 'RECREATE')
+        fout.cd()
+        for hist in self.get(channel, name).values():
+            hist.Write()
+        fout.Close()
+        with open(tmp_txt_path, 'w') as fh:
+            fh.write(text)
+
+        os.replace(tmp_root_path, root_path)
+        os.replace(tmp_txt_path, txt_path)
+        # the hash goes last: if something fails before, next run rewrites the card
+        with open(self.card_path(channel, name, 'sha1'), 'w') as fh:
+            fh.write(digest)
+
+        self.release(channel, name)
+        return True
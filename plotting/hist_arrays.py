@@ -0,0 +1,77 @@
+'''
+Helpers to move between ROOT histograms and numpy arrays.
+The arrays always include the underflow and overflow bins (index 0 and nbins+1),
+exactly as they are stored inside the TH1.
+'''
+
+import ROOT
+import numpy as np
+
+def th1(hist):
+    '''
+    Returns the TH1 behind an RDataFrame result pointer (or the histo itself)
+    '''
+    if hasattr(hist, 'GetValue'):
+        return hist.GetValue()
+    return hist
+
+def th1_contents(hist):
+    hist = th1(hist)
+    return np.frombuffer(hist.GetArray(), dtype = np.float64, count = hist.GetNcells()).copy()
+
+def th1_errors(hist):
+    '''
+    Same definition as TH1::GetBinError with the default error option:
+    sqrt(sumw2) if the histo has the sumw2 structure, sqrt(|content|) otherwise
+    '''
+    hist = th1(hist)
+    if hist.GetSumw2N():
+        sumw2 = np.frombuffer(hist.GetSumw2().GetArray(), dtype = np.float64, count = hist.GetNcells())
+        return np.sqrt(sumw2)
+    return np.sqrt(np.abs(th1_contents(hist)))
+
+def th1_to_arrays(hist):
+    return th1_contents(hist), th1_errors(hist)
+
+def arrays_to_th1(name, contents, errors, nbins, xmin, xmax, title = ''):
+    '''
+    Creates a TH1D with uniform binning and fills it (underflow and overflow included)
+    with the given contents and errors in one go
+    '''
+    hist = ROOT.TH1D(name, title, nbins, xmin, xmax)
+    hist.SetDirectory(0) # not owned by whatever file is open, we decide where to write it
+    hist.SetContent(np.ascontiguousarray(contents, dtype = np.float64))
+    hist.SetError(np.ascontiguousarray(errors, dtype = np.float64))
+    return hist
+
+def like_th1(template, name, contents, errors):
+    '''
+    Same as arrays_to_th1, but with the binning (also variable) of the template histo
+    '''
+    hist = th1(template).Clone(name)
+    hist.SetDirectory(0)
+    hist.Reset()
+    hist.SetContent(np.ascontiguousarray(contents, dtype = np.float64))
+    hist.SetError(np.ascontiguousarray(errors, dtype = np.float64))
+    return hist
+
+def clamp_empty_bins(hist, value = 0.0001):
+    '''
+    Bins with content <= 0 are set to value (the fit does not like empty bins).
+    The bins to be fixed are found with numpy, only those are touched
+    '''
+    hist = th1(hist)
+    contents = th1_contents(hist)[1:hist.GetNbinsX()+1]
+    for ibin in np.nonzero(contents <= 0)[0]:
+        hist.SetBinContent(int(ibin)+1, value)
+    return hist
+
+def write_histos(path, histos, option = 'UPDATE'):
+    '''
+    Writes a list of histos in the root file, opening it only once
+    '''
+    fout = ROOT.TFile.Open(path, option)
+    fout.cd()
+    for hist in histos:
+        hist.Write()
+    fout.Close()
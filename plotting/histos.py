@@ -273,3 +273,9 @@ histos['ip3d_sig'                  ] = (ROOT.RDF.TH1DModel('ip3d_sig'
 #histos['bdt_tau_mu_v2'                   ] = (ROOT.RDF.TH1DModel('bdt_tau_mu_v2'                   , '', 15,      0.,     1), 'BDT #tau vs #mu'                                                , 0)
 
 histos['norm'                      ] = (ROOT.RDF.TH1DModel('norm'                      , '',  1,      0,     1), 'normalisation'                                                 , 0)
+
+# binnings (bin edges) of the multi-dimensional templates, see ndhistos.py
+binnings_nd = dict()
+binnings_nd['E_mu_star'] = np.linspace(0.3, 2.3, 26)
+binnings_nd['m_miss_sq'] = np.linspace(0. , 9. , 26)
+binnings_nd['Q_sq'     ] = np.array([0., 6., 8., 8.7, np.nextafter(10., 11.)]) # q2 regions of 3dplot.py, 10 included
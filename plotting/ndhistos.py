@@ -0,0 +1,171 @@
+'''
+Multi-dimensional templates filled in a single event loop.
+
+An NDBinning is a list of variables with their bin edges (from histos.py, or given by hand).
+Each event gets the index of its global cell (first variable running fastest, as in the
+usual unrolling xbin + nx*(ybin-1)) computed in C++, and a sample is filled only once in a
+flat TH1D of the cell index. All the slices (for example the q2 regions of the 3D fit)
+and the projections are then taken from this single histo with numpy, with no other pass on the events.
+Events outside the binning go in the underflow of the flat histo and are ignored.
+
+The flat histo is the dense storage of the template ((ncells+2) doubles for contents and sumw2),
+the unrolling for the datacards keeps only the chosen (populated) cells.
+'''
+
+import ROOT
+import numpy as np
+from hist_arrays import th1, th1_to_arrays, arrays_to_th1
+
+ROOT.gInterpreter.Declare('''
+#ifndef NDHISTOS_GLOBAL_CELL
+#define NDHISTOS_GLOBAL_CELL
+long long nd_global_cell(const std::vector<std::vector<double>> &edges, const std::vector<double> &values){
+  long long cell = 0;
+  long long stride = 1;
+  for (size_t i = 0; i < edges.size(); ++i){
+    const auto &e = edges[i];
+    auto it = std::upper_bound(e.begin(), e.end(), values[i]);
+    if (it == e.begin() || it == e.end()) return -1;
+    cell += stride * (std::distance(e.begin(), it) - 1);
+    stride *= e.size() - 1;
+  }
+  return cell;
+}
+#endif
+''')
+
+_declared = set()
+
+def _edges(binning):
+    # bin edges from a histos.py entry, a TH1DModel or an explicit list of edges
+    if isinstance(binning, tuple):
+        binning = binning[0]
+    if hasattr(binning, 'GetHistogram'):
+        axis = binning.GetHistogram().GetXaxis()
+        return np.array([axis.GetBinLowEdge(i) for i in range(1, axis.GetNbins()+2)], dtype = np.float64)
+    return np.asarray(binning, dtype = np.float64)
+
+class NDBinning(object):
+
+    def __init__(self, name, variables, binnings):
+        '''
+        variables: list of columns of the dataframe
+        binnings:  dict variable -> bin edges, histos.py entry or TH1DModel (histos.binnings_nd, histos.histos, ...)
+        '''
+        self.name = name
+        self.variables = list(variables)
+        self.edges = [_edges(binnings[var]) for var in self.variables]
+        self.shape = tuple(len(edges)-1 for edges in self.edges)
+        self.ncells = int(np.prod(self.shape))
+        self.column = 'ndcell_%s' %name
+        self._declare()
+
+    def _declare(self):
+        if self.name in _declared:
+            return
+        edges = ', '.join('{%s}' %', '.join(repr(float(x)) for x in edges) for edges in self.edges)
+        args = ', '.join('double x%d' %i for i in range(len(self.variables)))
+        values = ', '.join('x%d' %i for i in range(len(self.variables)))
+        ROOT.gInterpreter.Declare('''
+        long long ndcell_%s(%s){
+          static const std::vector<std::vector<double>> edges = {%s};
+          return nd_global_cell(edges, {%s});
+        }
+        ''' %(self.name, args, edges, values))
+        _declared.add(self.name)
+
+    def axis(self, variable):
+        return self.variables.index(variable)
+
+    def model(self, name = None):
+        return ROOT.RDF.TH1DModel(name or self.name, '', self.ncells, 0., self.ncells)
+
+def book_nd(df, binning, weight = None, name = None):
+    '''
+    Books the flat histo of the cell index: nothing runs until one of the results is used,
+    so all the samples, regions and shape weights are filled in the same event loop
+    '''
+    if not df.HasColumn(binning.column):
+        df = df.Define(binning.column, 'ndcell_%s(%s)' %(binning.name, ', '.join(binning.variables)))
+    if weight is None:
+        return df.Histo1D(binning.model(name), binning.column)
+    return df.Histo1D(binning.model(name), binning.column, weight)
+
+def nd_arrays(hist, binning):
+    '''
+    Contents and sumw2 of the filled flat histo as arrays of shape binning.shape
+    '''
+    hist = th1(hist)
+    contents, errors = th1_to_arrays(hist)
+    # flat index: first variable fastest -> numpy (Fortran order)
+    contents = contents[1:binning.ncells+1].reshape(binning.shape, order = 'F')
+    sumw2 = (errors*errors)[1:binning.ncells+1].reshape(binning.shape, order = 'F')
+    return contents, sumw2
+
+def _reduce(array, binning, variables, fixed):
+    # restricts the fixed variables to one bin (or a slice of bins) and sums over all the others
+    index = [slice(None)] * len(binning.variables)
+    for var, ibin in (fixed or dict()).items():
+        index[binning.axis(var)] = ibin if isinstance(ibin, slice) else slice(ibin, ibin+1)
+    array = array[tuple(index)]
+    summed = tuple(i for i, var in enumerate(binning.variables) if var not in variables)
+    array = array.sum(axis = summed)
+    # order of the axes as requested
+    kept = [var for var in binning.variables if var in variables]
+    return np.transpose(array, [kept.index(var) for var in variables])
+
+def project(hist, binning, name, variables, fixed = None, title = ''):
+    '''
+    TH1D (one variable) or TH2D (two variables) with the binning of the variables,
+    summed over all the other variables. fixed = {variable: bin index (from 0) or slice}
+    restricts the other variables, e.g. a q2 region of the 3D template
+    '''
+    contents, sumw2 = nd_arrays(hist, binning)
+    contents = _reduce(contents, binning, variables, fixed)
+    sumw2 = _reduce(sumw2, binning, variables, fixed)
+    edges = [binning.edges[binning.axis(var)] for var in variables]
+    if len(variables) == 1:
+        hh = ROOT.TH1D(name, title, len(edges[0])-1, edges[0])
+    else:
+        hh = ROOT.TH2D(name, title, len(edges[0])-1, edges[0], len(edges[1])-1, edges[1])
+    hh.SetDirectory(0)
+    hh.Sumw2()
+    # root layout with underflow and overflow, x running fastest
+    padded = np.zeros([len(e)+1 for e in edges])
+    inner = tuple(slice(1, -1) for e in edges)
+    padded[inner] = contents
+    hh.SetContent(np.ascontiguousarray(padded.ravel(order = 'F')))
+    padded[inner] = np.sqrt(sumw2)
+    hh.SetError(np.ascontiguousarray(padded.ravel(order = 'F')))
+    return hh
+
+def unrolled_arrays(hist):
+    '''
+    Contents and errors of the bins (no underflow and overflow) of a TH1, TH2 or TH3,
+    unrolled with the first axis running fastest
+    '''
+    hist = th1(hist)
+    axes = [hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis()][:hist.GetDimension()]
+    shape = [axis.GetNbins()+2 for axis in reversed(axes)]
+    inner = tuple(slice(1, -1) for axis in axes)
+    contents, errors = th1_to_arrays(hist)
+    return contents.reshape(shape)[inner].ravel(), errors.reshape(shape)[inner].ravel()
+
+def chosen_cells(hist, threshold):
+    '''
+    Indices (from 0) of the unrolled bins of hist with content >= threshold
+    '''
+    return np.nonzero(unrolled_arrays(hist)[0] >= threshold)[0]
+
+def unroll(hist, name, cells = None, empty = 0.01, title = ''):
+    '''
+    1D histo for the datacards with one bin for each of the chosen cells of hist
+    (all of them if cells is None). Empty or negative bins are set to empty
+    '''
+    contents, errors = unrolled_arrays(hist)
+    if cells is not None:
+        contents = contents[cells]
+        errors = errors[cells]
+    contents = np.where(contents <= 0., empty, contents)
+    nbins = len(contents)
+    return arrays_to_th1(name, np.concatenate([[0.], contents, [0.]]), np.concatenate([[0.], errors, [0.]]), nbins, 0., nbins, title)
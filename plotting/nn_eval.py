@@ -0,0 +1,35 @@
+'''
+Fake-rate NNs evaluated on the fly in RDataFrame, from the C++ headers exported by fakerate/nn_export.py.
+    df = define_nn(df, 'exported_nn/onlydata_70.h')
+defines nn_onlydata_70 and fakerate_onlydata_70 = nn/(1-nn), the same columns the old friend/rewritten ntuples had.
+The exported function has no state, so it runs with all the threads of EnableImplicitMT.
+'''
+
+import os
+import ROOT
+
+def declare_nn(header):
+    '''
+    Declares the exported function (once) and returns the version of the NN (name of the header)
+    '''
+    version = os.path.splitext(os.path.basename(header))[0]
+    if not hasattr(ROOT, 'eval_nn_%s' %version):
+        if not ROOT.gInterpreter.Declare('#include "%s"' %os.path.abspath(header)):
+            raise RuntimeError('cannot declare the NN in %s' %header)
+    return version
+
+def nn_inputs(version):
+    return str(getattr(ROOT, 'eval_nn_%s_inputs' %version)).split(',')
+
+def define_nn(df, header, inputs = None):
+    '''
+    inputs: optional dict feature -> expression, for the features that are not columns of the dataframe
+    '''
+    version = declare_nn(header)
+    inputs = inputs or dict()
+    arguments = ', '.join('(double)(%s)' %inputs.get(feature, feature) for feature in nn_inputs(version))
+    if not df.HasColumn('nn_%s' %version):
+        df = df.Define('nn_%s' %version, 'eval_nn_%s(%s)' %(version, arguments))
+    if not df.HasColumn('fakerate_%s' %version):
+        df = df.Define('fakerate_%s' %version, 'nn_%s/(1.-nn_%s)' %(version, version))
+    return df
@@ -15,7 +15,7 @@ import numpy as np
 ROOT.gROOT.SetBatch()   
 ROOT.gStyle.SetOptStat(0)
 
-sfrange = 16
+sfrange = 64 # number of cells of the muon sf tables (see sf_cells.py)
 
 def plot_shape_nuisances(histos_folder, variable, channel, sample_names=sample_names, which_sample_single_bbb =[], plot3d = False, fakes = True, path = '/work/friti/rjpsi_tools/CMSSW_10_6_14/src/RJpsiTools/plotting/plots_ul/', compute_sf = False, verbose = False, compute_sf_onlynorm = False):
 
@@ -96,6 +96,13 @@ ff_weights['jpsi_mu_bglvar_e10Up'  ] = 1./0.586
 ff_weights['jpsi_tau_bglvar_e10Down' ] = 1./0.554
 ff_weights['jpsi_mu_bglvar_e10Down'  ] = 1./0.586
 
+# or the table written by tools/hammer/compute_yield_weights/compute_yield_weights.py (None: the values above)
+ff_weights_table = None
+if ff_weights_table is not None:
+    import json
+    with open(ff_weights_table) as fh:
+        ff_weights.update(json.load(fh)['ff_weights'])
+
 
 
 
@@ -0,0 +1,100 @@
+'''
+Analytic per cell shape variations of the muon reco and id scale factors.
+
+Instead of filling one histo for each of the 2*64 sf_reco_<cell>_up/down (sf_id_<cell>_jpsi_up/down) weights,
+each sample is filled once in a 2D histo (variable x sf cell), with weight
+    nominal weight * (prod_{muons in the cell} (1 +- relative error) - 1)
+so that for each cell c the varied shape is simply
+    nominal + h2[:, c]
+This is the same as using the per cell weights computed in scale_factors/scale_factors.py
+(also when more than one muon falls in the same cell), with only two extra fills.
+The per muon columns <mu>_<reco|id>_sf_cell and <mu>_<reco|id>_sf_relerr come from scale_factors.py (save_cells).
+'''
+
+import ROOT
+import numpy as np
+from hist_arrays import th1, th1_to_arrays, like_th1
+
+ncells = 64
+
+# which muons enter each scale factor (the id of the third muon is only in the pass region)
+sf_cells_muons = {
+    'sfReco' : ('reco', ['mu1', 'mu2', 'k']),
+    'sfId'   : ('id',   ['mu1', 'mu2']),
+}
+
+ROOT.gInterpreter.Declare('''
+ROOT::RVecI sf_unique_cells(const ROOT::RVecI &cells){
+  ROOT::RVecI unique;
+  for (auto cell : cells){
+    if (cell < 0) continue;
+    if (std::find(unique.begin(), unique.end(), cell) == unique.end()) unique.push_back(cell);
+  }
+  return unique;
+}
+
+ROOT::RVecD sf_cell_deltas(const ROOT::RVecI &cells, const ROOT::RVecD &relerrs, double weight, double sign){
+  auto unique = sf_unique_cells(cells);
+  ROOT::RVecD deltas(unique.size(), 1.);
+  for (size_t i = 0; i < unique.size(); ++i){
+    for (size_t m = 0; m < cells.size(); ++m){
+      if (cells[m] == unique[i]) deltas[i] *= 1. + sign * relerrs[m];
+    }
+    deltas[i] = weight * (deltas[i] - 1.);
+  }
+  return deltas;
+}
+''')
+
+def define_sf_cells(df, syst, weight):
+    '''
+    Defines the columns to fill the 2D histos of the syst (sfReco or sfId) for the given weight column
+    '''
+    kind, muons = sf_cells_muons[syst]
+    cells   = 'ROOT::RVecI{%s}' %', '.join(['(int)%s_%s_sf_cell' %(mu, kind) for mu in muons])
+    relerrs = 'ROOT::RVecD{%s}' %', '.join(['(double)%s_%s_sf_relerr' %(mu, kind) for mu in muons])
+    if not df.HasColumn('%s_cells' %syst):
+        df = df.Define('%s_cells' %syst, 'sf_unique_cells(%s)' %cells)
+    df = df.Define('%s_%s_deltaUp'   %(syst, weight), 'sf_cell_deltas(%s, %s, %s,  1.)' %(cells, relerrs, weight))
+    df = df.Define('%s_%s_deltaDown' %(syst, weight), 'sf_cell_deltas(%s, %s, %s, -1.)' %(cells, relerrs, weight))
+    return df
+
+def sf_cells_model(model):
+    # same x binning of the 1D model, one y bin per cell
+    hist = model.GetHistogram()
+    nbins = hist.GetNbinsX()
+    edges = np.array([hist.GetXaxis().GetBinLowEdge(i) for i in range(1, nbins+2)], dtype = np.float64)
+    cells = np.arange(ncells+1, dtype = np.float64)
+    return ROOT.RDF.TH2DModel(hist.GetName()+'_sfcells', '', nbins, edges, ncells, cells)
+
+def book_sf_cells(df, variable, model, syst, weight):
+    '''
+    Books the up and down 2D histos (variable x cell) of syst for a dataframe that has define_sf_cells columns
+    '''
+    xcol = '%s_%s_x' %(syst, variable)
+    if not df.HasColumn(xcol):
+        df = df.Define(xcol, 'ROOT::RVecD(%s_cells.size(), %s)' %(syst, variable))
+    model2d = sf_cells_model(model)
+    up   = df.Histo2D(model2d, xcol, '%s_cells' %syst, '%s_%s_deltaUp'   %(syst, weight))
+    down = df.Histo2D(model2d, xcol, '%s_cells' %syst, '%s_%s_deltaDown' %(syst, weight))
+    return up, down
+
+def sf_cells_shapes(nominal, up, down, sample, syst, prefix = ''):
+    '''
+    All the per cell shapes from the nominal histo and the two 2D histos, with numpy.
+    Returns a dict prefix+sample_syst_<cell>Up/Down -> TH1D
+    The errors are the nominal ones scaled as the contents
+    '''
+    nominal = th1(nominal)
+    contents, errors = th1_to_arrays(nominal)
+    nx = nominal.GetNbinsX()
+    shapes = dict()
+    for direction, h2 in zip(['Up', 'Down'], [up, down]):
+        # root 2D arrays: bin = ix + (nx+2)*iy -> rows are the cells
+        deltas = th1_to_arrays(h2)[0].reshape(ncells+2, nx+2)[1:ncells+1]
+        varied = contents[np.newaxis, :] + deltas
+        ratio = np.divide(varied, contents, out = np.ones_like(varied), where = contents != 0)
+        for cell in range(ncells):
+            name = '%s%s_%s_%d%s' %(prefix, sample, syst, cell, direction)
+            shapes[name] = like_th1(nominal, name, varied[cell], errors * np.abs(ratio[cell]))
+    return shapes
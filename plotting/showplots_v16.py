@@ -771,10 +771,10 @@ if __name__ == '__main__':
                         if compute_dimuon:
                             print("Doing the Dimuon",k)
                             Norm_SRloose = get_DiMuonBkgNorm() 
-                            temp_hists[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, pass_id+" & Bmass<6.3 & Q_sq>5.5 &"+args.preselection_plus, 0, 0, label, 'ch1').GetValue()
-                            temp_hists_fake[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass<6.3 & Q_sq>5.5 & "+args.preselection_plus, 0, 0, label, 'ch2_flat').GetValue()
+                            temp_hists[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, pass_id+" & Bmass<6.3 & Q_sq>5.5 &"+args.preselection_plus, 0, 0, label, 'ch1')
+                            temp_hists_fake[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass<6.3 & Q_sq>5.5 & "+args.preselection_plus, 0, 0, label, 'ch2_flat')
                             if not flat_fakerate:
-                                temp_hists_fake_nn[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass<6.3 & Q_sq>5.5 &"+args.preselection_plus, 0, 1, label, 'ch2').GetValue()
+                                temp_hists_fake_nn[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass<6.3 & Q_sq>5.5 &"+args.preselection_plus, 0, 1, label, 'ch2')
                             #save them on file
                             fout = ROOT.TFile.Open('plots_ul/%s/dimuon/dimuon_%s.root' %(label, k), 'UPDATE')
                             fout.cd()
@@ -803,10 +803,10 @@ if __name__ == '__main__':
                     if k == 'jpsivtx_log10_lxy_sig':  #changed from this line 15_03_2022 up to
                         if compute_dimuon:
                             print("Doing the Dimuon",k)
-                            temp_hists[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, pass_id+" & Bmass>6.3 &"+args.preselection_plus, 5, 0, label, 'ch3').GetValue()
-                            temp_hists_fake[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass>6.3 &"+args.preselection_plus, 5, 0, label, 'ch4_flat').GetValue()
+                            temp_hists[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, pass_id+" & Bmass>6.3 &"+args.preselection_plus, 5, 0, label, 'ch3')
+                            temp_hists_fake[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass>6.3 &"+args.preselection_plus, 5, 0, label, 'ch4_flat')
                             if not flat_fakerate:
-                                temp_hists_fake_nn[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass>6.3 &"+args.preselection_plus, 5, 1, label, 'ch4').GetValue()  
+                                temp_hists_fake_nn[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass>6.3 &"+args.preselection_plus, 5, 1, label, 'ch4')  
                                                         #save them on file
                             fout = ROOT.TFile.Open('plots_ul/%s/dimuon/dimuon_%s.root' %(label, k), 'UPDATE')
                             fout.cd()
@@ -91,6 +91,12 @@ from create_datacard_v3 import create_datacard_ch1, create_datacard_ch2, create_
 from plot_shape_nuisances_v4 import plot_shape_nuisances
 from DiMuon import get_DiMuonBkgNorm, get_DiMuonBkg
 from shape_comparison import shape_comparison
+from binbybin import binbybin_shapes, single_binbybin_shapes
+from hist_arrays import clamp_empty_bins
+from datacard_store import DatacardStore
+from sf_cells import sf_cells_muons, define_sf_cells, book_sf_cells, sf_cells_shapes
+from nn_eval import define_nn
+from bdt_eval import define_bdt
 
 parser = ArgumentParser()
 
@@ -114,6 +120,9 @@ shape_nuisances = True
 flat_fakerate = False # false mean that we use the NN weights for the fr
 
 compute_sf_onlynorm = False # compute only the sf normalisation (best case)
+compute_sf_cells = False # per cell reco and id sf shapes, computed analytically from one 2D histo per sample (see sf_cells.py)
+nn_headers = [] # fake-rate NNs exported with fakerate/nn_export.py, evaluated on the fly (e.g. 'exported_nn/onlydata_70.h' -> fakerate_onlydata_70)
+bdt_headers = [] # BDTs exported with bdt/bdt_export.py, evaluated on the fly (e.g. 'exported_bdt/v1.h' -> bdt_mu_v1, bdt_tau_v1, bdt_bkg_v1)
 blind_analysis = True
 rjpsi = 1
 
@@ -232,127 +241,66 @@ def create_legend(temp_hists, sample_names, titles):
 
 def create_datacard_prep(hists, shape_hists, shapes_names, sample_names, channel, name, label, which_sample_bbb_unc):
     '''
-    Creates and saves the root file with the histograms of each contribution.
-    Saves the histograms of the shape nuisances.
-    Calls the 'create datacard' function, both for the pass and fail regions, 
-    to write the text datacard for the fit in combine. 
+    Puts in the datacard store the histograms of each contribution and of the shape nuisances.
+    Then the store writes, for both the pass and fail regions, the root file with all the histograms
+    and the text datacard for the fit in combine (made by the 'create datacard' function) together. 
     '''
     if only_pass and (channel == 'ch2' or channel == 'ch4'): #don't save the fail datacards
         return
 
-    fout = ROOT.TFile.Open('plots_ul/%s/datacards/datacard_%s_%s.root' %(label, channel, name), 'UPDATE')
-    fout.cd()
     myhists = dict()
 
     for k, v in hists.items():
         for isample in sample_names + ['fakes']:
             if k == '%s_%s'%(name,isample):
-                hh = v.Clone()
                 if isample == 'data':
-                    hh.SetName(isample+'_obs_'+channel)
+                    myhists[isample] = store.add(channel, name, v, isample+'_obs_'+channel)
                 else:
-                    hh.SetName(isample+'_'+channel)
-                hh.Write()
-                myhists[isample] = hh.Clone()
+                    myhists[isample] = store.add(channel, name, v, isample+'_'+channel)
         
     # Creates the shape nuisances both for Pass and Fail regions
     for k,v in shape_hists.items():
         for sname in shapes_names:
             if k == '%s_%s'%(name,sname):
-                hh = v.Clone()
-                hh.SetName(sname + '_'+channel)
-                hh.Write()
-
-    if not add_dimuon or add_dimuon:
-        if only_pass: #the rate of fakes must be == integral in case of only pass category fit, while ==1 in case of two regions
-            if channel == 'ch1' :
-                create_datacard_ch1_onlypass(label, name, myhists,False, jpsi_x_mu_samples, which_sample_bbb_unc)
-            else:
-                create_datacard_ch3_onlypass(label, name,  myhists, False, jpsi_x_mu_samples, which_sample_bbb_unc)
+                store.add(channel, name, v, sname + '_'+channel)
 
+    # text datacard and root file with all the histos (also the bbb ones) written together
+    if only_pass: #the rate of fakes must be == integral in case of only pass category fit, while ==1 in case of two regions
+        if channel == 'ch1' :
+            store.write(channel, name, create_datacard_ch1_onlypass, label, name, myhists,False, jpsi_x_mu_samples, which_sample_bbb_unc)
         else:
-            if channel == 'ch1' :
-                create_datacard_ch1(label, name,  myhists,  False, jpsi_x_mu_samples, which_sample_bbb_unc, add_dimuon = add_dimuon)
-            elif channel == 'ch2' :
-                create_datacard_ch2(label, name,  myhists,  False, jpsi_x_mu_samples, which_sample_bbb_unc)
-            elif channel == 'ch3' :
-                create_datacard_ch3(label, name,  myhists,  False, jpsi_x_mu_samples, which_sample_bbb_unc, add_dimuon = add_dimuon)
-            else:
-                create_datacard_ch4(label, name,  myhists,  False, jpsi_x_mu_samples, which_sample_bbb_unc)
+            store.write(channel, name, create_datacard_ch3_onlypass, label, name,  myhists, False, jpsi_x_mu_samples, which_sample_bbb_unc)
 
-    fout.Close()
+    else:
+        if channel == 'ch1' :
+            store.write(channel, name, create_datacard_ch1, label, name,  myhists,  False, jpsi_x_mu_samples, which_sample_bbb_unc, add_dimuon = add_dimuon)
+        elif channel == 'ch2' :
+            store.write(channel, name, create_datacard_ch2, label, name,  myhists,  False, jpsi_x_mu_samples, which_sample_bbb_unc)
+        elif channel == 'ch3' :
+            store.write(channel, name, create_datacard_ch3, label, name,  myhists,  False, jpsi_x_mu_samples, which_sample_bbb_unc, add_dimuon = add_dimuon)
+        else:
+            store.write(channel, name, create_datacard_ch4, label, name,  myhists,  False, jpsi_x_mu_samples, which_sample_bbb_unc)
 
 # pass the jpsi_x_mu hists chi, sigma, lambda
 def make_single_binbybin(hists, channel, label, name):
+    '''
+    Returns the single bbb histos (to be written together with the others with write_binbybin)
+    and for each bin the sample that takes the uncertainty
+    '''
     if only_pass and (channel == 'ch2' or channel == 'ch4'):
-        return
-    fout = ROOT.TFile.Open('plots_ul/%s/datacards/datacard_%s_%s.root' %(label, channel, name), 'UPDATE')
-    which_sample = []
-    # loop over the bins of the hist
-    for i in range(1,hists['sigma'].GetValue().GetNbinsX()+1):
-        
-        # if at least 2 of them are zero, no uncertainty bc gives problems to the fit
-        flag = 0
-        for s1,s2 in zip(['sigma','xi','lambdazero_b'],['xi','lambdazero_b','sigma']):
-            if (hists[s1].GetValue().GetBinContent(i)<0.01 and hists[s2].GetValue().GetBinContent(i)<0.01):
-                flag = 1
-        if flag == 1:
-            which_sample.append(None)
-            continue
-        # compute the quadratic sum of the stat unc of the 3 
-        stat_unc = math.sqrt(hists['sigma'].GetValue().GetBinError(i)*hists['sigma'].GetValue().GetBinError(i)+hists['xi'].GetValue().GetBinError(i)*hists['xi'].GetValue().GetBinError(i)+ hists['lambdazero_b'].GetValue().GetBinError(i)*hists['lambdazero_b'].GetValue().GetBinError(i))
-        #find the bin with highest uncertainty amongst the 3 contributes
-        highest_stat = max(hists, key = lambda x:hists[x].GetValue().GetBinError(i))
-        #print(i,hists['sigma'].GetValue().GetBinError(i),hists['xi'].GetValue().GetBinError(i),hists['lambdazero_b'].GetValue().GetBinError(i), stat_unc)
-        which_sample.append(highest_stat)
-
-        #define histo up and down
-        histo_up = ROOT.TH1D('jpsi_x_mu_from_'+highest_stat+'_'+'jpsi_x_mu_from_'+highest_stat+'_single_bbb'+str(i)+channel+'Up_'+channel,'',hists[highest_stat].GetValue().GetNbinsX(),hists[highest_stat].GetValue().GetBinLowEdge(1), hists[highest_stat].GetValue().GetBinLowEdge(hists[highest_stat].GetValue().GetNbinsX() + 1))
-        histo_down = ROOT.TH1D('jpsi_x_mu_from_'+highest_stat+'_'+'jpsi_x_mu_from_'+highest_stat+'_single_bbb'+str(i)+channel+'Down_'+channel,'',hists[highest_stat].GetValue().GetNbinsX(),hists[highest_stat].GetValue().GetBinLowEdge(1), hists[highest_stat].GetValue().GetBinLowEdge(hists[highest_stat].GetValue().GetNbinsX() + 1))
-
-        for nbin in range(1,hists[highest_stat].GetValue().GetNbinsX()+1):
-            if nbin == i:
-                histo_up.SetBinContent(nbin,hists[highest_stat].GetValue().GetBinContent(nbin) + stat_unc)
-                histo_up.SetBinError(nbin,stat_unc + math.sqrt(stat_unc))
-                histo_down.SetBinContent(nbin,hists[highest_stat].GetValue().GetBinContent(nbin) - stat_unc)
-                histo_down.SetBinError(nbin,stat_unc +math.sqrt( stat_unc))
-            else:
-                histo_up.SetBinContent(nbin,hists[highest_stat].GetValue().GetBinContent(nbin))
-                histo_up.SetBinError(nbin,hists[highest_stat].GetValue().GetBinError(nbin))
-                histo_down.SetBinContent(nbin,hists[highest_stat].GetValue().GetBinContent(nbin))
-                histo_down.SetBinError(nbin,hists[highest_stat].GetValue().GetBinError(nbin))
-        fout.cd()
-        histo_up.Write()
-        histo_down.Write()
-    fout.Close()
-    return which_sample
-
+        return [], None
+    return single_binbybin_shapes(hists, channel)
 
 def make_binbybin(hist, sample, channel, label, name):
     if only_pass and (channel == 'ch2' or channel == 'ch4'):
-        return
+        return []
+    return binbybin_shapes(hist, sample, channel)
 
-    fout = ROOT.TFile.Open('plots_ul/%s/datacards/datacard_%s_%s.root' %(label, channel, name), 'UPDATE')
-    for i in range(1,hist.GetValue().GetNbinsX()+1):
-        #histo_up = ROOT.TH1D('jpsi_x_mu_bbb'+str(i)+flag+'Up','jpsi_x_mu_bbb'+str(i)+flag+'Up',hist.GetValue().GetNbinsX(),hist.GetValue().GetBinLowEdge(1), hist.GetValue().GetBinLowEdge(hist.GetValue().GetNbinsX() + 1))
-        #histo_down = ROOT.TH1D('jpsi_x_mu_bbb'+str(i)+flag+'Down','jpsi_x_mu_bbb'+str(i)+flag+'Down',hist.GetValue().GetNbinsX(),hist.GetValue().GetBinLowEdge(1), hist.GetValue().GetBinLowEdge(hist.GetValue().GetNbinsX() + 1))
-        histo_up = ROOT.TH1D(sample+'_'+sample+'_bbb'+str(i)+channel+'Up_'+channel,'',hist.GetValue().GetNbinsX(),hist.GetValue().GetBinLowEdge(1), hist.GetValue().GetBinLowEdge(hist.GetValue().GetNbinsX() + 1))
-        histo_down = ROOT.TH1D(sample+'_'+sample+'_bbb'+str(i)+channel+'Down_'+channel,'',hist.GetValue().GetNbinsX(),hist.GetValue().GetBinLowEdge(1), hist.GetValue().GetBinLowEdge(hist.GetValue().GetNbinsX() + 1))
-        for nbin in range(1,hist.GetValue().GetNbinsX()+1):
-            if nbin == i:
-                histo_up.SetBinContent(nbin,hist.GetValue().GetBinContent(nbin) + hist.GetValue().GetBinError(nbin))
-                histo_up.SetBinError(nbin,hist.GetValue().GetBinError(nbin) + math.sqrt(hist.GetValue().GetBinError(nbin)))
-                histo_down.SetBinContent(nbin,hist.GetValue().GetBinContent(nbin) - hist.GetValue().GetBinError(nbin))
-                histo_down.SetBinError(nbin,hist.GetValue().GetBinError(nbin) - math.sqrt(hist.GetValue().GetBinError(nbin)))
-            else:
-                histo_up.SetBinContent(nbin,hist.GetValue().GetBinContent(nbin))
-                histo_up.SetBinError(nbin,hist.GetValue().GetBinError(nbin))
-                histo_down.SetBinContent(nbin,hist.GetValue().GetBinContent(nbin))
-                histo_down.SetBinError(nbin,hist.GetValue().GetBinError(nbin))
-        fout.cd()
-        histo_up.Write()
-        histo_down.Write()
-    fout.Close()
+def write_binbybin(bbb_histos, channel, label, name):
+    # kept in memory, they are written together with the rest of the datacard
+    if only_pass and (channel == 'ch2' or channel == 'ch4'):
+        return
+    store.add_histos(channel, name, bbb_histos)
     
 
 def define_shape_nuisances(sname, shapes, samples, nuisance_name, central_value, up_value, down_value, central_weights_string):
@@ -411,6 +359,9 @@ if __name__ == '__main__':
 
     # create plot directories
     make_directories(label)
+
+    # all the datacard histos stay here until their card is complete
+    store = DatacardStore(label)
     
     #central_weights_string = 'br_weight'#*puWeight*sf_reco_total*sf_id_jpsi*sf_id_k'#*jpsimass_weights_for_correction*bc_mc_correction_weight_central' #the mc_correction_central weight is 1, added just to generalize the function for shape uncertainties
 
@@ -497,6 +448,10 @@ if __name__ == '__main__':
             if samples_orig[k].HasColumn(new_column):
                 continue       
             samples_orig[k] = samples_orig[k].Define(new_column, new_definition)
+        for header in nn_headers:
+            samples_orig[k] = define_nn(samples_orig[k], header)
+        for header in bdt_headers:
+            samples_orig[k] = define_bdt(samples_orig[k], header)
     print("weights defined")
     if flat_fakerate == False:
         for sample in samples_orig:
@@ -793,11 +748,11 @@ if __name__ == '__main__':
                         if compute_dimuon:
                             print("Doing the Dimuon",k)
                             Norm_SRloose = get_DiMuonBkgNorm() 
-                            temp_hists[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, pass_id+" & Bmass<6.3 & Q_sq>5.5 &"+args.preselection_plus, 0, 0, label, 'ch1').GetValue()
+                            temp_hists[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, pass_id+" & Bmass<6.3 & Q_sq>5.5 &"+args.preselection_plus, 0, 0, label, 'ch1')
                             '''
-                            temp_hists_fake[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass<6.3 & Q_sq>5.5 & "+args.preselection_plus, 0, 0, label, 'ch2_flat').GetValue()
+                            temp_hists_fake[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass<6.3 & Q_sq>5.5 & "+args.preselection_plus, 0, 0, label, 'ch2_flat')
                             if not flat_fakerate:
-                                temp_hists_fake_nn[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass<6.3 & Q_sq>5.5 &"+args.preselection_plus, 0, 1, label, 'ch2').GetValue()
+                                temp_hists_fake_nn[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass<6.3 & Q_sq>5.5 &"+args.preselection_plus, 0, 1, label, 'ch2')
                             '''
                             #save them on file
                             fout = ROOT.TFile.Open('plots_ul/%s/dimuon/dimuon_%s.root' %(label, k), 'UPDATE')
@@ -830,11 +785,11 @@ if __name__ == '__main__':
                     if k == 'jpsivtx_log10_lxy_sig_corr':  #changed from this line 15_03_2022 up to
                         if compute_dimuon:
                             print("Doing the Dimuon",k)
-                            temp_hists[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, pass_id+" & Bmass>6.3 &"+args.preselection_plus, 5, 0, label, 'ch3').GetValue()
+                            temp_hists[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, pass_id+" & Bmass>6.3 &"+args.preselection_plus, 5, 0, label, 'ch3')
                             '''
-                            temp_hists_fake[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass>6.3 &"+args.preselection_plus, 5, 0, label, 'ch4_flat').GetValue()
+                            temp_hists_fake[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass>6.3 &"+args.preselection_plus, 5, 0, label, 'ch4_flat')
                             if not flat_fakerate:
-                                temp_hists_fake_nn[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass>6.3 &"+args.preselection_plus, 5, 1, label, 'ch4').GetValue()  
+                                temp_hists_fake_nn[k]['%s_dimuon'%k] = get_DiMuonBkg(Norm_SRloose, fail_id+" & Bmass>6.3 &"+args.preselection_plus, 5, 1, label, 'ch4')  
                             '''
                             #save them on file
                             fout = ROOT.TFile.Open('plots_ul/%s/dimuon/dimuon_%s.root' %(label, k), 'UPDATE')
@@ -908,21 +863,50 @@ if __name__ == '__main__':
                         #        unc_hists_fake_nn[k]['%s_%s' %(k, kk)] = vv.Filter(fail_id).Histo1D(v[0], k, 'shape_weight_wfr_norm')
                         #else:
                         unc_hists_fake_nn[k]['%s_%s' %(k, kk)] = vv.Filter(fail_id).Histo1D(v[0], k, 'shape_weight_wfr')
+
+        # Per cell sf shapes: instead of one histo per cell and up/down, one 2D histo (variable x cell) per sample
+        if shape_nuisances and compute_sf_cells:
+            print('====> sf cells histos')
+            sf_cells_weights = {'pass':'total_weight', 'fail':'total_weight'}
+            if not flat_fakerate:
+                sf_cells_weights['fail_nn'] = 'total_weight_wfr'
+            sf_cells_samples = {}
+            for kk, vv in samples.items():
+                if kk == 'data':
+                    continue
+                for region, weight in sf_cells_weights.items():
+                    df = vv.Filter(pass_id if region == 'pass' else fail_id)
+                    for syst in sf_cells_muons:
+                        df = define_sf_cells(df, syst, weight)
+                    sf_cells_samples[(kk, region)] = df
+            sf_cells_hists = {}
+            for k, v in histos.items():
+                if k not in unc_hists:
+                    continue
+                sf_cells_hists[k] = {}
+                for (kk, region), df in sf_cells_samples.items():
+                    for syst in sf_cells_muons:
+                        sf_cells_hists[k][(kk, region, syst)] = book_sf_cells(df, k, v[0], syst, sf_cells_weights[region])
                                 
         
+        # names of the per cell sf shapes, written in the datacards with the other shapes
+        sf_cells_names = []
+
         print('====> now looping')
         for k, v in histos.items():
             print("Histo %s"%k)
             single_bbb_histos = {}
             single_bbb_histos_fake = {}
+            bbb_histos = []
+            bbb_histos_fake = []
             for sample,sample_item in samples.items():
                 if "jpsi_x_mu" in sample:
                     if not jpsi_x_mu_split_jpsimother: # The general binbybin only for jpsi_x_mu when it is not splitted
-                        make_binbybin(temp_hists[k]['%s_%s'%(k,sample)],sample,channels[0], label, k)
+                        bbb_histos += make_binbybin(temp_hists[k]['%s_%s'%(k,sample)],sample,channels[0], label, k)
                         if not flat_fakerate:
-                            make_binbybin(temp_hists_fake_nn[k]['%s_%s'%(k,sample)],sample,channels[1], label, k)
+                            bbb_histos_fake += make_binbybin(temp_hists_fake_nn[k]['%s_%s'%(k,sample)],sample,channels[1], label, k)
                         else:
-                            make_binbybin(temp_hists_fake[k]['%s_%s'%(k,sample)],sample,channels[1], label, k)
+                            bbb_histos_fake += make_binbybin(temp_hists_fake[k]['%s_%s'%(k,sample)],sample,channels[1], label, k)
                     if 'sigma' in sample or 'xi' in sample or 'lambda' in sample:
                         single_bbb_histos[sample.replace("jpsi_x_mu_from_","")]=temp_hists[k]['%s_%s'%(k,sample)]
                         if not flat_fakerate:
@@ -930,62 +914,47 @@ if __name__ == '__main__':
                         else:
                             single_bbb_histos_fake[sample.replace("jpsi_x_mu_from_","")]=temp_hists_fake[k]['%s_%s'%(k,sample)]
 
-            which_sample_bbb_unc = make_single_binbybin(single_bbb_histos, channels[0], label, k)
-            which_sample_bbb_unc_fake = make_single_binbybin(single_bbb_histos_fake, channels[1], label, k)
+            single_histos, which_sample_bbb_unc = make_single_binbybin(single_bbb_histos, channels[0], label, k)
+            single_histos_fake, which_sample_bbb_unc_fake = make_single_binbybin(single_bbb_histos_fake, channels[1], label, k)
+            write_binbybin(bbb_histos + single_histos, channels[0], label, k)
+            write_binbybin(bbb_histos_fake + single_histos_fake, channels[1], label, k)
+
+            # derive all the per cell sf shapes from the 2D histos (before the empty bins are corrected, as the others)
+            if shape_nuisances and compute_sf_cells and k in sf_cells_hists:
+                sf_cells_targets = {'pass':(temp_hists[k], unc_hists[k]), 'fail':(temp_hists_fake[k], unc_hists_fake[k])}
+                if not flat_fakerate:
+                    sf_cells_targets['fail_nn'] = (temp_hists_fake_nn[k], unc_hists_fake_nn[k])
+                for (kk, region, syst), (up, down) in sf_cells_hists[k].items():
+                    nominal, target = sf_cells_targets[region]
+                    sf_shapes = sf_cells_shapes(nominal['%s_%s'%(k,kk)], up, down, kk, syst, prefix = k+'_')
+                    target.update(sf_shapes)
+                    for name in sf_shapes:
+                        if name.replace(k+'_','',1) not in sf_cells_names:
+                            sf_cells_names.append(name.replace(k+'_','',1))
             
             #check that bins are not zero (if they are, correct)
-            for i, kv in enumerate(temp_hists[k].items()):
-                key = kv[0]
-                ihist = kv[1]
-                sample_name = key.split(k+'_')[1]
-                for i in range(1,ihist.GetNbinsX()+1):
-                    if ihist.GetBinContent(i) <= 0:
-                        ihist.SetBinContent(i,0.0001)
+            for ihist in temp_hists[k].values():
+                clamp_empty_bins(ihist)
 
-            for i, kv in enumerate(temp_hists_fake[k].items()):
-                key = kv[0]
-                ihist = kv[1]
-                sample_name = key.split(k+'_')[1]
-                for i in range(1,ihist.GetNbinsX()+1):
-                    if ihist.GetBinContent(i) <= 0:
-                        ihist.SetBinContent(i,0.0001)
+            for ihist in temp_hists_fake[k].values():
+                clamp_empty_bins(ihist)
 
             if not flat_fakerate:
-                for i, kv in enumerate(temp_hists_fake_nn[k].items()):
-                    key = kv[0]
-                    ihist = kv[1]
-                    sample_name = key.split(k+'_')[1]
-                    for i in range(1,ihist.GetNbinsX()+1):
-                        if ihist.GetBinContent(i) <= 0:
-                            ihist.SetBinContent(i,0.0001)
+                for ihist in temp_hists_fake_nn[k].values():
+                    clamp_empty_bins(ihist)
 
             if shape_nuisances and ((k in datacards and  iteration==0) or (k in histos and iteration)):
             #if shape_nuisances and ((iteration==0) or (k == 'Bmass' and iteration)):
                 
-                for i, kv in enumerate(unc_hists[k].items()):
-                    key = kv[0]
-                    ihist = kv[1]
-                    sample_name = key.split(k+'_')[1]
-                    for i in range(1,ihist.GetNbinsX()+1):
-                        if ihist.GetBinContent(i) <= 0:
-                            ihist.SetBinContent(i,0.0001)
+                for ihist in unc_hists[k].values():
+                    clamp_empty_bins(ihist)
 
-                for i, kv in enumerate(unc_hists_fake[k].items()):
-                    key = kv[0]
-                    ihist = kv[1]
-                    sample_name = key.split(k+'_')[1]
-                    for i in range(1,ihist.GetNbinsX()+1):
-                        if ihist.GetBinContent(i) <= 0:
-                            ihist.SetBinContent(i,0.0001)
+                for ihist in unc_hists_fake[k].values():
+                    clamp_empty_bins(ihist)
                 
                 if not flat_fakerate:
-                    for i, kv in enumerate(unc_hists_fake_nn[k].items()):
-                        key = kv[0]
-                        ihist = kv[1]
-                        sample_name = key.split(k+'_')[1]
-                        for i in range(1,ihist.GetNbinsX()+1):
-                            if ihist.GetBinContent(i) <= 0:
-                                ihist.SetBinContent(i,0.0001)
+                    for ihist in unc_hists_fake_nn[k].values():
+                        clamp_empty_bins(ihist)
                     
 
             c1.cd()
@@ -1123,17 +1092,13 @@ if __name__ == '__main__':
             # choose which one goes to Pass region
             if not flat_fakerate:
                 #check fakes do not have <= 0 bins
-                for b in range(1,fakes_failnn.GetNbinsX()+1):
-                    if fakes_failnn.GetBinContent(b)<=0.:
-                        fakes_failnn.SetBinContent(b,0.0001)
+                clamp_empty_bins(fakes_failnn)
                 fakes_failnn.SetFillColor(colours['fakes'])
                 fakes_failnn.SetFillStyle(1001)
                 fakes_failnn.SetLineColor(colours['fakes'])
                 fakes = fakes_failnn.Clone()
 
-            for b in range(1,fakes_fail.GetNbinsX()+1):
-                if fakes_fail.GetBinContent(b)<=0.:
-                    fakes_fail.SetBinContent(b,0.0001)
+            clamp_empty_bins(fakes_fail)
             fakes_fail.SetFillColor(colours['fakes'])
             fakes_fail.SetFillStyle(1001)
             fakes_fail.SetLineColor(colours['fakes'])
@@ -1263,10 +1228,10 @@ if __name__ == '__main__':
                 shapes['fakes_fakesshapeUp'] = [] #just for the name
                 shapes['fakes_fakesshapeDown'] = []
 
-                create_datacard_prep(temp_hists[k], unc_hists[k], shapes, samples_for_legend, channels[0], k, label, which_sample_bbb_unc)
+                create_datacard_prep(temp_hists[k], unc_hists[k], list(shapes) + sf_cells_names, samples_for_legend, channels[0], k, label, which_sample_bbb_unc)
                 #shape_comparison(label, k, channels[0], [name for name,v in samples.items()], verbose = True)
                 if not add_dimuon:
-                    plot_shape_nuisances(label, k, channels[0], [name for name,v in samples.items()], which_sample_bbb_unc, compute_sf = False, compute_sf_onlynorm = compute_sf_onlynorm)
+                    plot_shape_nuisances(label, k, channels[0], [name for name,v in samples.items()], which_sample_bbb_unc, compute_sf = compute_sf_cells, compute_sf_onlynorm = compute_sf_onlynorm)
                     # script per comparison shapes tau mu fakes
 
             #####################################################
@@ -1387,13 +1352,13 @@ if __name__ == '__main__':
                     #if shape_nuisances and ((iteration==0) or (k == 'Bmass' and iteration)):
 
                         if not flat_fakerate:
-                            create_datacard_prep(temp_hists_fake_nn[k], unc_hists_fake_nn[k], shapes, samples_for_legend, channels[1], k, label, which_sample_bbb_unc_fake)
+                            create_datacard_prep(temp_hists_fake_nn[k], unc_hists_fake_nn[k], list(shapes) + sf_cells_names, samples_for_legend, channels[1], k, label, which_sample_bbb_unc_fake)
                         else:
-                            create_datacard_prep(temp_hists_fake_nn[k], unc_hists_fake[k], shapes, samples_for_legend, channels[1], k, label, which_sample_bbb_unc_fake)
+                            create_datacard_prep(temp_hists_fake_nn[k], unc_hists_fake[k], list(shapes) + sf_cells_names, samples_for_legend, channels[1], k, label, which_sample_bbb_unc_fake)
                         #create_datacard_prep(temp_hists_fake[k],unc_hists_fake[k],shapes,'fail',k,label)
                         #shape_comparison(label, k, channels[1], [name for name,v in samples.items()], verbose = True)
                         if not only_pass and not add_dimuon:
-                            plot_shape_nuisances(label, k, channels[1], [name for name,v in samples.items()], which_sample_bbb_unc_fake, compute_sf = False, compute_sf_onlynorm = compute_sf_onlynorm)
+                            plot_shape_nuisances(label, k, channels[1], [name for name,v in samples.items()], which_sample_bbb_unc_fake, compute_sf = compute_sf_cells, compute_sf_onlynorm = compute_sf_onlynorm)
             #####################################################
             # Now creating and saving the stack of the fail region
 
@@ -1504,20 +1469,24 @@ if __name__ == '__main__':
                 #if shape_nuisances and ((iteration==0) or (k == 'Bmass' and iteration)):
 
                     if not flat_fakerate:
-                        create_datacard_prep(temp_hists_fake[k], unc_hists_fake_nn[k], shapes, [name for name,v in samples.items()], channels[1], k, label, which_sample_bbb_unc_fake)
+                        create_datacard_prep(temp_hists_fake[k], unc_hists_fake_nn[k], list(shapes) + sf_cells_names, [name for name,v in samples.items()], channels[1], k, label, which_sample_bbb_unc_fake)
                     else:
-                        create_datacard_prep(temp_hists_fake[k], unc_hists_fake[k], shapes, [name for name,v in samples.items()], channels[1], k, label, which_sample_bbb_unc_fake)
+                        create_datacard_prep(temp_hists_fake[k], unc_hists_fake[k], list(shapes) + sf_cells_names, [name for name,v in samples.items()], channels[1], k, label, which_sample_bbb_unc_fake)
                         
                     #create_datacard_prep(temp_hists_fake[k],unc_hists_fake[k],shapes,'fail',k,label)
                     #shape_comparison(label, k, channels[1], [name for name,v in samples.items()], verbose = True)
                     if not only_pass and not add_dimuon:
-                        plot_shape_nuisances(label, k, channels[1], [name for name,v in samples.items()], which_sample_bbb_unc_fake, compute_sf = False, compute_sf_onlynorm = compute_sf_onlynorm)
+                        plot_shape_nuisances(label, k, channels[1], [name for name,v in samples.items()], which_sample_bbb_unc_fake, compute_sf = compute_sf_cells, compute_sf_onlynorm = compute_sf_onlynorm)
 
             if channels[0] == 'ch1' and not flat_fakerate:
                 shape_comparison({'jpsi_mu':temp_hists[k]['%s_jpsi_mu' %k],'jpsi_tau':temp_hists[k]['%s_jpsi_tau' %k],"fakes":fakes},label, k, channels[0], [name for name,v in samples.items()], verbose = True)
             if channels[1] == 'ch2' and not flat_fakerate:
                 shape_comparison({'jpsi_mu':temp_hists_fake_nn[k]['%s_jpsi_mu' %k],'jpsi_tau':temp_hists_fake_nn[k]['%s_jpsi_tau' %k],"fakes":fakes_failnn},label, k, channels[1], [name for name,v in samples.items()], verbose = True)
             
+            # the bbb histos of the variables without datacard are not needed anymore
+            store.release(channels[0], k)
+            store.release(channels[1], k)
+
             #try:
             #    fdimuon.Close()
 
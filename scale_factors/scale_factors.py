@@ -16,6 +16,9 @@ import numpy as np
 
 compute_error = False
 compute_error_global = True
+# Instead of the 2*64 per cell weights of compute_error, save for each muon its cell and relative error:
+# the per cell shapes are then computed analytically in the plotting (plotting/sf_cells.py)
+save_cells = True
 
 # Path for final root files 
 path = '/pnfs/psi.ch/cms/trivcat/store/user/friti/dataframes_Dec2021'
@@ -127,6 +130,13 @@ for sname in sample_names+['jpsi_x']:
           df['sf_id_'+str(iid)+'_k_up'] = ((k_id_features[0]+k_id_features[1]*weight_k_id)).astype(float)
           df['sf_id_'+str(iid)+'_k_down'] = ((k_id_features[0]-k_id_features[1]*weight_k_id)).astype(float)
 
+    if save_cells:
+      # cell == None (outside the json tables) -> -1, never varied
+      for mu, reco_features, id_features in zip(['mu1', 'mu2', 'k'], [mu1_reco_features, mu2_reco_features, k_reco_features], [mu1_id_features, mu2_id_features, k_id_features]):
+        for kind, features in zip(['reco', 'id'], [reco_features, id_features]):
+          df[mu+'_'+kind+'_sf_cell'] = np.array([-1 if cell is None else cell for cell in features[2]]).astype(int)
+          df[mu+'_'+kind+'_sf_relerr'] = (features[1].astype(float) / features[0].astype(float)).astype(float)
+
     if compute_error_global:
       # worst case when I apply only the normalisation nuisance to the fit
       df['sf_reco_all_up'] = ((mu1_reco_features[0]+mu1_reco_features[1])*(mu2_reco_features[0]+mu2_reco_features[1])*(k_reco_features[0]+k_reco_features[1])).astype(float)